@@ -24,6 +24,7 @@ from flask_socketio import SocketIO
 from flask_cors import CORS
 from dotenv import load_dotenv
 from flask_migrate import Migrate
+from werkzeug.serving import is_running_from_reloader
 # Используем абсолютный импорт
 from backend.models import db # Импортируем db из models.py
 
@@ -32,6 +33,20 @@ load_dotenv(dotenv_path=dotenv_path)
 
 socketio = SocketIO()
 
+SQLITE_BUSY_TIMEOUT_MS = 15000 # Ожидание блокировки записи вместо немедленного "database is locked"
+
+
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """
+    WAL: чтения не блокируют запись и наоборот - короткие записи (прием callback'ов,
+    захват пачек диспетчером и пулами) не ждут, пока закончатся параллельные чтения.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+
 def create_app():
     app = Flask(__name__)
 
@@ -40,6 +55,8 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     base_dir = os.path.abspath(os.path.dirname(__file__))
     app.config['GENERATED_FILES_FOLDER'] = os.path.join(base_dir, os.environ.get('GENERATED_FILES_FOLDER', 'generated_images'))
+    # Внешний адрес для URL сгенерированных файлов; пусто - берется из запроса
+    app.config['PUBLIC_BASE_URL'] = os.environ.get('PUBLIC_BASE_URL') or None
     # Убедимся, что папка существует
     os.makedirs(app.config['GENERATED_FILES_FOLDER'], exist_ok=True)
 
@@ -48,10 +65,18 @@ def create_app():
 
     # Инициализация расширений
     db.init_app(app)
-    Migrate(app, db)
+    Migrate(app, db, directory=os.path.join(base_dir, 'migrations'), render_as_batch=True) # batch-режим нужен для ALTER в SQLite
     socketio.init_app(app, cors_allowed_origins="*") # Разрешаем CORS для SocketIO
 
+    # Сжатие ответов /api/* (gzip, brotli/zstd при наличии пакетов)
+    from backend.utils.compression import init_compression
+    init_compression(app)
+
     with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            from sqlalchemy import event
+            event.listen(db.engine, 'connect', configure_sqlite_connection)
+
         # Создание таблиц БД
         # Используем абсолютный импорт
         from backend import models # Убедимся, что модели импортированы перед create_all
@@ -66,6 +91,7 @@ def create_app():
         from backend.features.image_generation.routes import generation_bp
         from backend.features.grid_selection.routes import grid_selection_bp
         from backend.features.file_serving.routes import file_serving_bp
+        from backend.features.jobs.routes import jobs_bp
         # Импортируем остальные из старого api.py (пока они там)
         # from backend.api import collections_api, generations_api, files_api 
         # from backend.api import generations_api, files_api # Убираем collections_api
@@ -81,6 +107,60 @@ def create_app():
         app.register_blueprint(grid_selection_bp) # Регистрируем новый Blueprint (префикс /api уже в нем)
         # app.register_blueprint(files_api) # Закомментировано
         app.register_blueprint(file_serving_bp) # Регистрируем новый Blueprint (без префикса)
+        app.register_blueprint(jobs_bp) # Фоновые задания (префикс /api уже в нем)
+
+        # Последовательность изменений грида (для /api/grid-data/changes)
+        from backend.features.grid_selection.changes import ensure_change_sequence
+        ensure_change_sequence()
+
+        # Заполняем денормализованную таблицу ячеек грида на существующей базе
+        from backend.features.grid_selection.grid_cells import ensure_grid_cells_populated, rebuild_grid_cells
+        ensure_grid_cells_populated()
+
+        # Теневой FTS5-индекс для поиска по коллекциям (только SQLite)
+        from backend.features.collection_management.search import ensure_collection_search_index
+        ensure_collection_search_index()
+
+        # Диспетчер очереди отправки генераций в планировщик (GENERATION_DISPATCHER)
+        from backend.features.image_generation.dispatcher import GenerationDispatcher, start_generation_dispatcher
+        start_generation_dispatcher(app)
+
+        # Пул обработки принятых callback'ов планировщика (CALLBACK_INGEST)
+        from backend.features.image_generation.callback_ingest import start_callback_ingestor
+        start_callback_ingestor(app)
+
+        # Миниатюры: без Pillow или при THUMBNAIL_WORKERS=0 отдаются оригиналы
+        if os.environ.get('FLASK_DEBUG') != '1' or is_running_from_reloader():
+            from backend.features.file_serving.thumbnails import warn_if_thumbnails_disabled
+            warn_if_thumbnails_disabled()
+
+        # Фоновые задания, прерванные перезапуском
+        from backend.features.jobs.runner import start_job_heartbeat
+        start_job_heartbeat(app)
+
+        @app.cli.command('dispatch-generations')
+        def dispatch_generations_command():
+            """ Запускает диспетчер очереди генераций в этом процессе (для GENERATION_DISPATCHER=off). """
+            print("Generation dispatcher is running, press Ctrl+C to stop.")
+            GenerationDispatcher(app).run_forever()
+
+        @app.cli.command('reconcile-generations')
+        def reconcile_generations_command():
+            """ Один проход сверки зависших QUEUED-генераций с планировщиком (например, из cron при GENERATION_DISPATCHER=inline). """
+            from backend.features.image_generation.reconciler import reconcile_stale_generations
+            print(f"Reconciliation: {reconcile_stale_generations()}")
+
+        @app.cli.command('gc-image-blobs')
+        def gc_image_blobs_command():
+            """ Пересчитывает ссылки на blob'ы (IMAGE_STORE=blobs) и удаляет blob'ы без ссылок. """
+            from backend.features.file_serving.blob_store import gc_image_blobs
+            print(f"Image blobs: {gc_image_blobs()}")
+
+        @app.cli.command('rebuild-grid-cells')
+        def rebuild_grid_cells_command():
+            """ Полностью перестраивает таблицу grid_cells из generations/selected_covers. """
+            count = rebuild_grid_cells()
+            print(f"Rebuilt {count} grid cells.")
 
         # Тестовый маршрут
         @app.route('/api/hello')
@@ -0,0 +1,129 @@
+"""
+Бенчмарк: всплеск callback'ов планировщика при CALLBACK_INGEST=inline и async.
+
+Поднимает приложение на локальном многопоточном сервере, создает QUEUED-генерации
+и одновременно (--concurrency потоков, как несколько экземпляров планировщика с
+повторами) шлет им callback'и 'done' с --files файлами по --file-kb КБ. Для
+каждого режима печатаются перцентили времени ответа на callback, число ответов
+дольше --timeout (планировщик счел бы их неудачными и повторил), время до
+последнего ответа и до завершения всех генераций в БД. Ответ с ошибкой (например,
+"database is locked" при inline) планировщик тоже повторил бы; такие генерации
+в "done s" не дожидаются.
+
+Запуск из корня репозитория:
+    python -m backend.benchmarks.bench_callback_ingest [--callbacks 400] [--concurrency 32]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+
+def percentile(values: list[float], q: float) -> float:
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0.0
+
+
+def queue_generations(n: int) -> list[str]:
+    from backend.models import db, Generation, GenerationStatus
+    from backend.benchmarks.bench_scheduler_submit import fill_db
+    pairs = fill_db(n)
+    ids = [str(uuid.uuid4()) for _ in pairs]
+    db.session.bulk_insert_mappings(Generation, [
+        {'id': generation_id, 'project_id': pair['project_id'], 'collection_id': int(pair['collection_id']),
+         'status': GenerationStatus.QUEUED, 'final_positive_prompt': 'portrait'}
+        for generation_id, pair in zip(ids, pairs)
+    ])
+    db.session.commit()
+    return ids
+
+
+def send_callbacks(base_url: str, generation_ids: list[str], args, payload: bytes) -> tuple[list[float], int, float]:
+    """ Возвращает (отсортированные времена ответов, число ответов с ошибкой, время до последнего ответа). """
+    local = threading.local()
+
+    def send(generation_id):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        files = [('files', (f'{generation_id}-{i}.png', payload, 'image/png')) for i in range(args.files)]
+        started = time.perf_counter()
+        response = session.post(f'{base_url}/api/scheduler_callback/{generation_id}',
+                                data={'status': 'done', 'task_id': generation_id}, files=files, timeout=300)
+        return time.perf_counter() - started, response.status_code != 200
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(send, generation_ids))
+    return sorted(latency for latency, _ in results), sum(failed for _, failed in results), time.perf_counter() - started
+
+
+def wait_completed(app, generation_ids: list[str], timeout: float = 600.0) -> bool:
+    from backend.models import db, Generation, GenerationStatus
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with app.app_context():
+            pending = db.session.query(Generation.id).filter(
+                Generation.id.in_(generation_ids), Generation.status != GenerationStatus.COMPLETED
+            ).count()
+            db.session.remove()
+        if not pending:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--callbacks', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--files', type=int, default=2)
+    parser.add_argument('--file-kb', type=int, default=512)
+    parser.add_argument('--timeout', type=float, default=1.0, help="Порог 'слишком долгого' ответа, секунд")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['GENERATED_FILES_FOLDER'] = os.path.join(tmp, 'generated')
+        os.environ['FLASK_CALLBACK_BASE_URL'] = 'http://127.0.0.1:5001'
+        from backend.benchmarks.bench_grid_format import build_app
+        from backend.features.image_generation.callback_ingest import INGESTOR_EXTENSION_KEY, CallbackIngestor
+
+        app = build_app(os.path.join(tmp, 'bench.db'))
+        app.logger.disabled = True
+        ingestor = CallbackIngestor(app)
+        app.extensions[INGESTOR_EXTENSION_KEY] = ingestor
+        ingestor.start()
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        payload = os.urandom(args.file_kb * 1024)
+
+        print(f"{args.callbacks} callbacks x {args.files} files x {args.file_kb} KB, {args.concurrency} concurrent senders, "
+              f"{ingestor.workers} ingest workers\n")
+        print(f"{'mode':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {f'>{args.timeout:g}s':>7} "
+              f"{'errors':>7} {'acked s':>8} {'done s':>8}")
+        with app.app_context():
+            all_ids = queue_generations(2 * args.callbacks)
+        for index, mode in enumerate(('inline', 'async')):
+            os.environ['CALLBACK_INGEST'] = mode
+            generation_ids = all_ids[index * args.callbacks:(index + 1) * args.callbacks]
+            started = time.perf_counter()
+            latencies, failed, acked = send_callbacks(base_url, generation_ids, args, payload)
+            completed = wait_completed(app, generation_ids, timeout=60.0 if failed else 600.0)
+            done = time.perf_counter() - started
+            slow = sum(1 for latency in latencies if latency > args.timeout)
+            print(f"{mode:<8} {percentile(latencies, 0.5) * 1000:8.0f} {percentile(latencies, 0.95) * 1000:8.0f} "
+                  f"{percentile(latencies, 0.99) * 1000:8.0f} {latencies[-1] * 1000:8.0f} {slow:7} {failed:7} {acked:8.2f} "
+                  f"{done:8.2f}{'' if completed else ' (not all completed)'}")
+
+        ingestor.stop(timeout=5)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
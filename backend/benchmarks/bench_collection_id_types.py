@@ -0,0 +1,119 @@
+"""
+Бенчмарк: планы запросов и время для collection_id TEXT (старая схема, с CAST)
+против INTEGER (новая схема) на синтетических данных.
+
+Запуск из корня репозитория:
+    python -m backend.benchmarks.bench_collection_id_types [--collections 5000] [--projects 40]
+"""
+import argparse
+import random
+import sqlite3
+import time
+import uuid
+
+SCHEMA = """
+CREATE TABLE collections (id INTEGER PRIMARY KEY, name VARCHAR(120) NOT NULL);
+CREATE TABLE generations (
+    id VARCHAR(36) PRIMARY KEY,
+    project_id VARCHAR(36) NOT NULL,
+    collection_id {fk_type} NOT NULL,
+    status VARCHAR(9) NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+CREATE INDEX ix_generations_collection_id ON generations (collection_id);
+CREATE INDEX ix_generation_collection_project_updated ON generations (collection_id, project_id, updated_at DESC);
+CREATE TABLE selected_covers (
+    collection_id {fk_type} NOT NULL,
+    project_id VARCHAR(36) NOT NULL,
+    generation_id VARCHAR(36) NOT NULL,
+    PRIMARY KEY (collection_id, project_id)
+);
+"""
+
+# {fk} - выражение для сравнения с collections.id: CAST в старой схеме, как было в сервисе грида
+QUERIES = {
+    'not_generated (correlated NOT EXISTS)': """
+        SELECT c.id FROM collections c
+        WHERE NOT EXISTS (SELECT 1 FROM generations g
+                          WHERE g.collection_id = {fk} AND g.project_id IN ({projects}))
+        ORDER BY c.id DESC LIMIT 100
+    """,
+    'not_selected (correlated COUNT)': """
+        SELECT c.id FROM collections c
+        WHERE (SELECT count(DISTINCT sc.project_id) FROM selected_covers sc
+               WHERE sc.collection_id = {fk} AND sc.project_id IN ({projects})) < {n_projects}
+        ORDER BY c.id DESC LIMIT 100
+    """,
+    'last_generation_at (correlated MAX)': """
+        SELECT c.id, (SELECT max(g.updated_at) FROM generations g WHERE g.collection_id = {fk})
+        FROM collections c ORDER BY c.id DESC LIMIT 500
+    """,
+}
+
+
+def build_db(fk_type: str, n_collections: int, n_projects: int, seed: int) -> tuple[sqlite3.Connection, list[str]]:
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(SCHEMA.format(fk_type=fk_type))
+    project_ids = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(n_projects)]
+    to_fk = str if fk_type.startswith('VARCHAR') else int
+
+    conn.executemany("INSERT INTO collections VALUES (?, ?)", ((i, f"collection {i}") for i in range(1, n_collections + 1)))
+    generations, covers = [], []
+    for cid in range(1, n_collections + 1):
+        for pid in project_ids:
+            if rnd.random() < 0.6: # ~60% ячеек сгенерированы
+                gid = str(uuid.UUID(int=rnd.getrandbits(128)))
+                generations.append((gid, pid, to_fk(cid), 'COMPLETED', f"2026-01-{rnd.randint(1, 28):02d} 12:00:00"))
+                if rnd.random() < 0.5:
+                    covers.append((to_fk(cid), pid, gid))
+    conn.executemany("INSERT INTO generations VALUES (?, ?, ?, ?, ?)", generations)
+    conn.executemany("INSERT INTO selected_covers VALUES (?, ?, ?)", covers)
+    conn.execute("ANALYZE")
+    return conn, project_ids
+
+
+def run_query(conn, sql: str, repeat: int) -> tuple[list, float]:
+    plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql).fetchall()
+        best = min(best, time.perf_counter() - started)
+    return plan, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--collections', type=int, default=5000)
+    parser.add_argument('--projects', type=int, default=40)
+    parser.add_argument('--visible-projects', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    variants = {
+        'before (VARCHAR + CAST)': ('VARCHAR(36)', 'CAST(c.id AS VARCHAR)'),
+        'after (INTEGER)': ('INTEGER', 'c.id'),
+    }
+    results = {}
+    for label, (fk_type, fk_expr) in variants.items():
+        conn, project_ids = build_db(fk_type, args.collections, args.projects, seed=42)
+        visible = ", ".join(f"'{pid}'" for pid in project_ids[:args.visible_projects])
+        for name, template in QUERIES.items():
+            sql = template.format(fk=fk_expr, projects=visible, n_projects=args.visible_projects)
+            results[(name, label)] = run_query(conn, sql, args.repeat)
+        conn.close()
+
+    print(f"Dataset: {args.collections} collections x {args.projects} projects, {args.visible_projects} visible\n")
+    for name in QUERIES:
+        print(f"== {name}")
+        for label in variants:
+            plan, seconds = results[(name, label)]
+            print(f"  {label}: {seconds * 1000:.2f} ms")
+            for line in plan:
+                print(f"      {line}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
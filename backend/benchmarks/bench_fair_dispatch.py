@@ -0,0 +1,145 @@
+"""
+Бенчмарк (симуляция): задержка маленьких пакетов за большим при разных политиках отправки.
+
+Модель: N экземпляров планировщика, каждый выполняет по одной генерации за
+--gen-seconds в порядке своей FIFO-очереди. Диспетчер раз в --poll-seconds
+досылает генерации до лимита "в полете" (как SCHEDULER_BACKPRESSURE=adaptive).
+В момент 0 один проект ставит большой пакет (--big), затем другие проекты
+случайно (пуассоновски, в среднем раз в --small-every секунд) ставят маленькие
+пакеты по 1-10 пар. Сравниваются:
+  - fifo: прежний захват самых ранних генераций;
+  - fair: fair_share.allocate_claims, у всех приоритет normal;
+  - fair + low bulk: большой пакет поставлен с priority=low.
+Для маленьких пакетов печатаются перцентили времени от постановки до
+завершения последней генерации, для большого - время завершения.
+
+Запуск из корня репозитория:
+    python -m backend.benchmarks.bench_fair_dispatch [--big 5000] [--hours 2]
+"""
+import argparse
+import random
+from collections import deque
+from datetime import datetime, timedelta
+
+from backend.constants import GENERATION_PRIORITY_VALUES, GenerationPriorities
+from backend.features.image_generation.fair_share import DueFlow, allocate_claims
+
+EPOCH = datetime(2026, 1, 1)
+
+
+class Item:
+    __slots__ = ('job', 'priority', 'project', 'created')
+
+    def __init__(self, job, priority, project, created):
+        self.job, self.priority, self.project, self.created = job, priority, project, created
+
+
+def make_workload(args, rnd: random.Random, big_priority: int) -> list[tuple]:
+    """ [(время постановки, job_id, проект, приоритет, число пар)] """
+    jobs = [(0.0, 'big', 'bulk-project', big_priority, args.big)]
+    t = 0.0
+    index = 0
+    while True:
+        t += rnd.expovariate(1.0 / args.small_every)
+        if t >= args.hours * 3600:
+            return jobs
+        jobs.append((t, f'small-{index}', f'project-{rnd.randrange(args.projects)}',
+                     GENERATION_PRIORITY_VALUES[GenerationPriorities.NORMAL], rnd.randint(1, 10)))
+        index += 1
+
+
+def claim_fifo(outbox: list[Item], limit: int) -> list[Item]:
+    return outbox[:limit] # outbox упорядочен по времени постановки
+
+
+def claim_fair(outbox: list[Item], limit: int) -> list[Item]:
+    flows = {}
+    for item in outbox:
+        key = (item.priority, item.project, None)
+        due, oldest = flows.get(key, (0, item.created))
+        flows[key] = (due + 1, min(oldest, item.created))
+    quotas = allocate_claims(
+        [DueFlow(p, project, None, due, oldest, 1) for (p, project, _), (due, oldest) in flows.items()], limit
+    )
+    claimed = []
+    taken = dict.fromkeys(quotas, 0)
+    for item in outbox: # Внутри потока - самые ранние
+        key = (item.priority, item.project, None)
+        if taken.get(key, 0) < quotas.get(key, 0):
+            taken[key] += 1
+            claimed.append(item)
+    claimed.sort(key=lambda item: -item.priority) # Как в claim_due_generations: сначала высокий приоритет
+    return claimed
+
+
+def simulate(args, policy, big_priority: int) -> tuple[list[float], float]:
+    rnd = random.Random(args.seed)
+    arrivals = deque(sorted(make_workload(args, rnd, big_priority)))
+    outbox = []
+    queues = [deque() for _ in range(args.instances)]
+    busy_until = [0.0] * args.instances
+    remaining, submitted_at, finished_at = {}, {}, {}
+    in_flight_limit = args.instances * (1 + args.queue_depth)
+    step = args.poll_seconds
+    t = 0.0
+    while arrivals or outbox or any(queues) or any(b > t for b in busy_until):
+        while arrivals and arrivals[0][0] <= t:
+            arrival, job, project, priority, size = arrivals.popleft()
+            created = EPOCH + timedelta(seconds=arrival)
+            outbox.extend(Item(job, priority, project, created) for _ in range(size))
+            remaining[job] = size
+            submitted_at[job] = arrival
+        # Освободившийся экземпляр берет следующую задачу из своей очереди
+        for i, queue in enumerate(queues):
+            if queue and busy_until[i] <= t:
+                item = queue.popleft()
+                busy_until[i] = t + args.gen_seconds
+                remaining[item.job] -= 1
+                if remaining[item.job] == 0:
+                    finished_at[item.job] = busy_until[i]
+        # Диспетчер: досылает до лимита "в полете", на наименее загруженный экземпляр
+        in_flight = sum(len(q) for q in queues) + sum(1 for b in busy_until if b > t)
+        free = in_flight_limit - in_flight
+        if free > 0 and outbox:
+            claimed = policy(outbox, free)
+            claimed_ids = {id(item) for item in claimed}
+            outbox = [item for item in outbox if id(item) not in claimed_ids]
+            for item in claimed:
+                min(queues, key=len).append(item)
+        t += step
+    small = sorted(finished_at[job] - submitted_at[job] for job in finished_at if job != 'big')
+    return small, finished_at['big']
+
+
+def percentile(values: list[float], q: float) -> float:
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--big', type=int, default=5000)
+    parser.add_argument('--hours', type=float, default=2.0, help="Окно прихода маленьких пакетов")
+    parser.add_argument('--small-every', type=float, default=60.0)
+    parser.add_argument('--projects', type=int, default=10)
+    parser.add_argument('--instances', type=int, default=2)
+    parser.add_argument('--queue-depth', type=int, default=4, help="Задач в очереди экземпляра сверх выполняемой")
+    parser.add_argument('--gen-seconds', type=float, default=3.0)
+    parser.add_argument('--poll-seconds', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    normal = GENERATION_PRIORITY_VALUES[GenerationPriorities.NORMAL]
+    low = GENERATION_PRIORITY_VALUES[GenerationPriorities.LOW]
+    print(f"{args.instances} instances x {args.gen_seconds:.0f} s/generation, in-flight limit "
+          f"{args.instances * (1 + args.queue_depth)}, big batch {args.big} pairs, "
+          f"small batches every ~{args.small_every:.0f} s for {args.hours:g} h\n")
+    print(f"{'policy':<18} {'small':>6} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'max s':>8} {'big done s':>11}")
+    for label, policy, big_priority in (('fifo', claim_fifo, normal), ('fair', claim_fair, normal),
+                                        ('fair + low bulk', claim_fair, low)):
+        small, big_done = simulate(args, policy, big_priority)
+        print(f"{label:<18} {len(small):6} {percentile(small, 0.5):8.0f} {percentile(small, 0.95):8.0f} "
+              f"{percentile(small, 0.99):8.0f} {small[-1] if small else 0:8.0f} {big_done:11.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Бенчмарк: запросов в секунду к /generated_files/<id>.
+
+Регистрирует --files файлов по --file-kb КБ (callback'и планировщика) и в течение
+--seconds секунд на каждый сценарий запрашивает случайные файлы через тестовый
+клиент Flask (без сети - измеряется работа обработчика):
+- full: обычный GET (первая загрузка страницы грида);
+- revalidate: GET с If-None-Match из предыдущего ответа (повторный рендер грида,
+  если браузер перепроверяет изображения);
+- range: GET первых 64 КБ (Range: bytes=0-65535).
+Печатаются req/s, доля ответов 304/206 и заголовок Cache-Control: с immutable
+браузер при повторном рендере вообще не обращается к серверу.
+
+Запуск из корня репозитория:
+    python -m backend.benchmarks.bench_file_serving [--files 200] [--seconds 5]
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+
+
+def run_scenario(client, file_ids: list[int], etags: dict, scenario: str, seconds: float) -> tuple[float, float]:
+    """ (запросов в секунду, доля ответов 304/206) """
+    expected_status = {'full': 200, 'revalidate': 304, 'range': 206}[scenario]
+    rnd = random.Random(1)
+    done = matched = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        file_id = rnd.choice(file_ids)
+        headers = {}
+        if scenario == 'revalidate':
+            headers['If-None-Match'] = etags[file_id]
+        elif scenario == 'range':
+            headers['Range'] = 'bytes=0-65535'
+        response = client.get(f'/generated_files/{file_id}', headers=headers)
+        response.get_data() # Тело читается, как его прочитал бы сервер при отправке
+        response.close()
+        done += 1
+        matched += response.status_code == expected_status
+    return done / (time.perf_counter() - started), matched / max(done, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--file-kb', type=int, default=512)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['GENERATED_FILES_FOLDER'] = os.path.join(tmp, 'generated')
+        os.environ['CALLBACK_INGEST'] = 'inline'
+        os.environ['THUMBNAIL_WORKERS'] = '0' # Случайные байты - не изображения
+        from backend.benchmarks.bench_grid_format import build_app
+        from backend.benchmarks.bench_callback_ingest import queue_generations
+        from backend.models import GeneratedFile
+
+        app = build_app(os.path.join(tmp, 'bench.db'))
+        app.logger.disabled = True
+        client = app.test_client()
+        with app.app_context():
+            generation_ids = queue_generations(args.files)
+        for generation_id in generation_ids:
+            data = {'status': 'done', 'files': [(io.BytesIO(os.urandom(args.file_kb * 1024)), 'image.png')]}
+            client.post(f'/api/scheduler_callback/{generation_id}', data=data, content_type='multipart/form-data')
+        with app.app_context():
+            file_ids = [file_id for file_id, in GeneratedFile.query.with_entities(GeneratedFile.id)]
+
+        etags, cache_control = {}, None
+        for file_id in file_ids:
+            response = client.get(f'/generated_files/{file_id}')
+            etags[file_id] = response.headers.get('ETag', '')
+            cache_control = response.headers.get('Cache-Control')
+            response.close()
+
+        print(f"{len(file_ids)} files x {args.file_kb} KB, {args.seconds:g} s per scenario")
+        print(f"Cache-Control: {cache_control}\n")
+        print(f"{'scenario':<11} {'req/s':>8} {'304/206':>8}")
+        for scenario in ('full', 'revalidate', 'range'):
+            rps, matched = run_scenario(client, file_ids, etags, scenario, args.seconds)
+            print(f"{scenario:<11} {rps:8.0f} {'-' if scenario == 'full' else f'{matched:.0%}':>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Бенчмарк: построение URL сгенерированных файлов через url_for на каждый файл
+(прежний GeneratedFile.get_url) против префикса, вычисленного один раз
+(generated_file_url_prefix / serialize_generated_files).
+
+Также замеряет целиком get_grid_data_service (rows) и
+Generation.to_dict(include_files=True) на синтетической базе из
+bench_grid_format.
+
+Запуск из корня репозитория:
+    python -m backend.benchmarks.bench_file_urls [--collections 500] [--projects 40]
+"""
+import argparse
+import os
+import tempfile
+
+from flask import url_for
+
+from backend.benchmarks.bench_grid_format import best_of, build_app, fill_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--collections', type=int, default=500)
+    parser.add_argument('--projects', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = build_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            project_ids = fill_db(args.collections, args.projects, seed=42)
+
+        from backend.models import Generation, GeneratedFile, generated_file_url_prefix, serialize_generated_files
+        from backend.features.grid_selection.services import get_grid_data_service
+
+        with app.test_request_context():
+            files = GeneratedFile.query.all()
+            generations = Generation.query.all()
+
+            def legacy_urls():
+                return [url_for('file_serving.serve_generated_file', file_id=f.id, _external=True, _scheme='http') for f in files]
+
+            def prefix_urls():
+                prefix = generated_file_url_prefix()
+                return [f.get_url(prefix) for f in files]
+
+            legacy_seconds, legacy = best_of(args.repeat, legacy_urls)
+            prefix_seconds, current = best_of(args.repeat, prefix_urls)
+            assert legacy == current, "URL mismatch between url_for and prefix"
+            serialize_seconds, _ = best_of(args.repeat, lambda: serialize_generated_files(files))
+            generations_seconds, _ = best_of(args.repeat, lambda: [g.to_dict(include_files=True) for g in generations])
+            grid_seconds, _ = best_of(args.repeat, lambda: get_grid_data_service(
+                ','.join(project_ids), search=None, type_=None, advanced=None, sort='id', order='asc',
+                generation_status_filter=None, page=1, per_page=args.collections, include_total=False
+            ))
+
+    print(f"Dataset: {args.collections} collections x {args.projects} projects, {len(files)} files\n")
+    print(f"url_for per file ({len(files)} URLs):        {legacy_seconds * 1000:8.1f} ms")
+    print(f"precomputed prefix ({len(files)} URLs):      {prefix_seconds * 1000:8.1f} ms")
+    print(f"serialize_generated_files:               {serialize_seconds * 1000:8.1f} ms")
+    print(f"Generation.to_dict(include_files) x{len(generations)}: {generations_seconds * 1000:8.1f} ms")
+    print(f"get_grid_data_service (rows, 1 page):    {grid_seconds * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
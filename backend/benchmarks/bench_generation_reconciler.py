@@ -0,0 +1,106 @@
+"""
+Бенчмарк: сверка зависших QUEUED-генераций с планировщиком.
+
+Ставит пакет генераций в локальный фейковый планировщик (bench_scheduler_submit),
+затем "теряет" все callback'и: часть задач у планировщика завершается, часть
+падает, часть остается в очереди, часть планировщик забывает. queued_at
+сдвигается в прошлое, после чего проходы reconcile_stale_generations
+показывают исходы, число HTTP-запросов, TCP-соединений и SQL-запросов.
+Повторный проход сразу после первого не должен трогать уже проверенные задачи.
+
+Запуск из корня репозитория:
+    python -m backend.benchmarks.bench_generation_reconciler [--pairs 300] [--latency-ms 5]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from backend.constants import SchedulerTaskStatus
+from backend.benchmarks.bench_scheduler_submit import FakeScheduler, fill_db, reset_counters
+
+
+def lose_callbacks(server: FakeScheduler, seed: int = 7) -> Counter:
+    """ Раскладывает задачи по исходам у планировщика: 40% done, 20% failed, 20% pending, 20% забыты. """
+    rnd = random.Random(seed)
+    fates = Counter()
+    with server.lock:
+        for task_id in list(server.tasks):
+            fate = rnd.choices(['done', 'failed', 'pending', 'forgotten'], weights=[4, 2, 2, 2])[0]
+            fates[fate] += 1
+            if fate == 'forgotten':
+                del server.tasks[task_id]
+            else:
+                server.tasks[task_id] = {'done': SchedulerTaskStatus.DONE, 'failed': SchedulerTaskStatus.FAILED,
+                                         'pending': SchedulerTaskStatus.PENDING}[fate]
+    return fates
+
+
+def run_pass(app, server: FakeScheduler) -> tuple[float, dict, int]:
+    from sqlalchemy import event
+    from backend.models import db
+    from backend.features.image_generation.reconciler import reconcile_stale_generations
+    reset_counters(server)
+    statements = []
+    listener = lambda *a, **kw: statements.append(1)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        started = time.perf_counter()
+        summary = reconcile_stale_generations(limit=10_000)
+        seconds = time.perf_counter() - started
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    return seconds, summary, len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', type=int, default=300)
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    server = FakeScheduler(args.latency_ms / 1000.0, 0.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['A1111_SCHEDULER_URL'] = server.url
+        os.environ['FLASK_CALLBACK_BASE_URL'] = 'http://127.0.0.1:5001'
+        os.environ['GENERATION_DISPATCHER'] = 'inline'
+        os.environ['GENERATED_FILES_FOLDER'] = os.path.join(tmp, 'generated')
+        os.environ.setdefault('SCHEDULER_SUBMIT_RATE', '0')
+        from backend.benchmarks.bench_grid_format import build_app
+        from backend.models import db, Generation, GenerationStatus
+        from backend.features.image_generation.services import process_generation_request
+
+        app = build_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            pairs = fill_db(args.pairs)
+        with app.test_request_context():
+            results = process_generation_request(pairs)
+        print(f"Queued {len(results['tasks_started'])} generations, scheduler at {args.latency_ms:.0f} ms latency")
+
+        fates = lose_callbacks(server)
+        print(f"Callbacks lost; scheduler side: {dict(fates)}\n")
+        with app.app_context():
+            db.session.query(Generation).filter(Generation.status == GenerationStatus.QUEUED).update(
+                {Generation.queued_at: datetime.utcnow() - timedelta(hours=1)}, synchronize_session=False)
+            db.session.commit()
+
+        for label in ('first pass', 'immediate second pass'):
+            seconds, summary, statements = run_pass(app, server)
+            print(f"{label}: {seconds:.2f} s, {server.requests} HTTP requests over {server.connections} new TCP connections, "
+                  f"{statements} SQL statements")
+            print(f"    {summary}")
+
+        with app.app_context():
+            statuses = Counter(status.value for status, in db.session.query(Generation.status))
+        print(f"\nGeneration statuses after reconciliation: {dict(statuses)}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
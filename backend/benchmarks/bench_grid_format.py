@@ -0,0 +1,124 @@
+"""
+Бенчмарк: размер ответа /api/grid-data и время его сборки/кодирования для
+формата rows (по умолчанию) и columnar, кодировщиками json / orjson / msgpack.
+
+Данные синтетические: временная SQLite-база, N коллекций с промптами и
+комментариями, M проектов, ~60% ячеек сгенерированы (половина из них выбраны).
+Ответ строится настоящим get_grid_data_service.
+
+Запуск из корня репозитория:
+    python -m backend.benchmarks.bench_grid_format [--collections 500] [--projects 40]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+
+def build_app(db_path: str):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ.setdefault('GENERATION_DISPATCHER', 'off') # Бенчмаркам фоновый диспетчер не нужен
+    from backend.app import create_app
+    return create_app()
+
+
+def fill_db(n_collections: int, n_projects: int, seed: int) -> list[str]:
+    from backend.models import db, Project, Collection, Generation, GenerationStatus, GeneratedFile, SelectedCover
+    from backend.features.grid_selection.grid_cells import rebuild_grid_cells
+
+    rnd = random.Random(seed)
+    now = datetime.utcnow()
+    project_ids = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(n_projects)]
+    db.session.bulk_insert_mappings(Project, [
+        {'id': pid, 'name': f'project {i}', 'path': f'project_{i}', 'base_positive_prompt': 'masterpiece, best quality'}
+        for i, pid in enumerate(project_ids)
+    ])
+    words = ['portrait', 'landscape', 'night', 'city', 'forest', 'cinematic', 'lighting', 'detailed', 'soft', 'color']
+    db.session.bulk_insert_mappings(Collection, [
+        {
+            'id': cid,
+            'name': f'collection {cid}',
+            'type': rnd.choice(['character', 'style', 'location']),
+            'collection_positive_prompt': ', '.join(rnd.choices(words, k=40)),
+            'collection_negative_prompt': ', '.join(rnd.choices(words, k=15)),
+            'comment': ' '.join(rnd.choices(words, k=20)),
+        }
+        for cid in range(1, n_collections + 1)
+    ])
+
+    generations, files, covers = [], [], []
+    file_id = 0
+    for cid in range(1, n_collections + 1):
+        for pid in project_ids:
+            if rnd.random() >= 0.6:
+                continue
+            gid = str(uuid.UUID(int=rnd.getrandbits(128)))
+            file_id += 1
+            generations.append({'id': gid, 'project_id': pid, 'collection_id': cid, 'status': GenerationStatus.COMPLETED,
+                                'final_positive_prompt': 'prompt', 'updated_at': now - timedelta(minutes=file_id)})
+            files.append({'id': file_id, 'generation_id': gid, 'file_path': f'{pid}/{cid}/{gid}.png'})
+            if rnd.random() < 0.5:
+                covers.append({'collection_id': cid, 'project_id': pid, 'generation_id': gid, 'generated_file_id': file_id})
+    db.session.bulk_insert_mappings(Generation, generations)
+    db.session.bulk_insert_mappings(GeneratedFile, files)
+    db.session.bulk_insert_mappings(SelectedCover, covers)
+    db.session.commit()
+    rebuild_grid_cells()
+    return project_ids
+
+
+def best_of(repeat: int, fn):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--collections', type=int, default=500)
+    parser.add_argument('--projects', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from backend.utils import serialization
+    encoders = {'json (stdlib)': lambda data: json.dumps(data).encode('utf-8')}
+    if serialization.orjson is not None:
+        encoders['orjson'] = lambda data: serialization.orjson.dumps(data, option=serialization.orjson.OPT_NON_STR_KEYS)
+    else:
+        print("orjson is not installed, skipping")
+    if serialization.msgpack is not None:
+        encoders['msgpack'] = serialization.msgpack.packb
+    else:
+        print("msgpack is not installed, skipping")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = build_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            project_ids = fill_db(args.collections, args.projects, seed=42)
+
+        from backend.features.grid_selection.services import get_grid_data_service
+        print(f"Dataset: {args.collections} collections x {args.projects} projects (one page of {args.collections})\n")
+        print(f"{'format':<10} {'encoder':<14} {'build ms':>9} {'encode ms':>10} {'bytes':>11} {'gzip bytes':>11}")
+        for response_format in ('rows', 'columnar'):
+            with app.test_request_context():
+                build_seconds, data = best_of(args.repeat, lambda: get_grid_data_service(
+                    ','.join(project_ids), search=None, type_=None, advanced=None, sort='id', order='asc',
+                    generation_status_filter=None, page=1, per_page=args.collections,
+                    include_total=False, response_format=response_format
+                ))
+            for name, encode in encoders.items():
+                encode_seconds, body = best_of(args.repeat, lambda: encode(data))
+                print(f"{response_format:<10} {name:<14} {build_seconds * 1000:>9.1f} {encode_seconds * 1000:>10.1f} "
+                      f"{len(body):>11,} {len(gzip.compress(body, 6)):>11,}")
+
+
+if __name__ == '__main__':
+    main()
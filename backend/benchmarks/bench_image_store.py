@@ -0,0 +1,112 @@
+"""
+Бенчмарк: место на диске и экспорт обложек при IMAGE_STORE=paths и blobs.
+
+Для каждого режима создает --generations QUEUED-генераций и принимает для них
+callback'и (CALLBACK_INGEST=async, финализация пулом), причем изображения берутся
+из набора --unique разных файлов по --file-kb КБ - как при повторных генерациях
+с фиксированным seed. Затем переиндексирует папку проектов в новый проект
+(тот же набор байтов второй раз) и экспортирует --exports файлов в selection_path.
+Печатаются логический объем файлов, фактически занятое место (уникальные inode),
+время приема и время экспорта: копирование против link_file.
+
+Запуск из корня репозитория:
+    python -m backend.benchmarks.bench_image_store [--generations 300] [--unique 60]
+"""
+import argparse
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+
+
+def disk_usage(root: str) -> tuple[int, int]:
+    """ (логический объем всех файлов, место, занятое уникальными inode) """
+    logical, inodes = 0, {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            st = os.stat(os.path.join(dirpath, filename))
+            logical += st.st_size
+            inodes[(st.st_dev, st.st_ino)] = st.st_blocks * 512
+    return logical, sum(inodes.values())
+
+
+def run_mode(mode: str, args, tmp: str, images: list[bytes]) -> dict:
+    os.environ['IMAGE_STORE'] = mode
+    os.environ['CALLBACK_INGEST'] = 'async'
+    root = os.path.join(tmp, mode, 'generated')
+    os.environ['GENERATED_FILES_FOLDER'] = root
+    from backend.benchmarks.bench_grid_format import build_app
+    from backend.benchmarks.bench_callback_ingest import queue_generations
+    from backend.models import db, Project, GeneratedFile
+    from backend.features.image_generation.callback_ingest import ingest_staged_callbacks
+    from backend.features.project_management.services import reindex_project_files
+    from backend.features.file_serving.blob_store import generated_file_abs_path, link_file
+
+    app = build_app(os.path.join(tmp, mode, 'bench.db'))
+    rnd = random.Random(args.seed)
+    with app.app_context():
+        generation_ids = queue_generations(args.generations)
+    client = app.test_client()
+    started = time.perf_counter()
+    for generation_id in generation_ids:
+        data = {'status': 'done', 'files': [(io.BytesIO(rnd.choice(images)), 'image.png')]}
+        client.post(f'/api/scheduler_callback/{generation_id}', data=data, content_type='multipart/form-data')
+    with app.app_context():
+        while ingest_staged_callbacks():
+            pass
+        ingest_seconds = time.perf_counter() - started
+
+        # Переиндексация копии папки проекта: те же байты приходят второй раз
+        source_dir = generated_file_abs_path(os.path.dirname(GeneratedFile.query.first().file_path))
+        import_dir = os.path.join(root, 'imported')
+        shutil.copytree(source_dir, import_dir)
+        project = Project(name='imported', path='imported')
+        db.session.add(project)
+        db.session.commit()
+        started = time.perf_counter()
+        reindex = reindex_project_files(project, import_dir)
+        reindex_seconds = time.perf_counter() - started
+
+        sources = [generated_file_abs_path(f.file_path) for f in GeneratedFile.query.limit(args.exports)]
+    logical, physical = disk_usage(root)
+
+    export_times = {}
+    for label, export in (('copy', lambda src, dst: shutil.copy(src, dst)), ('link', link_file)):
+        target = os.path.join(tmp, mode, f'selection_{label}')
+        os.makedirs(target)
+        started = time.perf_counter()
+        for source in sources:
+            export(source, os.path.join(target, os.path.basename(source)))
+        export_times[label] = time.perf_counter() - started
+    return {
+        'logical_mb': logical / 2 ** 20, 'physical_mb': physical / 2 ** 20, 'ingest_s': ingest_seconds,
+        'reindex_s': reindex_seconds, 'deduplicated': reindex.get('deduplicated_files', 0),
+        'copy_ms': export_times['copy'] * 1000, 'link_ms': export_times['link'] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--generations', type=int, default=300)
+    parser.add_argument('--unique', type=int, default=60)
+    parser.add_argument('--file-kb', type=int, default=512)
+    parser.add_argument('--exports', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    images = [os.urandom(args.file_kb * 1024) for _ in range(args.unique)]
+    print(f"{args.generations} callbacks drawing from {args.unique} distinct {args.file_kb} KB images, "
+          f"then reindex of a copy and {args.exports} selection exports\n")
+    print(f"{'mode':<7} {'logical MB':>11} {'on disk MB':>11} {'ingest s':>9} {'reindex s':>10} {'dedup':>6} "
+          f"{'copy ms':>8} {'link ms':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('paths', 'blobs'):
+            r = run_mode(mode, args, tmp, images)
+            print(f"{mode:<7} {r['logical_mb']:11.1f} {r['physical_mb']:11.1f} {r['ingest_s']:9.2f} {r['reindex_s']:10.2f} "
+                  f"{r['deduplicated']:6} {r['copy_ms']:8.0f} {r['link_ms']:8.0f}")
+
+
+if __name__ == '__main__':
+    main()
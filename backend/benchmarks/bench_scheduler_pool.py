@@ -0,0 +1,92 @@
+"""
+Бенчмарк: распределение генераций по пулу экземпляров agent-scheduler.
+
+Поднимает несколько локальных фейковых планировщиков (см. bench_scheduler_submit)
+с разной задержкой ответа, отправляет пакет через process_generation_request
+в режиме inline и показывает, сколько задач получил каждый экземпляр (по
+Generation.scheduler_url). Затем один экземпляр останавливается, и второй пакет
+(экземпляр отвечает 500 и не принимает новые соединения) проверяет вывод его
+из ротации и переназначение неотправленных генераций.
+
+Запуск из корня репозитория:
+    python -m backend.benchmarks.bench_scheduler_pool [--pairs 300] [--instances 3]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from backend.benchmarks.bench_scheduler_submit import FakeScheduler, fill_db
+
+
+def run_batch(app, pairs: list[dict], concurrency: int) -> tuple[float, dict, Counter]:
+    from backend.models import db, Generation, GenerationStatus
+    from backend.features.image_generation.services import process_generation_request
+    with app.test_request_context():
+        started = time.perf_counter()
+        results = process_generation_request(pairs, concurrency=concurrency)
+        seconds = time.perf_counter() - started
+        ids = results['tasks_started']
+        routed = Counter(url for url, in db.session.query(Generation.scheduler_url).filter(
+            Generation.id.in_(ids), Generation.status == GenerationStatus.QUEUED))
+        statuses = Counter(status.value for status, in db.session.query(Generation.status).filter(Generation.id.in_(ids)))
+    return seconds, {**statuses, 'errors': len(results['pair_errors'])}, routed
+
+
+def print_batch(label: str, seconds: float, statuses: dict, routed: Counter, servers: list[FakeScheduler]):
+    print(f"{label}: {seconds:.2f} s, {statuses}")
+    for server in servers:
+        print(f"    {server.url} ({server.latency * 1000:.0f} ms): {routed.get(server.url, 0)} queued")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', type=int, default=300)
+    parser.add_argument('--instances', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=10.0, help="Задержка первого экземпляра, следующие медленнее")
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    servers = [FakeScheduler(args.latency_ms * (i + 1) / 1000.0, 0.0) for i in range(args.instances)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ['A1111_SCHEDULER_URLS'] = ','.join(server.url for server in servers)
+    os.environ['FLASK_CALLBACK_BASE_URL'] = 'http://127.0.0.1:5001'
+    os.environ['GENERATION_DISPATCHER'] = 'inline'
+    os.environ.setdefault('SCHEDULER_SUBMIT_RATE', '0')
+    from backend.benchmarks.bench_grid_format import build_app
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = build_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            pairs = fill_db(args.pairs * 2)
+        print(f"{args.instances} fake schedulers, {args.pairs} pairs per batch, concurrency {args.concurrency}\n")
+
+        seconds, statuses, routed = run_batch(app, pairs[:args.pairs], args.concurrency)
+        print_batch("all instances up", seconds, statuses, routed, servers)
+
+        # Открытые keep-alive соединения продолжают обслуживаться и после остановки
+        # сервера, поэтому "упавший" экземпляр на них отвечает 500
+        stopped = servers[0]
+        stopped.error_rate = 1.0
+        stopped.shutdown()
+        stopped.server_close()
+        seconds, statuses, routed = run_batch(app, pairs[args.pairs:], args.concurrency)
+        print_batch(f"\n{stopped.url} stopped", seconds, statuses, routed, servers)
+
+        with app.app_context():
+            from backend.features.image_generation.dispatcher import scheduler_pool
+            print()
+            for instance in scheduler_pool().status():
+                print(f"    {instance['url']}: healthy={instance['healthy']}, submitted={instance['submitted']}, "
+                      f"failed={instance['failed']}")
+
+    for server in servers[1:]:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Бенчмарк: пакетная отправка задач в agent-scheduler.
+
+Поднимает локальный фейковый планировщик (ThreadingHTTPServer) с заданной
+задержкой ответа и сравнивает:
+  - голый requests.post на каждую задачу (новое TCP-соединение, как раньше);
+  - общую keep-alive сессию последовательно;
+  - process_generation_request целиком при разной параллельности.
+Фейковый сервер считает принятые TCP-соединения и может отвечать ошибками
+(--error-rate), чтобы проверить построчные ошибки. Принятые задачи он помнит
+и отдает их статус и результаты (GET /v1/task/<id>[/results]) - для сверки
+зависших генераций (bench_generation_reconciler).
+
+Запуск из корня репозитория:
+    python -m backend.benchmarks.bench_scheduler_submit [--pairs 400] [--latency-ms 20]
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from backend.constants import SCHEDULER_QUEUE_TXT2IMG_PATH, SchedulerTaskStatus
+
+# Минимальный PNG 1x1 - "результат" завершенной задачи
+FAKE_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+
+class FakeScheduler(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float, error_rate: float):
+        super().__init__(('127.0.0.1', 0), FakeSchedulerHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.connections = 0
+        self.requests = 0
+        self.tasks = {} # task_id -> SchedulerTaskStatus
+        self.lock = threading.Lock()
+        self.random = random.Random(7)
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FakeSchedulerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+    # Заголовки и тело уходят отдельными send(); без TCP_NODELAY keep-alive
+    # соединение ловит задержку Nagle + delayed ACK (~40 мс на запрос)
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        json.loads(body or b'{}')
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            position = server.requests
+            fail = server.random.random() < server.error_rate
+        time.sleep(server.latency)
+        if fail:
+            status, payload = 500, {'detail': 'fake scheduler error'}
+        else:
+            task_id = str(uuid.uuid4())
+            with server.lock:
+                server.tasks[task_id] = SchedulerTaskStatus.PENDING
+            status, payload = 200, {'task_id': task_id, 'queue_position': position}
+        self.send_json(status, payload)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        parts = self.path.split('?')[0].strip('/').split('/') # agent-scheduler/v1/task/<id>[/results]
+        task_id = parts[3] if len(parts) >= 4 and parts[:3] == ['agent-scheduler', 'v1', 'task'] else None
+        with server.lock:
+            task_status = server.tasks.get(task_id)
+        time.sleep(server.latency)
+        if task_status is None:
+            self.send_json(404, {'detail': 'Task not found'})
+        elif len(parts) == 5 and parts[4] == 'results':
+            image = 'data:image/png;base64,' + base64.b64encode(FAKE_PNG).decode('ascii')
+            self.send_json(200, {'success': True, 'data': [{'image': image, 'infotext': 'fake'}]})
+        else:
+            self.send_json(200, {'success': True, 'data': {'id': task_id, 'status': task_status}})
+
+    def send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def reset_counters(server: FakeScheduler):
+    with server.lock:
+        server.connections = 0
+        server.requests = 0
+
+
+def bench_raw_http(server: FakeScheduler, n: int, use_session: bool) -> tuple[float, int]:
+    reset_counters(server)
+    endpoint = server.url + SCHEDULER_QUEUE_TXT2IMG_PATH
+    session = requests.Session() if use_session else None
+    started = time.perf_counter()
+    for i in range(n):
+        post = session.post if session else requests.post
+        try:
+            post(endpoint, json={'prompt': f'p{i}'}, timeout=15)
+        except requests.RequestException:
+            pass
+    return time.perf_counter() - started, server.connections
+
+
+def fill_db(n_pairs: int) -> list[dict]:
+    from backend.models import db, Project, Collection
+    n_projects = 10
+    n_collections = (n_pairs + n_projects - 1) // n_projects
+    project_ids = [str(uuid.uuid4()) for _ in range(n_projects)]
+    db.session.bulk_insert_mappings(Project, [
+        {'id': pid, 'name': f'project {i}', 'path': f'project_{i}', 'base_positive_prompt': 'masterpiece'}
+        for i, pid in enumerate(project_ids)
+    ])
+    db.session.bulk_insert_mappings(Collection, [
+        {'id': cid, 'name': f'collection {cid}', 'collection_positive_prompt': 'portrait'}
+        for cid in range(1, n_collections + 1)
+    ])
+    db.session.commit()
+    pairs = [{'project_id': pid, 'collection_id': str(cid)} for cid in range(1, n_collections + 1) for pid in project_ids]
+    return pairs[:n_pairs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', type=int, default=400)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    args = parser.parse_args()
+
+    server = FakeScheduler(args.latency_ms / 1000.0, args.error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f"Fake scheduler: {args.latency_ms:.0f} ms latency, error rate {args.error_rate:.0%}, {args.pairs} pairs\n")
+    seconds, connections = bench_raw_http(server, args.pairs, use_session=False)
+    print(f"{'raw requests.post, sequential':<42} {seconds:7.2f} s  {connections:5} TCP connections")
+    seconds, connections = bench_raw_http(server, args.pairs, use_session=True)
+    print(f"{'raw Session.post, sequential':<42} {seconds:7.2f} s  {connections:5} TCP connections")
+
+    os.environ['A1111_SCHEDULER_URL'] = server.url
+    os.environ['FLASK_CALLBACK_BASE_URL'] = 'http://127.0.0.1:5001'
+    os.environ['GENERATION_DISPATCHER'] = 'inline' # Замеряем отправку целиком внутри вызова
+    os.environ.setdefault('SCHEDULER_SUBMIT_RATE', '0')
+    from backend.benchmarks.bench_grid_format import build_app
+
+    for concurrency in args.concurrency:
+        with tempfile.TemporaryDirectory() as tmp:
+            app = build_app(os.path.join(tmp, 'bench.db'))
+            with app.app_context():
+                pairs = fill_db(args.pairs)
+            from sqlalchemy import event
+            from backend.models import db
+            from backend.features.image_generation.services import process_generation_request
+            reset_counters(server)
+            statements = []
+            with app.test_request_context():
+                listener = lambda *a, **kw: statements.append(1)
+                event.listen(db.engine, 'before_cursor_execute', listener)
+                started = time.perf_counter()
+                results = process_generation_request(pairs, concurrency=concurrency)
+                seconds = time.perf_counter() - started
+                event.remove(db.engine, 'before_cursor_execute', listener)
+            label = f"process_generation_request, concurrency {concurrency}"
+            print(f"{label:<42} {seconds:7.2f} s  {server.connections:5} TCP connections  {len(statements):5} SQL statements  "
+                  f"{len(results['tasks_started'])} queued, {len(results['pair_errors'])} errors")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
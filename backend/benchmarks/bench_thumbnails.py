@@ -0,0 +1,102 @@
+"""
+Бенчмарк: трафик страницы грида с оригиналами и с WebP-миниатюрами (нужен Pillow).
+
+Принимает --files callback'ов с PNG --image-px x --image-px (шум поверх градиентов,
+сжимается примерно как сгенерированные изображения), ждет построения миниатюр пулом
+процессов и печатает:
+- время построения всех миниатюр после приема;
+- байты и время отдачи страницы грида (все файлы) оригиналами и ?size=256;
+- задержку ?size=256, когда миниатюры еще нет (ленивое построение), и когда она есть.
+
+Запуск из корня репозитория:
+    python -m backend.benchmarks.bench_thumbnails [--files 100] [--image-px 1024]
+"""
+import argparse
+import io
+import os
+import shutil
+import tempfile
+import time
+
+
+def make_png(px: int, seed: int) -> bytes:
+    from PIL import Image
+    noise = Image.effect_noise((px, px), 24 + seed % 16)
+    gradient = Image.linear_gradient('L').resize((px, px))
+    radial = Image.radial_gradient('L').resize((px, px))
+    image = Image.merge('RGB', (Image.blend(noise, gradient, 0.6), Image.blend(noise, radial, 0.6), noise))
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def fetch_all(client, file_ids: list[int], query: str = '') -> tuple[int, float, list[float]]:
+    """ (всего байт, общее время, время каждого запроса) """
+    total, latencies = 0, []
+    started = time.perf_counter()
+    for file_id in file_ids:
+        request_started = time.perf_counter()
+        response = client.get(f'/generated_files/{file_id}{query}')
+        latencies.append(time.perf_counter() - request_started)
+        total += len(response.data)
+        response.close()
+    return total, time.perf_counter() - started, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--image-px', type=int, default=1024)
+    parser.add_argument('--lazy', type=int, default=20, help="Сколько миниатюр строить лениво по запросу")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['GENERATED_FILES_FOLDER'] = os.path.join(tmp, 'generated')
+        os.environ['CALLBACK_INGEST'] = 'async'
+        from backend.benchmarks.bench_grid_format import build_app
+        from backend.benchmarks.bench_callback_ingest import queue_generations
+        from backend.constants import THUMBNAIL_FOLDER, THUMBNAIL_SIZES
+        from backend.models import GeneratedFile
+        from backend.features.image_generation.callback_ingest import ingest_staged_callbacks
+        from backend.features.file_serving.thumbnails import thumbnail_abs_path, thumbnail_key, thumbnail_workers
+
+        app = build_app(os.path.join(tmp, 'bench.db'))
+        app.logger.disabled = True
+        images = [make_png(args.image_px, seed) for seed in range(8)]
+        client = app.test_client()
+        with app.app_context():
+            generation_ids = queue_generations(args.files)
+        for index, generation_id in enumerate(generation_ids):
+            data = {'status': 'done', 'files': [(io.BytesIO(images[index % len(images)]), 'image.png')]}
+            client.post(f'/api/scheduler_callback/{generation_id}', data=data, content_type='multipart/form-data')
+
+        with app.app_context():
+            started = time.perf_counter()
+            while ingest_staged_callbacks():
+                pass
+            files = [(f.id, f.content_hash) for f in GeneratedFile.query.order_by(GeneratedFile.id)]
+            expected = [thumbnail_abs_path(thumbnail_key(file_id, content_hash), size)
+                        for file_id, content_hash in files for size in THUMBNAIL_SIZES]
+            while not all(os.path.exists(path) for path in expected):
+                time.sleep(0.01)
+            build_seconds = time.perf_counter() - started
+        file_ids = [file_id for file_id, _ in files]
+
+        print(f"{args.files} files, {args.image_px}x{args.image_px} PNG, {thumbnail_workers()} thumbnail workers\n")
+        print(f"eager build (all sizes, {len(images)} distinct images): {build_seconds:.2f} s\n")
+        print(f"{'grid page':<14} {'MB':>8} {'total ms':>9} {'p50 ms':>7}")
+        for label, query in (('original', ''), ('size=256', '?size=256')):
+            total, seconds, latencies = fetch_all(client, file_ids, query)
+            print(f"{label:<14} {total / 2 ** 20:8.2f} {seconds * 1000:9.0f} {latencies[len(latencies) // 2] * 1000:7.1f}")
+
+        # Ленивое построение: миниатюр нет (файлы зарегистрированы до их появления)
+        shutil.rmtree(os.path.join(os.environ['GENERATED_FILES_FOLDER'], THUMBNAIL_FOLDER))
+        lazy_ids = file_ids[:min(args.lazy, len(images))]
+        _, _, cold = fetch_all(client, lazy_ids, '?size=256')
+        _, _, warm = fetch_all(client, lazy_ids, '?size=256')
+        print(f"\n?size=256 without thumbnail (built on request): p50 {cold[len(cold) // 2] * 1000:.0f} ms, "
+              f"max {cold[-1] * 1000:.0f} ms; with thumbnail: p50 {warm[len(warm) // 2] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
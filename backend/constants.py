@@ -14,6 +14,140 @@ SUPPORTED_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
 REQUEST_TIMEOUT_SECONDS = 15
 SCHEDULER_REQUEST_TIMEOUT = 15
 
+# Отправка задач в agent-scheduler
+SCHEDULER_QUEUE_TXT2IMG_PATH = '/agent-scheduler/v1/queue/txt2img'
+DEFAULT_SCHEDULER_SUBMIT_CONCURRENCY = 8 # Параллельных запросов к планировщику (SCHEDULER_SUBMIT_CONCURRENCY в .env)
+MAX_SCHEDULER_SUBMIT_CONCURRENCY = 64
+SCHEDULER_RESULT_BATCH_SIZE = 200 # Ответов планировщика на один UPDATE/коммит
+SCHEDULER_UNHEALTHY_AFTER_FAILURES = 3 # Подряд временных ошибок, после которых экземпляр выводится из ротации
+SCHEDULER_UNHEALTHY_COOLDOWN_SECONDS = 30.0 # На столько; удваивается при повторных сбоях
+SCHEDULER_UNHEALTHY_COOLDOWN_MAX_SECONDS = 600.0
+SCHEDULER_TASK_PATH = '/agent-scheduler/v1/task/{task_id}'
+SCHEDULER_TASK_RESULTS_PATH = '/agent-scheduler/v1/task/{task_id}/results'
+
+# Сверка зависших QUEUED-генераций с планировщиком (потерянные callback'и)
+class SchedulerTaskStatus:
+    """ Статусы задачи agent-scheduler (GET /v1/task/<id>). """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    SAVED = 'saved' # Завершенная задача, отмеченная в истории планировщика
+    FAILED = 'failed'
+    INTERRUPTED = 'interrupted'
+
+DEFAULT_RECONCILE_INTERVAL_SECONDS = 120.0 # Как часто диспетчер запускает сверку (GENERATION_RECONCILE_INTERVAL в .env, 0 - выключена)
+DEFAULT_RECONCILE_STALE_AFTER_SECONDS = 900.0 # QUEUED дольше этого проверяется у планировщика (GENERATION_STALE_AFTER в .env)
+RECONCILE_RECHECK_SECONDS = 600.0 # Задачу, которая еще в очереди планировщика, проверяем снова не раньше
+RECONCILE_BATCH_SIZE = 100 # Генераций, проверяемых за один проход
+RECONCILE_CONCURRENCY = 4 # Параллельных запросов статуса к планировщику
+
+# Диспетчер очереди отправки (outbox) генераций
+class GenerationDispatcherModes:
+    THREAD = 'thread' # Фоновый поток в процессе приложения (по умолчанию)
+    INLINE = 'inline' # Отправка внутри запроса /generate-batch (как раньше)
+    OFF = 'off' # Отправляет отдельный процесс: flask dispatch-generations
+
+DISPATCH_BATCH_SIZE = 100 # Генераций, захватываемых диспетчером за один проход
+DISPATCH_POLL_INTERVAL_SECONDS = 2.0 # Пауза между проходами, если очередь пуста
+DISPATCH_LEASE_SECONDS = 300 # Срок захвата пачки: после падения процесса пачка снова станет доступна
+DEFAULT_SCHEDULER_SUBMIT_RATE = 20.0 # Запросов к планировщику в секунду (SCHEDULER_SUBMIT_RATE в .env, 0 - без ограничения)
+DISPATCH_MAX_ATTEMPTS = 8 # После стольких временных ошибок генерация помечается FAILED
+DISPATCH_BACKOFF_BASE_SECONDS = 2.0
+DISPATCH_BACKOFF_MAX_SECONDS = 300.0
+
+# Прием callback'ов планировщика (CALLBACK_INGEST в .env)
+class CallbackIngestModes:
+    ASYNC = 'async' # Файлы складываются в staging, ответ сразу, остальное - пул потоков (по умолчанию)
+    INLINE = 'inline' # Вся обработка внутри запроса callback'а (как раньше)
+
+CALLBACK_STAGING_FOLDER = '.staging' # Папка принятых, но еще не обработанных файлов внутри GENERATED_FILES_FOLDER
+DEFAULT_CALLBACK_INGEST_WORKERS = 2 # Потоков обработки принятых callback'ов (CALLBACK_INGEST_WORKERS в .env)
+CALLBACK_INGEST_BATCH_SIZE = 50 # Callback'ов, обрабатываемых одной транзакцией
+CALLBACK_INGEST_POLL_INTERVAL_SECONDS = 2.0 # Пауза между проходами, если принятых callback'ов нет
+CALLBACK_INGEST_LEASE_SECONDS = 120 # Срок захвата пачки: после падения процесса пачка снова станет доступна
+CALLBACK_INGEST_MAX_ATTEMPTS = 5 # После стольких ошибок обработки генерация помечается FAILED
+CALLBACK_SPOOL_CHUNK_BYTES = 1024 * 1024 # Размер блока при записи загруженного файла в staging
+
+# Хранилище изображений (IMAGE_STORE в .env)
+class ImageStoreModes:
+    PATHS = 'paths' # Каждый файл - отдельная копия по своему пути (по умолчанию, как раньше)
+    BLOBS = 'blobs' # Контентно-адресуемое хранилище: одинаковые байты на диске один раз, пути - ссылки на blob
+
+IMAGE_BLOB_FOLDER = '.blobs' # Папка blob'ов внутри GENERATED_FILES_FOLDER: .blobs/ab/cd/<sha256>
+IMAGE_BLOB_FANOUT_LEVELS = 2 # Уровней подкаталогов по 2 hex-символа хэша
+FILE_HASH_CHUNK_BYTES = 1024 * 1024 # Размер блока при подсчете SHA-256 файла на диске
+
+# Миниатюры изображений (?size= у /generated_files/<id>, нужен Pillow)
+THUMBNAIL_SIZES = (256, 512, 1024) # Длинная сторона, px: грид, окно выбора, просмотр
+THUMBNAIL_FOLDER = '.thumbnails' # Папка миниатюр внутри GENERATED_FILES_FOLDER
+THUMBNAIL_WEBP_QUALITY = 80
+DEFAULT_THUMBNAIL_WORKERS = 2 # Процессов построения миниатюр (THUMBNAIL_WORKERS в .env)
+THUMBNAIL_LAZY_TIMEOUT_SECONDS = 30.0 # Ожидание миниатюры, которую строим по запросу
+GENERATED_FILE_CACHE_MAX_AGE_SECONDS = 365 * 24 * 60 * 60 # Cache-Control для /generated_files/<id> (файлы не меняются)
+
+# Повторная постановка тех же параметров, пока предыдущая генерация не завершена ("dedup" в /generate-batch)
+class GenerationDedupModes:
+    REUSE = 'reuse' # Вернуть незавершенную генерацию вместо новой (по умолчанию)
+    SKIP = 'skip' # Пропустить пару, ничего не возвращая в tasks_started
+    OFF = 'off' # Всегда ставить новую генерацию
+
+DEDUP_LOOKUP_BATCH_SIZE = 500 # Хэшей в одном IN-запросе поиска незавершенных генераций
+RANDOM_SEED_VALUES = (-1, None, '', '-1') # Значения seed, означающие "случайный"
+
+# Приоритет отправки генераций ("priority" в /generate-batch и /generate-by-filter)
+class GenerationPriorities:
+    LOW = 'low' # Фоновые массовые пакеты
+    NORMAL = 'normal' # По умолчанию
+    HIGH = 'high' # Срочные перегенерации: отправляются раньше всех остальных
+
+GENERATION_PRIORITY_VALUES = {GenerationPriorities.LOW: -1, GenerationPriorities.NORMAL: 0, GenerationPriorities.HIGH: 1}
+GENERATION_PRIORITY_NAMES = {value: name for name, value in GENERATION_PRIORITY_VALUES.items()}
+DEFAULT_PROJECT_QUEUE_WEIGHT = 1 # Доля проекта в справедливом разделении отправки (Project.queue_weight)
+MAX_PROJECT_QUEUE_WEIGHT = 100
+MAX_REQUESTED_BY_LENGTH = 64 # Идентификатор клиента/сессии (X-Client-Id)
+
+# Фоновые задания (Job, features/jobs/runner.py)
+class JobStatus:
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+JOB_FINISHED_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+class JobKinds:
+    GENERATE_BY_FILTER = 'generate_by_filter' # Все подходящие ячейки грида по фильтру
+    GENERATE_BATCH = 'generate_batch' # /generate-batch?async=1
+    PROJECT_REINDEX = 'project_reindex' # /projects/<id>/reindex?async=1
+    COLLECTIONS_IMPORT_CSV = 'collections_import_csv' # /collections/import-csv?async=1
+
+DEFAULT_JOB_WORKERS = 2 # Потоков исполнителя заданий (JOB_WORKERS в .env)
+JOB_PROGRESS_INTERVAL_SECONDS = 0.5 # Не чаще записываем прогресс в БД и шлем job_update
+JOB_CANCEL_POLL_SECONDS = 1.0 # Как часто задание перечитывает флаг отмены из БД
+JOB_HEARTBEAT_SECONDS = 5.0 # Как часто процесс отмечает свои незавершенные задания (Job.heartbeat_at) и ищет прерванные
+JOB_HEARTBEAT_TIMEOUT_SECONDS = 30.0 # Незавершенное задание без отметки дольше этого считается прерванным
+REINDEX_BATCH_FILES = 500 # Переиндексация фоновым заданием: файлов между коммитами и отчетами о прогрессе
+CSV_IMPORT_PROGRESS_ROWS = 1000 # Импорт CSV фоновым заданием: строк между отчетами о прогрессе
+
+# Массовая генерация (по фильтру грида, /generate-batch?async=1)
+BULK_GENERATION_CHUNK_SIZE = 500 # Пар на один вызов process_generation_request
+
+# Адаптивное ограничение генераций "в полете" у планировщика (SCHEDULER_BACKPRESSURE в .env)
+class SchedulerBackpressureModes:
+    OFF = 'off' # Отправлять все готовые генерации сразу (по умолчанию)
+    ADAPTIVE = 'adaptive' # Держать не больше limit QUEUED-генераций, limit подстраивается (AIMD)
+
+BACKPRESSURE_INITIAL_LIMIT = 32
+BACKPRESSURE_MIN_LIMIT = 1
+BACKPRESSURE_MAX_LIMIT = 1024
+DEFAULT_BACKPRESSURE_TARGET_QUEUE_POSITION = 16 # SCHEDULER_TARGET_QUEUE_POSITION в .env
+DEFAULT_BACKPRESSURE_TARGET_LATENCY_SECONDS = 600.0 # SCHEDULER_TARGET_CALLBACK_LATENCY в .env
+BACKPRESSURE_DECREASE_FACTOR = 0.7
+BACKPRESSURE_DECREASE_COOLDOWN_SECONDS = 10.0 # Не чаще одного снижения limit за это время
+BACKPRESSURE_LATENCY_EWMA_ALPHA = 0.2
+BACKPRESSURE_IN_FLIGHT_HORIZON_SECONDS = 6 * 3600 # QUEUED дольше этого считаются потерянными и не занимают место
+
 # Размеры файлов
 MAX_FILE_SIZE_MB = 50
 LOG_FILE_MAX_SIZE_MB = 10
@@ -23,6 +157,14 @@ LOG_BACKUP_COUNT = 5
 DEFAULT_HOST = '127.0.0.1'
 DEFAULT_PORT = 5001
 
+# Сжатие ответов /api/*
+COMPRESSION_MIN_SIZE_BYTES = 1024 # Ответы меньше порога не сжимаются
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_ZSTD_LEVEL = 3
+COMPRESSION_CACHE_MAX_ENTRIES = 64 # Кэш сжатых тел по ETag
+COMPRESSION_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
 # База данных
 DEFAULT_DATABASE_URL = 'sqlite:///app.db'
 
@@ -74,6 +216,28 @@ class CellStatus:
     ERROR = 'error'
     UNKNOWN = 'unknown'
 
+# Целочисленные коды статусов ячеек для компактного (columnar) формата грида
+CELL_STATUS_CODES = {
+    CellStatus.NOT_GENERATED: 0,
+    CellStatus.SELECTED: 1,
+    CellStatus.GENERATED_NOT_SELECTED: 2,
+    CellStatus.QUEUED: 3,
+    CellStatus.ERROR: 4,
+    CellStatus.UNKNOWN: 5,
+}
+
+# Форматы ответа грида
+class GridResponseFormats:
+    ROWS = 'rows'
+    COLUMNAR = 'columnar'
+
+# Поля columnar-формата, доступные для проекции (?fields=, ?cell_fields=)
+GRID_COLUMNAR_COLLECTION_FIELDS = ('name', 'type', 'collection_positive_prompt', 'collection_negative_prompt',
+                                   'comment', 'last_generation_at', 'created_at', 'updated_at')
+GRID_COLUMNAR_DEFAULT_COLLECTION_FIELDS = ('name', 'type', 'last_generation_at')
+GRID_COLUMNAR_CELL_FIELDS = ('status', 'generation_id', 'file_id', 'file_path', 'is_selected', 'error_message')
+GRID_COLUMNAR_DEFAULT_CELL_FIELDS = ('status', 'generation_id', 'file_id', 'error_message')
+
 # Regex паттерны
 COLLECTION_ID_PATTERN = r"^(\d+)"
 
@@ -1,7 +1,15 @@
 from flask import Blueprint, request, jsonify
 from backend.models import db, Project, Collection # Используем абсолютный импорт
-import csv
-import io # Для работы с потоком файла в памяти
+from backend.features.grid_selection.grid_cells import delete_grid_cells
+from backend.features.grid_selection.changes import next_change_version, mark_collection_deleted, clear_collection_tombstones, current_change_version
+from backend.utils.http_cache import compute_etag, request_args_signature, is_not_modified, not_modified_response, with_etag
+from backend.constants import DEFAULT_PAGE_SIZE, MIN_PAGE_SIZE, MAX_PAGE_SIZE, JobKinds
+from backend.utils.pagination import paginate_keyset, order_by_keyset
+from backend.utils.validators import ValidationError
+from backend.features.jobs.runner import submit_job
+from backend.features.jobs.routes import is_async_request, job_accepted_response
+from .search import apply_collection_search
+from .services import import_collections_csv_text
 import logging # Используем logging
 
 # Настраиваем логгер
@@ -14,12 +22,54 @@ collections_bp = Blueprint('collection_management', __name__, url_prefix='/api')
 
 @collections_bp.route('/collections', methods=['GET'])
 def get_collections():
-    """ Возвращает список всех коллекций. """
+    """
+    Возвращает список коллекций, отсортированный по имени.
+    ?search= - полнотекстовый поиск (FTS5 trigram), результаты упорядочены по релевантности.
+    Без параметров пагинации - весь список (массив). С ?limit= и/или ?cursor= - одна страница
+    keyset-пагинации: {"items": [...], "next_cursor": ..., "has_next": ...}.
+    """
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit')
+    search = request.args.get('search', '').strip()
+
+    # Любая запись коллекции увеличивает версию изменений (удаление - через надгробие)
+    etag = compute_etag('collections', current_change_version(), request_args_signature())
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+
     try:
-        collections = Collection.query.order_by(Collection.name).all()
-        return jsonify([c.to_dict() for c in collections])
+        query = Collection.query
+        sort_column, sort_key = Collection.name, 'name'
+        search_rank = None
+        if search:
+            query, search_rank = apply_collection_search(query, search)
+            if search_rank is not None:
+                sort_column, sort_key = search_rank, 'relevance'
+
+        def row_collection(row):
+            return row[0] if search_rank is not None else row
+
+        if cursor is None and limit is None:
+            rows = order_by_keyset(query, sort_column, Collection.id, 'asc').all()
+            return with_etag(jsonify([row_collection(row).to_dict() for row in rows]), etag)
+
+        try:
+            limit = min(max(int(limit or DEFAULT_PAGE_SIZE), MIN_PAGE_SIZE), MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({"error": "Invalid limit parameter"}), 400
+        rows, next_cursor = paginate_keyset(
+            query, sort_column, Collection.id, sort_key, 'asc', cursor, limit,
+            value_getter=lambda row: (row.search_rank, row[0].id) if search_rank is not None else (row.name, row.id)
+        )
+        return with_etag(jsonify({
+            "items": [row_collection(row).to_dict() for row in rows],
+            "next_cursor": next_cursor,
+            "has_next": next_cursor is not None
+        }), etag)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Error fetching collections: {e}") # Лучше использовать logging
+        logger.exception("Error fetching collections")
         return jsonify({"error": "Failed to fetch collections"}), 500
 
 @collections_bp.route('/collections', methods=['POST'])
@@ -51,8 +101,10 @@ def add_collection():
             id=collection_id, # Передаем ID из запроса
             name=name,
             type=collection_type, # Передаем тип (может быть None)
+            change_version=next_change_version()
         )
         db.session.add(new_collection)
+        clear_collection_tombstones([collection_id])
         db.session.commit()
         print(f"Added new collection: ID={new_collection.id}, Name={new_collection.name}") # Лучше использовать logging
         return jsonify({"message": "Collection added successfully", "collection": new_collection.to_dict()}), 201 
@@ -80,6 +132,7 @@ def update_collection(collection_id):
     collection.collection_positive_prompt = data.get('collection_positive_prompt', collection.collection_positive_prompt)
     collection.collection_negative_prompt = data.get('collection_negative_prompt', collection.collection_negative_prompt)
     collection.comment = data.get('comment', collection.comment)
+    collection.change_version = next_change_version()
 
     db.session.commit()
     return jsonify(collection.to_dict())
@@ -88,6 +141,8 @@ def update_collection(collection_id):
 def delete_collection(collection_id):
     collection = Collection.query.get_or_404(collection_id)
     # TODO: Проверить cascade удаление связанных Generation, SelectedCover?
+    delete_grid_cells(collection_id=collection.id)
+    mark_collection_deleted(collection.id)
     db.session.delete(collection)
     db.session.commit()
     return jsonify({"message": f"Collection '{collection.name}' deleted"}), 200
@@ -100,6 +155,7 @@ def import_collections_csv():
     id и name - обязательные.
     Пропускает строки с существующими ID.
     Автоматически определяет наличие заголовка.
+    ?async=1 - импорт фоновым заданием, ответ 202 с ID задания (см. /api/jobs/<id>).
     """
     if 'file' not in request.files:
         return jsonify({"error": "No file part in the request"}), 400
@@ -111,115 +167,22 @@ def import_collections_csv():
     if not file.filename.lower().endswith('.csv'):
          return jsonify({"error": "Invalid file type, please upload a CSV file"}), 400
 
-    # Статистика импорта
-    processed_rows = 0
-    added_count = 0
-    skipped_duplicates = 0
-    skipped_errors = 0
-    error_messages = []
-    new_collections = []
-
     try:
-        # Читаем файл как текстовый поток
-        stream = io.StringIO(file.stream.read().decode("UTF-8", errors='ignore'), newline=None) # Добавляем errors='ignore'
-        # Определяем наличие заголовка
-        try:
-            has_header = csv.Sniffer().has_header(stream.read(1024))
-            stream.seek(0) # Возвращаемся к началу файла
-        except csv.Error:
-            logger.warning("Could not determine CSV header, assuming none.")
-            has_header = False
-            stream.seek(0)
-
-        # Всегда используем csv.reader
-        reader = csv.reader(stream)
-
-        if has_header:
-            try:
-                header_row = next(reader) # Пропускаем заголовок
-                logger.info(f"Skipping header row: {header_row}")
-            except StopIteration:
-                 return jsonify({"error": "CSV file seems to contain only a header row"}), 400
-        
-        existing_ids = {str(c.id) for c in Collection.query.with_entities(Collection.id).all()}
-        logger.info(f"Found {len(existing_ids)} existing collection IDs.")
-
-        for i, row_data in enumerate(reader):
-            row_num = i + (2 if has_header else 1) # Номер строки в файле (для ошибок)
-            processed_rows += 1
-            
-            collection_id_str = None
-            name = None
-            collection_type = None
-            positive_prompt = None
-
-            try:
-                # Доступ по индексу
-                if len(row_data) < 2:
-                        raise ValueError("Row has fewer than 2 columns (expected at least id, name)")
-                collection_id_str = row_data[0].strip()
-                name = row_data[1].strip()
-                # Получаем остальные поля по индексу, если они есть
-                collection_type = row_data[2].strip() if len(row_data) > 2 and row_data[2] else None
-                positive_prompt = row_data[3].strip() if len(row_data) > 3 and row_data[3] else None
-                
-                # Валидация ID
-                if not collection_id_str:
-                    raise ValueError("Missing 'id'")
-                try:
-                    collection_id = int(collection_id_str)
-                except ValueError:
-                     raise ValueError(f"Invalid 'id' format: '{collection_id_str}'. Must be an integer.")
-                
-                # Валидация Name
-                if not name:
-                    raise ValueError("Missing 'name'")
-
-                # Проверка на дубликат ID
-                if str(collection_id) in existing_ids:
-                    skipped_duplicates += 1
-                    logger.debug(f"Skipping duplicate ID {collection_id} at row {row_num}")
-                    continue
-
-                # Создаем новую коллекцию
-                new_collection = Collection(
-                    id=collection_id,
-                    name=name,
-                    type=collection_type, # Будет None если пусто или отсутствует
-                    collection_positive_prompt=positive_prompt # Будет None если пусто или отсутствует
-                )
-                new_collections.append(new_collection)
-                existing_ids.add(str(collection_id)) # Добавляем в сет, чтобы не дублировать внутри файла
-                added_count += 1
-
-            except (ValueError, IndexError) as e: # Убрали KeyError, т.к. нет словаря
-                error_msg = f"Error processing row {row_num}: {e}. Row data: {row_data}"
-                logger.warning(error_msg)
-                error_messages.append(error_msg)
-                skipped_errors += 1
-                continue # Пропускаем строку с ошибкой
-
-        if new_collections:
-            db.session.add_all(new_collections)
-            db.session.commit()
-            logger.info(f"Successfully added {len(new_collections)} new collections from CSV.")
-        else:
-            logger.info("No new valid collections found in CSV to add.")
-            # Не коммитим, если ничего не добавлено
+        # Читаем файл как текст (errors='ignore' - битые байты пропускаются)
+        text = file.stream.read().decode("UTF-8", errors='ignore')
+    finally:
+        file.close() # Закрываем файл
 
+    if is_async_request():
+        job = submit_job(JobKinds.COLLECTIONS_IMPORT_CSV, {'filename': file.filename}, payload=text)
+        return job_accepted_response(job)
 
+    try:
+        summary = import_collections_csv_text(text)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         db.session.rollback() # Откатываем изменения в случае общей ошибки
         logger.exception("Failed to process CSV file")
         return jsonify({"error": f"An error occurred during CSV processing: {e}"}), 500
-    finally:
-        file.close() # Закрываем файл
-
-    return jsonify({
-        "message": "CSV import process completed.",
-        "processed_rows": processed_rows,
-        "added_count": added_count,
-        "skipped_duplicates": skipped_duplicates,
-        "skipped_errors": skipped_errors,
-        "errors": error_messages
-    }), 200
+    return jsonify(summary), 200
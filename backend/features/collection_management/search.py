@@ -0,0 +1,123 @@
+"""
+Полнотекстовый поиск по коллекциям.
+
+На SQLite используется теневой индекс FTS5 с токенизатором trigram
+(name, id, collection_positive_prompt, comment), который синхронизируется
+триггерами на таблице collections. Trigram-индекс находит любые подстроки
+длиной от 3 символов, поэтому покрывает и поиск по префиксу. Для коротких
+запросов и других СУБД используется прежний ILIKE-фильтр.
+"""
+import logging
+from flask import current_app
+from sqlalchemy import case, column, func, literal_column, or_, select, table, text
+from sqlalchemy.exc import OperationalError
+from backend.models import db, Collection
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'collections_fts'
+MIN_TRIGRAM_LENGTH = 3 # trigram MATCH не находит запросы короче 3 символов
+
+# Ранжирование: меньше - лучше (как bm25). Точное совпадение ID и префикс имени
+# поднимаются над остальными результатами фиксированным смещением.
+EXACT_ID_BOOST = 2000.0
+NAME_PREFIX_BOOST = 1000.0
+BM25_WEIGHTS = (10.0, 5.0, 1.0, 1.0) # name, id, positive prompt, comment
+# Ранг округляется в SQL: keyset-курсор хранит его и сравнивает на равенство, а у
+# неокругленного double равные по смыслу оценки могут отличаться в последних битах.
+# Строки с равным округленным рангом упорядочиваются по id.
+SEARCH_RANK_DECIMALS = 6
+
+_fts = table(FTS_TABLE, column('rowid'))
+
+_FTS_SETUP_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, collection_id, collection_positive_prompt, comment, tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS collections_fts_ai AFTER INSERT ON collections BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, collection_id, collection_positive_prompt, comment)
+        VALUES (new.id, new.name, CAST(new.id AS TEXT), new.collection_positive_prompt, new.comment);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS collections_fts_ad AFTER DELETE ON collections BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS collections_fts_au AFTER UPDATE OF id, name, collection_positive_prompt, comment ON collections BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE}(rowid, name, collection_id, collection_positive_prompt, comment)
+        VALUES (new.id, new.name, CAST(new.id AS TEXT), new.collection_positive_prompt, new.comment);
+    END""",
+]
+
+
+def rebuild_collection_search_index():
+    """ Полностью перестраивает FTS-индекс из таблицы collections. Не коммитит. """
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    db.session.execute(text(
+        f"INSERT INTO {FTS_TABLE}(rowid, name, collection_id, collection_positive_prompt, comment) "
+        "SELECT id, name, CAST(id AS TEXT), collection_positive_prompt, comment FROM collections"
+    ))
+
+
+def ensure_collection_search_index() -> bool:
+    """
+    Создает FTS-таблицу и триггеры (идемпотентно) и заполняет индекс, если он
+    рассинхронизирован с collections. Результат сохраняется в
+    app.config['COLLECTION_SEARCH_FTS'].
+    """
+    enabled = False
+    if db.engine.dialect.name == 'sqlite':
+        try:
+            for statement in _FTS_SETUP_STATEMENTS:
+                db.session.execute(text(statement))
+            indexed = db.session.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+            total = db.session.query(func.count(Collection.id)).scalar()
+            if indexed != total:
+                logger.info(f"Rebuilding collection search index ({indexed} indexed, {total} collections)...")
+                rebuild_collection_search_index()
+            db.session.commit()
+            enabled = True
+        except OperationalError as e:
+            # Например, SQLite собран без FTS5 или без токенизатора trigram
+            db.session.rollback()
+            logger.warning(f"FTS5 trigram search is unavailable, falling back to ILIKE search: {e}")
+    current_app.config['COLLECTION_SEARCH_FTS'] = enabled
+    return enabled
+
+
+def _fts_match_expression(term: str) -> str:
+    """ Экранирует пользовательский ввод как одну фразу FTS5. """
+    return '"' + term.replace('"', '""') + '"'
+
+
+def apply_collection_search(query, term: str):
+    """
+    Применяет поиск к запросу по Collection.
+
+    Returns:
+        (query, rank_column): при использовании FTS к запросу добавляется колонка
+        'search_rank' (строки становятся (Collection, rank)), иначе rank_column=None
+        и запрос просто фильтруется ILIKE.
+    """
+    term = term.strip()
+    if not current_app.config.get('COLLECTION_SEARCH_FTS') or len(term) < MIN_TRIGRAM_LENGTH:
+        search_term = f"%{term}%"
+        return query.filter(
+            or_(
+                Collection.name.ilike(search_term),
+                func.cast(Collection.id, db.String).ilike(search_term)
+            )
+        ), None
+
+    fts_ref = literal_column(FTS_TABLE)
+    matches = select(
+        _fts.c.rowid.label('collection_id'),
+        func.bm25(fts_ref, *BM25_WEIGHTS).label('bm25')
+    ).select_from(_fts).where(fts_ref.op('MATCH')(_fts_match_expression(term))).subquery('collection_matches')
+
+    boosts = case((Collection.name.ilike(f"{term}%"), NAME_PREFIX_BOOST), else_=0.0)
+    if term.isdigit():
+        boosts = boosts + case((Collection.id == int(term), EXACT_ID_BOOST), else_=0.0)
+    rank_column = func.round(matches.c.bm25 - boosts, SEARCH_RANK_DECIMALS).label('search_rank')
+
+    query = query.join(matches, matches.c.collection_id == Collection.id).add_columns(rank_column)
+    return query, rank_column
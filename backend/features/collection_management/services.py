@@ -0,0 +1,139 @@
+import csv
+import io
+import logging
+
+from backend.models import db, Collection
+from backend.constants import JobKinds, CSV_IMPORT_PROGRESS_ROWS
+from backend.features.grid_selection.changes import next_change_version, clear_collection_tombstones
+from backend.features.jobs.runner import JobContext, register_job_handler
+from backend.utils.validators import ValidationError
+
+logger = logging.getLogger(__name__)
+
+
+def import_collections_csv_text(text: str, ctx: JobContext | None = None) -> dict:
+    """
+    Импортирует коллекции из текста CSV (id,name,type,collection_positive_prompt).
+    id и name - обязательные. Пропускает строки с существующими ID.
+    Автоматически определяет наличие заголовка.
+
+    В фоновом задании (ctx) сообщает прогресс по строкам и проверяет отмену;
+    коллекции добавляются одной транзакцией после разбора всего файла,
+    поэтому отмененный импорт ничего не добавляет.
+    """
+    # Статистика импорта
+    processed_rows = 0
+    added_count = 0
+    skipped_duplicates = 0
+    skipped_errors = 0
+    error_messages = []
+    new_collections = []
+
+    stream = io.StringIO(text, newline=None)
+    # Определяем наличие заголовка
+    try:
+        has_header = csv.Sniffer().has_header(stream.read(1024))
+        stream.seek(0) # Возвращаемся к началу файла
+    except csv.Error:
+        logger.warning("Could not determine CSV header, assuming none.")
+        has_header = False
+        stream.seek(0)
+
+    # Всегда используем csv.reader
+    reader = csv.reader(stream)
+
+    if has_header:
+        try:
+            header_row = next(reader) # Пропускаем заголовок
+            logger.info(f"Skipping header row: {header_row}")
+        except StopIteration:
+            raise ValidationError("CSV file seems to contain only a header row")
+
+    existing_ids = {str(c.id) for c in Collection.query.with_entities(Collection.id).all()}
+    logger.info(f"Found {len(existing_ids)} existing collection IDs.")
+
+    for i, row_data in enumerate(reader):
+        row_num = i + (2 if has_header else 1) # Номер строки в файле (для ошибок)
+        processed_rows += 1
+        if ctx is not None and processed_rows % CSV_IMPORT_PROGRESS_ROWS == 0:
+            ctx.check_cancelled()
+            ctx.advance(CSV_IMPORT_PROGRESS_ROWS, added_count=added_count, skipped_duplicates=skipped_duplicates)
+
+        try:
+            # Доступ по индексу
+            if len(row_data) < 2:
+                    raise ValueError("Row has fewer than 2 columns (expected at least id, name)")
+            collection_id_str = row_data[0].strip()
+            name = row_data[1].strip()
+            # Получаем остальные поля по индексу, если они есть
+            collection_type = row_data[2].strip() if len(row_data) > 2 and row_data[2] else None
+            positive_prompt = row_data[3].strip() if len(row_data) > 3 and row_data[3] else None
+
+            # Валидация ID
+            if not collection_id_str:
+                raise ValueError("Missing 'id'")
+            try:
+                collection_id = int(collection_id_str)
+            except ValueError:
+                 raise ValueError(f"Invalid 'id' format: '{collection_id_str}'. Must be an integer.")
+
+            # Валидация Name
+            if not name:
+                raise ValueError("Missing 'name'")
+
+            # Проверка на дубликат ID
+            if str(collection_id) in existing_ids:
+                skipped_duplicates += 1
+                logger.debug(f"Skipping duplicate ID {collection_id} at row {row_num}")
+                continue
+
+            # Создаем новую коллекцию
+            new_collection = Collection(
+                id=collection_id,
+                name=name,
+                type=collection_type, # Будет None если пусто или отсутствует
+                collection_positive_prompt=positive_prompt # Будет None если пусто или отсутствует
+            )
+            new_collections.append(new_collection)
+            existing_ids.add(str(collection_id)) # Добавляем в сет, чтобы не дублировать внутри файла
+            added_count += 1
+
+        except (ValueError, IndexError) as e:
+            error_msg = f"Error processing row {row_num}: {e}. Row data: {row_data}"
+            logger.warning(error_msg)
+            error_messages.append(error_msg)
+            skipped_errors += 1
+            continue # Пропускаем строку с ошибкой
+
+    if ctx is not None:
+        ctx.check_cancelled()
+        ctx.advance(processed_rows - ctx.processed, errors=skipped_errors - ctx.errors)
+
+    if new_collections:
+        version = next_change_version()
+        for new_collection in new_collections:
+            new_collection.change_version = version
+        db.session.add_all(new_collections)
+        clear_collection_tombstones([c.id for c in new_collections])
+        db.session.commit()
+        logger.info(f"Successfully added {len(new_collections)} new collections from CSV.")
+    else:
+        logger.info("No new valid collections found in CSV to add.")
+        # Не коммитим, если ничего не добавлено
+
+    return {
+        "message": "CSV import process completed.",
+        "processed_rows": processed_rows,
+        "added_count": added_count,
+        "skipped_duplicates": skipped_duplicates,
+        "skipped_errors": skipped_errors,
+        "errors": error_messages
+    }
+
+
+def run_collections_import_csv_job(ctx: JobContext, params: dict, text: str) -> dict:
+    """ Задание COLLECTIONS_IMPORT_CSV: текст файла передается в payload. """
+    return import_collections_csv_text(text, ctx)
+
+
+register_job_handler(JobKinds.COLLECTIONS_IMPORT_CSV, run_collections_import_csv_job)
@@ -0,0 +1,254 @@
+"""
+Контентно-адресуемое хранилище изображений (IMAGE_STORE=blobs).
+
+Одни и те же байты раньше оказывались на диске несколько раз: повторная
+генерация с фиксированным seed, переиндексация папок, куда уже лежали
+сгенерированные файлы, копии выбранных обложек в selection_path. В режиме
+blobs содержимое хранится один раз в GENERATED_FILES_FOLDER/.blobs/ab/cd/<sha256>
+(ImageBlob, ref_count - число GeneratedFile с этим content_hash), а привычные
+пути файлов в папках проектов (GeneratedFile.file_path, их отдают
+/generated_files/<id> и переиндексация) - ссылки на blob без копирования байтов:
+reflink (копия при записи на btrfs/xfs), иначе жесткая ссылка, а если blob на
+другой файловой системе - обычная копия.
+
+SHA-256 считается при приеме файла (callback'и, см. image_generation/services.py)
+или при переиндексации. Ссылки на blob уменьшаются при удалении GeneratedFile;
+flask gc-image-blobs пересчитывает их по generated_files и удаляет blob'ы без
+ссылок (файлы в папках проектов при этом остаются).
+
+Копии выбранных обложек (selection_path) создаются через link_file в любом режиме.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import uuid
+from collections import Counter
+from flask import current_app
+from sqlalchemy import event, func, update
+
+from backend.models import db, GeneratedFile, ImageBlob
+from backend.constants import ImageStoreModes, IMAGE_BLOB_FOLDER, IMAGE_BLOB_FANOUT_LEVELS, FILE_HASH_CHUNK_BYTES
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409 # ioctl Linux: reflink файла целиком (btrfs, xfs)
+
+LINK_REFLINK = 'reflink'
+LINK_HARDLINK = 'hardlink'
+LINK_COPY = 'copy'
+
+
+def image_store_mode() -> str:
+    """ Режим хранилища из IMAGE_STORE (paths / blobs). """
+    mode = os.environ.get('IMAGE_STORE', ImageStoreModes.PATHS).strip().lower()
+    if mode not in (ImageStoreModes.PATHS, ImageStoreModes.BLOBS):
+        logger.warning(f"Unknown IMAGE_STORE={mode!r}, using '{ImageStoreModes.PATHS}'")
+        mode = ImageStoreModes.PATHS
+    return mode
+
+
+def blobs_enabled() -> bool:
+    return image_store_mode() == ImageStoreModes.BLOBS
+
+
+def blob_relative_path(content_hash: str) -> str:
+    """ '.blobs/ab/cd/<sha256>' относительно GENERATED_FILES_FOLDER. """
+    fanout = [content_hash[2 * level:2 * level + 2] for level in range(IMAGE_BLOB_FANOUT_LEVELS)]
+    return os.path.join(IMAGE_BLOB_FOLDER, *fanout, content_hash)
+
+
+def blob_abs_path(content_hash: str) -> str:
+    return os.path.join(os.path.abspath(current_app.config['GENERATED_FILES_FOLDER']), blob_relative_path(content_hash))
+
+
+def generated_file_abs_path(file_path: str) -> str:
+    """ Абсолютный путь к файлу по GeneratedFile.file_path (относительные пути - от GENERATED_FILES_FOLDER). """
+    if os.path.isabs(file_path):
+        return file_path
+    return os.path.join(os.path.abspath(current_app.config['GENERATED_FILES_FOLDER']), file_path)
+
+
+def file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FILE_HASH_CHUNK_BYTES), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _try_reflink(src: str, dst: str) -> bool:
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    try:
+        with open(src, 'rb') as source, open(dst, 'wb') as target:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        return True
+    except OSError:
+        try:
+            os.remove(dst)
+        except FileNotFoundError:
+            pass
+        return False
+
+
+def link_file(src: str, dst: str) -> str:
+    """
+    Создает (или заменяет) dst с содержимым src, по возможности без копирования байтов:
+    reflink, затем жесткая ссылка, иначе копия. dst появляется атомарно (временное имя +
+    os.replace), поэтому прерванная операция не оставляет полузаписанный файл.
+    Возвращает способ: LINK_REFLINK / LINK_HARDLINK / LINK_COPY.
+    """
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    tmp = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        if _try_reflink(src, tmp):
+            method = LINK_REFLINK
+        else:
+            try:
+                os.link(src, tmp)
+                method = LINK_HARDLINK
+            except OSError: # Другая ФС, ФС без жестких ссылок, нет прав
+                shutil.copy2(src, tmp)
+                method = LINK_COPY
+        os.replace(tmp, dst)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return method
+
+
+def store_blob_from_file(source_path: str, content_hash: str, move: bool = False) -> bool:
+    """
+    Кладет файл в хранилище, если blob'а с таким хэшем еще нет (move - перенести источник,
+    иначе - ссылка на него). При move источник удаляется и тогда, когда blob уже есть.
+    Возвращает True, если blob создан.
+    """
+    blob_path = blob_abs_path(content_hash)
+    if os.path.exists(blob_path):
+        if move:
+            os.remove(source_path)
+        return False
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    if move:
+        shutil.move(source_path, blob_path) # staging внутри GENERATED_FILES_FOLDER: rename
+    else:
+        link_file(source_path, blob_path)
+    return True
+
+
+def store_blob_from_upload(file_storage, content_hash: str) -> bool:
+    """ Как store_blob_from_file, но для загруженного файла (FileStorage). """
+    blob_path = blob_abs_path(content_hash)
+    if os.path.exists(blob_path):
+        return False
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    tmp = f"{blob_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        file_storage.save(tmp)
+        os.replace(tmp, blob_path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return True
+
+
+def materialize_blob(content_hash: str, final_path: str) -> bool:
+    """ Создает путь файла как ссылку на blob. False - blob'а нет (и файла на месте тоже). """
+    if os.path.exists(final_path):
+        return True # Повторная обработка после прерванной попытки
+    blob_path = blob_abs_path(content_hash)
+    if not os.path.exists(blob_path):
+        return False
+    link_file(blob_path, final_path)
+    return True
+
+
+def adopt_existing_file(path: str, content_hash: str) -> str:
+    """
+    Переиндексация: файл, уже лежащий в папке проекта, связывается с хранилищем. Если blob
+    с таким содержимым уже есть - файл заменяется ссылкой на него (дубликат освобождает место),
+    иначе blob создается как ссылка на файл. Возвращает 'deduplicated' или 'stored'.
+    """
+    blob_path = blob_abs_path(content_hash)
+    if os.path.exists(blob_path):
+        if not os.path.samefile(blob_path, path):
+            link_file(blob_path, path)
+        return 'deduplicated'
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    link_file(path, blob_path)
+    return 'stored'
+
+
+def add_blob_refs(refs: Counter, sizes: dict[str, int]):
+    """
+    Увеличивает ref_count blob'ов на число новых GeneratedFile (в текущей транзакции, без
+    коммита); недостающие строки ImageBlob создаются. Одна выборка на вызов.
+    """
+    if not refs:
+        return
+    existing = {
+        content_hash for content_hash, in
+        db.session.query(ImageBlob.content_hash).filter(ImageBlob.content_hash.in_(list(refs)))
+    }
+    for content_hash, count in refs.items():
+        if content_hash in existing:
+            db.session.execute(
+                update(ImageBlob).where(ImageBlob.content_hash == content_hash)
+                .values(ref_count=ImageBlob.ref_count + count)
+                .execution_options(synchronize_session=False)
+            )
+        else:
+            db.session.add(ImageBlob(content_hash=content_hash, path=blob_relative_path(content_hash),
+                                     size_bytes=sizes.get(content_hash), ref_count=count))
+
+
+@event.listens_for(GeneratedFile, 'after_delete')
+def _release_blob_ref(mapper, connection, target):
+    """ Удаление GeneratedFile освобождает ссылку на blob (массовые удаления поправит gc_image_blobs). """
+    if target.content_hash:
+        connection.execute(
+            update(ImageBlob)
+            .where(ImageBlob.content_hash == target.content_hash, ImageBlob.ref_count > 0)
+            .values(ref_count=ImageBlob.ref_count - 1)
+        )
+
+
+def gc_image_blobs() -> dict:
+    """
+    Пересчитывает ref_count по generated_files и удаляет blob'ы без ссылок (файл и строку).
+    Возвращает счетчики.
+    """
+    counts = dict(
+        db.session.query(GeneratedFile.content_hash, func.count(GeneratedFile.id))
+        .filter(GeneratedFile.content_hash.isnot(None))
+        .group_by(GeneratedFile.content_hash)
+    )
+    summary = Counter()
+    unreferenced = []
+    for blob in ImageBlob.query.all():
+        refs = counts.get(blob.content_hash, 0)
+        if blob.ref_count != refs:
+            blob.ref_count = refs
+            summary['recounted'] += 1
+        if not refs:
+            unreferenced.append((blob.path, blob.size_bytes or 0))
+            db.session.delete(blob)
+    db.session.commit()
+    # Файлы - после коммита: blob без строки в БД безопаснее, чем строка без blob'а
+    for path, size_bytes in unreferenced:
+        try:
+            os.remove(generated_file_abs_path(path))
+            summary['removed_bytes'] += size_bytes
+        except FileNotFoundError:
+            pass
+        summary['removed'] += 1
+    return dict(summary)
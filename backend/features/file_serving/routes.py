@@ -1,9 +1,13 @@
 import os
 import logging
-from flask import Blueprint, jsonify, current_app, send_from_directory
+from flask import Blueprint, jsonify, current_app, request, send_file, send_from_directory
+from werkzeug.exceptions import NotFound
 # Используем абсолютные импорты (если понадобятся модели для проверки)
 # from backend.models import Generation, ModerationStatus 
-from backend.models import GeneratedFile 
+from backend.models import db, GeneratedFile 
+from backend.constants import GENERATED_FILE_CACHE_MAX_AGE_SECONDS, THUMBNAIL_WEBP_QUALITY
+from backend.utils.validators import ValidationError
+from .thumbnails import get_thumbnail, parse_thumbnail_size
 
 logger = logging.getLogger(__name__)
 
@@ -11,24 +15,61 @@ logger = logging.getLogger(__name__)
 # Не используем префикс /api
 file_serving_bp = Blueprint('file_serving', __name__)
 
+def _cacheable(response, etag: str):
+    """ Сгенерированный файл по своему URL не меняется: строгий ETag и кэш без перепроверки. """
+    response.set_etag(etag)
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = GENERATED_FILE_CACHE_MAX_AGE_SECONDS
+    response.cache_control.immutable = True
+    return response
+
+
+def _file_etag(content_hash: str | None, abs_path: str, thumbnail_size: int | None) -> str:
+    """
+    Строгий ETag: SHA-256 содержимого из БД (без обращения к диску), для файлов без хэша -
+    размер и mtime файла. Миниатюра - отдельное представление с суффиксом размера и качества.
+    """
+    if content_hash:
+        etag = content_hash
+    else:
+        st = os.stat(abs_path)
+        etag = f'{st.st_size:x}-{st.st_mtime_ns:x}'
+    if thumbnail_size is not None:
+        etag = f'{etag}-w{thumbnail_size}q{THUMBNAIL_WEBP_QUALITY}'
+    return etag
+
+
 @file_serving_bp.route('/generated_files/<int:file_id>')
 def serve_generated_file(file_id):
     """ 
     Отдает сгенерированный файл по его ID.
     Может обрабатывать как пути, относительные к GENERATED_FILES_FOLDER,
     так и абсолютные пути, если они были сохранены в GeneratedFile.file_path.
+    ?size=<THUMBNAIL_SIZES> - WebP-миниатюра (отсутствующая строится; без Pillow - оригинал).
+
+    Ответ кэшируется браузером как неизменяемый (Cache-Control: immutable, строгий ETag);
+    перепроверка с совпавшим If-None-Match получает 304 до открытия файла. Range-запросы
+    отдаются частично (206).
     """
     
-    logger.info(f"Attempting to serve file with ID: {file_id}")
+    logger.debug(f"Attempting to serve file with ID: {file_id}")
+    try:
+        thumbnail_size = parse_thumbnail_size(request.args.get('size'))
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        generated_file = GeneratedFile.query.get_or_404(file_id)
-    except Exception as e: # Обработка ошибок, если get_or_404 не срабатывает как ожидается или другая ошибка БД
+        # Только нужные колонки: запрос выполняется на каждую картинку грида
+        row = db.session.query(GeneratedFile.file_path, GeneratedFile.content_hash).filter_by(id=file_id).first()
+    except Exception as e:
         logger.error(f"Error fetching GeneratedFile with ID {file_id} from DB: {e}")
         return jsonify({"error": "File record not found or database error"}), 404
+    if row is None:
+        return jsonify({"error": "File record not found or database error"}), 404
 
-    filepath_from_db = generated_file.file_path
-    logger.info(f"Retrieved filepath from DB for ID {file_id}: {filepath_from_db}")
+    filepath_from_db, content_hash = row
+    logger.debug(f"Retrieved filepath from DB for ID {file_id}: {filepath_from_db}")
 
     serve_directory: str
     serve_filename: str
@@ -36,11 +77,10 @@ def serve_generated_file(file_id):
     if os.path.isabs(filepath_from_db):
         serve_directory = os.path.dirname(filepath_from_db)
         serve_filename = os.path.basename(filepath_from_db)
-        logger.info(f"Serving absolute path. Directory: '{serve_directory}', Filename: '{serve_filename}'")
+        requested_path_abs = filepath_from_db
     else:
         serve_directory = current_app.config['GENERATED_FILES_FOLDER']
         serve_filename = filepath_from_db
-        logger.info(f"Serving relative path. Base Directory: '{serve_directory}', Relative Filepath: '{serve_filename}'")
 
         requested_path_abs = os.path.abspath(os.path.join(serve_directory, serve_filename))
         base_directory_abs = os.path.abspath(serve_directory)
@@ -51,14 +91,31 @@ def serve_generated_file(file_id):
                 f"(Resolved: {requested_path_abs}, Base: {base_directory_abs}) for file ID: {file_id}"
             )
             return jsonify({"error": "Forbidden path"}), 403
-        
+
     try:
-        return send_from_directory(serve_directory,
-                                   serve_filename,
-                                   as_attachment=False)
+        etag = _file_etag(content_hash, requested_path_abs, thumbnail_size)
     except FileNotFoundError:
+        logger.error(f"File not found on disk: '{requested_path_abs}' (for file ID: {file_id})")
+        return jsonify({"error": "File not found on disk"}), 404
+    if request.if_none_match.contains(etag):
+        return _cacheable(current_app.response_class(status=304), etag)
+
+    if thumbnail_size is not None:
+        thumbnail_path = get_thumbnail(file_id, filepath_from_db, content_hash, thumbnail_size)
+        if thumbnail_path is not None:
+            return _cacheable(send_file(thumbnail_path, mimetype='image/webp', etag=etag), etag)
+        # Миниатюры нет: оригинал без долгого кэша, чтобы миниатюра появилась, когда ее можно будет построить
+        etag = None
+        
+    try:
+        response = send_from_directory(serve_directory,
+                                       serve_filename,
+                                       as_attachment=False,
+                                       etag=etag or True)
+        return _cacheable(response, etag) if etag else response
+    except (FileNotFoundError, NotFound):
         logger.error(f"File not found on disk. Calculated serve_directory: '{serve_directory}', Calculated serve_filename: '{serve_filename}' (for file ID: {file_id})")
         return jsonify({"error": "File not found on disk"}), 404
     except Exception as e:
          logger.exception(f"Error serving file. Original DB filepath: {filepath_from_db}, Serve_dir: {serve_directory}, Serve_file: {serve_filename} (for file ID: {file_id})")
-         return jsonify({"error": "Could not serve file"}), 500 
\ No newline at end of file
+         return jsonify({"error": "Could not serve file"}), 500
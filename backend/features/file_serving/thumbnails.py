@@ -0,0 +1,210 @@
+"""
+Миниатюры сгенерированных изображений (WebP, THUMBNAIL_SIZES по длинной стороне).
+
+Грид и окно выбора обложки загружали полноразмерные PNG 512-2048 px на каждую
+ячейку - сотни МБ на страницу грида. Теперь /generated_files/<id>?size=256
+отдает миниатюру из GENERATED_FILES_FOLDER/.thumbnails/.
+
+Миниатюры всех размеров строятся сразу после регистрации файла (callback
+планировщика, переиндексация) в пуле процессов (THUMBNAIL_WORKERS): декодирование
+и масштабирование PNG - работа для CPU, в потоках Flask она бы упиралась в GIL.
+Изображение открывается один раз, размеры считаются от большего к меньшему.
+Если миниатюры нет (файл зарегистрирован до этого изменения, построение не
+успело или упало), запрос ?size= строит ее в том же пуле и ждет результат;
+повторные запросы той же миниатюры ждут одну задачу.
+
+Ключ миниатюры - content_hash файла (одинаковые изображения делят миниатюры),
+для файлов без хэша - ID файла; такая миниатюра перестраивается, если файл
+новее нее. Без Pillow (или при THUMBNAIL_WORKERS=0) ?size= отдает оригинал.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+
+from backend.constants import (
+    THUMBNAIL_SIZES, THUMBNAIL_FOLDER, THUMBNAIL_WEBP_QUALITY, DEFAULT_THUMBNAIL_WORKERS, THUMBNAIL_LAZY_TIMEOUT_SECONDS
+)
+from backend.utils.validators import ValidationError
+from .blob_store import generated_file_abs_path
+
+try:
+    from PIL import Image
+except ImportError: # pragma: no cover - зависит от окружения
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAILER_EXTENSION_KEY = 'thumbnailer'
+
+
+def thumbnail_workers() -> int:
+    """ Число процессов построения миниатюр (THUMBNAIL_WORKERS, 0 - миниатюры выключены). """
+    try:
+        return max(int(os.environ.get('THUMBNAIL_WORKERS', DEFAULT_THUMBNAIL_WORKERS)), 0)
+    except ValueError:
+        logger.warning("Invalid THUMBNAIL_WORKERS, using default")
+        return DEFAULT_THUMBNAIL_WORKERS
+
+
+def thumbnails_enabled() -> bool:
+    return Image is not None and thumbnail_workers() > 0
+
+
+def warn_if_thumbnails_disabled():
+    """ Один раз при старте приложения: почему ?size= будет отдавать оригиналы. """
+    if Image is None:
+        logger.warning("Pillow is not installed: thumbnails are disabled, ?size= serves original images "
+                       "(pip install -r backend/requirements.txt)")
+    elif thumbnail_workers() == 0:
+        logger.warning("THUMBNAIL_WORKERS=0: thumbnails are disabled, ?size= serves original images")
+
+
+def parse_thumbnail_size(value) -> int | None:
+    """ Значение ?size=: None - оригинал, иначе один из THUMBNAIL_SIZES (ValidationError для остальных). """
+    if value is None or value == '':
+        return None
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        size = None
+    if size not in THUMBNAIL_SIZES:
+        raise ValidationError(f"Invalid size '{value}'. Allowed: {', '.join(map(str, THUMBNAIL_SIZES))}")
+    return size
+
+
+def thumbnail_key(file_id: int, content_hash: str | None) -> str:
+    return content_hash or f'file-{file_id}'
+
+
+def thumbnail_abs_path(key: str, size: int) -> str:
+    return os.path.join(os.path.abspath(current_app.config['GENERATED_FILES_FOLDER']), THUMBNAIL_FOLDER,
+                        key[-2:], f'{key}-{size}.webp')
+
+
+def render_thumbnails(source_path: str, targets: list[tuple[int, str]]) -> int:
+    """
+    Выполняется в процессе пула: открывает изображение один раз и пишет WebP для всех
+    размеров (от большего к меньшему, каждый - из предыдущего). Возвращает число миниатюр.
+    """
+    with Image.open(source_path) as image:
+        image.load()
+        has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        current = image.convert('RGBA' if has_alpha else 'RGB') if image.mode not in ('RGB', 'RGBA') else image
+        for size, target in sorted(targets, reverse=True):
+            if max(current.size) > size:
+                current = current.copy()
+                current.thumbnail((size, size), Image.Resampling.LANCZOS)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = f'{target}.{os.getpid()}.tmp'
+            current.save(tmp, 'WEBP', quality=THUMBNAIL_WEBP_QUALITY)
+            os.replace(tmp, target)
+    return len(targets)
+
+
+class Thumbnailer:
+    """
+    Пул процессов приложения и задачи в работе: повторный запрос той же миниатюры
+    получает уже отправленную задачу.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor = self._new_executor()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn: дочерние процессы не наследуют потоки и соединения с БД процесса приложения
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, key: str, source_path: str, targets: list[tuple[int, str]]):
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            try:
+                future = self.executor.submit(render_thumbnails, source_path, targets)
+            except BrokenProcessPool:
+                # Процесс пула умер (например, OOM на огромном изображении): пул создается заново
+                logger.warning("Thumbnail process pool is broken, restarting it")
+                self.executor = self._new_executor()
+                future = self.executor.submit(render_thumbnails, source_path, targets)
+            self._pending[key] = future
+        future.add_done_callback(lambda done: self._finished(key, source_path, done))
+        return future
+
+    def _finished(self, key: str, source_path: str, future):
+        with self._lock:
+            self._pending.pop(key, None)
+        error = future.exception()
+        if error is not None:
+            logger.warning(f"Failed to build thumbnails for {source_path}: {error}")
+
+
+def _thumbnailer() -> Thumbnailer:
+    thumbnailer = current_app.extensions.get(THUMBNAILER_EXTENSION_KEY)
+    if thumbnailer is None:
+        thumbnailer = current_app.extensions.setdefault(THUMBNAILER_EXTENSION_KEY, Thumbnailer(thumbnail_workers()))
+    return thumbnailer
+
+
+def _missing_targets(key: str, source_path: str, sizes) -> list[tuple[int, str]]:
+    """ Размеры без актуальной миниатюры (для ключа по ID файла - еще и устаревшие). """
+    check_mtime = key.startswith('file-')
+    source_mtime = os.path.getmtime(source_path) if check_mtime else None
+    targets = []
+    for size in sizes:
+        path = thumbnail_abs_path(key, size)
+        try:
+            thumbnail_mtime = os.path.getmtime(path)
+            if not check_mtime or thumbnail_mtime >= source_mtime:
+                continue
+        except FileNotFoundError:
+            pass
+        targets.append((size, path))
+    return targets
+
+
+def schedule_thumbnails(files: list[tuple[int, str, str | None]]):
+    """
+    Ставит построение миниатюр всех размеров для только что зарегистрированных файлов
+    [(ID, file_path, content_hash)] и не ждет его. Вызывается после коммита.
+    """
+    if not files or not thumbnails_enabled():
+        return
+    thumbnailer = _thumbnailer()
+    for file_id, file_path, content_hash in files:
+        key = thumbnail_key(file_id, content_hash)
+        source_path = generated_file_abs_path(file_path)
+        try:
+            targets = _missing_targets(key, source_path, THUMBNAIL_SIZES)
+        except OSError as e:
+            logger.warning(f"Cannot schedule thumbnails for file {file_id}: {e}")
+            continue
+        if targets:
+            thumbnailer.submit(key, source_path, targets)
+
+
+def get_thumbnail(file_id: int, file_path: str, content_hash: str | None, size: int) -> str | None:
+    """
+    Путь к миниатюре; отсутствующая строится (в пуле, все размеры сразу) с ожиданием.
+    None - миниатюры выключены или построить не удалось: нужно отдать оригинал.
+    """
+    if not thumbnails_enabled():
+        return None
+    key = thumbnail_key(file_id, content_hash)
+    source_path = generated_file_abs_path(file_path)
+    path = thumbnail_abs_path(key, size)
+    try:
+        targets = _missing_targets(key, source_path, THUMBNAIL_SIZES)
+        if not any(target_size == size for target_size, _ in targets):
+            return path
+        _thumbnailer().submit(key, source_path, targets).result(timeout=THUMBNAIL_LAZY_TIMEOUT_SECONDS)
+    except Exception as e:
+        logger.warning(f"Thumbnail {size} for file {file_id} is unavailable, serving original: {e}")
+        return None
+    return path if os.path.exists(path) else None
@@ -0,0 +1,126 @@
+"""
+Глобальная последовательность изменений грида и выдача дельт.
+
+Каждая транзакция, меняющая коллекцию или ячейку грида, получает номер версии
+из change_sequence и записывает его в change_version измененных строк.
+Клиент, знающий версию V, получает только строки с change_version > V.
+
+UPDATE строки последовательности берет блокировку записи до конца транзакции,
+поэтому транзакции фиксируются в порядке своих версий (на SQLite запись и так
+сериализована) и клиент не пропускает изменения.
+"""
+import logging
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import selectinload
+from backend.models import db, ChangeSequence, Collection, DeletedCollection, GridCell, Project, generated_file_url_prefix
+
+logger = logging.getLogger(__name__)
+
+SEQUENCE_ROW_ID = 1
+_SESSION_INFO_KEY = 'grid_change_version'
+DEFAULT_CHANGES_LIMIT = 5000
+
+
+def ensure_change_sequence():
+    """ Создает строку последовательности, если ее нет. """
+    if db.session.get(ChangeSequence, SEQUENCE_ROW_ID) is None:
+        db.session.add(ChangeSequence(id=SEQUENCE_ROW_ID, version=0))
+        db.session.commit()
+
+
+def current_change_version() -> int:
+    """ Последняя зафиксированная версия. """
+    return db.session.execute(
+        select(ChangeSequence.version).where(ChangeSequence.id == SEQUENCE_ROW_ID)
+    ).scalar() or 0
+
+
+def projects_signature() -> tuple:
+    """
+    Дешевый валидатор списка проектов: (количество, max(updated_at)).
+    Проекты не участвуют в последовательности изменений, поэтому проверяются отдельно.
+    """
+    count, last_updated = db.session.query(func.count(Project.id), func.max(Project.updated_at)).one()
+    return count, last_updated.isoformat() if last_updated else None
+
+
+def next_change_version() -> int:
+    """
+    Возвращает версию для текущей транзакции (одну на транзакцию). Не коммитит.
+    """
+    session = db.session() # Реальная Session за scoped_session
+    transaction = session.get_transaction()
+    cached = session.info.get(_SESSION_INFO_KEY)
+    if cached and cached[0] is transaction:
+        return cached[1]
+
+    db.session.execute(
+        update(ChangeSequence)
+        .where(ChangeSequence.id == SEQUENCE_ROW_ID)
+        .values(version=ChangeSequence.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    version = current_change_version()
+    session.info[_SESSION_INFO_KEY] = (transaction, version)
+    return version
+
+
+def mark_collection_deleted(collection_id):
+    """ Записывает надгробие удаленной коллекции. Не коммитит. """
+    db.session.merge(DeletedCollection(collection_id=int(collection_id), change_version=next_change_version()))
+
+
+def clear_collection_tombstones(collection_ids):
+    """ Убирает надгробия для снова созданных коллекций. Не коммитит. """
+    ids = [int(cid) for cid in collection_ids]
+    if ids:
+        db.session.query(DeletedCollection).filter(
+            DeletedCollection.collection_id.in_(ids)
+        ).delete(synchronize_session=False)
+
+
+def get_grid_changes_service(since: int, project_ids: list[str] | None, limit: int = DEFAULT_CHANGES_LIMIT) -> dict:
+    """
+    Возвращает изменения грида после версии since.
+
+    'cells' - {collection_id: {project_id: cell}} только для запрошенных проектов;
+    'collections' - измененные коллекции (без ячеек); 'deleted_collection_ids' -
+    удаленные коллекции. Если изменений больше limit, возвращается truncated=True
+    и клиенту нужно перезагрузить грид целиком.
+    """
+    # Версию читаем ДО данных: изменение, зафиксированное между чтениями,
+    # в худшем случае придет повторно, но не потеряется
+    version = current_change_version()
+
+    changed_collections = db.session.query(Collection).filter(
+        Collection.change_version > since
+    ).order_by(Collection.change_version).limit(limit + 1).all()
+
+    changed_cells = []
+    if project_ids:
+        changed_cells = db.session.query(GridCell).filter(
+            GridCell.change_version > since,
+            GridCell.project_id.in_(project_ids)
+        ).options(selectinload(GridCell.generated_file)).order_by(GridCell.change_version).limit(limit + 1).all()
+
+    deleted_ids = [cid for (cid,) in db.session.query(DeletedCollection.collection_id).filter(
+        DeletedCollection.change_version > since
+    )]
+
+    if len(changed_collections) > limit or len(changed_cells) > limit:
+        return {'version': version, 'since': since, 'truncated': True,
+                'collections': [], 'cells': {}, 'deleted_collection_ids': []}
+
+    cells = {}
+    url_prefix = generated_file_url_prefix() if changed_cells else None
+    for grid_cell in changed_cells:
+        cells.setdefault(grid_cell.collection_id, {})[grid_cell.project_id] = grid_cell.to_dict(url_prefix)
+
+    return {
+        'version': version,
+        'since': since,
+        'truncated': False,
+        'collections': [c.to_dict() for c in changed_collections],
+        'cells': cells,
+        'deleted_collection_ids': deleted_ids
+    }
@@ -0,0 +1,268 @@
+"""
+Поддержка денормализованной таблицы grid_cells.
+
+Каждая функция работает в текущей сессии и НЕ коммитит: вызывающий сервис
+обновляет ячейки в той же транзакции, в которой меняет Generation/SelectedCover.
+"""
+import logging
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import selectinload
+from backend.models import db, Collection, Generation, GenerationStatus, SelectedCover, GridCell
+from backend.constants import CellStatus
+from .changes import next_change_version
+
+logger = logging.getLogger(__name__)
+
+REFRESH_BATCH_SIZE = 500 # Коллекций на один набор запросов в refresh_grid_cells (лимит параметров IN)
+
+
+def _cell_state_from_selected_cover(selected_cover: SelectedCover) -> dict:
+    """ Состояние ячейки, для которой выбрана обложка. """
+    state = {
+        'status': CellStatus.ERROR,
+        'is_selected': True,
+        'generation_id': selected_cover.generation_id,
+        'generated_file_id': None,
+        'error_message': None
+    }
+    file_to_display = selected_cover.generated_file
+    if not file_to_display and selected_cover.generation and selected_cover.generation.generated_files:
+        file_to_display = selected_cover.generation.generated_files[0]
+        logger.warning(f"SelectedCover (C:{selected_cover.collection_id}, P:{selected_cover.project_id}) has no generated_file_id, using first file from Generation {selected_cover.generation_id}")
+    if file_to_display:
+        state['status'] = CellStatus.SELECTED
+        state['generated_file_id'] = file_to_display.id
+    elif selected_cover.generation:
+        state['error_message'] = 'Selected cover points to generation, but file is missing.'
+    else:
+        state['error_message'] = 'Selected cover data inconsistent (generation missing?).'
+    return state
+
+
+def _cell_state_from_generation(generation_id: str, status: GenerationStatus, error_message: str | None) -> dict:
+    """ Состояние ячейки по последней генерации (без выбранной обложки). """
+    state = {
+        'status': CellStatus.UNKNOWN,
+        'is_selected': False,
+        'generation_id': generation_id,
+        'generated_file_id': None,
+        'error_message': None
+    }
+    if status == GenerationStatus.COMPLETED:
+        state['status'] = CellStatus.GENERATED_NOT_SELECTED
+    elif status in (GenerationStatus.PENDING, GenerationStatus.QUEUED):
+        state['status'] = CellStatus.QUEUED
+    elif status == GenerationStatus.FAILED:
+        state['status'] = CellStatus.ERROR
+        state['error_message'] = error_message
+    else:
+        state['error_message'] = f"Unknown generation status: {status}"
+    return state
+
+
+def _apply_cell_state(collection_id: int, project_id: str, state: dict | None, cell: GridCell | None):
+    """ Создает/обновляет/удаляет строку grid_cells в текущей сессии (cell - текущая строка или None). """
+    if state is None:
+        if cell:
+            db.session.delete(cell)
+        return
+    if cell is None:
+        cell = GridCell(collection_id=collection_id, project_id=project_id)
+        db.session.add(cell)
+    elif all(getattr(cell, key) == value for key, value in state.items()):
+        return # Ничего не изменилось - версию не увеличиваем
+    for key, value in state.items():
+        setattr(cell, key, value)
+    cell.change_version = next_change_version()
+
+
+def _last_generation_at_subquery(collection_id_column):
+    """ max(Generation.updated_at) для коллекции (скалярный подзапрос). """
+    return select(func.max(Generation.updated_at)).where(
+        Generation.collection_id == collection_id_column
+    ).scalar_subquery()
+
+
+def refresh_collection_last_generation(collection_id):
+    """
+    Пересчитывает Collection.last_generation_at (и change_version, если значение изменилось).
+    Не коммитит. updated_at коллекции не трогаем: это не пользовательское изменение.
+    """
+    refresh_collections_last_generation([collection_id])
+
+
+def refresh_collections_last_generation(collection_ids):
+    """ То же для набора коллекций одним UPDATE. Не коммитит. """
+    ids = sorted(set(int(cid) for cid in collection_ids))
+    if not ids:
+        return
+    last_generation_at = _last_generation_at_subquery(Collection.id)
+    db.session.execute(
+        update(Collection)
+        .where(Collection.id.in_(ids), Collection.last_generation_at.is_distinct_from(last_generation_at))
+        .values(last_generation_at=last_generation_at,
+                change_version=next_change_version(),
+                updated_at=Collection.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def refresh_grid_cell(collection_id, project_id: str):
+    """
+    Пересчитывает одну ячейку из исходных таблиц (SelectedCover + последняя Generation)
+    и last_generation_at коллекции. Не коммитит.
+    """
+    collection_id = int(collection_id)
+    selected_cover = db.session.query(SelectedCover).filter_by(
+        collection_id=collection_id,
+        project_id=project_id
+    ).first()
+
+    state = None
+    if selected_cover:
+        state = _cell_state_from_selected_cover(selected_cover)
+    else:
+        latest_gen = db.session.query(Generation).filter(
+            Generation.collection_id == collection_id,
+            Generation.project_id == project_id
+        ).order_by(Generation.updated_at.desc()).first()
+        if latest_gen:
+            state = _cell_state_from_generation(latest_gen.id, latest_gen.status, latest_gen.error_message)
+
+    _apply_cell_state(collection_id, project_id, state, db.session.get(GridCell, (collection_id, project_id)))
+    refresh_collection_last_generation(collection_id)
+
+
+def _latest_generations_query(collection_ids, project_ids):
+    """ Последняя (по updated_at) генерация для каждой пары коллекция/проект среди заданных. """
+    generation_cte = select(
+        Generation.id,
+        Generation.collection_id,
+        Generation.project_id,
+        Generation.status,
+        Generation.error_message,
+        func.row_number().over(
+            partition_by=(Generation.collection_id, Generation.project_id),
+            order_by=Generation.updated_at.desc()
+        ).label('rn')
+    )
+    if collection_ids is not None:
+        generation_cte = generation_cte.where(Generation.collection_id.in_(collection_ids))
+    if project_ids is not None:
+        generation_cte = generation_cte.where(Generation.project_id.in_(project_ids))
+    generation_cte = generation_cte.cte('generation_ranked')
+    return db.session.query(
+        generation_cte.c.id,
+        generation_cte.c.collection_id,
+        generation_cte.c.project_id,
+        generation_cte.c.status,
+        generation_cte.c.error_message
+    ).filter(generation_cte.c.rn == 1)
+
+
+def refresh_grid_cells(pairs):
+    """
+    Пересчитывает набор ячеек. pairs - итерируемое (collection_id, project_id).
+    Число запросов не зависит от количества пар (обрабатываются пачками коллекций). Не коммитит.
+    """
+    pairs = set((int(c), p) for c, p in pairs)
+    if not pairs:
+        return
+    project_ids = sorted(set(p for _, p in pairs))
+    collection_ids = sorted(set(c for c, _ in pairs))
+
+    for start in range(0, len(collection_ids), REFRESH_BATCH_SIZE):
+        chunk = collection_ids[start:start + REFRESH_BATCH_SIZE]
+        states = {}
+        for lg in _latest_generations_query(chunk, project_ids):
+            key = (lg.collection_id, lg.project_id)
+            if key in pairs:
+                states[key] = _cell_state_from_generation(lg.id, lg.status, lg.error_message)
+
+        selected_covers = db.session.query(SelectedCover).filter(
+            SelectedCover.collection_id.in_(chunk),
+            SelectedCover.project_id.in_(project_ids)
+        ).options(
+            selectinload(SelectedCover.generation).selectinload(Generation.generated_files),
+            selectinload(SelectedCover.generated_file)
+        )
+        for sc in selected_covers:
+            key = (sc.collection_id, sc.project_id)
+            if key in pairs:
+                states[key] = _cell_state_from_selected_cover(sc)
+
+        existing_cells = {
+            (cell.collection_id, cell.project_id): cell
+            for cell in db.session.query(GridCell).filter(
+                GridCell.collection_id.in_(chunk),
+                GridCell.project_id.in_(project_ids)
+            )
+        }
+        chunk_ids = set(chunk)
+        for key in pairs:
+            if key[0] in chunk_ids:
+                _apply_cell_state(key[0], key[1], states.get(key), existing_cells.get(key))
+
+    refresh_collections_last_generation(collection_ids)
+
+
+def delete_grid_cells(collection_id=None, project_id=None):
+    """ Удаляет ячейки коллекции и/или проекта (при удалении сущности). Не коммитит. """
+    query = db.session.query(GridCell)
+    if collection_id is not None:
+        query = query.filter(GridCell.collection_id == int(collection_id))
+    if project_id is not None:
+        query = query.filter(GridCell.project_id == project_id)
+    query.delete(synchronize_session=False)
+
+
+def rebuild_grid_cells() -> int:
+    """
+    Полностью перестраивает grid_cells и Collection.last_generation_at из исходных таблиц
+    (backfill / восстановление).
+    Коммитит результат. Возвращает количество ячеек.
+    """
+    db.session.query(GridCell).delete(synchronize_session=False)
+
+    states = {}
+    for lg in _latest_generations_query(None, None):
+        states[(lg.collection_id, lg.project_id)] = _cell_state_from_generation(lg.id, lg.status, lg.error_message)
+
+    selected_covers = db.session.query(SelectedCover).options(
+        selectinload(SelectedCover.generation).selectinload(Generation.generated_files),
+        selectinload(SelectedCover.generated_file)
+    )
+    for sc in selected_covers:
+        states[(sc.collection_id, sc.project_id)] = _cell_state_from_selected_cover(sc)
+
+    version = next_change_version()
+    db.session.bulk_insert_mappings(GridCell, [
+        {'collection_id': collection_id, 'project_id': project_id, 'change_version': version, **state}
+        for (collection_id, project_id), state in states.items()
+    ])
+    db.session.execute(
+        update(Collection)
+        .values(last_generation_at=_last_generation_at_subquery(Collection.id),
+                change_version=version,
+                updated_at=Collection.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    logger.info(f"Rebuilt grid_cells: {len(states)} cells.")
+    return len(states)
+
+
+def ensure_grid_cells_populated():
+    """ Заполняет grid_cells при первом запуске на существующей базе. """
+    if db.session.query(GridCell.collection_id).first() is not None:
+        return
+    if db.session.query(Generation.id).first() is None and db.session.query(SelectedCover.collection_id).first() is None:
+        return
+    logger.info("grid_cells table is empty, backfilling from generations/selected covers...")
+    try:
+        rebuild_grid_cells()
+    except OperationalError as e:
+        # Схема еще не обновлена (например, при запуске самого `flask db upgrade`)
+        db.session.rollback()
+        logger.warning(f"Skipping grid_cells backfill, database schema is outdated (run `flask db upgrade`): {e}")
@@ -2,7 +2,12 @@ from flask import Blueprint, request, jsonify, current_app
 import logging
 # Используем абсолютные импорты
 from backend.models import db, Project, Collection, Generation, GenerationStatus, SelectedCover, GeneratedFile
-from .services import get_grid_data_service, get_selection_shell_service, get_project_attempts_service, select_cover_service
+from backend.utils.validators import ValidationError
+from backend.utils.http_cache import compute_etag, request_args_signature, is_not_modified, not_modified_response, with_etag
+from backend.utils.serialization import encoded_response, negotiated_mimetype
+from backend.constants import GridResponseFormats
+from .changes import DEFAULT_CHANGES_LIMIT, current_change_version, projects_signature
+from .services import get_grid_changes, get_grid_data_service, get_selection_shell_service, get_project_attempts_service, select_cover_service
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +35,24 @@ def get_grid_data_route():
         per_page = min(per_page, 500) 
     except ValueError:
          return jsonify({"error": "Invalid page or per_page parameter"}), 400
+    # Keyset-пагинация: ?cursor= (пусто для первой страницы) или next_cursor из предыдущего ответа
+    cursor = request.args.get('cursor')
+    include_total = request.args.get('include_total')
+    if include_total is not None:
+        include_total = include_total.lower() not in ('0', 'false', 'no')
+
+    # Компактный формат: ?format=columnar&fields=name,type&cell_fields=status,file_id
+    response_format = request.args.get('format', GridResponseFormats.ROWS)
+    if response_format not in (GridResponseFormats.ROWS, GridResponseFormats.COLUMNAR):
+        return jsonify({"error": f"Invalid format: {response_format}"}), 400
+    fields = request.args.get('fields')
+    cell_fields = request.args.get('cell_fields')
+
+    # Условный GET: ответ зависит только от версии изменений, проектов, параметров запроса и Accept
+    etag = compute_etag('grid-data', current_change_version(), projects_signature(), request_args_signature(),
+                        negotiated_mimetype())
+    if is_not_modified(etag):
+        return not_modified_response(etag)
 
     try:
         data = get_grid_data_service(
@@ -41,13 +64,39 @@ def get_grid_data_route():
             order=order,
             generation_status_filter=generation_status_filter,
             page=page,
-            per_page=per_page
+            per_page=per_page,
+            cursor=cursor,
+            include_total=include_total,
+            response_format=response_format,
+            fields=fields,
+            cell_fields=cell_fields
         )
-        return jsonify(data)
+        return with_etag(encoded_response(data), etag)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.exception("Error in get_grid_data_route")
         return jsonify({"error": "Failed to fetch grid data"}), 500
 
+@grid_selection_bp.route('/grid-data/changes', methods=['GET'])
+def get_grid_changes_route():
+    """
+    Инкрементальные изменения грида: ?since=<version>&visible_project_ids=...
+    Возвращает измененные ячейки/коллекции и новую версию.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(max(int(request.args.get('limit', DEFAULT_CHANGES_LIMIT)), 1), DEFAULT_CHANGES_LIMIT)
+    except ValueError:
+        return jsonify({"error": "Invalid since or limit parameter"}), 400
+
+    try:
+        data = get_grid_changes(request.args.get('visible_project_ids'), since, limit)
+        return jsonify(data)
+    except Exception as e:
+        logger.exception("Error in get_grid_changes_route")
+        return jsonify({"error": "Failed to fetch grid changes"}), 500
+
 @grid_selection_bp.route('/selection-data', methods=['GET'])
 def get_selection_shell_route():
     """
@@ -59,11 +108,16 @@ def get_selection_shell_route():
     if not collection_id or not project_id:
         return jsonify({"error": "Missing collection_id or project_id parameter"}), 400
 
+    # Выбранные обложки и коллекция отражаются в версии изменений, проекты - в их сигнатуре
+    etag = compute_etag('selection-data', current_change_version(), projects_signature(), request_args_signature())
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+
     try:
         data = get_selection_shell_service(collection_id, project_id)
         if data is None:
              return jsonify({"error": "Required resources not found"}), 404
-        return jsonify(data)
+        return with_etag(jsonify(data), etag)
     except Exception as e:
         logger.exception("Error in get_selection_shell_route")
         return jsonify({"error": "Failed to fetch selection shell data"}), 500
@@ -1,11 +1,21 @@
 import logging
 import os
-import shutil
 from sqlalchemy import func, distinct, and_, or_, select, literal_column, case
 from sqlalchemy.orm import aliased, contains_eager, selectinload
 from sqlalchemy.sql.expression import literal # Добавляем literal
 # Используем абсолютные импорты
-from backend.models import db, Project, Collection, Generation, GenerationStatus, SelectedCover, GeneratedFile
+from backend.models import db, Project, Collection, Generation, GenerationStatus, SelectedCover, GeneratedFile, GridCell, generated_file_url_prefix
+from backend.constants import (
+    CellStatus, CELL_STATUS_CODES, GridResponseFormats,
+    GRID_COLUMNAR_COLLECTION_FIELDS, GRID_COLUMNAR_DEFAULT_COLLECTION_FIELDS,
+    GRID_COLUMNAR_CELL_FIELDS, GRID_COLUMNAR_DEFAULT_CELL_FIELDS
+)
+from backend.utils.pagination import paginate_keyset, order_by_keyset
+from backend.utils.validators import ValidationError
+from backend.features.collection_management.search import apply_collection_search
+from backend.features.file_serving.blob_store import generated_file_abs_path, link_file
+from .grid_cells import refresh_grid_cell
+from .changes import current_change_version, get_grid_changes_service
 # Убираем импорт socketio
 # from backend.app import socketio # Для WebSocket событий
 # Добавляем импорт current_app
@@ -16,7 +26,7 @@ logger = logging.getLogger(__name__)
 
 def _handle_file_copy_for_selection(selection_path: str, old_file: GeneratedFile | None, new_file: GeneratedFile | None):
     """
-    Обрабатывает копирование новой выбранной обложки и удаление старой.
+    Обрабатывает экспорт новой выбранной обложки (ссылкой, см. blob_store.link_file) и удаление старой.
     Эта функция не вызывает исключений, а только логирует ошибки,
     так как файловые операции являются второстепенными по отношению к записи в БД.
     """
@@ -32,12 +42,12 @@ def _handle_file_copy_for_selection(selection_path: str, old_file: GeneratedFile
                 os.remove(old_file_dest_path)
                 logger.info(f"Removed old selected cover: {old_file_dest_path}")
 
-        # 2. Копируем новый файл в папку выбранных
+        # 2. Связываем новый файл с папкой выбранных: reflink/жесткая ссылка вместо копии байтов
         if new_file and new_file.file_path:
-            source_path = new_file.file_path
+            source_path = generated_file_abs_path(new_file.file_path)
             if os.path.exists(source_path):
-                shutil.copy(source_path, selection_path)
-                logger.info(f"Copied new selected cover from {source_path} to {selection_path}")
+                method = link_file(source_path, os.path.join(selection_path, os.path.basename(source_path)))
+                logger.info(f"Exported new selected cover from {source_path} to {selection_path} ({method})")
             else:
                 logger.error(f"Source file for new selection does not exist: {source_path}")
 
@@ -51,47 +61,21 @@ def _parse_project_ids(ids_str: str | None) -> list[str] | None:
     ids_list = [pid.strip() for pid in ids_str.split(',') if pid.strip()]
     return ids_list if ids_list else None
 
-def get_grid_data_service(visible_project_ids_str: str | None, search=None, type_=None, advanced=None, sort=None, order=None, generation_status_filter=None, page=1, per_page=100) -> dict:
+def get_grid_changes(visible_project_ids_str: str | None, since: int, limit: int) -> dict:
+    """ Дельта грида после версии since (см. changes.get_grid_changes_service). """
+    return get_grid_changes_service(since, _parse_project_ids(visible_project_ids_str), limit=limit)
+
+def apply_grid_filters(query, project_ids_for_cells: list[str], search=None, type_=None, advanced=None,
+                       generation_status_filter=None):
     """
-    Оптимизированная сервисная функция для получения данных грида.
+    Фильтры грида (поиск, тип, advanced, статус генерации) над запросом коллекций.
+    Возвращает (query, search_rank): search_rank - колонка релевантности при FTS-поиске, иначе None.
+    Используется и для страниц грида, и для массовой генерации по фильтру.
     """
-    requested_project_ids = _parse_project_ids(visible_project_ids_str)
-    # logger.info(f"get_grid_data_service called with requested_project_ids: {requested_project_ids}") # Убираем лог
-
-    # --- 1. Получаем проекты для заголовка ---
-    projects_query = db.session.query(Project).order_by(Project.name)
-    if requested_project_ids:
-        projects_query = projects_query.filter(Project.id.in_(requested_project_ids))
-        # logger.info(f"Fetching specific projects for header: {requested_project_ids}") # Убираем лог
-    else:
-        # logger.info("No specific projects requested, fetching all projects for header.") # Убираем лог
-        pass # Просто получаем все проекты
-
-    projects_for_header = projects_query.all()
-    projects_data = [p.to_dict() for p in projects_for_header]
-
-    # --- Определяем ID проектов, для которых будем искать данные ячеек ---
-    project_ids_for_cells = requested_project_ids if requested_project_ids is not None else [p['id'] for p in projects_data]
-
-    # logger.info(f"Project IDs to be used for fetching cell data: {project_ids_for_cells}") # Убираем лог
-
-    # !!! Убрана проверка и ранний выход при отсутствии проектов !!!
-
-    # --- 2. Строим основной запрос для коллекций ---
-    base_query = db.session.query(Collection)
-
-    # УБИРАЕМ outerjoin и add_columns отсюда
-    query = base_query 
-
     # --- Применяем базовые фильтры ---
+    search_rank = None # Колонка релевантности (только при FTS-поиске)
     if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            or_(
-                Collection.name.ilike(search_term),
-                func.cast(Collection.id, db.String).ilike(search_term)
-            )
-        )
+        query, search_rank = apply_collection_search(query, search)
     if type_ and type_ != 'all':
         query = query.filter(Collection.type == type_)
 
@@ -114,48 +98,145 @@ def get_grid_data_service(visible_project_ids_str: str | None, search=None, type
         if project_ids_for_cells: # Применяем фильтр только если есть видимые проекты
             # Подзапрос для подсчета количества проектов, для которых выбрана обложка для данной коллекции
             selected_covers_count_subquery = select(
-                func.count(func.distinct(SelectedCover.project_id)) # Считаем уникальные project_id
+                func.count(GridCell.project_id)
             ).where(
                 and_(
-                    SelectedCover.collection_id == func.cast(Collection.id, db.String),
-                    SelectedCover.project_id.in_(project_ids_for_cells)
+                    GridCell.collection_id == Collection.id,
+                    GridCell.project_id.in_(project_ids_for_cells),
+                    GridCell.is_selected == True
                 )
-            ).correlate(Collection).as_scalar()
+            ).correlate(Collection).scalar_subquery()
 
             # Коллекция должна оставаться, если количество выбранных обложек МЕНЬШЕ, чем общее количество видимых проектов
             query = query.filter(selected_covers_count_subquery < len(project_ids_for_cells))
         # Если project_ids_for_cells пуст, то фильтр 'not_selected' не имеет смысла или должен быть проигнорирован.
         # Текущая логика (если убрать if project_ids_for_cells) оставит все коллекции, что может быть ожидаемо.
     elif generation_status_filter == 'not_generated':
+         # Строка в grid_cells существует только если есть генерация (или выбранная обложка)
          subquery_generated = select(literal(1)).where(
             and_(
-                Generation.collection_id == func.cast(Collection.id, db.String),
-                Generation.project_id.in_(project_ids_for_cells) 
+                GridCell.collection_id == Collection.id,
+                GridCell.project_id.in_(project_ids_for_cells)
             )
         ).exists()
          query = query.filter(~subquery_generated)
 
-    # --- Определяем поле для сортировки (НО НЕ СОРТИРУЕМ ПО last_generation_at ЗДЕСЬ) ---
+    return query, search_rank
+
+def get_grid_data_service(visible_project_ids_str: str | None, search=None, type_=None, advanced=None, sort=None, order=None, generation_status_filter=None, page=1, per_page=100, cursor=None, include_total=None,
+                          response_format=GridResponseFormats.ROWS, fields=None, cell_fields=None) -> dict:
+    """
+    Оптимизированная сервисная функция для получения данных грида.
+    Если передан cursor (в т.ч. пустая строка для первой страницы), используется
+    keyset-пагинация и в ответе возвращается next_cursor. include_total управляет
+    подсчетом total (по умолчанию: только в постраничном режиме).
+    response_format='columnar' возвращает компактный формат (см. _build_columnar_grid),
+    fields/cell_fields - проекция полей коллекций/ячеек для него.
+    """
+    requested_project_ids = _parse_project_ids(visible_project_ids_str)
+    # logger.info(f"get_grid_data_service called with requested_project_ids: {requested_project_ids}") # Убираем лог
+    # Версия изменений читается ДО данных; клиент продолжает с нее через /grid-data/changes
+    change_version = current_change_version()
+
+    # --- 1. Получаем проекты для заголовка ---
+    projects_query = db.session.query(Project).order_by(Project.name)
+    if requested_project_ids:
+        projects_query = projects_query.filter(Project.id.in_(requested_project_ids))
+        # logger.info(f"Fetching specific projects for header: {requested_project_ids}") # Убираем лог
+    else:
+        # logger.info("No specific projects requested, fetching all projects for header.") # Убираем лог
+        pass # Просто получаем все проекты
+
+    projects_for_header = projects_query.all()
+    projects_data = [p.to_dict() for p in projects_for_header]
+
+    # --- Определяем ID проектов, для которых будем искать данные ячеек ---
+    project_ids_for_cells = requested_project_ids if requested_project_ids is not None else [p['id'] for p in projects_data]
+
+    # logger.info(f"Project IDs to be used for fetching cell data: {project_ids_for_cells}") # Убираем лог
+
+    # !!! Убрана проверка и ранний выход при отсутствии проектов !!!
+
+    # --- 2. Строим основной запрос для коллекций ---
+    query, search_rank = apply_grid_filters(
+        db.session.query(Collection), project_ids_for_cells,
+        search=search, type_=type_, advanced=advanced, generation_status_filter=generation_status_filter
+    )
+
+    # --- Определяем поле для сортировки ---
     sort_direction = 'desc' if order != 'asc' and order != 'ascending' else 'asc'
     sort_field = Collection.id # Сортировка по умолчанию
+    sort_key = 'id'
 
     if sort == 'name':
-        sort_field = Collection.name
+        sort_field, sort_key = Collection.name, 'name'
     elif sort == 'created_at':
-        sort_field = Collection.created_at
+        sort_field, sort_key = Collection.created_at, 'created_at'
     elif sort == 'type':
-        sort_field = Collection.type
-    # Сортировку по last_generation_at будем делать в Python после получения данных
-
-    if sort != 'last_generation_at': # Применяем сортировку в БД только для других полей
-        if sort_direction == 'asc':
-            query = query.order_by(sort_field.asc().nullslast())
-        else:
-            query = query.order_by(sort_field.desc().nullslast())
-
-    # --- Применяем пагинацию к базовому запросу --- 
+        sort_field, sort_key = Collection.type, 'type'
+    elif sort == 'last_generation_at':
+        # Денормализованная колонка с индексом (last_generation_at, id)
+        sort_field, sort_key = Collection.last_generation_at, 'last_generation_at'
+    elif sort in (None, '', 'relevance') and search_rank is not None:
+        # Лучшие совпадения первыми (ранг: меньше - лучше)
+        sort_field, sort_key, sort_direction = search_rank, 'relevance', 'asc'
+
+    # При FTS-поиске строки запроса - (Collection, search_rank)
+    def _row_collection(row):
+        return row[0] if search_rank is not None else row
+
+    def _row_sort_value(row):
+        if sort_key == 'relevance':
+            return row.search_rank, row[0].id
+        collection = _row_collection(row)
+        return getattr(collection, sort_key), collection.id
+
+    # --- Применяем пагинацию к базовому запросу ---
+    # cursor is None -> постраничный режим (page/OFFSET), иначе keyset по (поле сортировки, id)
+    if include_total is None:
+        include_total = cursor is None
     try:
-        pagination = db.paginate(query, page=page, per_page=per_page, error_out=False)
+        if cursor is not None:
+            paginated_collections, next_cursor = paginate_keyset(
+                query, sort_field, Collection.id, sort_key, sort_direction, cursor, per_page,
+                value_getter=_row_sort_value
+            )
+            page_info = {
+                'page': None,
+                'per_page': per_page,
+                'total': query.order_by(None).count() if include_total else None,
+                'pages': None,
+                'has_next': next_cursor is not None,
+                'has_prev': bool(cursor),
+                'next_cursor': next_cursor
+            }
+        else:
+            query = order_by_keyset(query, sort_field, Collection.id, sort_direction)
+            if include_total:
+                pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+                paginated_collections = pagination.items
+                page_info = {
+                    'page': page,
+                    'per_page': per_page,
+                    'total': pagination.total,
+                    'pages': pagination.pages,
+                    'has_next': pagination.has_next,
+                    'has_prev': pagination.has_prev
+                }
+            else:
+                # Без COUNT(*): берем на одну строку больше, чтобы узнать о следующей странице
+                rows = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+                paginated_collections = rows[:per_page]
+                page_info = {
+                    'page': page,
+                    'per_page': per_page,
+                    'total': None,
+                    'pages': None,
+                    'has_next': len(rows) > per_page,
+                    'has_prev': page > 1
+                }
+    except ValidationError:
+        raise
     except Exception as e:
          logger.exception("Error during pagination query")
          return {
@@ -166,175 +247,136 @@ def get_grid_data_service(visible_project_ids_str: str | None, search=None, type
              }
          }
 
-    paginated_collections = pagination.items # Теперь это список объектов Collection
-    total_items = pagination.total
+    paginated_collections = [_row_collection(row) for row in paginated_collections]
     collection_ids_on_page = [c.id for c in paginated_collections]
 
-    # --- Получаем last_generation_at для коллекций на странице ОТДЕЛЬНО ---
-    last_gen_times = {}
-    if collection_ids_on_page:
-        last_gen_query = db.session.query(
-            Generation.collection_id,
-            func.max(Generation.updated_at)
-        ).filter(
-            # Сравниваем строки
-            Generation.collection_id.in_([str(cid) for cid in collection_ids_on_page])
-        ).group_by(Generation.collection_id).all()
-        
-        # Преобразуем результат в словарь {id: datetime}
-        last_gen_times = {str_cid: dt for str_cid, dt in last_gen_query}
+    if response_format == GridResponseFormats.COLUMNAR:
+        return _build_columnar_grid(
+            projects_data, change_version, page_info, paginated_collections,
+            project_ids_for_cells, fields, cell_fields
+        )
 
-    # --- Получаем данные ячеек ---
-    # !!! ВОЗВРАЩАЕМ ЛОГИКУ !!!
+    # --- Получаем данные ячеек из денормализованной таблицы grid_cells ---
+    # Один диапазонный скан по первичному ключу (collection_id, project_id)
     cells_data = {} # Структура: { collection_id(int): { project_id(str): { cell_data } } }
 
     if collection_ids_on_page and project_ids_for_cells: # Выполняем только если есть коллекции и проекты
-        # --- Получаем выбранные обложки ---
-        selected_covers_list = db.session.query(SelectedCover).filter(
-            # Сравниваем Int c Int, Str с Str
-            SelectedCover.collection_id.in_(collection_ids_on_page),
-            SelectedCover.project_id.in_(project_ids_for_cells)
-        ).options(
-            selectinload(SelectedCover.generation).selectinload(Generation.generated_files),
-            selectinload(SelectedCover.generated_file)
-        ).all()
-
-        selected_covers_dict = {}
-        for sc in selected_covers_list:
-            # Ключ: (collection_id(int), project_id(str))
-            selected_covers_dict[(int(sc.collection_id), sc.project_id)] = sc 
-
-        # --- Получаем последние генерации (где нет выбранной обложки) ---
-        generation_cte = select(
-            Generation.id,
-            Generation.collection_id,
-            Generation.project_id,
-            Generation.status,
-            Generation.error_message,
-            Generation.updated_at,
-            func.row_number().over(
-                partition_by=(Generation.collection_id, Generation.project_id),
-                order_by=Generation.updated_at.desc()
-            ).label('rn')
-        ).where(
-            # Сравниваем строки с результатом func.cast
-            Generation.collection_id.in_([str(cid) for cid in collection_ids_on_page]),
-            Generation.project_id.in_(project_ids_for_cells)
-        ).cte('generation_ranked')
-
-        latest_generation_query = db.session.query(
-            generation_cte.c.id,
-            generation_cte.c.collection_id, # Это строка
-            generation_cte.c.project_id,
-            generation_cte.c.status,
-            generation_cte.c.error_message
-        ).filter(generation_cte.c.rn == 1)
-
-        latest_generations_dict = {}
-        for lg in latest_generation_query.all():
-            coll_id_int = int(lg.collection_id) # Преобразуем ID коллекции обратно в int
-            # Ключ: (collection_id(int), project_id(str))
-            if (coll_id_int, lg.project_id) not in selected_covers_dict:
-                 latest_generations_dict[(coll_id_int, lg.project_id)] = {
-                     'id': lg.id,
-                     'status': lg.status,
-                     'error_message': lg.error_message
-                 }
-
-        # --- Формируем данные ячеек ---
+        stored_cells = _load_grid_cells(collection_ids_on_page, project_ids_for_cells)
+        url_prefix = generated_file_url_prefix()
+
         for coll_id in collection_ids_on_page: # coll_id здесь int
             cells_data[coll_id] = {}
             for proj_id in project_ids_for_cells: # proj_id здесь str
-                cell_key = proj_id # Ключ - ID проекта (строка)
-                cell_info = {
-                    'status': 'not_generated',
-                    'generation_id': None,
-                    'file_url': None,
-                    'file_path': None,
-                    'is_selected': False,
-                    'error_message': None
-                }
-
-                # Ключ: (collection_id(int), project_id(str))
-                selected_cover = selected_covers_dict.get((coll_id, proj_id))
-                latest_gen = latest_generations_dict.get((coll_id, proj_id))
-
-                if selected_cover:
-                    # ... (логика для selected_cover как была раньше) ...
-                    cell_info['is_selected'] = True
-                    cell_info['generation_id'] = selected_cover.generation_id
-                    file_to_display = selected_cover.generated_file
-                    if not file_to_display and selected_cover.generation and selected_cover.generation.generated_files:
-                        file_to_display = next((f for f in selected_cover.generation.generated_files), None)
-                        logger.warning(f"SelectedCover (C:{coll_id}, P:{proj_id}) has no generated_file_id, using first file from Generation {selected_cover.generation_id}")
-                    if file_to_display:
-                        cell_info['status'] = 'selected'
-                        cell_info['file_url'] = file_to_display.get_url()
-                        cell_info['file_path'] = file_to_display.file_path
-                    elif selected_cover.generation:
-                         cell_info['status'] = 'error'
-                         cell_info['error_message'] = 'Selected cover points to generation, but file is missing.'
-                         logger.error(f"Selected cover file missing for C:{coll_id}, P:{proj_id}, G:{selected_cover.generation_id}, FileID:{selected_cover.generated_file_id}")
-                    else:
-                         cell_info['status'] = 'error'
-                         cell_info['error_message'] = 'Selected cover data inconsistent (generation missing?).'
-                         logger.error(f"Selected cover generation missing for C:{coll_id}, P:{proj_id}, G:{selected_cover.generation_id}")
-
-                elif latest_gen:
-                   # ... (логика для latest_gen как была раньше) ...
-                    cell_info['generation_id'] = latest_gen['id']
-                    if latest_gen['status'] == GenerationStatus.COMPLETED:
-                        cell_info['status'] = 'generated_not_selected'
-                    elif latest_gen['status'] in [GenerationStatus.PENDING, GenerationStatus.QUEUED]:
-                        cell_info['status'] = 'queued'
-                    elif latest_gen['status'] == GenerationStatus.FAILED:
-                        cell_info['status'] = 'error'
-                        cell_info['error_message'] = latest_gen['error_message']
-                    else:
-                        cell_info['status'] = 'unknown'
-                        cell_info['error_message'] = f"Unknown generation status: {latest_gen['status']}"
-
-                cells_data[coll_id][cell_key] = cell_info
+                grid_cell = stored_cells.get((coll_id, proj_id))
+                if grid_cell:
+                    cells_data[coll_id][proj_id] = grid_cell.to_dict(url_prefix)
+                else:
+                    cells_data[coll_id][proj_id] = {
+                        'status': CellStatus.NOT_GENERATED,
+                        'generation_id': None,
+                        'file_url': None,
+                        'file_path': None,
+                        'is_selected': False,
+                        'error_message': None
+                    }
 
     # --- 4. Собираем финальный ответ --- 
     collections_processed = [] # Определяем список ЗДЕСЬ
     for collection in paginated_collections: # collection.id здесь int
-        collection_dict = collection.to_dict()
-        last_gen_time = last_gen_times.get(str(collection.id)) 
-        collection_dict['last_generation_at_raw'] = last_gen_time
-        collection_dict['last_generation_at'] = last_gen_time.isoformat() + 'Z' if last_gen_time else None
+        collection_dict = collection.to_dict() # Включает last_generation_at
         collection_dict['cells'] = cells_data.get(collection.id, {}) # Используем int ID коллекции для доступа к cells_data
         collections_processed.append(collection_dict)
 
-    # --- Сортировка в Python (если выбрано last_generation_at) --- 
-    # Переносим сортировку СЮДА, после формирования collections_processed
-    if sort == 'last_generation_at':
-        collections_processed.sort(
-            key=lambda c: c['last_generation_at_raw'] or datetime.min, 
-            reverse=(sort_direction == 'desc')
-        )
-        # Удаляем временное поле после сортировки
-        for c_dict in collections_processed:
-             # Используем try-except на случай, если поля уже нет (хотя не должно)
-             try:
-                 del c_dict['last_generation_at_raw']
-             except KeyError:
-                 pass 
-
     return {
         'projects': projects_data,
+        'version': change_version,
         'collections': {
             'items': collections_processed, # Используем обработанный список
-            'page': page,
-            'per_page': per_page,
-            'total': total_items,
-            'pages': pagination.pages,
-            'has_next': pagination.has_next,
-            'has_prev': pagination.has_prev
+            **page_info
         }
     }
 
 
+def _load_grid_cells(collection_ids: list[int], project_ids: list[str]) -> dict:
+    """ Ячейки страницы из grid_cells: {(collection_id, project_id): GridCell}. """
+    query = db.session.query(GridCell).filter(
+        GridCell.collection_id.in_(collection_ids),
+        GridCell.project_id.in_(project_ids)
+    ).options(selectinload(GridCell.generated_file))
+    return {(gc.collection_id, gc.project_id): gc for gc in query}
+
+
+def _parse_projection(fields_str: str | None, allowed: tuple, default: tuple) -> list[str]:
+    """ Разбирает ?fields=a,b с проверкой по списку допустимых полей. """
+    if not fields_str:
+        return list(default)
+    fields = [f.strip() for f in fields_str.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValidationError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    return fields
+
+
+def _build_columnar_grid(projects_data: list, change_version: int, page_info: dict, collections: list,
+                         project_ids: list[str], fields: str | None, cell_fields: str | None) -> dict:
+    """
+    Компактный формат грида: массивы по колонкам вместо словаря на каждую ячейку.
+    collections.fields[f][i] и cells[project_id][f][i] относятся к collections.ids[i];
+    статусы - целые коды (status_codes), файлы - ID (URL строится по file_url_template).
+    """
+    collection_fields = _parse_projection(fields, GRID_COLUMNAR_COLLECTION_FIELDS, GRID_COLUMNAR_DEFAULT_COLLECTION_FIELDS)
+    cell_field_names = _parse_projection(cell_fields, GRID_COLUMNAR_CELL_FIELDS, GRID_COLUMNAR_DEFAULT_CELL_FIELDS)
+
+    collection_ids = [c.id for c in collections]
+    collection_columns = {}
+    for field in collection_fields:
+        values = [getattr(c, field) for c in collections]
+        if field in ('last_generation_at', 'created_at', 'updated_at'):
+            values = [v.isoformat() + 'Z' if v else None for v in values]
+        collection_columns[field] = values
+
+    # Только нужные колонки, без ORM-объектов (строки Row, атрибуты как у GridCell)
+    stored_cells = {}
+    if collection_ids and project_ids:
+        query = db.session.query(
+            GridCell.collection_id, GridCell.project_id, GridCell.status, GridCell.is_selected,
+            GridCell.generation_id, GridCell.generated_file_id, GridCell.error_message,
+            GeneratedFile.file_path
+        ).outerjoin(GeneratedFile, GeneratedFile.id == GridCell.generated_file_id).filter(
+            GridCell.collection_id.in_(collection_ids),
+            GridCell.project_id.in_(project_ids)
+        )
+        stored_cells = {(row.collection_id, row.project_id): row for row in query}
+
+    not_generated_code = CELL_STATUS_CODES[CellStatus.NOT_GENERATED]
+    cell_getters = {
+        'status': lambda gc: CELL_STATUS_CODES.get(gc.status, CELL_STATUS_CODES[CellStatus.UNKNOWN]) if gc else not_generated_code,
+        'generation_id': lambda gc: gc.generation_id if gc else None,
+        'file_id': lambda gc: gc.generated_file_id if gc else None,
+        'file_path': lambda gc: gc.file_path if gc else None,
+        'is_selected': lambda gc: gc.is_selected if gc else False,
+        'error_message': lambda gc: gc.error_message if gc else None,
+    }
+    cells = {}
+    for project_id in project_ids:
+        column_cells = [stored_cells.get((cid, project_id)) for cid in collection_ids]
+        cells[project_id] = {field: [cell_getters[field](gc) for gc in column_cells] for field in cell_field_names}
+
+    return {
+        'format': GridResponseFormats.COLUMNAR,
+        'projects': projects_data,
+        'version': change_version,
+        'status_codes': CELL_STATUS_CODES,
+        'file_url_template': generated_file_url_prefix() + '{file_id}',
+        'collections': {
+            'ids': collection_ids,
+            'fields': collection_columns,
+            **page_info
+        },
+        'cells': cells
+    }
+
+
 # --- Функции для окна выбора --- 
 
 def get_selection_shell_service(collection_id: str, initial_project_id: str) -> dict | None:
@@ -413,6 +455,7 @@ def select_cover_service(data: dict) -> tuple[bool, str, int]:
     collection = db.session.get(Collection, collection_id)
     if not collection:
         return False, f"Collection with ID {collection_id} not found.", 404
+    collection_id = collection.id # Нормализуем к int (ID может прийти строкой)
     project = db.session.get(Project, project_id)
     if not project:
         return False, f"Project with ID {project_id} not found.", 404
@@ -450,6 +493,7 @@ def select_cover_service(data: dict) -> tuple[bool, str, int]:
             )
             db.session.add(selected_cover)
 
+        refresh_grid_cell(collection_id, project_id) # Ячейка грида обновляется в той же транзакции
         db.session.commit()
         logger.info(f"Successfully selected cover: C:{collection_id}, P:{project_id}, G:{generation_id}, F:{new_file.id if new_file else 'None'}")
         
@@ -0,0 +1,144 @@
+"""
+Адаптивное ограничение числа генераций "в полете" у планировщика.
+
+agent-scheduler принимает задачи без ограничений: если разом поставить тысячи
+задач, очередь A1111 разрастается, и callback'и приходят через часы. В режиме
+SCHEDULER_BACKPRESSURE=adaptive диспетчер держит у планировщика не больше limit
+генераций в статусе QUEUED, остальные ждут в локальной очереди (PENDING) и
+отправляются по мере освобождения места.
+
+limit подстраивается по схеме AIMD (как окно TCP):
+  - queue_position из ответа планировщика и задержка callback'а (EWMA) в пределах
+    цели -> limit растет на 1 за "окно" (на 1/limit за каждое наблюдение);
+  - queue_position или задержка выше цели, 429 от планировщика, слишком старая
+    незавершенная генерация -> limit умножается на BACKPRESSURE_DECREASE_FACTOR,
+    не чаще раза в BACKPRESSURE_DECREASE_COOLDOWN_SECONDS (ответы одной пачки
+    сообщают об одной и той же перегрузке).
+"""
+import logging
+import os
+import threading
+import time
+
+from backend.constants import (
+    SchedulerBackpressureModes, BACKPRESSURE_INITIAL_LIMIT, BACKPRESSURE_MIN_LIMIT, BACKPRESSURE_MAX_LIMIT,
+    DEFAULT_BACKPRESSURE_TARGET_QUEUE_POSITION, DEFAULT_BACKPRESSURE_TARGET_LATENCY_SECONDS,
+    BACKPRESSURE_DECREASE_FACTOR, BACKPRESSURE_DECREASE_COOLDOWN_SECONDS, BACKPRESSURE_LATENCY_EWMA_ALPHA
+)
+
+logger = logging.getLogger(__name__)
+
+
+def backpressure_mode() -> str:
+    """ Режим ограничения из SCHEDULER_BACKPRESSURE (off / adaptive). """
+    mode = os.environ.get('SCHEDULER_BACKPRESSURE', SchedulerBackpressureModes.OFF).strip().lower()
+    if mode not in (SchedulerBackpressureModes.OFF, SchedulerBackpressureModes.ADAPTIVE):
+        logger.warning(f"Unknown SCHEDULER_BACKPRESSURE={mode!r}, using '{SchedulerBackpressureModes.OFF}'")
+        mode = SchedulerBackpressureModes.OFF
+    return mode
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(float(os.environ.get(name, default)), 0.0)
+    except ValueError:
+        logger.warning(f"Invalid {name}, using default")
+        return default
+
+
+def create_scheduler_backpressure(name: str = 'scheduler') -> 'SchedulerBackpressure | None':
+    """ Ограничитель для планировщика, если включен SCHEDULER_BACKPRESSURE=adaptive, иначе None. """
+    if backpressure_mode() != SchedulerBackpressureModes.ADAPTIVE:
+        return None
+    return SchedulerBackpressure(
+        name,
+        target_queue_position=_env_float('SCHEDULER_TARGET_QUEUE_POSITION', DEFAULT_BACKPRESSURE_TARGET_QUEUE_POSITION),
+        target_latency=_env_float('SCHEDULER_TARGET_CALLBACK_LATENCY', DEFAULT_BACKPRESSURE_TARGET_LATENCY_SECONDS)
+    )
+
+
+class SchedulerBackpressure:
+    """ Потокобезопасный AIMD-ограничитель числа QUEUED-генераций одного планировщика. """
+
+    def __init__(self, name: str, target_queue_position: float = DEFAULT_BACKPRESSURE_TARGET_QUEUE_POSITION,
+                 target_latency: float = DEFAULT_BACKPRESSURE_TARGET_LATENCY_SECONDS,
+                 initial_limit: int = BACKPRESSURE_INITIAL_LIMIT, min_limit: int = BACKPRESSURE_MIN_LIMIT,
+                 max_limit: int = BACKPRESSURE_MAX_LIMIT):
+        self.name = name
+        self.target_queue_position = target_queue_position
+        self.target_latency = target_latency
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._latency_ewma = None
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def callback_latency(self) -> float | None:
+        """ Сглаженная задержка callback'а (секунды от QUEUED до результата). """
+        return self._latency_ewma
+
+    def available(self, in_flight: int) -> int:
+        """ Сколько генераций еще можно отправить при in_flight уже стоящих в очереди планировщика. """
+        return max(self.limit - in_flight, 0)
+
+    def observe_queue_position(self, queue_position) -> None:
+        """ Учитывает queue_position из ответа планировщика на постановку задачи. """
+        try:
+            position = float(queue_position)
+        except (TypeError, ValueError):
+            return # Планировщик не сообщил позицию
+        if position > self.target_queue_position:
+            self._decrease(f"queue position {position:.0f} > {self.target_queue_position:.0f}")
+        else:
+            self._increase()
+
+    def observe_callback_latency(self, latency_seconds: float) -> None:
+        """ Учитывает время от постановки в очередь планировщика до callback'а. """
+        with self._lock:
+            if self._latency_ewma is None:
+                self._latency_ewma = latency_seconds
+            else:
+                self._latency_ewma += BACKPRESSURE_LATENCY_EWMA_ALPHA * (latency_seconds - self._latency_ewma)
+            latency = self._latency_ewma
+        if latency > self.target_latency:
+            self._decrease(f"callback latency {latency:.0f}s > {self.target_latency:.0f}s")
+        else:
+            self._increase()
+
+    def observe_oldest_in_flight(self, age_seconds: float | None) -> None:
+        """
+        Возраст самой старой QUEUED-генерации: если она ждет дольше цели, очередь
+        перегружена, даже пока callback'ов нет (или они приходят в другой процесс).
+        """
+        if age_seconds is not None and age_seconds > self.target_latency:
+            self._decrease(f"oldest queued generation is {age_seconds:.0f}s old")
+
+    def observe_overload(self) -> None:
+        """ Планировщик явно отказал из-за перегрузки (429). """
+        self._decrease("scheduler responded 429")
+
+    def _increase(self) -> None:
+        with self._lock:
+            previous = self.limit
+            self._limit = min(self._limit + 1.0 / max(self._limit, 1.0), float(self.max_limit))
+            current = self.limit
+        if current != previous:
+            logger.debug(f"Backpressure [{self.name}]: in-flight limit raised to {current}")
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_decrease < BACKPRESSURE_DECREASE_COOLDOWN_SECONDS:
+                return
+            self._last_decrease = now
+            previous = self.limit
+            self._limit = max(self._limit * BACKPRESSURE_DECREASE_FACTOR, float(self.min_limit))
+            current = self.limit
+        if current != previous:
+            logger.info(f"Backpressure [{self.name}]: {reason}, in-flight limit lowered {previous} -> {current}")
@@ -0,0 +1,183 @@
+"""
+Массовая генерация фоновыми заданиями (см. features/jobs/runner.py).
+
+POST /api/generate-by-filter принимает те же фильтры, что /api/grid-data
+(search, type, advanced, generation_status_filter, visible_project_ids), создает
+задание и сразу отвечает его ID. Задание один раз фиксирует коллекции по
+фильтрам грида, вычисляет целевые пары в SQL (эти коллекции × видимые проекты с
+условием на ячейку) и порциями по BULK_GENERATION_CHUNK_SIZE (keyset по
+(collection_id, project_id)) передает их в process_generation_request. Прогресс: GET /api/jobs/<job_id> и
+событие Socket.IO 'job_update'.
+
+/generate-batch?async=1 так же порциями обрабатывает переданный список пар.
+
+Целевые ячейки среди подходящих коллекций:
+  - not_generated: ячейки без генераций;
+  - not_selected: ячейки без выбранной обложки;
+  - без фильтра: все ячейки.
+Ячейки, генерация которых уже стоит в очереди, пропускаются всегда.
+"""
+import logging
+from sqlalchemy import and_, func, or_, select
+
+from backend.models import db, Project, Collection, GridCell
+from backend.constants import (
+    CellStatus, GenerationDedupModes, GenerationStatusFilters, JobKinds, BULK_GENERATION_CHUNK_SIZE
+)
+from backend.utils.validators import ValidationError
+from backend.features.grid_selection.services import apply_grid_filters
+from backend.features.jobs.runner import JobContext, register_job_handler
+from .services import parse_generation_priority, process_generation_request
+
+logger = logging.getLogger(__name__)
+
+GRID_FILTER_PARAMS = ('search', 'type', 'advanced', 'generation_status_filter')
+BATCH_RESULT_KEYS = ('tasks_started', 'pair_errors', 'coalesced')
+
+
+class BulkGenerationError(RuntimeError):
+    """ Пакет не удалось поставить целиком (например, не настроен планировщик). """
+
+
+def parse_grid_filter_params(data: dict) -> dict:
+    """ Проверяет и нормализует параметры задания: фильтры грида, видимые проекты, режим dedup и приоритет. """
+    params = {key: data.get(key) or None for key in GRID_FILTER_PARAMS}
+    if params['generation_status_filter'] not in (None, GenerationStatusFilters.NOT_SELECTED,
+                                                  GenerationStatusFilters.NOT_GENERATED):
+        raise ValidationError(f"Invalid generation_status_filter: {params['generation_status_filter']}")
+
+    project_ids = data.get('visible_project_ids')
+    if isinstance(project_ids, str):
+        project_ids = [pid.strip() for pid in project_ids.split(',') if pid.strip()]
+    elif project_ids is not None and not (isinstance(project_ids, list) and all(isinstance(pid, str) for pid in project_ids)):
+        raise ValidationError("visible_project_ids must be a comma-separated string or a list of project IDs")
+    params['visible_project_ids'] = project_ids or None
+
+    dedup = str(data.get('dedup', GenerationDedupModes.REUSE)).lower()
+    if dedup not in (GenerationDedupModes.REUSE, GenerationDedupModes.SKIP, GenerationDedupModes.OFF):
+        raise ValidationError(f"Invalid dedup mode: {dedup}. Expected 'reuse', 'skip' or 'off'")
+    params['dedup'] = dedup
+    params['priority'] = parse_generation_priority(data.get('priority'))
+    return params
+
+
+def target_collection_ids(params: dict, project_ids: list[str]) -> list[int]:
+    """
+    ID коллекций по фильтрам грида на момент старта задания (по возрастанию).
+    Снимок берется один раз: фильтр по статусу генерации зависит от ячеек, которые
+    само задание и создает, и при повторном вычислении на каждой порции коллекция,
+    пары которой попали в разные порции, выпадала бы из выборки после первой.
+    """
+    collections_query, _ = apply_grid_filters(
+        db.session.query(Collection), project_ids,
+        search=params.get('search'), type_=params.get('type'), advanced=params.get('advanced'),
+        generation_status_filter=params.get('generation_status_filter')
+    )
+    return sorted(collection_id for collection_id, in collections_query.with_entities(Collection.id))
+
+
+def target_pairs_select(collection_ids: list[int], project_ids: list[str], status_filter: str | None):
+    """ SELECT (collection_id, project_id) целевых ячеек среди collection_ids × project_ids с условием на ячейку. """
+    not_queued = GridCell.status != CellStatus.QUEUED
+    no_cell = GridCell.collection_id.is_(None)
+    if status_filter == GenerationStatusFilters.NOT_GENERATED:
+        cell_condition = no_cell
+    elif status_filter == GenerationStatusFilters.NOT_SELECTED:
+        cell_condition = or_(no_cell, and_(GridCell.is_selected == False, not_queued))
+    else:
+        cell_condition = or_(no_cell, not_queued)
+
+    return select(
+        Collection.id.label('collection_id'), Project.id.label('project_id')
+    ).select_from(Collection).join(
+        Project, Project.id.in_(project_ids) # Декартово произведение с видимыми проектами
+    ).outerjoin(
+        GridCell, and_(GridCell.collection_id == Collection.id, GridCell.project_id == Project.id)
+    ).where(Collection.id.in_(collection_ids), cell_condition)
+
+
+def _collection_id_slices(collection_ids: list[int], chunk_size: int):
+    """ Снимок коллекций частями: IN (...) не упирается в лимит параметров SQLite. """
+    for start in range(0, len(collection_ids), chunk_size):
+        yield collection_ids[start:start + chunk_size]
+
+
+def count_target_pairs(collection_ids: list[int], project_ids: list[str], status_filter: str | None,
+                       chunk_size: int) -> int:
+    total = 0
+    for id_slice in _collection_id_slices(collection_ids, chunk_size):
+        pairs = target_pairs_select(id_slice, project_ids, status_filter).subquery()
+        total += db.session.execute(select(func.count()).select_from(pairs)).scalar()
+    return total
+
+
+def _target_pairs_chunks(collection_ids: list[int], project_ids: list[str], status_filter: str | None,
+                         chunk_size: int):
+    """
+    Порции целевых пар по keyset (collection_id, project_id) внутри снимка коллекций:
+    без OFFSET и без всей выборки в памяти. На каждой порции перепроверяется только
+    условие на саму ячейку - пары, уже обработанные заданием, остаются позади ключа.
+    """
+    for id_slice in _collection_id_slices(collection_ids, chunk_size):
+        pairs = target_pairs_select(id_slice, project_ids, status_filter).subquery('target_pairs')
+        last = None
+        while True:
+            chunk_query = select(pairs.c.collection_id, pairs.c.project_id)
+            if last is not None:
+                chunk_query = chunk_query.where(or_(
+                    pairs.c.collection_id > last[0],
+                    and_(pairs.c.collection_id == last[0], pairs.c.project_id > last[1])
+                ))
+            rows = db.session.execute(
+                chunk_query.order_by(pairs.c.collection_id, pairs.c.project_id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            last = rows[-1]
+            yield rows
+
+
+def _process_pairs_chunk(ctx: JobContext, pairs: list[dict], params: dict, collected: dict):
+    """
+    Ставит порцию пар. Списки для итога копятся в collected (формат ответа /generate-batch),
+    в промежуточный итог задания пишутся только счетчики.
+    """
+    results = process_generation_request(
+        pairs, dedup=params.get('dedup', GenerationDedupModes.REUSE),
+        priority=params.get('priority', 0), requested_by=params.get('requested_by')
+    )
+    if results.get('overall_error'):
+        raise BulkGenerationError(results['overall_error'])
+    for key in BATCH_RESULT_KEYS:
+        collected[key].extend(results[key])
+    ctx.advance(len(pairs), errors=len(results['pair_errors']),
+                **{f"{key}_count": len(collected[key]) for key in BATCH_RESULT_KEYS})
+
+
+def run_generate_by_filter_job(ctx: JobContext, params: dict, payload=None) -> dict:
+    """ Задание GENERATE_BY_FILTER: целевые ячейки по фильтру грида порциями через process_generation_request. """
+    project_ids = params.get('visible_project_ids') or [pid for pid, in db.session.query(Project.id)]
+    status_filter = params.get('generation_status_filter')
+    collection_ids = target_collection_ids(params, project_ids)
+    ctx.set_total(count_target_pairs(collection_ids, project_ids, status_filter, BULK_GENERATION_CHUNK_SIZE))
+    logger.info(f"Job {ctx.job_id}: {ctx.total} target pairs in {len(collection_ids)} collections")
+    collected = {key: [] for key in BATCH_RESULT_KEYS}
+    for rows in _target_pairs_chunks(collection_ids, project_ids, status_filter, BULK_GENERATION_CHUNK_SIZE):
+        ctx.check_cancelled()
+        pairs = [{'project_id': project_id, 'collection_id': collection_id} for collection_id, project_id in rows]
+        _process_pairs_chunk(ctx, pairs, params, collected)
+    return {"message": f"Processed {ctx.processed} pairs.", **collected}
+
+
+def run_generate_batch_job(ctx: JobContext, params: dict, pairs: list[dict]) -> dict:
+    """ Задание GENERATE_BATCH: переданный список пар порциями через process_generation_request. """
+    ctx.set_total(len(pairs))
+    collected = {key: [] for key in BATCH_RESULT_KEYS}
+    for start in range(0, len(pairs), BULK_GENERATION_CHUNK_SIZE):
+        ctx.check_cancelled()
+        _process_pairs_chunk(ctx, pairs[start:start + BULK_GENERATION_CHUNK_SIZE], params, collected)
+    return {"message": f"Processed {len(pairs)} pairs.", **collected}
+
+
+register_job_handler(JobKinds.GENERATE_BY_FILTER, run_generate_by_filter_job)
+register_job_handler(JobKinds.GENERATE_BATCH, run_generate_batch_job)
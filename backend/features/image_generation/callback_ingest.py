@@ -0,0 +1,437 @@
+"""
+Быстрый прием callback'ов планировщика.
+
+Раньше /api/scheduler_callback/<generation_id> делал всю работу, пока
+планировщик ждал ответа: сохранял каждый файл, записывал GeneratedFile по
+одному, коммитил и рассылал событие. При всплеске callback'ов потоки Flask
+заканчивались, планировщик получал таймауты и повторял запросы.
+
+При CALLBACK_INGEST=async (по умолчанию) запрос callback'а только складывает
+загруженные файлы в staging (CALLBACK_STAGING_FOLDER внутри
+GENERATED_FILES_FOLDER), записывает StagedCallback и сразу отвечает. Пул потоков
+(CALLBACK_INGEST_WORKERS) захватывает принятые callback'и пачками и для всей
+пачки одной транзакцией переносит файлы на место, вставляет GeneratedFile,
+обновляет генерации и ячейки грида и удаляет обработанные записи; события
+generation_update рассылаются после коммита.
+
+Захват - один UPDATE, который ставит claim_token и сдвигает next_attempt_at на
+срок аренды, поэтому после падения процесса пачка снова станет доступна
+(обработка "хотя бы один раз"). Имя файла на месте определяется заранее
+(тот же uuid, что в staging), поэтому повторная обработка находит уже
+перенесенный файл. Ошибка пачки разбирается по одному callback'у; callback,
+который не удалось обработать CALLBACK_INGEST_MAX_ATTEMPTS раз, помечает
+генерацию FAILED.
+
+Повторная доставка (планировщик не дождался ответа и повторил запрос)
+отсекается до записи на диск чтением Generation.callback_digest - отпечатка
+callback'а (статус, ошибка, SHA-256 файлов). Сам отпечаток ставится после записи
+файлов в staging одним UPDATE по первичному ключу в транзакции со вставкой
+StagedCallback; параллельный повтор этот UPDATE не проходит и удаляет свои файлы. Файл, который у генерации уже есть (тот же
+хэш, например забранный сверкой с планировщиком), повторно не сохраняется;
+уникальный индекс (generation_id, content_hash) страхует на уровне БД.
+
+CALLBACK_INGEST=inline - прежняя обработка внутри запроса (с той же защитой от повторов).
+"""
+import logging
+import os
+import random
+import shutil
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, select, update
+from werkzeug.serving import is_running_from_reloader
+
+from backend.models import db, Generation, GenerationStatus, ModerationStatus, GeneratedFile, Project, StagedCallback
+from backend.constants import (
+    CallbackIngestModes, CALLBACK_STAGING_FOLDER, DEFAULT_CALLBACK_INGEST_WORKERS, CALLBACK_INGEST_BATCH_SIZE,
+    CALLBACK_INGEST_POLL_INTERVAL_SECONDS, CALLBACK_INGEST_LEASE_SECONDS, CALLBACK_INGEST_MAX_ATTEMPTS,
+    CALLBACK_SPOOL_CHUNK_BYTES, DISPATCH_BACKOFF_BASE_SECONDS, DISPATCH_BACKOFF_MAX_SECONDS
+)
+from backend.features.grid_selection.grid_cells import refresh_grid_cells
+from backend.features.file_serving.blob_store import add_blob_refs, blobs_enabled, materialize_blob, store_blob_from_file
+from backend.features.file_serving.thumbnails import schedule_thumbnails
+from .dispatcher import emit_generation_update, notify_generation_finished
+from .services import (
+    callback_already_delivered, callback_digest, claim_callback_delivery, generated_file_db_path, generation_files_dir,
+    hash_callback_uploads, known_content_hashes
+)
+
+logger = logging.getLogger(__name__)
+
+INGESTOR_EXTENSION_KEY = 'callback_ingestor'
+
+
+def callback_ingest_mode() -> str:
+    """ Режим приема callback'ов из CALLBACK_INGEST (async / inline). """
+    mode = os.environ.get('CALLBACK_INGEST', CallbackIngestModes.ASYNC).strip().lower()
+    if mode not in (CallbackIngestModes.ASYNC, CallbackIngestModes.INLINE):
+        logger.warning(f"Unknown CALLBACK_INGEST={mode!r}, using '{CallbackIngestModes.ASYNC}'")
+        mode = CallbackIngestModes.ASYNC
+    return mode
+
+
+def callback_ingest_workers() -> int:
+    """ Число потоков обработки принятых callback'ов (CALLBACK_INGEST_WORKERS). """
+    try:
+        return max(int(os.environ.get('CALLBACK_INGEST_WORKERS', DEFAULT_CALLBACK_INGEST_WORKERS)), 1)
+    except ValueError:
+        logger.warning("Invalid CALLBACK_INGEST_WORKERS, using default")
+        return DEFAULT_CALLBACK_INGEST_WORKERS
+
+
+def staging_dir() -> str:
+    """ Абсолютный путь к staging: внутри GENERATED_FILES_FOLDER, чтобы перенос на место был rename. """
+    return os.path.join(os.path.abspath(current_app.config['GENERATED_FILES_FOLDER']), CALLBACK_STAGING_FOLDER)
+
+
+def _spool_upload(file_storage, path: str) -> int:
+    """ Записывает загруженный файл на диск крупными блоками. Возвращает размер в байтах. """
+    size_bytes = 0
+    with open(path, 'wb') as out:
+        while True:
+            chunk = file_storage.stream.read(CALLBACK_SPOOL_CHUNK_BYTES)
+            if not chunk:
+                break
+            out.write(chunk)
+            size_bytes += len(chunk)
+    return size_bytes
+
+
+def _remove_staged_files(staged_files: list[dict] | None, root: str):
+    for staged in staged_files or []:
+        try:
+            os.remove(os.path.join(root, staged['staged_name']))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove staged file {staged['staged_name']}: {e}")
+
+
+def spool_scheduler_callback(generation_id: str, form_data: dict, files: dict | None) -> StagedCallback | None:
+    """
+    Принимает callback: файлы - в staging, запись - в staged_callbacks (коммит), затем будит пул.
+    Повтор уже принятого callback'а отсекается чтением отпечатка до записи на диск.
+    Отметка доставки (claim_callback_delivery) ставится уже после записи файлов, в одной
+    короткой транзакции со вставкой StagedCallback: блокировка записи SQLite не держится,
+    пока файлы пишутся на диск. Если параллельный повтор успел первым, записанные
+    файлы удаляются. None - повтор (или генерации нет).
+    """
+    status, error = form_data.get('status'), form_data.get('error')
+    uploads = hash_callback_uploads(files)
+    digest = callback_digest(status, error, [h for _, h in uploads])
+    already_delivered = callback_already_delivered(generation_id, digest)
+    db.session.rollback() # Транзакция чтения не живет во время записи файлов
+    if already_delivered:
+        logger.info(f"Duplicate callback for {generation_id} (or unknown generation) ignored")
+        return None
+
+    root = staging_dir()
+    os.makedirs(root, exist_ok=True)
+    staged_files = []
+    try:
+        for file_storage, content_hash in uploads:
+            if any(staged['content_hash'] == content_hash for staged in staged_files):
+                continue # Один и тот же файл дважды в одном callback'е
+            filename_ext = os.path.splitext(file_storage.filename)[1].lower() or '.png'
+            staged = {
+                'staged_name': f"{uuid.uuid4().hex}{filename_ext}",
+                'original_filename': file_storage.filename,
+                'mime_type': file_storage.content_type,
+                'size_bytes': 0,
+                'content_hash': content_hash,
+            }
+            staged_files.append(staged) # До записи: недописанный файл тоже удаляется при ошибке
+            staged['size_bytes'] = _spool_upload(file_storage, os.path.join(root, staged['staged_name']))
+    except Exception:
+        _remove_staged_files(staged_files, root)
+        raise
+
+    try:
+        if not claim_callback_delivery(generation_id, digest):
+            db.session.rollback()
+            _remove_staged_files(staged_files, root)
+            logger.info(f"Duplicate callback for {generation_id} (or unknown generation) ignored")
+            return None
+        staged_callback = StagedCallback(generation_id=generation_id, status=status, error_message=error, files=staged_files)
+        db.session.add(staged_callback)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        _remove_staged_files(staged_files, root)
+        raise
+    logger.info(f"Staged callback for {generation_id}: status {staged_callback.status}, {len(staged_files)} files")
+    notify_callback_ingestor()
+    return staged_callback
+
+
+def claim_staged_callbacks(limit: int = CALLBACK_INGEST_BATCH_SIZE) -> tuple[str, list]:
+    """
+    Захватывает до limit готовых к обработке callback'ов одним UPDATE и коммитит.
+    Возвращает (claim_token, callback'и в порядке приема).
+    """
+    now = datetime.utcnow()
+    lease_until = now + timedelta(seconds=CALLBACK_INGEST_LEASE_SECONDS)
+    token = str(uuid.uuid4())
+    due_ids = select(StagedCallback.id).where(StagedCallback.next_attempt_at <= now).order_by(
+        StagedCallback.received_at
+    ).limit(limit)
+    db.session.execute(
+        update(StagedCallback)
+        .where(StagedCallback.id.in_(due_ids.scalar_subquery()), StagedCallback.next_attempt_at <= now)
+        .values(claim_token=token, next_attempt_at=lease_until)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    claimed = StagedCallback.query.filter(StagedCallback.claim_token == token).order_by(StagedCallback.received_at).all()
+    return token, claimed
+
+
+def _place_staged_file(staged_path: str, final_path: str, content_hash: str | None = None) -> bool:
+    """
+    Переносит файл из staging на место (IMAGE_STORE=blobs - в хранилище blob'ов, а на месте -
+    ссылка на blob). Если файла в staging уже нет, а на месте (или в хранилище) он есть -
+    перенос сделала прерванная попытка. False - файла нет нигде.
+    """
+    if content_hash and blobs_enabled():
+        if os.path.exists(staged_path):
+            store_blob_from_file(staged_path, content_hash, move=True)
+        return materialize_blob(content_hash, final_path)
+    if os.path.exists(staged_path):
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        shutil.move(staged_path, final_path) # rename в пределах одной ФС, иначе копирование
+        return True
+    return os.path.exists(final_path)
+
+
+def _finalize_callbacks(token: str, callbacks: list[StagedCallback]) -> int:
+    """
+    Обрабатывает пачку одной транзакцией и после коммита рассылает события.
+    Возвращает число обработанных callback'ов (0 - пачку успел перехватить другой поток).
+    """
+    root = staging_dir()
+    now = datetime.utcnow()
+    generation_ids = {callback.generation_id for callback in callbacks}
+    generations = {g.id: g for g in Generation.query.filter(Generation.id.in_(generation_ids))}
+    project_ids = {g.project_id for g in generations.values()}
+    projects = {p.id: p for p in Project.query.filter(Project.id.in_(project_ids))} if project_ids else {}
+
+    known_hashes = known_content_hashes(generations.keys())
+    updates = [] # (payload, label, queued_at, scheduler_url, [GeneratedFile])
+    discarded_files = [] # Файлы callback'ов, которые некуда сохранять
+    touched_cells = set()
+    for callback in callbacks:
+        generation = generations.get(callback.generation_id)
+        if generation is None:
+            logger.warning(f"Callback received for non-existent generation_id: {callback.generation_id}")
+            discarded_files.extend(callback.files or [])
+            continue
+        payload = {'id': generation.id, 'project_id': generation.project_id, 'collection_id': generation.collection_id}
+
+        if callback.status == 'done' and callback.files:
+            target_dir = generation_files_dir(projects.get(generation.project_id), callback.received_at)
+            new_files = []
+            for staged in callback.files:
+                content_hash = staged.get('content_hash')
+                if content_hash and (generation.id, content_hash) in known_hashes:
+                    # Такой файл у генерации уже есть (например, его забрала сверка с планировщиком)
+                    discarded_files.append(staged)
+                    continue
+                known_hashes.add((generation.id, content_hash))
+                final_path = os.path.join(target_dir, f"{generation.collection_id} {staged['staged_name']}")
+                if not _place_staged_file(os.path.join(root, staged['staged_name']), final_path, content_hash):
+                    logger.error(f"Staged file {staged['staged_name']} for generation {generation.id} is missing, skipping")
+                    continue
+                new_files.append(GeneratedFile(
+                    generation_id=generation.id,
+                    file_path=generated_file_db_path(final_path),
+                    original_filename=staged['original_filename'],
+                    mime_type=staged['mime_type'],
+                    size_bytes=staged['size_bytes'],
+                    infotext=None,
+                    content_hash=content_hash
+                ))
+            generation.status = GenerationStatus.COMPLETED
+            generation.moderation_status = ModerationStatus.PENDING_MODERATION
+            generation.error_message = None
+            db.session.add_all(new_files)
+            payload['status'] = GenerationStatus.COMPLETED.value
+            payload['moderation_status'] = ModerationStatus.PENDING_MODERATION.value
+            updates.append((payload, 'COMPLETED', generation.queued_at, generation.scheduler_url, new_files))
+        elif callback.status == 'failed':
+            generation.status = GenerationStatus.FAILED
+            generation.error_message = callback.error_message or "Generation failed without specific error message."
+            payload['status'] = GenerationStatus.FAILED.value
+            payload['error_message'] = generation.error_message
+            discarded_files.extend(callback.files or [])
+            updates.append((payload, 'FAILED', generation.queued_at, generation.scheduler_url, []))
+        else:
+            # Статус не меняем: зависшую генерацию потом проверит сверка с планировщиком (reconciler.py)
+            logger.warning(f"Callback for {generation.id} received with unhandled status '{callback.status}' or missing files.")
+            discarded_files.extend(callback.files or [])
+            continue
+        generation.updated_at = now
+        touched_cells.add((generation.collection_id, generation.project_id))
+
+    if blobs_enabled():
+        blob_files = [f for _, _, _, _, files in updates for f in files if f.content_hash]
+        add_blob_refs(Counter(f.content_hash for f in blob_files), {f.content_hash: f.size_bytes for f in blob_files})
+    db.session.flush() # ID и created_at новых файлов для событий
+    thumbnail_sources = []
+    for payload, label, _, _, new_files in updates:
+        if label == 'COMPLETED':
+            payload['generated_files'] = [generated_file.to_dict() for generated_file in new_files]
+            thumbnail_sources.extend((f.id, f.file_path, f.content_hash) for f in new_files)
+    refresh_grid_cells(touched_cells)
+    deleted = db.session.execute(
+        delete(StagedCallback)
+        .where(StagedCallback.id.in_([callback.id for callback in callbacks]), StagedCallback.claim_token == token)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if deleted != len(callbacks):
+        # Аренда истекла и часть пачки захватил другой поток: он и обработает ее целиком
+        db.session.rollback()
+        logger.warning(f"Staged callback batch {token} lost its lease, leaving it to the new owner")
+        return 0
+    db.session.commit()
+
+    _remove_staged_files(discarded_files, root)
+    schedule_thumbnails(thumbnail_sources)
+    for payload, label, queued_at, scheduler_url, _ in updates:
+        emit_generation_update(payload, label)
+        notify_generation_finished(queued_at, scheduler_url)
+    return len(callbacks)
+
+
+def _record_failed_attempt(token: str, callback_id: str, error: Exception):
+    """ Откладывает callback с экспоненциальной задержкой; после CALLBACK_INGEST_MAX_ATTEMPTS - генерация FAILED. """
+    callback = db.session.get(StagedCallback, callback_id)
+    if callback is None or callback.claim_token != token:
+        return
+    callback.attempts += 1
+    callback.last_error = str(error)
+    if callback.attempts < CALLBACK_INGEST_MAX_ATTEMPTS:
+        ceiling = min(DISPATCH_BACKOFF_MAX_SECONDS, DISPATCH_BACKOFF_BASE_SECONDS * (2 ** (callback.attempts - 1)))
+        callback.next_attempt_at = datetime.utcnow() + timedelta(seconds=random.uniform(ceiling / 2, ceiling))
+        db.session.commit()
+        logger.warning(f"Staged callback {callback_id} failed (attempt {callback.attempts}), will retry: {error}")
+        return
+
+    logger.error(f"Staged callback {callback_id} failed {callback.attempts} times, giving up: {error}")
+    staged_files = callback.files
+    generation = db.session.get(Generation, callback.generation_id)
+    payload = None
+    if generation is not None:
+        generation.callback_digest = None # Повторная доставка того же callback'а снова будет обработана
+    if generation is not None and generation.status in (GenerationStatus.PENDING, GenerationStatus.QUEUED):
+        generation.status = GenerationStatus.FAILED
+        generation.error_message = f"Callback processing error: {error}"
+        generation.updated_at = datetime.utcnow()
+        refresh_grid_cells({(generation.collection_id, generation.project_id)})
+        payload = {'id': generation.id, 'project_id': generation.project_id, 'collection_id': generation.collection_id,
+                   'status': GenerationStatus.FAILED.value, 'error_message': generation.error_message}
+    db.session.delete(callback)
+    db.session.commit()
+    _remove_staged_files(staged_files, staging_dir())
+    if payload is not None:
+        emit_generation_update(payload, 'FAILED')
+
+
+def ingest_staged_callbacks(limit: int = CALLBACK_INGEST_BATCH_SIZE) -> int:
+    """ Один проход: захват пачки и ее обработка. Возвращает число захваченных callback'ов. """
+    token, callbacks = claim_staged_callbacks(limit)
+    if not callbacks:
+        return 0
+    try:
+        _finalize_callbacks(token, callbacks)
+        return len(callbacks)
+    except Exception as batch_error:
+        db.session.rollback()
+        if len(callbacks) == 1:
+            _record_failed_attempt(token, callbacks[0].id, batch_error)
+            return 1
+        logger.warning(f"Staged callback batch of {len(callbacks)} failed, processing one by one: {batch_error}")
+    # Разбор пачки по одному, чтобы один сбойный callback не задерживал остальные
+    for callback_id in [callback.id for callback in callbacks]:
+        callback = db.session.get(StagedCallback, callback_id)
+        if callback is None or callback.claim_token != token:
+            continue
+        try:
+            _finalize_callbacks(token, [callback])
+        except Exception as e:
+            db.session.rollback()
+            _record_failed_attempt(token, callback_id, e)
+    return len(callbacks)
+
+
+class CallbackIngestor:
+    """ Пул потоков обработки принятых callback'ов: проходы, пока есть работа, затем ожидание wake() или таймаута. """
+
+    def __init__(self, app, workers: int | None = None, poll_interval: float = CALLBACK_INGEST_POLL_INTERVAL_SECONDS):
+        self.app = app
+        self.workers = callback_ingest_workers() if workers is None else workers
+        self.poll_interval = poll_interval
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """ Запускает потоки пула (daemon). """
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.run_forever, name=f'callback-ingest-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Callback ingestor started with {self.workers} workers")
+
+    def wake(self):
+        self._wake_event.set()
+
+    def stop(self, timeout: float | None = None):
+        self._stop_event.set()
+        self._wake_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_once(self) -> int:
+        """ Один проход в контексте приложения. Возвращает число захваченных callback'ов. """
+        with self.app.app_context():
+            try:
+                return ingest_staged_callbacks()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Callback ingest pass failed")
+                return 0
+            finally:
+                db.session.remove()
+
+    def run_forever(self):
+        while not self._stop_event.is_set():
+            if self.run_once():
+                continue # Могут быть еще принятые callback'и
+            self._wake_event.wait(self.poll_interval)
+            self._wake_event.clear()
+
+
+def start_callback_ingestor(app):
+    """
+    Запускает пул обработки при CALLBACK_INGEST=async. В debug-режиме с перезагрузчиком
+    потоки запускаются только в рабочем (дочернем) процессе. Callback'и, принятые до
+    перезапуска, пул подхватывает сам: они остаются в staged_callbacks.
+    """
+    if callback_ingest_mode() != CallbackIngestModes.ASYNC:
+        return None
+    if os.environ.get('FLASK_DEBUG') == '1' and not is_running_from_reloader():
+        return None
+    ingestor = CallbackIngestor(app)
+    app.extensions[INGESTOR_EXTENSION_KEY] = ingestor
+    ingestor.start()
+    return ingestor
+
+
+def notify_callback_ingestor():
+    """ Будит пул обработки текущего приложения (если он запущен). """
+    ingestor = current_app.extensions.get(INGESTOR_EXTENSION_KEY)
+    if ingestor is not None:
+        ingestor.wake()
@@ -0,0 +1,504 @@
+"""
+Очередь отправки генераций в планировщик (outbox).
+
+/generate-batch только вставляет генерации в статусе PENDING с next_submit_at
+и сразу отвечает. Диспетчер (фоновый поток приложения или отдельный процесс
+`flask dispatch-generations`) периодически захватывает готовые к отправке
+PENDING-генерации, отправляет их с ограничением частоты и параллельности и
+записывает результат:
+  - успех -> QUEUED (+ scheduler_task_id);
+  - временная ошибка (сеть, таймаут, 429, 5xx) -> остается PENDING,
+    next_submit_at сдвигается с экспоненциальной задержкой;
+  - постоянная ошибка или исчерпаны попытки -> FAILED.
+
+Захват пачки - один UPDATE, который ставит dispatch_token и сдвигает
+next_submit_at на срок аренды. Если процесс упал посреди отправки, после
+истечения аренды пачка снова становится доступной (доставка "хотя бы один
+раз"). Результаты записываются только для строк, которые все еще PENDING и
+принадлежат этой пачке, поэтому callback, пришедший раньше ответа
+планировщика, не затирается.
+
+Генерации распределяются по пулу экземпляров планировщика (scheduler_pool.py):
+каждая идет на здоровый экземпляр с наименьшим числом незавершенных задач, адрес
+записывается в Generation.scheduler_url. Если экземпляр перестал отвечать,
+неотправленные генерации сразу переназначаются на другой.
+
+При SCHEDULER_BACKPRESSURE=adaptive проход захватывает не больше генераций,
+чем позволяют ограничители экземпляров (см. backpressure.py) с учетом уже
+стоящих в их очередях; callback'и будят диспетчер, чтобы освободившееся место
+сразу занималось.
+
+Какие из готовых генераций захватить, решают приоритеты и справедливое
+разделение между проектами и клиентами (fair_share.py).
+
+Раз в GENERATION_RECONCILE_INTERVAL диспетчер также сверяет с планировщиком
+давно стоящие в очереди генерации (потерянные callback'и, см. reconciler.py).
+"""
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, bindparam, func, or_, select, update
+from werkzeug.serving import is_running_from_reloader
+
+from backend.models import db, Generation, GenerationStatus, Project
+from backend.constants import (
+    SCHEDULER_RESULT_BATCH_SIZE, GenerationDispatcherModes,
+    DISPATCH_BATCH_SIZE, DISPATCH_POLL_INTERVAL_SECONDS, DISPATCH_LEASE_SECONDS, DEFAULT_SCHEDULER_SUBMIT_RATE,
+    DISPATCH_MAX_ATTEMPTS, DISPATCH_BACKOFF_BASE_SECONDS, DISPATCH_BACKOFF_MAX_SECONDS,
+    BACKPRESSURE_IN_FLIGHT_HORIZON_SECONDS, DEFAULT_PROJECT_QUEUE_WEIGHT
+)
+from backend.features.grid_selection.grid_cells import refresh_grid_cells
+from .fair_share import DueFlow, allocate_claims
+from .scheduler_pool import SchedulerInstance, SchedulerPool, scheduler_urls
+from .scheduler_client import RateLimiter, SchedulerResponseError, is_overload_error, is_retryable_error, submit_many
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_ID_PLACEHOLDER = '__generation_id__'
+DISPATCHER_EXTENSION_KEY = 'generation_dispatcher'
+SCHEDULER_POOL_EXTENSION_KEY = 'scheduler_pool'
+
+# Исходы отправки одной генерации
+OUTCOME_QUEUED = 'queued'
+OUTCOME_RETRY = 'retry'
+OUTCOME_FAILED = 'failed'
+
+# Захваченная генерация: только поля, нужные для записи результата
+ClaimedGeneration = namedtuple('ClaimedGeneration', 'project_id collection_id attempts')
+
+
+class DispatcherConfigError(RuntimeError):
+    """ Не заданы адрес планировщика или базовый URL callback'ов. """
+
+
+def dispatcher_mode() -> str:
+    """ Режим отправки из GENERATION_DISPATCHER (thread / inline / off). """
+    mode = os.environ.get('GENERATION_DISPATCHER', GenerationDispatcherModes.THREAD).strip().lower()
+    if mode not in (GenerationDispatcherModes.THREAD, GenerationDispatcherModes.INLINE, GenerationDispatcherModes.OFF):
+        logger.warning(f"Unknown GENERATION_DISPATCHER={mode!r}, using '{GenerationDispatcherModes.THREAD}'")
+        mode = GenerationDispatcherModes.THREAD
+    return mode
+
+
+def submit_rate() -> float:
+    """ Ограничение частоты отправки (SCHEDULER_SUBMIT_RATE, запросов в секунду; 0 - без ограничения). """
+    try:
+        return max(float(os.environ.get('SCHEDULER_SUBMIT_RATE', DEFAULT_SCHEDULER_SUBMIT_RATE)), 0.0)
+    except ValueError:
+        logger.warning("Invalid SCHEDULER_SUBMIT_RATE, using default")
+        return DEFAULT_SCHEDULER_SUBMIT_RATE
+
+
+def scheduler_pool() -> SchedulerPool:
+    """ Пул экземпляров планировщика текущего приложения (создается один раз, состояние здоровья общее). """
+    pool = current_app.extensions.get(SCHEDULER_POOL_EXTENSION_KEY)
+    if pool is None:
+        urls = scheduler_urls()
+        if not urls:
+            raise DispatcherConfigError("A1111_SCHEDULER_URLS (or A1111_SCHEDULER_URL) is not configured in .env")
+        pool = current_app.extensions.setdefault(SCHEDULER_POOL_EXTENSION_KEY, SchedulerPool(urls))
+    return pool
+
+
+def callback_url_template() -> str:
+    """
+    Шаблон URL, по которому планировщик сообщит о результате генерации
+    (CALLBACK_ID_PLACEHOLDER заменяется на ID генерации). Хост берется из
+    FLASK_CALLBACK_BASE_URL, поэтому шаблон строится и вне HTTP-запроса.
+    """
+    callback_url_base = os.environ.get('FLASK_CALLBACK_BASE_URL')
+    if not callback_url_base:
+        raise DispatcherConfigError("FLASK_CALLBACK_BASE_URL is not configured in .env")
+    path = current_app.url_map.bind('localhost').build(
+        'image_generation.handle_scheduler_callback', {'generation_id': CALLBACK_ID_PLACEHOLDER}
+    )
+    return callback_url_base.rstrip('/') + path
+
+
+def backoff_delay(attempt: int) -> float:
+    """ Задержка перед повторной отправкой: экспонента с "полным" джиттером. """
+    ceiling = min(DISPATCH_BACKOFF_MAX_SECONDS, DISPATCH_BACKOFF_BASE_SECONDS * (2 ** max(attempt - 1, 0)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def claim_due_generations(limit: int = DISPATCH_BATCH_SIZE, generation_ids: list[str] | None = None) -> tuple[str, list]:
+    """
+    Захватывает до limit готовых к отправке PENDING-генераций одним UPDATE и коммитит.
+    Возвращает (dispatch_token, генерации).
+    """
+    now = datetime.utcnow()
+    lease_until = now + timedelta(seconds=DISPATCH_LEASE_SECONDS)
+    token = str(uuid.uuid4())
+
+    due_condition = (Generation.status == GenerationStatus.PENDING, Generation.next_submit_at <= now)
+    if generation_ids is not None:
+        # Режим inline: только генерации этого запроса
+        due_ids = select(Generation.id).where(*due_condition, Generation.id.in_(generation_ids)).order_by(
+            Generation.priority.desc(), Generation.next_submit_at, Generation.created_at
+        ).limit(limit)
+    else:
+        due_ids = _fair_due_ids(due_condition, limit)
+        if due_ids is None:
+            return token, []
+
+    db.session.execute(
+        update(Generation)
+        .where(Generation.id.in_(due_ids.scalar_subquery()), *due_condition)
+        .values(dispatch_token=token, next_submit_at=lease_until, updated_at=Generation.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    claimed = Generation.query.filter(
+        Generation.status == GenerationStatus.PENDING,
+        Generation.next_submit_at == lease_until,
+        Generation.dispatch_token == token
+    ).order_by(Generation.priority.desc(), Generation.created_at).all()
+    return token, claimed
+
+
+def _fair_due_ids(due_condition: tuple, limit: int):
+    """
+    SELECT ID генераций для захвата: limit делится между потоками (приоритет, проект,
+    клиент) по fair_share.allocate_claims, внутри потока - самые ранние.
+    None - готовых генераций нет.
+    """
+    flow_columns = (Generation.priority, Generation.project_id, Generation.requested_by)
+    rows = db.session.query(
+        *flow_columns, func.count(Generation.id), func.min(Generation.created_at), Project.queue_weight
+    ).join(Project, Project.id == Generation.project_id).filter(*due_condition).group_by(
+        *flow_columns, Project.queue_weight
+    ).all()
+    if not rows:
+        return None
+    order = (Generation.next_submit_at, Generation.created_at)
+    if len(rows) == 1: # Один поток - делить нечего
+        return select(Generation.id).where(*due_condition).order_by(*order).limit(limit)
+
+    flows = [DueFlow(priority, project_id, requested_by, due, oldest_created_at,
+                     max(weight or DEFAULT_PROJECT_QUEUE_WEIGHT, 1))
+             for priority, project_id, requested_by, due, oldest_created_at, weight in rows]
+    quotas = allocate_claims(flows, limit)
+    ranked = select(
+        Generation.id, *flow_columns,
+        func.row_number().over(partition_by=flow_columns, order_by=order).label('position')
+    ).where(*due_condition).subquery('ranked_due')
+    return select(ranked.c.id).where(or_(*(
+        and_(ranked.c.priority == priority, ranked.c.project_id == project_id,
+             ranked.c.requested_by.is_(None) if requested_by is None else ranked.c.requested_by == requested_by,
+             ranked.c.position <= quota)
+        for (priority, project_id, requested_by), quota in quotas.items()
+    )))
+
+
+def queued_in_flight() -> dict[str, tuple[int, datetime | None]]:
+    """
+    {scheduler_url: (число QUEUED-генераций, время постановки самой старой из них)}.
+    Генерации, поставленные раньше BACKPRESSURE_IN_FLIGHT_HORIZON_SECONDS назад
+    (или до появления queued_at), считаются потерянными и место не занимают.
+    """
+    horizon = datetime.utcnow() - timedelta(seconds=BACKPRESSURE_IN_FLIGHT_HORIZON_SECONDS)
+    rows = db.session.query(
+        Generation.scheduler_url, func.count(Generation.id), func.min(Generation.queued_at)
+    ).filter(
+        Generation.status == GenerationStatus.QUEUED, Generation.queued_at >= horizon
+    ).group_by(Generation.scheduler_url)
+    return {url: (count, oldest_queued_at) for url, count, oldest_queued_at in rows}
+
+
+def dispatch_due_generations(limit: int = DISPATCH_BATCH_SIZE, generation_ids: list[str] | None = None,
+                             concurrency: int | None = None, rate_limiter: RateLimiter | None = None,
+                             apply_backpressure: bool = False) -> dict:
+    """
+    Один проход диспетчера: захват пачки, распределение по экземплярам пула,
+    отправка, запись результатов. С apply_backpressure захватывается не больше
+    свободного места у экземпляров; ответы планировщика подстраивают их лимиты.
+
+    Returns:
+        dict: {generation_id: (outcome, error_message | None)}
+    """
+    pool = scheduler_pool()
+    template = callback_url_template()
+    in_flight = queued_in_flight()
+    outstanding = {url: count for url, (count, _) in in_flight.items()}
+    now = datetime.utcnow()
+    for instance in pool.instances:
+        oldest_queued_at = in_flight.get(instance.url, (0, None))[1]
+        if instance.backpressure is not None and oldest_queued_at is not None:
+            instance.backpressure.observe_oldest_in_flight((now - oldest_queued_at).total_seconds())
+
+    capacities = pool.capacities(outstanding, apply_backpressure)
+    if not capacities:
+        logger.warning("No healthy scheduler instances, holding generations until one recovers")
+    elif None not in capacities.values():
+        limit = min(limit, sum(capacities.values()))
+        if limit <= 0:
+            logger.debug(f"Backpressure: all scheduler instances are at their in-flight limit {outstanding}, holding the rest")
+    if not capacities or limit <= 0:
+        db.session.commit() # Не держим транзакцию чтения до следующего прохода
+        return {}
+    token, claimed = claim_due_generations(limit, generation_ids)
+    if not claimed:
+        return {}
+
+    # Каждому захваченному - экземпляр (места хватает: limit не больше суммарной емкости)
+    routes = dict(zip((g.id for g in claimed), pool.route(len(claimed), outstanding, capacities)))
+
+    # Нужные поля копируем сразу: после коммитов ORM-объекты истекают и перечитывались бы по одному
+    by_id = {g.id: ClaimedGeneration(g.project_id, g.collection_id, g.submit_attempts) for g in claimed}
+    submissions = [
+        (g.id, routes[g.id].endpoint,
+         {**(g.generation_params or {}), "callback_url": template.replace(CALLBACK_ID_PLACEHOLDER, g.id)})
+        for g in claimed
+    ]
+    logger.info(f"Dispatching {len(submissions)} generations to {len(set(routes.values()))} scheduler instance(s)...")
+
+    outcomes = {}
+    pending_results = []
+    for submission_result in submit_many(submissions, concurrency, rate_limiter):
+        _observe_submission(pool, routes[submission_result[0]], submission_result)
+        pending_results.append(submission_result)
+        if len(pending_results) >= SCHEDULER_RESULT_BATCH_SIZE:
+            outcomes.update(_record_submission_results(pending_results, by_id, token, routes, pool))
+            pending_results = []
+    outcomes.update(_record_submission_results(pending_results, by_id, token, routes, pool))
+    return outcomes
+
+
+def _observe_submission(pool: SchedulerPool, instance: SchedulerInstance, submission_result: tuple):
+    """ Учитывает ответ экземпляра в его здоровье и ограничителе. """
+    _, scheduler_result, submit_error = submission_result
+    backpressure = instance.backpressure
+    if submit_error is None:
+        pool.record_success(instance)
+        if backpressure is not None:
+            backpressure.observe_queue_position(scheduler_result.get('queue_position'))
+    elif is_overload_error(submit_error):
+        # Экземпляр жив, но перегружен: это сигнал ограничителю, а не сбой
+        if backpressure is not None:
+            backpressure.observe_overload()
+    elif is_retryable_error(submit_error):
+        pool.record_failure(instance, submit_error)
+
+
+def _describe_submit_error(submit_error: Exception) -> tuple[str, str]:
+    """ (текст ошибки для ответа API, текст для Generation.error_message) с логированием. """
+    if isinstance(submit_error, SchedulerResponseError):
+        error_msg = f"Scheduler response error: {submit_error}"
+        logger.error(f"{error_msg}. Response: {submit_error.response_text}")
+        return error_msg, error_msg
+    error_msg = f"Scheduler API request failed: {submit_error}"
+    logger.error(error_msg)
+    return error_msg, str(submit_error)
+
+
+def _record_submission_results(submission_results: list[tuple], by_id: dict, token: str,
+                               routes: dict, pool: SchedulerPool) -> dict:
+    """
+    Записывает пачку ответов планировщика пакетными UPDATE (только для строк этой
+    пачки, все еще PENDING), пересчитывает ячейки, коммитит и шлет события SocketIO.
+    Временные ошибки экземпляра, выведенного из ротации, повторяются сразу - на
+    другом экземпляре.
+    """
+    if not submission_results:
+        return {}
+    now = datetime.utcnow()
+    queued_rows, retry_rows, failed_rows = [], [], []
+    failed_errors = {}
+    outcomes = {}
+    for generation_id, scheduler_result, submit_error in submission_results:
+        if submit_error is None:
+            logger.info(f"Generation {generation_id} queued successfully. Task ID: {scheduler_result['task_id']}, "
+                        f"Position: {scheduler_result.get('queue_position')}")
+            queued_rows.append({'b_id': generation_id, 'b_task_id': scheduler_result['task_id'],
+                                'b_url': routes[generation_id].url})
+            outcomes[generation_id] = (OUTCOME_QUEUED, None)
+            continue
+        error_msg, stored_error = _describe_submit_error(submit_error)
+        attempt = by_id[generation_id].attempts + 1
+        instance = routes[generation_id]
+        if is_retryable_error(submit_error) and attempt < DISPATCH_MAX_ATTEMPTS:
+            if not instance.is_healthy() and pool.has_other_healthy(instance):
+                delay = 0.0
+                logger.warning(f"Generation {generation_id}: scheduler {instance.url} is down, failing over")
+            else:
+                delay = backoff_delay(attempt)
+                logger.warning(f"Generation {generation_id}: attempt {attempt} failed, retrying in {delay:.1f}s")
+            retry_rows.append({'b_id': generation_id, 'b_attempts': attempt, 'b_error': stored_error,
+                               'b_next': now + timedelta(seconds=delay), 'b_url': instance.url})
+            outcomes[generation_id] = (OUTCOME_RETRY, error_msg)
+        else:
+            failed_rows.append({'b_id': generation_id, 'b_attempts': attempt, 'b_error': stored_error,
+                                'b_url': instance.url})
+            failed_errors[generation_id] = stored_error
+            outcomes[generation_id] = (OUTCOME_FAILED, error_msg)
+
+    generations = Generation.__table__
+    owned = (generations.c.id == bindparam('b_id'),
+             generations.c.status == GenerationStatus.PENDING,
+             generations.c.dispatch_token == token)
+    if queued_rows:
+        db.session.execute(
+            update(generations).where(*owned)
+            .values(status=GenerationStatus.QUEUED, scheduler_task_id=bindparam('b_task_id'), queued_at=now,
+                    scheduler_url=bindparam('b_url'),
+                    dispatch_token=None, next_submit_at=None, error_message=None),
+            queued_rows
+        )
+    if retry_rows:
+        db.session.execute(
+            update(generations).where(*owned)
+            .values(submit_attempts=bindparam('b_attempts'), error_message=bindparam('b_error'),
+                    scheduler_url=bindparam('b_url'), dispatch_token=None, next_submit_at=bindparam('b_next'), updated_at=generations.c.updated_at),
+            retry_rows
+        )
+    if failed_rows:
+        db.session.execute(
+            update(generations).where(*owned)
+            .values(status=GenerationStatus.FAILED, submit_attempts=bindparam('b_attempts'),
+                    error_message=bindparam('b_error'), scheduler_url=bindparam('b_url'), dispatch_token=None, next_submit_at=None),
+            failed_rows
+        )
+    changed_ids = [row['b_id'] for row in queued_rows + failed_rows]
+    refresh_grid_cells((by_id[gid].collection_id, by_id[gid].project_id) for gid in changed_ids)
+    db.session.commit()
+
+    # События только для строк, которые действительно перешли (callback мог успеть раньше)
+    if changed_ids:
+        current_statuses = dict(db.session.query(Generation.id, Generation.status).filter(Generation.id.in_(changed_ids)))
+        for generation_id in changed_ids:
+            generation = by_id[generation_id]
+            payload = {'id': generation_id, 'project_id': generation.project_id, 'collection_id': generation.collection_id}
+            outcome, error_msg = outcomes[generation_id]
+            if outcome == OUTCOME_QUEUED and current_statuses.get(generation_id) == GenerationStatus.QUEUED:
+                emit_generation_update({**payload, 'status': GenerationStatus.QUEUED.value}, 'QUEUED')
+            elif outcome == OUTCOME_FAILED and current_statuses.get(generation_id) == GenerationStatus.FAILED:
+                emit_generation_update({**payload, 'status': GenerationStatus.FAILED.value,
+                                        'error_message': failed_errors[generation_id]}, 'FAILED')
+    return outcomes
+
+
+def emit_generation_update(payload: dict, label: str):
+    """ Отправляет событие generation_update через SocketIO (ошибки только логируются). """
+    try:
+        socketio = current_app.extensions['socketio']
+        socketio.emit('generation_update', payload)
+        logger.info(f"Sent {label} WebSocket update for {payload['id']}")
+    except Exception as ws_err:
+        logger.error(f"Failed to send {label} WebSocket update for {payload['id']}: {ws_err}")
+
+
+class GenerationDispatcher:
+    """
+    Цикл диспетчера: проходы по очереди, пока она не пуста, затем ожидание wake() или таймаута.
+    Между проходами периодически запускается сверка зависших генераций.
+    """
+
+    def __init__(self, app, poll_interval: float = DISPATCH_POLL_INTERVAL_SECONDS, reconcile_interval: float | None = None):
+        from .reconciler import reconcile_interval as default_reconcile_interval # reconciler импортирует этот модуль
+        self.app = app
+        self.poll_interval = poll_interval
+        self.reconcile_interval = default_reconcile_interval() if reconcile_interval is None else reconcile_interval
+        self.rate_limiter = RateLimiter(submit_rate())
+        self._next_reconcile = time.monotonic() + self.reconcile_interval
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ Запускает цикл в фоновом daemon-потоке. """
+        self._thread = threading.Thread(target=self.run_forever, name='generation-dispatcher', daemon=True)
+        self._thread.start()
+        logger.info("Generation dispatcher thread started")
+
+    def wake(self):
+        """ Будит диспетчер сразу после постановки новых генераций. """
+        self._wake_event.set()
+
+    def stop(self, timeout: float | None = None):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def run_once(self) -> int:
+        """ Один проход в контексте приложения. Возвращает число обработанных генераций. """
+        with self.app.app_context():
+            try:
+                return len(dispatch_due_generations(rate_limiter=self.rate_limiter, apply_backpressure=True))
+            except DispatcherConfigError as e:
+                logger.error(f"Generation dispatcher is not configured: {e}")
+                return 0
+            except Exception:
+                db.session.rollback()
+                logger.exception("Generation dispatcher pass failed")
+                return 0
+            finally:
+                db.session.remove()
+
+    def reconcile_once(self) -> dict:
+        """ Проход сверки зависших генераций в контексте приложения (запросы идут через общий ограничитель частоты). """
+        from .reconciler import reconcile_stale_generations
+        with self.app.app_context():
+            try:
+                return reconcile_stale_generations(rate_limiter=self.rate_limiter)
+            except DispatcherConfigError as e:
+                logger.error(f"Generation reconciler is not configured: {e}")
+                return {}
+            except Exception:
+                db.session.rollback()
+                logger.exception("Generation reconciliation pass failed")
+                return {}
+            finally:
+                db.session.remove()
+
+    def run_forever(self):
+        while not self._stop_event.is_set():
+            if self.reconcile_interval and time.monotonic() >= self._next_reconcile:
+                self.reconcile_once()
+                self._next_reconcile = time.monotonic() + self.reconcile_interval
+            processed = self.run_once()
+            if processed:
+                continue # В очереди могут быть еще готовые генерации
+            self._wake_event.wait(self.poll_interval)
+            self._wake_event.clear()
+
+
+def start_generation_dispatcher(app):
+    """
+    Запускает фоновый диспетчер, если GENERATION_DISPATCHER=thread. В debug-режиме
+    с перезагрузчиком поток запускается только в рабочем (дочернем) процессе.
+    """
+    if dispatcher_mode() != GenerationDispatcherModes.THREAD:
+        return None
+    if os.environ.get('FLASK_DEBUG') == '1' and not is_running_from_reloader():
+        return None
+    dispatcher = GenerationDispatcher(app)
+    app.extensions[DISPATCHER_EXTENSION_KEY] = dispatcher
+    dispatcher.start()
+    return dispatcher
+
+
+def notify_generation_dispatcher():
+    """ Будит фоновый диспетчер текущего приложения (если он запущен). """
+    dispatcher = current_app.extensions.get(DISPATCHER_EXTENSION_KEY)
+    if dispatcher is not None:
+        dispatcher.wake()
+
+
+def notify_generation_finished(queued_at: datetime | None, scheduler_url: str | None):
+    """
+    Сообщает диспетчеру, что экземпляр планировщика завершил задачу: задержка
+    callback'а идет в ограничитель экземпляра, а освободившееся место занимается сразу.
+    """
+    pool = current_app.extensions.get(SCHEDULER_POOL_EXTENSION_KEY)
+    instance = pool.get(scheduler_url) if pool is not None else None
+    if instance is not None and instance.backpressure is not None and queued_at is not None:
+        instance.backpressure.observe_callback_latency((datetime.utcnow() - queued_at).total_seconds())
+    notify_generation_dispatcher()
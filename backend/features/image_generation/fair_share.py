@@ -0,0 +1,101 @@
+"""
+Приоритеты и справедливое разделение отправки генераций между проектами.
+
+Диспетчер за проход захватывает не больше limit генераций (см. dispatcher.py).
+Раньше это были limit самых ранних, поэтому пакет из 5000 пар одного проекта
+задерживал единичные срочные перегенерации других проектов на все время своей
+отправки. Теперь limit делится так:
+  1. строгий приоритет: сначала все готовые генерации уровня high, затем
+     normal, затем low;
+  2. внутри уровня - взвешенное max-min разделение между проектами
+     (Project.queue_weight): проекту, которому нужно меньше своей доли, дается
+     все нужное, остаток делится между остальными пропорционально весам;
+  3. доля проекта так же поровну делится между клиентами/сессиями
+     (Generation.requested_by, заголовок X-Client-Id), если они известны.
+Целые остатки достаются потокам с наибольшей дробной частью доли, при равенстве -
+тем, чья самая старая генерация ждет дольше. Внутри потока порядок прежний
+(next_submit_at, created_at).
+
+Разделение не хранит состояния между проходами и считается по одной
+группировке готовых генераций, поэтому одинаково работает в фоновом потоке,
+в отдельном процессе диспетчера и в нескольких процессах сразу. Оно действует,
+пока генерации ждут в очереди отправки - то есть при ограничении
+SCHEDULER_BACKPRESSURE=adaptive или SCHEDULER_SUBMIT_RATE; без них все готовые
+генерации быстро уходят в FIFO-очередь планировщика.
+"""
+import math
+from collections import namedtuple, defaultdict
+from datetime import datetime
+
+# Готовые к отправке генерации одного потока (уровень приоритета, проект, клиент)
+DueFlow = namedtuple('DueFlow', 'priority project_id requested_by due oldest_created_at weight')
+
+# Участник одного разделения: поток или проект целиком
+_Share = namedtuple('_Share', 'key due weight oldest_created_at')
+
+
+def flow_key(flow: DueFlow) -> tuple:
+    return flow.priority, flow.project_id, flow.requested_by
+
+
+def allocate_claims(flows: list[DueFlow], limit: int) -> dict[tuple, int]:
+    """ Сколько генераций захватить из каждого потока: {flow_key: число > 0}, в сумме не больше limit. """
+    quotas = {}
+    remaining = limit
+    by_priority = defaultdict(list)
+    for flow in flows:
+        by_priority[flow.priority].append(flow)
+    for priority in sorted(by_priority, reverse=True):
+        if remaining <= 0:
+            break
+        by_project = defaultdict(list)
+        for flow in by_priority[priority]:
+            by_project[flow.project_id].append(flow)
+        projects = [
+            _Share(project_id, sum(f.due for f in project_flows), project_flows[0].weight,
+                   min(f.oldest_created_at for f in project_flows))
+            for project_id, project_flows in by_project.items()
+        ]
+        for project_id, project_grant in _weighted_fair_split(projects, remaining).items():
+            if not project_grant:
+                continue
+            clients = [_Share(flow_key(f), f.due, 1, f.oldest_created_at) for f in by_project[project_id]]
+            for key, grant in _weighted_fair_split(clients, project_grant).items():
+                if grant:
+                    quotas[key] = grant
+                    remaining -= grant
+    return quotas
+
+
+def _weighted_fair_split(shares: list[_Share], slots: int) -> dict:
+    """ Взвешенное max-min разделение slots между участниками с ограничением по их due. """
+    grants = {share.key: 0 for share in shares}
+    active = [share for share in shares if share.due > 0]
+    # Участники, которым нужно не больше их доли, получают все нужное; доля остальных растет
+    while active and slots > 0:
+        per_weight = slots / sum(share.weight for share in active)
+        satisfied = [share for share in active if share.due <= share.weight * per_weight]
+        if not satisfied:
+            break
+        for share in satisfied:
+            grants[share.key] = share.due
+            slots -= share.due
+        active = [share for share in active if share.due > share.weight * per_weight]
+    if not active or slots <= 0:
+        return grants
+
+    per_weight = slots / sum(share.weight for share in active)
+    fractions = {}
+    for share in active:
+        exact = share.weight * per_weight
+        grants[share.key] = int(math.floor(exact))
+        fractions[share.key] = exact - grants[share.key]
+        slots -= grants[share.key]
+    # Целые остатки: по наибольшей дробной части, при равенстве - дольше ждущим
+    for share in sorted(active, key=lambda s: (-round(fractions[s.key], 9), s.oldest_created_at or datetime.min)):
+        if slots <= 0:
+            break
+        if grants[share.key] < share.due:
+            grants[share.key] += 1
+            slots -= 1
+    return grants
@@ -0,0 +1,258 @@
+"""
+Сверка зависших QUEUED-генераций с планировщиком.
+
+Если callback /api/scheduler_callback/<generation_id> потерялся (перезапуск
+приложения, сеть), генерация навсегда остается QUEUED, и грид не дает
+перегенерировать ячейку. Сверка периодически (GENERATION_RECONCILE_INTERVAL,
+проход выполняет диспетчер, см. dispatcher.py; вручную - flask reconcile-generations)
+захватывает QUEUED-генерации старше GENERATION_STALE_AFTER, запрашивает статусы
+их задач (scheduler_task_id) у своих экземпляров планировщика через общую
+keep-alive сессию и исправляет состояние:
+  - pending / running: задача еще в очереди, проверим снова через RECONCILE_RECHECK_SECONDS;
+  - done / saved: изображения забираются из планировщика и обрабатываются так же,
+    как пришедший callback;
+  - failed / interrupted: генерация -> FAILED;
+  - планировщик не знает задачу (или нет task_id): генерация возвращается в
+    очередь отправки (PENDING), после DISPATCH_MAX_ATTEMPTS попыток -> FAILED;
+  - экземпляр не ответил: состояние не меняется, проверим снова позже.
+
+Захват - один UPDATE, который ставит status_checked_at; все изменения
+записываются только для строк, которые все еще QUEUED и несут эту отметку,
+поэтому callback, пришедший во время сверки, не затирается. Проход ограничен
+RECONCILE_BATCH_SIZE генерациями и RECONCILE_CONCURRENCY запросами.
+"""
+import base64
+import io
+import logging
+import mimetypes
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import and_, bindparam, or_, select, update
+from werkzeug.datastructures import FileStorage
+
+from backend.models import db, Generation, GenerationStatus
+from backend.constants import (
+    SchedulerTaskStatus, DEFAULT_RECONCILE_INTERVAL_SECONDS, DEFAULT_RECONCILE_STALE_AFTER_SECONDS,
+    RECONCILE_RECHECK_SECONDS, RECONCILE_BATCH_SIZE, RECONCILE_CONCURRENCY, DISPATCH_MAX_ATTEMPTS
+)
+from backend.features.grid_selection.grid_cells import refresh_grid_cells
+from .dispatcher import emit_generation_update, notify_generation_dispatcher, scheduler_pool
+from .scheduler_client import RateLimiter, fetch_task_statuses, get_task_results
+from .services import process_scheduler_callback
+
+logger = logging.getLogger(__name__)
+
+ALIVE_STATUSES = (SchedulerTaskStatus.PENDING, SchedulerTaskStatus.RUNNING)
+DONE_STATUSES = (SchedulerTaskStatus.DONE, SchedulerTaskStatus.SAVED)
+FAILED_STATUSES = (SchedulerTaskStatus.FAILED, SchedulerTaskStatus.INTERRUPTED)
+
+# Захваченная генерация: только поля, нужные для сверки
+StaleGeneration = namedtuple('StaleGeneration', 'id project_id collection_id task_id scheduler_url attempts')
+
+
+def _env_seconds(name: str, default: float) -> float:
+    try:
+        return max(float(os.environ.get(name, default)), 0.0)
+    except ValueError:
+        logger.warning(f"Invalid {name}, using default")
+        return default
+
+
+def reconcile_interval() -> float:
+    """ Период сверки в секундах (GENERATION_RECONCILE_INTERVAL; 0 - сверка выключена). """
+    return _env_seconds('GENERATION_RECONCILE_INTERVAL', DEFAULT_RECONCILE_INTERVAL_SECONDS)
+
+
+def stale_after() -> float:
+    """ Через сколько секунд в статусе QUEUED генерация проверяется у планировщика (GENERATION_STALE_AFTER). """
+    return _env_seconds('GENERATION_STALE_AFTER', DEFAULT_RECONCILE_STALE_AFTER_SECONDS)
+
+
+def claim_stale_generations(limit: int = RECONCILE_BATCH_SIZE) -> tuple[datetime, list[StaleGeneration]]:
+    """
+    Захватывает до limit давно стоящих в очереди генераций, которые не проверялись
+    последние RECONCILE_RECHECK_SECONDS, одним UPDATE и коммитит. Возвращает (отметка захвата, генерации).
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=stale_after())
+    stale_condition = (
+        Generation.status == GenerationStatus.QUEUED,
+        or_(Generation.queued_at < stale_before,
+            and_(Generation.queued_at.is_(None), Generation.updated_at < stale_before)), # До появления queued_at
+        or_(Generation.status_checked_at.is_(None),
+            Generation.status_checked_at < now - timedelta(seconds=RECONCILE_RECHECK_SECONDS)),
+    )
+    stale_ids = select(Generation.id).where(*stale_condition).order_by(Generation.queued_at).limit(limit)
+    db.session.execute(
+        update(Generation)
+        .where(Generation.id.in_(stale_ids.scalar_subquery()), *stale_condition)
+        .values(status_checked_at=now, updated_at=Generation.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    rows = db.session.query(
+        Generation.id, Generation.project_id, Generation.collection_id, Generation.scheduler_task_id,
+        Generation.scheduler_url, Generation.submit_attempts
+    ).filter(Generation.status == GenerationStatus.QUEUED, Generation.status_checked_at == now).all()
+    return now, [StaleGeneration(*row) for row in rows]
+
+
+def reconcile_stale_generations(limit: int = RECONCILE_BATCH_SIZE, concurrency: int = RECONCILE_CONCURRENCY,
+                                rate_limiter: RateLimiter | None = None) -> dict:
+    """
+    Один проход сверки. Возвращает счетчики исходов:
+    {'checked', 'alive', 'recovered', 'failed', 'requeued', 'unreachable'}.
+    """
+    pool = scheduler_pool()
+    stamp, claimed = claim_stale_generations(limit)
+    summary = {'checked': len(claimed), 'alive': 0, 'recovered': 0, 'failed': 0, 'requeued': 0, 'unreachable': 0}
+    if not claimed:
+        return summary
+    logger.info(f"Reconciling {len(claimed)} stale queued generations with the scheduler...")
+
+    by_id = {g.id: g for g in claimed}
+    default_url = pool.instances[0].url # Генерации до появления scheduler_url шли на единственный экземпляр
+    lost = [g for g in claimed if not g.task_id]
+    tasks = []
+    for g in claimed:
+        if not g.task_id:
+            continue
+        instance = pool.get(g.scheduler_url)
+        if instance is not None and not instance.is_healthy():
+            summary['unreachable'] += 1 # Экземпляр выведен из ротации - не нагружаем его
+            continue
+        tasks.append((g.id, g.scheduler_url or default_url, g.task_id))
+
+    done, failed = [], []
+    for generation_id, task_status, error in fetch_task_statuses(tasks, concurrency, rate_limiter):
+        generation = by_id[generation_id]
+        if error is not None:
+            summary['unreachable'] += 1
+            logger.warning(f"Generation {generation_id}: could not check task {generation.task_id}: {error}")
+        elif task_status is None:
+            lost.append(generation)
+        elif task_status in ALIVE_STATUSES:
+            summary['alive'] += 1
+        elif task_status in DONE_STATUSES:
+            done.append(generation)
+        elif task_status in FAILED_STATUSES:
+            failed.append((generation, f"Scheduler task {task_status}; the callback was not received"))
+        else:
+            summary['alive'] += 1
+            logger.warning(f"Generation {generation_id}: unknown scheduler task status '{task_status}', will recheck")
+
+    for generation in done:
+        if _recover_completed(generation, stamp, generation.scheduler_url or default_url):
+            summary['recovered'] += 1
+        else:
+            summary['unreachable'] += 1
+
+    summary['requeued'], summary['failed'] = _record_reconciled(failed, lost, stamp)
+    if summary['recovered'] or summary['failed'] or summary['requeued']:
+        notify_generation_dispatcher() # Освободилось место у планировщика / есть что отправить
+    logger.info(f"Reconciliation pass: {summary}")
+    return summary
+
+
+def _recover_completed(generation: StaleGeneration, stamp: datetime, base_url: str) -> bool:
+    """
+    Забирает изображения завершенной задачи и обрабатывает их как callback.
+    False - изображения получить не удалось (проверим снова позже).
+    """
+    try:
+        results = get_task_results(base_url, generation.task_id)
+    except Exception as e:
+        logger.warning(f"Generation {generation.id}: could not fetch results of task {generation.task_id}: {e}")
+        return False
+
+    files = []
+    for index, result in enumerate(results):
+        image = result.get('image') if isinstance(result, dict) else None
+        if not image:
+            continue
+        header, _, encoded = image.partition(',')
+        mime_type = header[5:].split(';')[0] if header.startswith('data:') else 'image/png'
+        try:
+            data = base64.b64decode(encoded if encoded else header)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Generation {generation.id}: skipping undecodable image {index}: {e}")
+            continue
+        extension = mimetypes.guess_extension(mime_type) or '.png'
+        files.append(FileStorage(stream=io.BytesIO(data), filename=f"{generation.task_id}-{index}{extension}",
+                                 content_type=mime_type))
+
+    # Callback мог прийти, пока шли запросы: обрабатываем, только если генерация все еще наша и в очереди
+    still_queued = db.session.query(Generation.id).filter(
+        Generation.id == generation.id, Generation.status == GenerationStatus.QUEUED,
+        Generation.status_checked_at == stamp
+    ).first()
+    db.session.commit()
+    if still_queued is None:
+        return True
+    if not files:
+        form_data = {'status': 'failed', 'error': "Scheduler task is done but returned no images"}
+    else:
+        form_data = {'status': 'done'}
+    success, message = process_scheduler_callback(generation.id, form_data=form_data, files={'files': files})
+    logger.info(f"Generation {generation.id} recovered from scheduler task {generation.task_id}: {message}")
+    return success
+
+
+def _record_reconciled(failed: list[tuple], lost: list[StaleGeneration], stamp: datetime) -> tuple[int, int]:
+    """
+    Пакетно записывает исходы сверки (только для строк, все еще QUEUED с отметкой
+    этого прохода), пересчитывает ячейки, коммитит и шлет события. Возвращает
+    (возвращено в очередь отправки, помечено FAILED).
+    """
+    now = datetime.utcnow()
+    failed_rows = [{'b_id': g.id, 'b_error': error} for g, error in failed]
+    requeue_rows = []
+    for g in lost:
+        attempt = g.attempts + 1
+        if attempt < DISPATCH_MAX_ATTEMPTS:
+            requeue_rows.append({'b_id': g.id, 'b_attempts': attempt})
+        else:
+            failed_rows.append({'b_id': g.id, 'b_error': "The scheduler lost the task and no attempts are left"})
+    if not failed_rows and not requeue_rows:
+        return 0, 0
+
+    generations = Generation.__table__
+    owned = (generations.c.id == bindparam('b_id'),
+             generations.c.status == GenerationStatus.QUEUED,
+             generations.c.status_checked_at == stamp)
+    if failed_rows:
+        db.session.execute(
+            update(generations).where(*owned)
+            .values(status=GenerationStatus.FAILED, error_message=bindparam('b_error')),
+            failed_rows
+        )
+    if requeue_rows:
+        db.session.execute(
+            update(generations).where(*owned)
+            .values(status=GenerationStatus.PENDING, submit_attempts=bindparam('b_attempts'), next_submit_at=now,
+                    scheduler_task_id=None, queued_at=None, status_checked_at=None,
+                    error_message="The scheduler lost the task, resubmitting"),
+            requeue_rows
+        )
+    by_id = {g.id: g for g, _ in failed}
+    by_id.update((g.id, g) for g in lost)
+    changed_ids = [row['b_id'] for row in failed_rows + requeue_rows]
+    refresh_grid_cells((by_id[gid].collection_id, by_id[gid].project_id) for gid in changed_ids)
+    db.session.commit()
+
+    current = dict(db.session.query(Generation.id, Generation.status).filter(Generation.id.in_(changed_ids)))
+    errors = {row['b_id']: row['b_error'] for row in failed_rows}
+    requeued = failed_count = 0
+    for generation_id in changed_ids:
+        generation = by_id[generation_id]
+        payload = {'id': generation_id, 'project_id': generation.project_id, 'collection_id': generation.collection_id}
+        if generation_id in errors and current.get(generation_id) == GenerationStatus.FAILED:
+            failed_count += 1
+            emit_generation_update({**payload, 'status': GenerationStatus.FAILED.value,
+                                    'error_message': errors[generation_id]}, 'FAILED (reconciled)')
+        elif generation_id not in errors and current.get(generation_id) == GenerationStatus.PENDING:
+            requeued += 1
+            emit_generation_update({**payload, 'status': GenerationStatus.PENDING.value}, 'PENDING (reconciled)')
+    return requeued, failed_count
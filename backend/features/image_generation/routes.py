@@ -3,13 +3,26 @@ import os
 import logging
 # Используем абсолютные импорты
 from backend.models import db, Generation, GenerationStatus
-from .services import process_generation_request, process_scheduler_callback # Импортируем сервисные функции
+from backend.constants import CallbackIngestModes, GenerationDedupModes, JobKinds
+from backend.utils.validators import ValidationError
+from .services import (
+    normalize_requested_by, parse_generation_priority, process_generation_request, process_scheduler_callback
+) # Импортируем сервисные функции
+from .dispatcher import DispatcherConfigError, queued_in_flight, scheduler_pool
+from .bulk_generation import parse_grid_filter_params
+from .callback_ingest import callback_ingest_mode, spool_scheduler_callback
+from backend.features.jobs.runner import submit_job
+from backend.features.jobs.routes import is_async_request, job_accepted_response
 
 logger = logging.getLogger(__name__)
 
 # Создаем Blueprint для этого среза
 generation_bp = Blueprint('image_generation', __name__, url_prefix='/api')
 
+def request_client_id(data: dict) -> str | None:
+    """ Клиент/сессия запроса: поле client_id или заголовок X-Client-Id. """
+    return normalize_requested_by(data.get('client_id') or request.headers.get('X-Client-Id'))
+
 @generation_bp.route('/generate-batch', methods=['POST'])
 def generate_batch():
     data = request.json
@@ -17,7 +30,22 @@ def generate_batch():
         return jsonify({"error": "Invalid input. Expected {'pairs': [{'project_id': '', 'collection_id': ''}]} "}), 400
 
     pairs = data['pairs']
-    results = process_generation_request(pairs)
+    # Что делать с парами, у которых уже есть незавершенная генерация с теми же параметрами
+    dedup = str(data.get('dedup', GenerationDedupModes.REUSE)).lower()
+    if dedup not in (GenerationDedupModes.REUSE, GenerationDedupModes.SKIP, GenerationDedupModes.OFF):
+        return jsonify({"error": f"Invalid dedup mode: {dedup}. Expected 'reuse', 'skip' or 'off'"}), 400
+    # Очередность отправки: приоритет и клиент для справедливого разделения (fair_share.py)
+    try:
+        priority = parse_generation_priority(data.get('priority'))
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    requested_by = request_client_id(data)
+    if is_async_request():
+        # Большой пакет: обработка фоновым заданием, ответ - ID задания (итог - в /api/jobs/<id>)
+        job = submit_job(JobKinds.GENERATE_BATCH, {'pairs_count': len(pairs), 'dedup': dedup, 'priority': priority,
+                                                   'requested_by': requested_by}, payload=pairs)
+        return job_accepted_response(job)
+    results = process_generation_request(pairs, dedup=dedup, priority=priority, requested_by=requested_by)
 
     # Проверяем, есть ли общие ошибки (например, конфигурации)
     if results.get('overall_error'):
@@ -27,9 +55,41 @@ def generate_batch():
     return jsonify({
         "message": f"Processed {len(pairs)} pairs.",
         "tasks_started": results.get('tasks_started', []), # Список ID успешно запущенных Generation
-        "pair_errors": results.get('pair_errors', []) # Список ошибок для конкретных пар
+        "pair_errors": results.get('pair_errors', []), # Список ошибок для конкретных пар
+        "coalesced": results.get('coalesced', []) # Пары, совпавшие с незавершенной генерацией
     }), 200 # Успешный ответ, даже если были ошибки по парам
 
+@generation_bp.route('/generate-by-filter', methods=['POST'])
+def generate_by_filter():
+    """
+    Массовая генерация по фильтру грида: {search, type, advanced, generation_status_filter,
+    visible_project_ids, dedup, priority, client_id}. Пары вычисляются на сервере в фоновом задании
+    (прогресс - /api/jobs/<job_id> и событие Socket.IO 'job_update').
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        params = parse_grid_filter_params(data)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    params['requested_by'] = request_client_id(data)
+    try:
+        job = submit_job(JobKinds.GENERATE_BY_FILTER, params)
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Error creating generation job")
+        return jsonify({"error": "Failed to create generation job"}), 500
+    return job_accepted_response(job)
+
+@generation_bp.route('/schedulers', methods=['GET'])
+def get_schedulers():
+    """ Состояние экземпляров планировщика: здоровье, незавершенные задачи, лимит очереди. """
+    try:
+        pool = scheduler_pool()
+    except DispatcherConfigError as e:
+        return jsonify({"error": str(e)}), 500
+    outstanding = {url: count for url, (count, _) in queued_in_flight().items()}
+    return jsonify({"schedulers": pool.status(outstanding)}), 200
+
 @generation_bp.route('/scheduler_callback/<string:generation_id>', methods=['POST'])
 def handle_scheduler_callback(generation_id):
     logger.info(f"Callback received for {generation_id}. Content-Type: {request.content_type}")
@@ -57,6 +117,11 @@ def handle_scheduler_callback(generation_id):
                         logger.info(f"File: {field}, name={file.filename}, type={file.content_type}, size={getattr(file, 'content_length', '?')}")
             else:
                 logger.info("No files received via request.files.")
+            if callback_ingest_mode() == CallbackIngestModes.ASYNC:
+                # Файлы - в staging, остальное сделает пул обработки (callback_ingest.py)
+                if spool_scheduler_callback(generation_id, form_data, received_files) is None:
+                    return jsonify({"message": "Duplicate callback ignored."}), 200
+                return jsonify({"message": "Callback accepted."}), 200
             success, message = process_scheduler_callback(generation_id, form_data=form_data, files=received_files)
         except Exception as e:
             return return_error(f"Failed to read form data/files: {e}")
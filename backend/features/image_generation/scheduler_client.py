@@ -0,0 +1,236 @@
+"""
+HTTP-клиент agent-scheduler (A1111).
+
+Все запросы идут через общий requests.Session с пулом keep-alive соединений,
+поэтому пакет из тысяч задач не открывает новое TCP-соединение на каждую.
+Пакетная отправка выполняется ограниченным пулом потоков; потоки делают только
+HTTP-запросы и не трогают сессию БД.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+from backend.constants import (
+    SCHEDULER_REQUEST_TIMEOUT, DEFAULT_SCHEDULER_SUBMIT_CONCURRENCY, MAX_SCHEDULER_SUBMIT_CONCURRENCY,
+    SCHEDULER_TASK_PATH, SCHEDULER_TASK_RESULTS_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class SchedulerResponseError(ValueError):
+    """ Планировщик ответил, но ответ не содержит ожидаемых данных. """
+
+    def __init__(self, message: str, response_text: str = ''):
+        super().__init__(message)
+        self.response_text = response_text
+
+
+class RateLimiter:
+    """ Потокобезопасный ограничитель частоты (token bucket): не более rate запросов в секунду. """
+
+    def __init__(self, rate_per_second: float, burst: int | None = None):
+        self.rate = float(rate_per_second)
+        self.capacity = float(burst or max(1, int(rate_per_second)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Блокирует поток, пока не появится свободный токен. """
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Стоит ли повторить отправку: сеть, таймаут, 429 и 5xx - временные ошибки;
+    прочие 4xx и некорректный ответ планировщика - постоянные.
+    """
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status is None or status == 429 or status >= 500
+    return False
+
+
+def is_overload_error(error: Exception) -> bool:
+    """ Планировщик отказал из-за перегрузки (HTTP 429). """
+    return (isinstance(error, requests.exceptions.HTTPError) and error.response is not None
+            and error.response.status_code == 429)
+
+
+def submit_concurrency() -> int:
+    """ Число параллельных запросов к планировщику (SCHEDULER_SUBMIT_CONCURRENCY). """
+    try:
+        value = int(os.environ.get('SCHEDULER_SUBMIT_CONCURRENCY', DEFAULT_SCHEDULER_SUBMIT_CONCURRENCY))
+    except ValueError:
+        logger.warning("Invalid SCHEDULER_SUBMIT_CONCURRENCY, using default")
+        value = DEFAULT_SCHEDULER_SUBMIT_CONCURRENCY
+    return min(max(value, 1), MAX_SCHEDULER_SUBMIT_CONCURRENCY)
+
+
+def get_scheduler_session() -> requests.Session:
+    """ Общая сессия с пулом соединений, достаточным для максимальной параллельности. """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_SCHEDULER_SUBMIT_CONCURRENCY)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def submit_txt2img(endpoint: str, payload: dict, session: requests.Session | None = None) -> dict:
+    """
+    Ставит задачу в очередь планировщика.
+
+    Returns:
+        dict: {'task_id': str, 'queue_position': int | None}
+
+    Raises:
+        requests.exceptions.RequestException: Ошибка сети или HTTP-статус 4xx/5xx
+        SchedulerResponseError: В ответе нет task_id или он не JSON
+    """
+    session = session or get_scheduler_session()
+    response = session.post(endpoint, json=payload, timeout=SCHEDULER_REQUEST_TIMEOUT)
+    response.raise_for_status()
+    try:
+        data = response.json()
+        task_id = data.get('task_id')
+    except (ValueError, AttributeError) as e:
+        raise SchedulerResponseError(f"Invalid scheduler response: {e}", response.text[:500])
+    if not task_id:
+        raise SchedulerResponseError("Scheduler response missing 'task_id'", response.text[:500])
+    return {'task_id': task_id, 'queue_position': data.get('queue_position')}
+
+
+def submit_many(submissions: list[tuple], concurrency: int | None = None,
+                rate_limiter: RateLimiter | None = None):
+    """
+    Отправляет задачи параллельно (не более concurrency запросов одновременно,
+    не чаще, чем позволяет rate_limiter).
+
+    Args:
+        submissions: [(key, endpoint, payload)] - задачи могут идти на разные экземпляры
+
+    Yields:
+        (key, result, error) по мере завершения запросов: result - ответ
+        submit_txt2img или None, error - исключение или None
+    """
+    concurrency = concurrency or submit_concurrency()
+    session = get_scheduler_session()
+
+    def submit(item):
+        key, endpoint, payload = item
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return key, submit_txt2img(endpoint, payload, session), None
+        except (requests.exceptions.RequestException, SchedulerResponseError) as e:
+            return key, None, e
+
+    if concurrency == 1 or len(submissions) <= 1:
+        for item in submissions:
+            yield submit(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(submissions)), thread_name_prefix='scheduler-submit') as executor:
+        # map сохраняет порядок и ограничивает число одновременных запросов размером пула
+        yield from executor.map(submit, submissions)
+
+
+def get_task_status(base_url: str, task_id: str, session: requests.Session | None = None) -> str | None:
+    """
+    Статус задачи планировщика (SchedulerTaskStatus) или None, если планировщик
+    такой задачи не знает (404 или success: false).
+
+    Raises:
+        requests.exceptions.RequestException: Ошибка сети или HTTP-статус (кроме 404)
+        SchedulerResponseError: Ответ не JSON или без статуса
+    """
+    session = session or get_scheduler_session()
+    response = session.get(base_url + SCHEDULER_TASK_PATH.format(task_id=task_id), timeout=SCHEDULER_REQUEST_TIMEOUT)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    try:
+        data = response.json()
+    except ValueError as e:
+        raise SchedulerResponseError(f"Invalid scheduler response: {e}", response.text[:500])
+    if not data.get('success', True):
+        return None
+    status = (data.get('data') or {}).get('status')
+    if not status:
+        raise SchedulerResponseError("Scheduler task response missing 'status'", response.text[:500])
+    return status
+
+
+def get_task_results(base_url: str, task_id: str, session: requests.Session | None = None) -> list[dict]:
+    """
+    Изображения завершенной задачи: [{'image': 'data:image/png;base64,...', 'infotext': str | None}].
+
+    Raises:
+        requests.exceptions.RequestException: Ошибка сети или HTTP-статус 4xx/5xx
+        SchedulerResponseError: Ответ не JSON или без изображений
+    """
+    session = session or get_scheduler_session()
+    response = session.get(base_url + SCHEDULER_TASK_RESULTS_PATH.format(task_id=task_id),
+                           params={'zip': 'false'}, timeout=SCHEDULER_REQUEST_TIMEOUT)
+    response.raise_for_status()
+    try:
+        data = response.json()
+    except ValueError as e:
+        raise SchedulerResponseError(f"Invalid scheduler response: {e}", response.text[:500])
+    if not data.get('success', True) or not isinstance(data.get('data'), list):
+        raise SchedulerResponseError("Scheduler results response missing 'data'", response.text[:500])
+    return data['data']
+
+
+def fetch_task_statuses(tasks: list[tuple], concurrency: int, rate_limiter: RateLimiter | None = None):
+    """
+    Запрашивает статусы задач параллельно через общую сессию (в agent-scheduler нет
+    запроса статусов по списку ID).
+
+    Args:
+        tasks: [(key, base_url, task_id)]
+
+    Yields:
+        (key, status, error): status - результат get_task_status, error - исключение или None
+    """
+    session = get_scheduler_session()
+
+    def fetch(item):
+        key, base_url, task_id = item
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return key, get_task_status(base_url, task_id, session), None
+        except (requests.exceptions.RequestException, SchedulerResponseError) as e:
+            return key, None, e
+
+    if not tasks:
+        return
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(tasks)), thread_name_prefix='scheduler-status') as executor:
+        yield from executor.map(fetch, tasks)
@@ -0,0 +1,157 @@
+"""
+Пул экземпляров agent-scheduler (несколько машин с A1111).
+
+Адреса задаются в A1111_SCHEDULER_URLS (через запятую или пробел); для одного
+экземпляра по-прежнему подходит A1111_SCHEDULER_URL. Диспетчер направляет каждую
+генерацию на здоровый экземпляр с наименьшим числом незавершенных задач (QUEUED
+у него + уже назначенные в этом проходе) и записывает выбранный адрес в
+Generation.scheduler_url.
+
+Здоровье отслеживается пассивно, по результатам отправки: после
+SCHEDULER_UNHEALTHY_AFTER_FAILURES подряд временных ошибок (сеть, таймаут, 5xx)
+экземпляр выводится из ротации на время остывания (удваивается при повторных
+сбоях). После остывания он снова получает задачи; первый успех сбрасывает счетчик.
+"""
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+from backend.constants import (
+    SCHEDULER_QUEUE_TXT2IMG_PATH, SCHEDULER_UNHEALTHY_AFTER_FAILURES,
+    SCHEDULER_UNHEALTHY_COOLDOWN_SECONDS, SCHEDULER_UNHEALTHY_COOLDOWN_MAX_SECONDS
+)
+from .backpressure import SchedulerBackpressure, create_scheduler_backpressure
+
+logger = logging.getLogger(__name__)
+
+
+def scheduler_urls() -> list[str]:
+    """ Адреса экземпляров из A1111_SCHEDULER_URLS или A1111_SCHEDULER_URL (без дублей, в порядке указания). """
+    raw = os.environ.get('A1111_SCHEDULER_URLS') or os.environ.get('A1111_SCHEDULER_URL') or ''
+    urls = []
+    for url in re.split(r'[\s,]+', raw.strip()):
+        url = url.strip().strip('\'"').rstrip('/')
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+@dataclass(eq=False)
+class SchedulerInstance:
+    url: str
+    backpressure: SchedulerBackpressure | None = None
+    consecutive_failures: int = 0
+    unhealthy_until: float = 0.0 # time.monotonic(); 0 - здоров
+    cooldown: float = SCHEDULER_UNHEALTHY_COOLDOWN_SECONDS
+    submitted: int = 0
+    failed: int = 0
+    last_error: str | None = field(default=None, repr=False)
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.url}{SCHEDULER_QUEUE_TXT2IMG_PATH}"
+
+    def is_healthy(self, now: float | None = None) -> bool:
+        return (now if now is not None else time.monotonic()) >= self.unhealthy_until
+
+
+class SchedulerPool:
+    """ Потокобезопасный пул экземпляров планировщика с маршрутизацией на наименее загруженный. """
+
+    def __init__(self, urls: list[str], backpressure_factory=create_scheduler_backpressure):
+        self.instances = [SchedulerInstance(url, backpressure_factory(url)) for url in urls]
+        self._by_url = {instance.url: instance for instance in self.instances}
+        self._lock = threading.Lock()
+
+    def get(self, url: str | None) -> SchedulerInstance | None:
+        return self._by_url.get(url) if url else None
+
+    def healthy_instances(self) -> list[SchedulerInstance]:
+        now = time.monotonic()
+        return [instance for instance in self.instances if instance.is_healthy(now)]
+
+    def capacities(self, outstanding: dict[str, int], apply_backpressure: bool) -> dict[str, int | None]:
+        """
+        Свободное место на здоровых экземплярах: {url: число | None (без ограничения)}.
+        Пустой словарь - ни один экземпляр сейчас не принимает задачи.
+        """
+        capacities = {}
+        for instance in self.healthy_instances():
+            if apply_backpressure and instance.backpressure is not None:
+                capacities[instance.url] = instance.backpressure.available(outstanding.get(instance.url, 0))
+            else:
+                capacities[instance.url] = None
+        return capacities
+
+    def route(self, count: int, outstanding: dict[str, int], capacities: dict[str, int | None]) -> list[SchedulerInstance]:
+        """
+        Назначает count задач по одной на экземпляр с наименьшим числом незавершенных
+        задач, не превышая свободное место. Может вернуть меньше count, если места нет.
+        """
+        heap = [(outstanding.get(url, 0), position, url) for position, url in enumerate(capacities)
+                if capacities[url] is None or capacities[url] > 0]
+        heapq.heapify(heap)
+        remaining = dict(capacities)
+        routes = []
+        while heap and len(routes) < count:
+            load, position, url = heapq.heappop(heap)
+            routes.append(self._by_url[url])
+            if remaining[url] is not None:
+                remaining[url] -= 1
+                if remaining[url] <= 0:
+                    continue
+            heapq.heappush(heap, (load + 1, position, url))
+        return routes
+
+    def record_success(self, instance: SchedulerInstance) -> None:
+        with self._lock:
+            instance.submitted += 1
+            if instance.consecutive_failures or instance.unhealthy_until:
+                logger.info(f"Scheduler {instance.url} is healthy again")
+            instance.consecutive_failures = 0
+            instance.unhealthy_until = 0.0
+            instance.cooldown = SCHEDULER_UNHEALTHY_COOLDOWN_SECONDS
+
+    def record_failure(self, instance: SchedulerInstance, error: Exception) -> None:
+        """ Временная ошибка отправки; после нескольких подряд экземпляр выводится из ротации. """
+        with self._lock:
+            instance.failed += 1
+            instance.consecutive_failures += 1
+            instance.last_error = str(error)
+            now = time.monotonic()
+            if instance.consecutive_failures < SCHEDULER_UNHEALTHY_AFTER_FAILURES or now < instance.unhealthy_until:
+                return
+            was_retried = instance.unhealthy_until > 0
+            if was_retried:
+                instance.cooldown = min(instance.cooldown * 2, SCHEDULER_UNHEALTHY_COOLDOWN_MAX_SECONDS)
+            instance.unhealthy_until = now + instance.cooldown
+        logger.warning(f"Scheduler {instance.url} marked unhealthy for {instance.cooldown:.0f}s "
+                       f"after {instance.consecutive_failures} consecutive failures: {error}")
+
+    def has_other_healthy(self, instance: SchedulerInstance) -> bool:
+        """ Есть ли куда перенаправить задачи с этого экземпляра. """
+        return any(other is not instance for other in self.healthy_instances())
+
+    def status(self, outstanding: dict[str, int] | None = None) -> list[dict]:
+        """ Состояние экземпляров для API/логов. """
+        now = time.monotonic()
+        result = []
+        for instance in self.instances:
+            backpressure = instance.backpressure
+            result.append({
+                'url': instance.url,
+                'healthy': instance.is_healthy(now),
+                'unhealthy_for_seconds': round(max(instance.unhealthy_until - now, 0.0), 1),
+                'consecutive_failures': instance.consecutive_failures,
+                'last_error': instance.last_error,
+                'submitted': instance.submitted,
+                'failed': instance.failed,
+                'outstanding': (outstanding or {}).get(instance.url, 0),
+                'in_flight_limit': backpressure.limit if backpressure is not None else None,
+                'callback_latency_seconds': backpressure.callback_latency if backpressure is not None else None,
+            })
+        return result
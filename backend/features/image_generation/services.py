@@ -1,12 +1,26 @@
 import os
-import requests
 import json
 import uuid
+import hashlib
 import logging
-from flask import current_app, url_for
+from collections import Counter
+from flask import current_app
 from datetime import datetime
+from sqlalchemy import insert, or_, select, update
 # Используем абсолютные импорты
 from backend.models import db, Project, Collection, Generation, GenerationStatus, ModerationStatus, GeneratedFile
+from backend.features.grid_selection.grid_cells import refresh_grid_cell, refresh_grid_cells
+from backend.features.file_serving.blob_store import add_blob_refs, blobs_enabled, materialize_blob, store_blob_from_upload
+from backend.features.file_serving.thumbnails import schedule_thumbnails
+from backend.constants import (
+    GenerationDispatcherModes, GenerationDedupModes, GenerationPriorities, DEDUP_LOOKUP_BATCH_SIZE, RANDOM_SEED_VALUES,
+    GENERATION_PRIORITY_VALUES, MAX_REQUESTED_BY_LENGTH, CALLBACK_SPOOL_CHUNK_BYTES
+)
+from backend.utils.validators import ValidationError
+from .dispatcher import (
+    OUTCOME_FAILED, OUTCOME_RETRY, DispatcherConfigError, callback_url_template, dispatch_due_generations,
+    dispatcher_mode, notify_generation_dispatcher, notify_generation_finished, scheduler_pool
+)
 # Убираем прямой импорт socketio отсюда
 # from backend.app import socketio # Импортируем socketio для эвентов
 
@@ -14,16 +28,20 @@ logger = logging.getLogger(__name__)
 
 # --- Вспомогательная функция для наследования параметров (перенесено из api.py) ---
 
-def merge_generation_parameters(project_id: str, collection_id: str) -> tuple[dict, str, str]:
+def merge_generation_parameters(project_id: str, collection_id: str,
+                                project: Project | None = None,
+                                collection: Collection | None = None) -> tuple[dict, str, str]:
     """
     Объединяет параметры генерации из Проекта и Коллекции.
+    Проект и коллекцию можно передать заранее загруженными (пакетная генерация).
     Возвращает кортеж: (final_params_dict, final_positive_prompt, final_negative_prompt)
     """
-    project = Project.query.get_or_404(project_id)
-    collection = Collection.query.get_or_404(collection_id)
+    project = project or Project.query.get_or_404(project_id)
+    collection = collection or Collection.query.get_or_404(collection_id)
 
-    # 1. Начинаем с базовых параметров проекта (если они есть)
-    final_params = project.base_generation_params_json or {}
+    # 1. Начинаем с копии базовых параметров проекта (если они есть):
+    # словарь проекта не меняем, он общий для всех пар пакета
+    final_params = dict(project.base_generation_params_json or {})
 
     # 2. Устанавливаем/Перезаписываем размеры
     # TODO: Учесть возможные переопределения из запроса пользователя, если нужно
@@ -51,32 +69,107 @@ def merge_generation_parameters(project_id: str, collection_id: str) -> tuple[di
 
     return final_params, final_positive, final_negative
 
+def generation_params_hash(project_id: str, collection_id: int, final_params: dict) -> str:
+    """
+    sha256 пары и итоговых параметров генерации (промпты входят в final_params).
+    Случайный seed (-1) в хэш не входит: две такие постановки равноценны;
+    фиксированный seed - часть параметров.
+    """
+    params = final_params
+    if params.get('seed', -1) in RANDOM_SEED_VALUES:
+        params = {key: value for key, value in params.items() if key != 'seed'}
+    canonical = json.dumps([project_id, collection_id, params], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def find_in_flight_generations(params_hashes: set[str]) -> dict[str, tuple[str, GenerationStatus]]:
+    """ {params_hash: (generation_id, status)} для незавершенных (PENDING/QUEUED) генераций. """
+    in_flight = {}
+    hashes = list(params_hashes)
+    for start in range(0, len(hashes), DEDUP_LOOKUP_BATCH_SIZE):
+        rows = db.session.query(Generation.params_hash, Generation.id, Generation.status).filter(
+            Generation.params_hash.in_(hashes[start:start + DEDUP_LOOKUP_BATCH_SIZE]),
+            Generation.status.in_((GenerationStatus.PENDING, GenerationStatus.QUEUED))
+        ).order_by(Generation.created_at)
+        for params_hash, generation_id, status in rows:
+            in_flight.setdefault(params_hash, (generation_id, status)) # Самая ранняя из незавершенных
+    return in_flight
+
+def parse_generation_priority(value) -> int:
+    """ 'low' / 'normal' / 'high' (по умолчанию normal) -> значение Generation.priority. """
+    name = str(value or GenerationPriorities.NORMAL).lower()
+    if name not in GENERATION_PRIORITY_VALUES:
+        raise ValidationError(f"Invalid priority: {value}. Expected 'low', 'normal' or 'high'")
+    return GENERATION_PRIORITY_VALUES[name]
+
+
+def normalize_requested_by(value) -> str | None:
+    """ Идентификатор клиента/сессии для справедливого разделения внутри проекта (None - неизвестен). """
+    value = str(value).strip() if value is not None else ''
+    return value[:MAX_REQUESTED_BY_LENGTH] or None
+
 # --- Логика обработки /generate-batch (перенесено из api.py) ---
 
-def process_generation_request(pairs: list[dict]) -> dict:
+def _prefetch_batch_entities(pairs: list[dict]) -> tuple[dict, dict]:
+    """ Загружает все проекты и коллекции пакета двумя IN-запросами. """
+    project_ids = {pair.get('project_id') for pair in pairs if pair.get('project_id')}
+    collection_ids = set()
+    for pair in pairs:
+        try:
+            collection_ids.add(int(pair.get('collection_id')))
+        except (TypeError, ValueError):
+            pass
+    projects = {p.id: p for p in Project.query.filter(Project.id.in_(project_ids))} if project_ids else {}
+    collections = {c.id: c for c in Collection.query.filter(Collection.id.in_(collection_ids))} if collection_ids else {}
+    return projects, collections
+
+
+def process_generation_request(pairs: list[dict], concurrency: int | None = None,
+                               dedup: str = GenerationDedupModes.REUSE, priority: int = 0,
+                               requested_by: str | None = None) -> dict:
     """
     Обрабатывает запрос на пакетную генерацию.
     Возвращает словарь с результатами и ошибками.
+
+    Пара, для которой уже есть незавершенная (PENDING/QUEUED) генерация с теми же
+    итоговыми параметрами (см. generation_params_hash), в том числе в этом же
+    пакете, попадает в coalesced: при dedup=reuse ID существующей генерации
+    возвращается в tasks_started, при dedup=skip пара просто пропускается,
+    dedup=off ставит новую генерацию всегда. Проверка не атомарна с вставкой:
+    два одновременных запроса могут поставить одинаковые генерации.
+    Ожидающая отправки генерация, с которой совпала пара, получает приоритет
+    не ниже приоритета этого запроса.
+
+    priority (GENERATION_PRIORITY_VALUES) и requested_by (клиент/сессия) определяют
+    очередность отправки диспетчером (см. fair_share.py).
+
+    Генерации вставляются одной транзакцией в статусе PENDING (очередь отправки,
+    см. dispatcher.py) и сразу возвращаются в tasks_started; отправку в
+    планировщик выполняет диспетчер. В режиме GENERATION_DISPATCHER=inline
+    новые генерации отправляются прямо в запросе, в pair_errors попадают
+    окончательно неудачные.
     """
     results = {
         "tasks_started": [],
         "pair_errors": [],
+        "coalesced": [],
         "overall_error": None
     }
 
-    A1111_API_URL = os.environ.get('A1111_SCHEDULER_URL')
-    if not A1111_API_URL:
-        results["overall_error"] = "A1111_SCHEDULER_URL is not configured in .env"
-        logger.error(results["overall_error"])
-        return results
-    SCHEDULER_ENDPOINT = f"{A1111_API_URL}/agent-scheduler/v1/queue/txt2img"
-    
-    FLASK_CALLBACK_URL_BASE = os.environ.get('FLASK_CALLBACK_BASE_URL')
-    if not FLASK_CALLBACK_URL_BASE:
-        results["overall_error"] = "FLASK_CALLBACK_BASE_URL is not configured in .env"
+    # Конфигурацию проверяем сразу, чтобы не копить очередь, которую некому отправить
+    try:
+        scheduler_pool()
+        callback_url_template()
+    except DispatcherConfigError as e:
+        results["overall_error"] = str(e)
         logger.error(results["overall_error"])
         return results
 
+    # --- 1. Готовим строки Generation ---
+    projects, collections = _prefetch_batch_entities(pairs)
+    generation_rows = []
+    prepared = {} # generation_id -> pair
+    now = datetime.utcnow()
     for pair in pairs:
         project_id = pair.get('project_id')
         collection_id = pair.get('collection_id')
@@ -84,141 +177,222 @@ def process_generation_request(pairs: list[dict]) -> dict:
         if not project_id or not collection_id:
             results["pair_errors"].append({"pair": pair, "error": "Missing project_id or collection_id"})
             continue
-
         try:
-            # 1. Получаем финальные параметры
-            final_params, final_pos, final_neg = merge_generation_parameters(project_id, collection_id)
-
-            # 2. Создаем запись Generation в БД
-            new_generation = Generation(
-                id=str(uuid.uuid4()), # Генерируем UUID здесь
-                project_id=project_id,
-                collection_id=collection_id,
-                status=GenerationStatus.PENDING, # Начинаем с PENDING
-                final_positive_prompt=final_pos,
-                final_negative_prompt=final_neg,
-                generation_params=final_params # Сохраняем весь JSON параметров
-            )
-            db.session.add(new_generation)
-            db.session.commit() # Коммитим создание Generation
-            internal_generation_id = new_generation.id
+            collection_id = int(collection_id)
+        except (TypeError, ValueError):
+            results["pair_errors"].append({"pair": pair, "error": f"Invalid collection_id: {collection_id}"})
+            continue
+        project = projects.get(project_id)
+        collection = collections.get(collection_id)
+        if project is None or collection is None:
+            missing = f"Project {project_id}" if project is None else f"Collection {collection_id}"
+            results["pair_errors"].append({"pair": pair, "error": f"{missing} not found"})
+            continue
 
-            # 3. Формируем callback URL
-            try:
-                 # Генерируем внутри контекста приложения, чтобы url_for работал
-                 with current_app.app_context():
-                      callback_url = url_for('image_generation.handle_scheduler_callback', 
-                                            generation_id=internal_generation_id, 
-                                            _external=True,
-                                            _scheme='http') # Явно указываем http
-                 
-                 # Переопределяем базовый URL, если он из .env (полезно для ngrok/docker)
-                 if FLASK_CALLBACK_URL_BASE != 'http://127.0.0.1:5001': # Проверяем, отличается ли от дефолтного
-                    from urllib.parse import urlparse, urlunparse
-                    parsed_callback = urlparse(callback_url)
-                    parsed_base = urlparse(FLASK_CALLBACK_URL_BASE)
-                    # Собираем URL заново с хостом/портом из .env
-                    callback_url = urlunparse((parsed_base.scheme, parsed_base.netloc, parsed_callback.path, 
-                                                parsed_callback.params, parsed_callback.query, parsed_callback.fragment))
-            except Exception as url_err:
-                 logger.error(f"Error generating callback URL for {internal_generation_id}: {url_err}")
-                 results["pair_errors"].append({"pair": pair, "error": f"Callback URL generation error: {url_err}"})
-                 # Откатываем создание Generation? Или оставляем в PENDING?
-                 # Пока оставляем, но логируем
-                 continue # Переходим к следующей паре
-
-            # 4. Формируем тело запроса к планировщику
-            scheduler_payload = { **final_params, "callback_url": callback_url }
-
-            # 5. Вызываем API планировщика
-            logger.info(f"Sending request to scheduler for generation {internal_generation_id}...")
-            # logger.debug(f"Scheduler payload: {json.dumps(scheduler_payload, indent=2)}")
-            try:
-                response = requests.post(SCHEDULER_ENDPOINT, json=scheduler_payload, timeout=15)
-                response.raise_for_status() # Проверка на HTTP ошибки (4xx, 5xx)
-                
-                scheduler_response_data = response.json()
-                scheduler_task_id = scheduler_response_data.get('task_id')
-                queue_position = scheduler_response_data.get('queue_position')
-                
-                if not scheduler_task_id:
-                    raise ValueError("Scheduler response missing 'task_id'")
-
-                # 6. Обновляем запись Generation в БД
-                new_generation.status = GenerationStatus.QUEUED
-                new_generation.scheduler_task_id = scheduler_task_id
-                db.session.commit()
-                
-                logger.info(f"Generation {internal_generation_id} queued successfully. Task ID: {scheduler_task_id}, Position: {queue_position}")
-                results["tasks_started"].append(internal_generation_id)
-                
-                # Отправляем событие через SocketIO
-                # Получаем socketio из current_app
-                try:
-                    socketio = current_app.extensions['socketio']
-                    socketio.emit('generation_update', {
-                        'id': internal_generation_id,
-                        'project_id': project_id,
-                        'collection_id': collection_id,
-                        'status': GenerationStatus.QUEUED.value
-                    })
-                    logger.info(f"Sent QUEUED WebSocket update for {internal_generation_id}")
-                except Exception as ws_err:
-                     logger.error(f"Failed to send QUEUED WebSocket update for {internal_generation_id}: {ws_err}")
-
-            except requests.exceptions.RequestException as req_err:
-                error_msg = f"Scheduler API request failed: {req_err}"
-                logger.error(error_msg)
-                new_generation.status = GenerationStatus.FAILED
-                new_generation.error_message = str(req_err)
-                db.session.commit()
-                results["pair_errors"].append({"pair": pair, "error": error_msg})
-                # Отправляем событие через SocketIO
-                try:
-                    socketio = current_app.extensions['socketio']
-                    socketio.emit('generation_update', {
-                        'id': internal_generation_id,
-                        'project_id': project_id,
-                        'collection_id': collection_id,
-                        'status': GenerationStatus.FAILED.value,
-                        'error_message': str(req_err)
-                    })
-                    logger.info(f"Sent FAILED (RequestException) WebSocket update for {internal_generation_id}")
-                except Exception as ws_err:
-                    logger.error(f"Failed to send FAILED (RequestException) WebSocket update for {internal_generation_id}: {ws_err}")
-            except (ValueError, KeyError) as resp_err:
-                 error_msg = f"Scheduler response error: {resp_err}"
-                 logger.error(f"{error_msg}. Response: {response.text[:500]}")
-                 new_generation.status = GenerationStatus.FAILED
-                 new_generation.error_message = f"Scheduler response error: {resp_err}"
-                 db.session.commit()
-                 results["pair_errors"].append({"pair": pair, "error": error_msg})
-                 # Отправляем событие через SocketIO
-                 try:
-                    socketio = current_app.extensions['socketio']
-                    socketio.emit('generation_update', {
-                        'id': internal_generation_id,
-                        'project_id': project_id,
-                        'collection_id': collection_id,
-                        'status': GenerationStatus.FAILED.value,
-                        'error_message': f"Scheduler response error: {resp_err}"
-                    })
-                    logger.info(f"Sent FAILED (ResponseError) WebSocket update for {internal_generation_id}")
-                 except Exception as ws_err:
-                    logger.error(f"Failed to send FAILED (ResponseError) WebSocket update for {internal_generation_id}: {ws_err}")
-
-        except Exception as e:
-            db.session.rollback() # Откатываем, если ошибка до вызова API
-            error_msg = f"Error processing pair {pair}: {e}"
-            logger.exception(error_msg) # Логируем с traceback
+        final_params, final_pos, final_neg = merge_generation_parameters(project_id, collection_id, project, collection)
+        internal_generation_id = str(uuid.uuid4()) # Генерируем UUID здесь
+        generation_rows.append({
+            'params_hash': generation_params_hash(project_id, collection_id, final_params),
+            'id': internal_generation_id,
+            'project_id': project_id,
+            'collection_id': collection_id,
+            'status': GenerationStatus.PENDING, # В очереди отправки
+            'final_positive_prompt': final_pos,
+            'final_negative_prompt': final_neg,
+            'generation_params': final_params, # Сохраняем весь JSON параметров
+            'next_submit_at': now,
+            'priority': priority,
+            'requested_by': requested_by
+        })
+        prepared[internal_generation_id] = pair
+
+    if dedup != GenerationDedupModes.OFF and generation_rows:
+        generation_rows = _coalesce_in_flight(generation_rows, prepared, results, dedup, priority)
+    if not generation_rows:
+        db.session.commit() # Повышение приоритета совпавших генераций
+        return results
+
+    # --- 2. Одна транзакция на весь пакет ---
+    try:
+        db.session.execute(insert(Generation), generation_rows)
+        refresh_grid_cells((row['collection_id'], row['project_id']) for row in generation_rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Error creating {len(generation_rows)} generations")
+        for pair in prepared.values():
             results["pair_errors"].append({"pair": pair, "error": str(e)})
-            # Если Generation была создана, нужно ли ее помечать как FAILED?
-            # Пока не делаем, т.к. ошибка могла быть до создания Generation
-            
+        return results
+    logger.info(f"Enqueued {len(generation_rows)} generations for dispatch")
+
+    if dispatcher_mode() != GenerationDispatcherModes.INLINE:
+        results["tasks_started"].extend(prepared)
+        notify_generation_dispatcher()
+        return results
+
+    # --- 3. Режим inline: отправляем новые генерации сразу ---
+    outcomes = {}
+    try:
+        # Повторяем, пока есть неотправленные и готовые к отправке (переназначенные на другой
+        # экземпляр планировщика); отложенные с задержкой проход не захватит - цикл закончится
+        while True:
+            unsent_ids = [gid for gid in prepared if outcomes.get(gid, (OUTCOME_RETRY,))[0] == OUTCOME_RETRY]
+            if not unsent_ids:
+                break
+            batch_outcomes = dispatch_due_generations(generation_ids=unsent_ids, concurrency=concurrency)
+            if not batch_outcomes:
+                break
+            outcomes.update(batch_outcomes)
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Inline dispatch failed")
+        results["overall_error"] = f"Failed to dispatch generations: {e}"
+        return results
+    for internal_generation_id, pair in prepared.items():
+        outcome, error_msg = outcomes.get(internal_generation_id, (OUTCOME_RETRY, None))
+        if outcome == OUTCOME_FAILED:
+            results["pair_errors"].append({"pair": pair, "error": error_msg})
+        else:
+            # QUEUED или PENDING с отложенной повторной отправкой
+            results["tasks_started"].append(internal_generation_id)
     return results
 
+
+def _coalesce_in_flight(generation_rows: list[dict], prepared: dict, results: dict, dedup: str,
+                        priority: int = 0) -> list[dict]:
+    """
+    Убирает из пакета строки, у которых уже есть незавершенная генерация с тем же
+    params_hash (или более ранняя строка пакета), и записывает их в coalesced.
+    Ожидающим отправки совпавшим генерациям повышает приоритет до priority (без коммита).
+    Возвращает строки, которые нужно вставить.
+    """
+    in_flight = find_in_flight_generations({row['params_hash'] for row in generation_rows})
+    reused_ids = set()
+    kept_rows = []
+    for row in generation_rows:
+        existing = in_flight.get(row['params_hash'])
+        if existing is None:
+            in_flight[row['params_hash']] = (row['id'], GenerationStatus.PENDING) # Повтор внутри пакета
+            kept_rows.append(row)
+            continue
+        existing_id, existing_status = existing
+        pair = prepared.pop(row['id'])
+        results["coalesced"].append({"pair": pair, "generation_id": existing_id, "status": existing_status.value})
+        # Повтор внутри пакета попадет в tasks_started вместе с новыми генерациями
+        if dedup == GenerationDedupModes.REUSE and existing_id not in prepared and existing_id not in reused_ids:
+            reused_ids.add(existing_id)
+            results["tasks_started"].append(existing_id)
+    if results["coalesced"]:
+        logger.info(f"Coalesced {len(results['coalesced'])} pairs into in-flight generations (dedup={dedup})")
+        pending_ids = [item["generation_id"] for item in results["coalesced"]
+                       if item["status"] == GenerationStatus.PENDING.value and item["generation_id"] not in prepared]
+        for start in range(0, len(pending_ids), DEDUP_LOOKUP_BATCH_SIZE):
+            db.session.execute(
+                update(Generation).where(
+                    Generation.id.in_(pending_ids[start:start + DEDUP_LOOKUP_BATCH_SIZE]),
+                    Generation.status == GenerationStatus.PENDING, Generation.priority < priority
+                ).values(priority=priority, updated_at=Generation.updated_at).execution_options(synchronize_session=False)
+            )
+    return kept_rows
+
 # --- Логика обработки /scheduler_callback (перенесено из api.py) ---
 
+def generation_files_dir(project: Project | None, received_at: datetime) -> str:
+    """
+    Абсолютный путь к папке для файлов генерации: <база>/<YYYY-MM-DD>. База -
+    абсолютный project.path как есть, относительный - внутри GENERATED_FILES_FOLDER,
+    без пути проекта - сама GENERATED_FILES_FOLDER.
+    """
+    generated_files_root_abs = os.path.abspath(current_app.config['GENERATED_FILES_FOLDER'])
+    user_defined_project_path = (project.path or '').strip() if project else ''
+    if not user_defined_project_path:
+        effective_base_path_on_disk = generated_files_root_abs
+    elif os.path.isabs(user_defined_project_path):
+        effective_base_path_on_disk = user_defined_project_path
+    else:
+        # Убираем возможные начальные/конечные разделители, чтобы join работал правильно
+        effective_base_path_on_disk = os.path.join(generated_files_root_abs, user_defined_project_path.strip(os.sep))
+    return os.path.join(effective_base_path_on_disk, received_at.strftime('%Y-%m-%d'))
+
+
+def generated_file_db_path(absolute_path: str) -> str:
+    """
+    Значение GeneratedFile.file_path: путь относительно GENERATED_FILES_FOLDER, если файл
+    внутри нее, иначе абсолютный (стандартный file_serving такой файл не отдаст).
+    """
+    generated_files_root_abs = os.path.abspath(current_app.config['GENERATED_FILES_FOLDER'])
+    if os.path.abspath(absolute_path).startswith(generated_files_root_abs + os.sep):
+        return os.path.relpath(absolute_path, generated_files_root_abs)
+    logger.warning(
+        f"File {absolute_path} is saved outside servable GENERATED_FILES_FOLDER ({generated_files_root_abs}). "
+        f"Storing absolute path in DB. File may not be accessible via standard file serving URL."
+    )
+    return absolute_path
+
+
+def uploaded_file_hash(file_storage) -> str:
+    """ SHA-256 загруженного файла; поток возвращается в начало, чтобы файл можно было записать. """
+    hasher = hashlib.sha256()
+    stream = file_storage.stream
+    for chunk in iter(lambda: stream.read(CALLBACK_SPOOL_CHUNK_BYTES), b''):
+        hasher.update(chunk)
+    stream.seek(0)
+    return hasher.hexdigest()
+
+
+def hash_callback_uploads(files: dict | None) -> list[tuple]:
+    """ [(file_storage, sha256)] непустых файлов callback'а в порядке получения. """
+    return [
+        (file_storage, uploaded_file_hash(file_storage))
+        for file_list in (files or {}).values()
+        for file_storage in file_list
+        if file_storage and file_storage.filename
+    ]
+
+
+def callback_digest(status: str | None, error: str | None, content_hashes: list[str]) -> str:
+    """ Отпечаток доставки callback'а: статус, ошибка и хэши файлов (без учета порядка). """
+    return hashlib.sha256(json.dumps([status, error, sorted(content_hashes)]).encode('utf-8')).hexdigest()
+
+
+def callback_already_delivered(generation_id: str, digest: str) -> bool:
+    """
+    Проверка повтора без записи (SELECT по первичному ключу): True - callback с таким
+    отпечатком уже принят или генерации нет. Окончательно решает claim_callback_delivery.
+    """
+    row = db.session.execute(
+        select(Generation.callback_digest).where(Generation.id == generation_id)
+    ).first()
+    return row is None or row.callback_digest == digest
+
+
+def claim_callback_delivery(generation_id: str, digest: str) -> bool:
+    """
+    Защита от повторной доставки: одним UPDATE по первичному ключу записывает отпечаток
+    callback'а в генерацию (без коммита - в транзакции обработки, откат снимает отметку).
+    False - callback с таким отпечатком уже принят или генерации нет: ничего писать не нужно.
+    """
+    result = db.session.execute(
+        update(Generation)
+        .where(Generation.id == generation_id,
+               or_(Generation.callback_digest.is_(None), Generation.callback_digest != digest))
+        .values(callback_digest=digest, updated_at=Generation.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def known_content_hashes(generation_ids) -> set[tuple]:
+    """ {(generation_id, content_hash)} уже записанных файлов генераций. """
+    if not generation_ids:
+        return set()
+    return set(
+        db.session.query(GeneratedFile.generation_id, GeneratedFile.content_hash)
+        .filter(GeneratedFile.generation_id.in_(list(generation_ids)), GeneratedFile.content_hash.isnot(None))
+        .all()
+    )
+
+
 def process_scheduler_callback(generation_id: str, 
                              form_data: dict | None = None, 
                              files: dict | None = None) -> tuple[bool, str]:
@@ -246,11 +420,22 @@ def process_scheduler_callback(generation_id: str,
 
     logger.info(f"Processing callback for {generation_id}. Final Status: {status_str}. Error Info: {error_info}")
 
+    # Повтор уже принятого callback'а (планировщик не дождался ответа) - без записи на диск и в БД
+    uploads = hash_callback_uploads(files)
+    if not claim_callback_delivery(generation_id, callback_digest(status_str, error_info, [h for _, h in uploads])):
+        db.session.rollback()
+        logger.info(f"Duplicate callback for {generation_id} ignored")
+        return True, "Duplicate callback ignored."
+    content_hashes = {id(file_storage): content_hash for file_storage, content_hash in uploads}
+    known_hashes = {content_hash for _, content_hash in known_content_hashes([generation_id])}
+
     generation_update_payload = {
         'id': generation.id,
         'project_id': generation.project_id,
         'collection_id': generation.collection_id,
     }
+    # Экземпляр планировщика и время постановки - для задержки callback'а (адаптивное ограничение очереди)
+    queued_at, scheduler_url = generation.queued_at, generation.scheduler_url
 
     try:
         if status_str == 'done' and files:
@@ -259,47 +444,12 @@ def process_scheduler_callback(generation_id: str,
             generation.error_message = None
 
             saved_files_info = []
+            thumbnail_sources = []
 
-            # --- Новая логика определения пути сохранения ---
             project = Project.query.get(generation.project_id)
-            date_folder_name = datetime.utcnow().strftime('%Y-%m-%d')
-            generation_id_folder = generation.id # Используем сам ID генерации как имя папки
-
-            effective_base_path_on_disk: str
-            # Этот флаг или префикс пути понадобится для формирования пути в БД,
-            # если он должен быть относительным к GENERATED_FILES_FOLDER
-            
-            path_prefix_for_db = [] # Части пути, которые будут впереди date/gen_id в file_path для БД, если путь внутри GENERATED_FILES_FOLDER
-
-            generated_files_root_abs = os.path.abspath(current_app.config['GENERATED_FILES_FOLDER'])
-
-            if project and project.path:
-                user_defined_project_path = project.path.strip()
-                if user_defined_project_path:
-                    if os.path.isabs(user_defined_project_path):
-                        effective_base_path_on_disk = user_defined_project_path
-                        # Если путь абсолютный, то для file_path в БД у нас нет простого относительного префикса от GENERATED_FILES_FOLDER
-                        # path_prefix_for_db остается пустым в этом сценарии, если мы хотим хранить полный путь,
-                        # или нам нужна более сложная логика, если мы хотим попытаться сделать его относительным к чему-то еще.
-                    else: # Относительный путь
-                        # Убираем возможные начальные/конечные разделители, чтобы join работал правильно
-                        clean_relative_path = user_defined_project_path.strip(os.sep)
-                        effective_base_path_on_disk = os.path.join(generated_files_root_abs, clean_relative_path)
-                        path_prefix_for_db.append(clean_relative_path)
-                else: # project.path пустая строка
-                    effective_base_path_on_disk = generated_files_root_abs
-            else: # project не найден или project.path не задан
-                effective_base_path_on_disk = generated_files_root_abs
-            
-            # Абсолютный путь на диске к папке для файлов данной конкретной генерации
-            absolute_dir_for_generation_files_on_disk = os.path.join(
-                effective_base_path_on_disk,
-                date_folder_name,
-            )
-            
+            absolute_dir_for_generation_files_on_disk = generation_files_dir(project, datetime.utcnow())
             os.makedirs(absolute_dir_for_generation_files_on_disk, exist_ok=True)
             logger.info(f"Ensured directory for generation files exists: {absolute_dir_for_generation_files_on_disk}")
-            # --- Конец новой логики определения пути ---
 
             # --- Обработка файлов ---
             if files:
@@ -310,6 +460,11 @@ def process_scheduler_callback(generation_id: str,
                       if not file_storage or not file_storage.filename:
                            logger.warning(f"Skipping empty file field '{field_name}' for {generation_id}")
                            continue
+                      content_hash = content_hashes[id(file_storage)]
+                      if content_hash in known_hashes:
+                           logger.info(f"Skipping already stored file '{file_storage.filename}' for {generation_id}")
+                           continue
+                      known_hashes.add(content_hash)
                       original_filename = file_storage.filename
                       filename_base = uuid.uuid4().hex
                       filename_ext = os.path.splitext(original_filename)[1].lower() or '.png'
@@ -323,48 +478,47 @@ def process_scheduler_callback(generation_id: str,
 
                       try:
                            logger.info(f"Saving file '{original_filename}' as '{secure_filename}' to {absolute_dir_for_generation_files_on_disk}")
-                           file_storage.save(absolute_full_save_path_on_disk)
+                           if blobs_enabled():
+                                # Содержимое - в хранилище blob'ов (один раз), на месте - ссылка на blob
+                                store_blob_from_upload(file_storage, content_hash)
+                                materialize_blob(content_hash, absolute_full_save_path_on_disk)
+                           else:
+                                file_storage.save(absolute_full_save_path_on_disk)
                            logger.info(f"File saved successfully: {absolute_full_save_path_on_disk}")
                            size_bytes = os.path.getsize(absolute_full_save_path_on_disk)
-
-                           # Определяем значение для GeneratedFile.file_path
-                           path_for_db: str
-                           # Проверяем, находится ли сохраненный файл внутри корневой папки GENERATED_FILES_FOLDER
-                           # os.path.abspath нужен для надежного сравнения, особенно если один из путей может содержать '..'
-                           if os.path.abspath(absolute_full_save_path_on_disk).startswith(generated_files_root_abs + os.sep):
-                               # Если да, сохраняем путь относительный к GENERATED_FILES_FOLDER
-                               path_for_db = os.path.relpath(absolute_full_save_path_on_disk, generated_files_root_abs)
-                           else:
-                               # Если нет (например, project.path был абсолютным и указывал в другое место),
-                               # сохраняем полный абсолютный путь.
-                               # ВАЖНО: Стандартный file_serving эндпоинт не сможет отдать этот файл без модификаций.
-                               logger.warning(
-                                   f"File {absolute_full_save_path_on_disk} is saved outside servable "
-                                   f"GENERATED_FILES_FOLDER ({generated_files_root_abs}). "
-                                   f"Storing absolute path in DB. File may not be accessible via standard file serving URL."
-                               )
-                               path_for_db = absolute_full_save_path_on_disk
-
-                           new_file = GeneratedFile(
-                                generation_id=generation.id,
-                                file_path=path_for_db, # Используем определенный path_for_db
-                                original_filename=original_filename,
-                                mime_type=mime_type,
-                                size_bytes=size_bytes,
-                                infotext=infotext
-                           )
-                           db.session.add(new_file)
-                           db.session.flush() # Получаем ID
-                           saved_files_info.append(new_file.to_dict()) # Собираем инфо для эвента
-                           logger.info(f"Created GeneratedFile record for {original_filename} (ID: {new_file.id})")
-
                       except (IOError, OSError) as save_err:
                            logger.error(f"Error saving file {original_filename} for generation {generation_id}: {save_err}")
                            continue # Пропускаем этот файл
+
+                      path_for_db = generated_file_db_path(absolute_full_save_path_on_disk)
+                      new_file = GeneratedFile(
+                           generation_id=generation.id,
+                           file_path=path_for_db, # Используем определенный path_for_db
+                           original_filename=original_filename,
+                           mime_type=mime_type,
+                           size_bytes=size_bytes,
+                           infotext=infotext,
+                           content_hash=content_hash
+                      )
+                      try:
+                           # Точка сохранения на файл: ошибка вставки (например, тот же хэш уже записала
+                           # сверка с планировщиком) откатывает только этот файл, а не отметку доставки
+                           # и уже записанные файлы callback'а
+                           with db.session.begin_nested():
+                                if blobs_enabled():
+                                     add_blob_refs(Counter([content_hash]), {content_hash: size_bytes})
+                                db.session.add(new_file)
+                           # Коммит точки сохранения выполнил flush: ID файла уже есть
                       except Exception as db_err:
                            logger.error(f"Error creating GeneratedFile record for {original_filename}: {db_err}")
-                           db.session.rollback() # Откатываем добавление этого файла
+                           try:
+                                os.remove(absolute_full_save_path_on_disk)
+                           except OSError:
+                                pass
                            continue # Пропускаем этот файл
+                      saved_files_info.append(new_file.to_dict()) # Собираем инфо для эвента
+                      thumbnail_sources.append((new_file.id, path_for_db, content_hash))
+                      logger.info(f"Created GeneratedFile record for {original_filename} (ID: {new_file.id})")
             else:
                  # Статус 'done', но файлов нет в request.files
                  logger.warning(f"Callback for {generation_id} is 'done' but no files were found in request.files.")
@@ -372,7 +526,10 @@ def process_scheduler_callback(generation_id: str,
 
             # --- Завершение обработки статуса 'done' --- 
             generation.updated_at = datetime.utcnow()
+            refresh_grid_cell(generation.collection_id, generation.project_id)
             db.session.commit()
+            notify_generation_finished(queued_at, scheduler_url)
+            schedule_thumbnails(thumbnail_sources)
             generation_update_payload['status'] = GenerationStatus.COMPLETED.value
             generation_update_payload['moderation_status'] = ModerationStatus.PENDING_MODERATION.value
             generation_update_payload['generated_files'] = saved_files_info
@@ -390,7 +547,9 @@ def process_scheduler_callback(generation_id: str,
             generation.status = GenerationStatus.FAILED
             generation.error_message = str(error_info) if error_info else "Generation failed without specific error message."
             generation.updated_at = datetime.utcnow()
+            refresh_grid_cell(generation.collection_id, generation.project_id)
             db.session.commit()
+            notify_generation_finished(queued_at, scheduler_url)
             generation_update_payload['status'] = GenerationStatus.FAILED.value
             generation_update_payload['error_message'] = generation.error_message
             
@@ -429,7 +588,9 @@ def process_scheduler_callback(generation_id: str,
             generation.status = GenerationStatus.FAILED
             generation.error_message = f"Callback processing error: {e}"
             generation.updated_at = datetime.utcnow()
+            refresh_grid_cell(generation.collection_id, generation.project_id)
             db.session.commit()
+            notify_generation_finished(queued_at, scheduler_url)
             generation_update_payload['status'] = GenerationStatus.FAILED.value
             generation_update_payload['error_message'] = generation.error_message
             
@@ -0,0 +1,59 @@
+from flask import Blueprint, request, jsonify
+import logging
+from backend.models import db, Job
+from .runner import cancel_job
+
+logger = logging.getLogger(__name__)
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api')
+
+MAX_JOBS_LIST_LIMIT = 200
+
+
+def is_async_request() -> bool:
+    """ ?async=1 - выполнить операцию фоновым заданием и сразу вернуть его ID. """
+    return request.args.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+def job_accepted_response(job: Job):
+    """ Ответ 202 на запуск фонового задания. """
+    return jsonify({"job_id": job.id, "job": job.to_dict()}), 202
+
+
+@jobs_bp.route('/jobs', methods=['GET'])
+def list_jobs():
+    """ Последние задания: ?kind=, ?status=, ?limit= (без итогов). """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), MAX_JOBS_LIST_LIMIT)
+    except ValueError:
+        return jsonify({"error": "Invalid limit parameter"}), 400
+    query = Job.query
+    if request.args.get('kind'):
+        query = query.filter(Job.kind == request.args['kind'])
+    if request.args.get('status'):
+        query = query.filter(Job.status == request.args['status'])
+    jobs = query.order_by(Job.created_at.desc()).limit(limit).all()
+    return jsonify({"jobs": [job.to_dict(include_result=False) for job in jobs]}), 200
+
+
+@jobs_bp.route('/jobs/<string:job_id>', methods=['GET'])
+def get_job(job_id):
+    """ Состояние, прогресс и итог задания. """
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@jobs_bp.route('/jobs/<string:job_id>/cancel', methods=['POST'])
+def cancel_job_route(job_id):
+    """ Запрашивает отмену; задание остановится на ближайшей проверке. """
+    try:
+        job = cancel_job(job_id)
+    except Exception:
+        db.session.rollback()
+        logger.exception(f"Error cancelling job {job_id}")
+        return jsonify({"error": "Failed to cancel job"}), 500
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return jsonify(job.to_dict(include_result=False)), 200
@@ -0,0 +1,339 @@
+"""
+Фоновые задания внутри процесса приложения.
+
+Долгие операции (массовая генерация, переиндексация проекта, импорт CSV) в
+режиме ?async=1 не выполняются в запросе: submit_job() создает строку Job и
+ставит обработчик в пул потоков (JOB_WORKERS), ответ содержит ID задания.
+
+Обработчик регистрируется для вида задания (register_job_handler) и получает
+JobContext: через него он сообщает объем работы и прогресс, пишет промежуточный
+итог и проверяет отмену. Прогресс записывается в Job и рассылается событием
+Socket.IO 'job_update' не чаще JOB_PROGRESS_INTERVAL_SECONDS; смена статуса
+рассылается всегда, итог (result) - в последнем событии.
+
+Отмена (POST /api/jobs/<id>/cancel) ставит Job.cancel_requested и будит задание
+этого процесса; обработчик останавливается на ближайшей проверке
+(ctx.check_cancelled()), уже сделанная работа сохраняется.
+
+Задание выполняется только в создавшем его процессе (payload хранится в памяти),
+поэтому после перезапуска его уже никто не продолжит. Job.runner_id - ID процесса,
+поток JobHeartbeat раз в JOB_HEARTBEAT_SECONDS ставит Job.heartbeat_at всем
+незавершенным заданиям своего процесса. Незавершенное задание другого процесса без
+отметки дольше JOB_HEARTBEAT_TIMEOUT_SECONDS (исполнитель завершился) помечается
+FAILED - при старте приложения и затем в каждом проходе того же потока, независимо
+от возраста задания.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, update
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.serving import is_running_from_reloader
+
+from backend.models import db, Job
+from backend.constants import (
+    JobStatus, JOB_FINISHED_STATUSES, DEFAULT_JOB_WORKERS, JOB_PROGRESS_INTERVAL_SECONDS,
+    JOB_CANCEL_POLL_SECONDS, JOB_HEARTBEAT_SECONDS, JOB_HEARTBEAT_TIMEOUT_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+JOB_EXECUTOR_EXTENSION_KEY = 'job_executor'
+JOB_HEARTBEAT_EXTENSION_KEY = 'job_heartbeat'
+JOB_UNFINISHED_STATUSES = (JobStatus.PENDING, JobStatus.RUNNING)
+
+_handlers = {}
+_cancel_events = {} # job_id -> threading.Event заданий этого процесса
+_cancel_events_lock = threading.Lock()
+_runner = {'pid': None, 'id': None}
+
+
+class JobCancelled(Exception):
+    """ Задание отменено пользователем; бросается из JobContext.check_cancelled(). """
+
+
+def register_job_handler(kind: str, handler):
+    """ Регистрирует обработчик вида задания: handler(ctx: JobContext, params: dict, payload) -> dict. """
+    _handlers[kind] = handler
+
+
+def runner_id() -> str:
+    """ ID исполнителя заданий этого процесса (новый после перезапуска и в дочернем процессе после fork). """
+    if _runner['pid'] != os.getpid():
+        _runner['pid'] = os.getpid()
+        _runner['id'] = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"[-64:]
+    return _runner['id']
+
+
+def job_workers() -> int:
+    """ Число потоков исполнителя заданий (JOB_WORKERS). """
+    try:
+        return max(int(os.environ.get('JOB_WORKERS', DEFAULT_JOB_WORKERS)), 1)
+    except ValueError:
+        logger.warning("Invalid JOB_WORKERS, using default")
+        return DEFAULT_JOB_WORKERS
+
+
+def _job_executor(app) -> ThreadPoolExecutor:
+    executor = app.extensions.get(JOB_EXECUTOR_EXTENSION_KEY)
+    if executor is None:
+        executor = app.extensions.setdefault(
+            JOB_EXECUTOR_EXTENSION_KEY, ThreadPoolExecutor(max_workers=job_workers(), thread_name_prefix='job')
+        )
+    return executor
+
+
+def submit_job(kind: str, params: dict | None = None, payload=None) -> Job:
+    """
+    Создает задание и ставит его в пул потоков.
+
+    Args:
+        params: JSON-параметры, сохраняемые в Job (видны в API)
+        payload: данные только для обработчика (список пар, содержимое файла), в БД не пишутся
+    """
+    if kind not in _handlers:
+        raise ValueError(f"No handler registered for job kind '{kind}'")
+    job = Job(kind=kind, status=JobStatus.PENDING, params=params or {}, runner_id=runner_id(),
+              heartbeat_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    with _cancel_events_lock:
+        _cancel_events[job.id] = threading.Event()
+    app = current_app._get_current_object()
+    _job_executor(app).submit(_run_job, app, job.id, payload)
+    logger.info(f"Job {job.id} ({kind}) submitted")
+    emit_job_update(job)
+    return job
+
+
+def cancel_job(job_id: str) -> Job | None:
+    """ Запрашивает отмену задания. Возвращает задание (None, если не найдено). """
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return None
+    if job.status in JOB_FINISHED_STATUSES:
+        return job
+    job.cancel_requested = True
+    db.session.commit()
+    with _cancel_events_lock:
+        event = _cancel_events.get(job_id)
+    if event is not None:
+        event.set()
+    logger.info(f"Cancellation requested for job {job_id}")
+    emit_job_update(job)
+    return job
+
+
+def emit_job_update(job: Job):
+    """ Рассылает состояние задания событием 'job_update' (итог - только для завершенных). """
+    try:
+        socketio = current_app.extensions['socketio']
+        socketio.emit('job_update', job.to_dict(include_result=job.status in JOB_FINISHED_STATUSES))
+    except Exception as ws_err:
+        logger.error(f"Failed to send job_update for {job.id}: {ws_err}")
+
+
+class JobContext:
+    """ Интерфейс обработчика к своему заданию: прогресс, промежуточный итог, отмена. """
+
+    def __init__(self, job_id: str, cancel_event: threading.Event | None = None):
+        self.job_id = job_id
+        self.total = None
+        self.processed = 0
+        self.errors = 0
+        self.result = {}
+        self._cancel_event = cancel_event or threading.Event()
+        self._last_flush = 0.0
+        self._last_cancel_poll = 0.0
+
+    def set_total(self, total: int | None):
+        self.total = total
+        self.flush(force=True)
+
+    def advance(self, count: int = 1, errors: int = 0, **result_updates):
+        """ Отмечает выполненную работу; result_updates сливаются в промежуточный итог. """
+        self.processed += count
+        self.errors += errors
+        self.result.update(result_updates)
+        self.flush()
+
+    def flush(self, force: bool = False):
+        """ Записывает прогресс в Job и рассылает его (не чаще JOB_PROGRESS_INTERVAL_SECONDS). """
+        now = time.monotonic()
+        if not force and now - self._last_flush < JOB_PROGRESS_INTERVAL_SECONDS:
+            return
+        self._last_flush = now
+        job = db.session.get(Job, self.job_id)
+        job.total, job.processed, job.errors = self.total, self.processed, self.errors
+        job.result = dict(self.result) # Новый объект, чтобы ORM заметил изменение JSON
+        db.session.commit()
+        emit_job_update(job)
+
+    def is_cancelled(self) -> bool:
+        if self._cancel_event.is_set():
+            return True
+        now = time.monotonic()
+        if now - self._last_cancel_poll >= JOB_CANCEL_POLL_SECONDS:
+            # Отмену могли запросить через другой процесс приложения
+            self._last_cancel_poll = now
+            if db.session.query(Job.cancel_requested).filter(Job.id == self.job_id).scalar():
+                self._cancel_event.set()
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """ Бросает JobCancelled, если запрошена отмена. Вызывается между порциями работы. """
+        if self.is_cancelled():
+            raise JobCancelled()
+
+
+def _finish_job(job_id: str, status: str, ctx: JobContext, result: dict | None = None, error_message: str | None = None):
+    job = db.session.get(Job, job_id)
+    job.status = status
+    job.total, job.processed, job.errors = ctx.total, ctx.processed, ctx.errors
+    job.result = result if result is not None else dict(ctx.result)
+    job.error_message = error_message
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    emit_job_update(job)
+
+
+def _run_job(app, job_id: str, payload):
+    """ Выполняет задание в контексте приложения; исход записывается в Job. """
+    with _cancel_events_lock:
+        cancel_event = _cancel_events.get(job_id)
+    ctx = JobContext(job_id, cancel_event)
+    with app.app_context():
+        try:
+            job = db.session.get(Job, job_id)
+            if job is None or job.status != JobStatus.PENDING:
+                return
+            if job.cancel_requested:
+                _finish_job(job_id, JobStatus.CANCELLED, ctx)
+                return
+            job.status = JobStatus.RUNNING
+            job.started_at = datetime.utcnow()
+            db.session.commit()
+            emit_job_update(job)
+            kind, params = job.kind, job.params or {}
+
+            result = _handlers[kind](ctx, params, payload)
+            _finish_job(job_id, JobStatus.COMPLETED, ctx, result)
+            logger.info(f"Job {job_id} ({kind}) completed: {ctx.processed} processed, {ctx.errors} errors")
+        except JobCancelled:
+            db.session.rollback()
+            _finish_job(job_id, JobStatus.CANCELLED, ctx)
+            logger.info(f"Job {job_id} cancelled after {ctx.processed} processed")
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"Job {job_id} failed")
+            try:
+                _finish_job(job_id, JobStatus.FAILED, ctx, error_message=str(e))
+            except Exception:
+                db.session.rollback()
+                logger.exception(f"Failed to record failure of job {job_id}")
+        finally:
+            db.session.remove()
+            with _cancel_events_lock:
+                _cancel_events.pop(job_id, None)
+
+
+def fail_stale_jobs() -> int:
+    """
+    Помечает FAILED незавершенные задания других процессов без отметки дольше
+    JOB_HEARTBEAT_TIMEOUT_SECONDS (задания до появления отметок - по updated_at).
+    Вызывается при старте приложения и периодически из JobHeartbeat.
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=JOB_HEARTBEAT_TIMEOUT_SECONDS)
+    stale = (
+        Job.status.in_(JOB_UNFINISHED_STATUSES),
+        func.coalesce(Job.heartbeat_at, Job.updated_at) < stale_before,
+        func.coalesce(Job.runner_id, '') != runner_id()
+    )
+    # Сначала чтение: в обычном проходе прерванных заданий нет, и блокировка записи не нужна
+    if not db.session.query(Job.id).filter(*stale).first():
+        db.session.commit()
+        return 0
+    count = db.session.query(Job).filter(*stale).update({
+        Job.status: JobStatus.FAILED,
+        Job.error_message: "Interrupted: the server was restarted while the job was running",
+        Job.finished_at: datetime.utcnow()
+    }, synchronize_session=False)
+    db.session.commit()
+    if count:
+        logger.warning(f"Marked {count} interrupted jobs as failed")
+    return count
+
+
+def beat_running_jobs() -> int:
+    """ Ставит heartbeat_at незавершенным заданиям этого процесса. Возвращает число заданий. """
+    with _cancel_events_lock:
+        job_ids = list(_cancel_events)
+    if not job_ids:
+        return 0
+    count = db.session.execute(
+        update(Job)
+        .where(Job.id.in_(job_ids), Job.runner_id == runner_id(), Job.status.in_(JOB_UNFINISHED_STATUSES))
+        .values(heartbeat_at=datetime.utcnow(), updated_at=Job.updated_at)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+class JobHeartbeat:
+    """ Фоновый поток: отметки заданий этого процесса и поиск прерванных заданий других процессов. """
+
+    def __init__(self, app, interval: float = JOB_HEARTBEAT_SECONDS):
+        self.app = app
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run_forever, name='job-heartbeat', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_once(self):
+        with self.app.app_context():
+            try:
+                beat_running_jobs()
+                fail_stale_jobs()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Job heartbeat pass failed")
+            finally:
+                db.session.remove()
+
+    def run_forever(self):
+        while not self._stop_event.wait(self.interval):
+            self.run_once()
+
+
+def start_job_heartbeat(app):
+    """
+    Помечает прерванные задания и запускает JobHeartbeat. В debug-режиме с
+    перезагрузчиком поток запускается только в рабочем (дочернем) процессе.
+    """
+    try:
+        fail_stale_jobs()
+    except SQLAlchemyError as e:
+        # База еще без jobs.runner_id/heartbeat_at: приложение должно подняться, чтобы выполнить `flask db upgrade`
+        db.session.rollback()
+        logger.warning(f"Cannot check interrupted jobs (run `flask db upgrade`): {e}")
+    if os.environ.get('FLASK_DEBUG') == '1' and not is_running_from_reloader():
+        return None
+    heartbeat = JobHeartbeat(app)
+    app.extensions[JOB_HEARTBEAT_EXTENSION_KEY] = heartbeat
+    heartbeat.start()
+    return heartbeat
@@ -0,0 +1,200 @@
+import os
+import logging
+import re
+import mimetypes
+import uuid
+from collections import Counter
+
+from backend.models import db, Project, Collection, Generation, GeneratedFile, GenerationStatus, ModerationStatus
+from backend.constants import (
+    JobKinds, REINDEX_BATCH_FILES, SUPPORTED_IMAGE_EXTENSIONS, IMAGE_BLOB_FOLDER, CALLBACK_STAGING_FOLDER,
+    THUMBNAIL_FOLDER
+)
+from backend.features.grid_selection.grid_cells import refresh_grid_cells
+from backend.features.file_serving.blob_store import add_blob_refs, adopt_existing_file, blobs_enabled, file_sha256
+from backend.features.file_serving.thumbnails import schedule_thumbnails
+from backend.features.jobs.runner import JobContext, register_job_handler
+
+logger = logging.getLogger(__name__)
+
+# Регулярное выражение: ищет одну или более цифр в САМОМ НАЧАЛЕ строки (^\d+)
+COLLECTION_ID_REGEX = re.compile(r"^(\d+)")
+
+
+def reindex_project_files(project: Project, absolute_project_path: str, ctx: JobContext | None = None) -> dict:
+    """
+    Рекурсивно импортирует изображения из директории проекта как завершенные генерации.
+    Collection ID берется из цифр в начале имени файла; уже известные файлы пропускаются.
+
+    При IMAGE_STORE=blobs каждый импортированный файл связывается с хранилищем blob'ов:
+    дубликат уже известного содержимого заменяется ссылкой на blob (место на диске освобождается).
+
+    В фоновом задании (ctx) импорт фиксируется порциями по REINDEX_BATCH_FILES файлов:
+    после каждой порции - коммит, пересчет затронутых ячеек грида, прогресс и проверка
+    отмены. Отмененная переиндексация сохраняет уже импортированные порции.
+    """
+    total_files_scanned = 0
+    processed_files = 0
+    created_generations = 0
+    created_generated_files = 0
+    skipped_no_collection_id = 0
+    skipped_collection_not_found = 0
+    skipped_file_exists_in_db = 0
+    skipped_unsupported_extension = 0
+    errors = []
+    touched_cells = set() # (collection_id, project_id) ячеек грида, которые нужно пересчитать
+    reported_files = 0
+    use_blobs = blobs_enabled()
+    deduplicated_files = 0
+    blob_refs = Counter() # Ссылки на blob'ы текущей порции
+    blob_sizes = {}
+    batch_files = [] # GeneratedFile текущей порции - для миниатюр после коммита
+
+    def commit_files():
+        add_blob_refs(blob_refs, blob_sizes)
+        blob_refs.clear()
+        refresh_grid_cells(touched_cells)
+        db.session.flush()
+        thumbnail_sources = [(f.id, f.file_path, f.content_hash) for f in batch_files if f.id is not None]
+        batch_files.clear()
+        db.session.commit()
+        schedule_thumbnails(thumbnail_sources)
+
+    def commit_batch():
+        nonlocal reported_files
+        commit_files()
+        touched_cells.clear()
+        ctx.advance(total_files_scanned - reported_files, created_generations=created_generations)
+        reported_files = total_files_scanned
+        ctx.check_cancelled()
+
+    # Используем os.walk для рекурсивного обхода
+    for dirpath, dirnames, filenames in os.walk(absolute_project_path):
+        # Служебные папки хранилища (если проект лежит в корне GENERATED_FILES_FOLDER)
+        dirnames[:] = [d for d in dirnames if d not in (IMAGE_BLOB_FOLDER, CALLBACK_STAGING_FOLDER, THUMBNAIL_FOLDER)]
+        for filename in filenames:
+            total_files_scanned += 1 # Считаем все файлы
+            if ctx is not None and total_files_scanned - reported_files >= REINDEX_BATCH_FILES:
+                commit_batch()
+            file_abs_path = os.path.join(dirpath, filename)
+
+            _, ext = os.path.splitext(filename.lower())
+            if ext not in SUPPORTED_IMAGE_EXTENSIONS:
+                skipped_unsupported_extension += 1
+                logger.debug(f"Skipping '{file_abs_path}': unsupported extension '{ext}'.")
+                continue
+
+            processed_files += 1 # Считаем только файлы с нужным расширением
+
+            # 1. Парсинг Collection ID из имени файла
+            match = COLLECTION_ID_REGEX.match(filename)
+            if not match:
+                skipped_no_collection_id += 1
+                logger.debug(f"Skipping '{filename}' in '{dirpath}': no collection ID pattern found at the beginning.")
+                continue
+
+            try:
+                collection_id_from_name = int(match.group(1))
+            except ValueError:
+                skipped_no_collection_id += 1
+                logger.warning(f"Skipping '{filename}' in '{dirpath}': could not parse collection ID '{match.group(1)}' as integer.")
+                continue
+
+            # 2. Проверка существования коллекции
+            collection = Collection.query.get(collection_id_from_name)
+            if not collection:
+                skipped_collection_not_found += 1
+                logger.warning(f"Skipping '{filename}' in '{dirpath}': Collection with ID {collection_id_from_name} not found.")
+                continue
+
+            # 3. Проверка дубликатов GeneratedFile по пути
+            existing_db_file = GeneratedFile.query.filter_by(file_path=file_abs_path).first()
+            if existing_db_file:
+                skipped_file_exists_in_db += 1
+                logger.info(f"Skipping '{file_abs_path}': already exists in DB (GeneratedFile ID: {existing_db_file.id}).")
+                continue
+
+            try:
+                new_generation_id = str(uuid.uuid4())
+                new_generation = Generation(
+                    id=new_generation_id,
+                    project_id=project.id,
+                    collection_id=collection.id,
+                    status=GenerationStatus.COMPLETED,
+                    moderation_status=ModerationStatus.PENDING_MODERATION,
+                    final_positive_prompt=f"Imported: {filename}",
+                    final_negative_prompt="",
+                    generation_params={"source": "reindex", "original_filename": filename, "original_path": file_abs_path}
+                )
+                db.session.add(new_generation)
+                created_generations += 1
+
+                mime_type, _ = mimetypes.guess_type(file_abs_path)
+                size_bytes = os.path.getsize(file_abs_path)
+                content_hash = None
+                if use_blobs:
+                    content_hash = file_sha256(file_abs_path)
+                    if adopt_existing_file(file_abs_path, content_hash) == 'deduplicated':
+                        deduplicated_files += 1
+                    blob_refs[content_hash] += 1
+                    blob_sizes[content_hash] = size_bytes
+
+                new_db_file = GeneratedFile(
+                    generation_id=new_generation_id,
+                    file_path=file_abs_path,
+                    original_filename=filename,
+                    mime_type=mime_type,
+                    size_bytes=size_bytes,
+                    infotext=None,
+                    content_hash=content_hash
+                )
+                db.session.add(new_db_file)
+                batch_files.append(new_db_file)
+                created_generated_files += 1
+                touched_cells.add((collection.id, project.id))
+                logger.info(f"Prepared for import: '{file_abs_path}'. New Generation ID: {new_generation_id}")
+
+            except Exception as e_inner:
+                db.session.rollback()
+                error_msg = f"Error processing file '{file_abs_path}' for import: {str(e_inner)}"
+                logger.error(error_msg)
+                errors.append(error_msg)
+                # Сброс счетчиков, если ошибка произошла после инкремента
+                if 'new_generation' in locals() and new_generation in db.session: created_generations -= 1
+                if 'new_db_file' in locals() and new_db_file in db.session: created_generated_files -= 1
+                continue
+
+    commit_files()
+    if ctx is not None:
+        ctx.advance(total_files_scanned - reported_files, errors=len(errors), created_generations=created_generations)
+
+    summary_msg = f"Recursive reindex for project '{project.name}' path '{absolute_project_path}' completed."
+    logger.info(summary_msg)
+    return {
+        "message": summary_msg,
+        "path_checked": absolute_project_path,
+        "total_files_scanned": total_files_scanned, # Общее число файлов в директории и поддиректориях
+        "processed_image_files": processed_files, # Число файлов с поддерживаемым расширением
+        "created_generations": created_generations,
+        "created_generated_files": created_generated_files,
+        "deduplicated_files": deduplicated_files, # IMAGE_STORE=blobs: заменены ссылкой на уже известное содержимое
+        "skipped_details": {
+            "unsupported_extension": skipped_unsupported_extension,
+            "no_collection_id_pattern": skipped_no_collection_id,
+            "collection_not_found_in_db": skipped_collection_not_found,
+            "file_already_in_db": skipped_file_exists_in_db
+        },
+        "processing_errors_count": len(errors),
+        "processing_errors_examples": errors[:5]
+    }
+
+
+def run_project_reindex_job(ctx: JobContext, params: dict, payload=None) -> dict:
+    """ Задание PROJECT_REINDEX: путь проверен маршрутом, params = {project_id, path}. """
+    project = db.session.get(Project, params['project_id'])
+    if project is None:
+        raise ValueError(f"Project {params['project_id']} not found")
+    return reindex_project_files(project, params['path'], ctx)
+
+
+register_job_handler(JobKinds.PROJECT_REINDEX, run_project_reindex_job)
@@ -0,0 +1,44 @@
+"""Add Collection.last_generation_at (denormalized, indexed)
+
+Revision ID: 3f1c2a7b9d10
+Revises: 
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7b9d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Базы, созданные через db.create_all() после появления колонки, уже ее содержат
+    inspector = sa.inspect(op.get_bind())
+    columns = {c['name'] for c in inspector.get_columns('collections')}
+    if 'last_generation_at' not in columns:
+        with op.batch_alter_table('collections', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('last_generation_at', sa.DateTime(), nullable=True))
+            batch_op.create_index('ix_collections_last_generation_at_id', ['last_generation_at', 'id'], unique=False)
+
+    # Заполняем из существующих генераций. До 8b2e4d6f1a3c generations.collection_id - строка;
+    # если колонка уже целочисленная, сравниваем напрямую (PostgreSQL не сравнивает integer с varchar)
+    generation_columns = {c['name']: c['type'] for c in inspector.get_columns('generations')}
+    collection_id = 'collections.id'
+    if not isinstance(generation_columns['collection_id'], sa.Integer):
+        collection_id = 'CAST(collections.id AS VARCHAR)'
+    op.execute(
+        "UPDATE collections SET last_generation_at = ("
+        " SELECT max(generations.updated_at) FROM generations"
+        f" WHERE generations.collection_id = {collection_id})"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('collections', schema=None) as batch_op:
+        batch_op.drop_index('ix_collections_last_generation_at_id')
+        batch_op.drop_column('last_generation_at')
@@ -0,0 +1,47 @@
+"""Add generation outbox columns (submit attempts, next submit time, dispatch token)
+
+Revision ID: 5d9a3e1f7c24
+Revises: c41d7e9a2b58
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d9a3e1f7c24'
+down_revision = 'c41d7e9a2b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'generations' not in inspector.get_table_names():
+        return # Таблица будет создана db.create_all() сразу с колонками
+    columns = {c['name'] for c in inspector.get_columns('generations')}
+    if 'submit_attempts' not in columns:
+        with op.batch_alter_table('generations', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('submit_attempts', sa.Integer(), nullable=False, server_default='0'))
+            batch_op.add_column(sa.Column('next_submit_at', sa.DateTime(), nullable=True))
+            batch_op.add_column(sa.Column('dispatch_token', sa.String(length=36), nullable=True))
+            batch_op.create_index('ix_generations_outbox', ['status', 'next_submit_at'], unique=False)
+
+    # Диспетчер берет только PENDING с next_submit_at <= now, а сверка - только QUEUED:
+    # без срока оставшиеся от прежней версии PENDING-генерации никогда не были бы отправлены.
+    # Время в UTC, как его пишет приложение (datetime.utcnow()), а не CURRENT_TIMESTAMP сервера БД
+    op.get_bind().execute(
+        sa.text("UPDATE generations SET next_submit_at = :now WHERE status = 'PENDING' AND next_submit_at IS NULL"),
+        {'now': datetime.utcnow()}
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.drop_index('ix_generations_outbox')
+        batch_op.drop_column('dispatch_token')
+        batch_op.drop_column('next_submit_at')
+        batch_op.drop_column('submit_attempts')
@@ -0,0 +1,34 @@
+"""Add generations.queued_at (time the scheduler accepted the task) and its index
+
+Revision ID: 7a4c9e2d5b61
+Revises: 5d9a3e1f7c24
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4c9e2d5b61'
+down_revision = '5d9a3e1f7c24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'generations' not in inspector.get_table_names():
+        return # Таблица будет создана db.create_all() сразу с колонкой
+    columns = {c['name'] for c in inspector.get_columns('generations')}
+    if 'queued_at' in columns:
+        return
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('queued_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_generations_status_queued_at', ['status', 'queued_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.drop_index('ix_generations_status_queued_at')
+        batch_op.drop_column('queued_at')
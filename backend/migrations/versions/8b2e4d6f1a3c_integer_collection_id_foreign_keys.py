@@ -0,0 +1,54 @@
+"""Make generations.collection_id and selected_covers.collection_id integer FKs
+
+Revision ID: 8b2e4d6f1a3c
+Revises: 3f1c2a7b9d10
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d6f1a3c'
+down_revision = '3f1c2a7b9d10'
+branch_labels = None
+depends_on = None
+
+
+def _column_type(table_name, column_name):
+    columns = sa.inspect(op.get_bind()).get_columns(table_name)
+    return next(c['type'] for c in columns if c['name'] == column_name)
+
+
+def upgrade():
+    # Базы, созданные через db.create_all() после изменения моделей, уже содержат INTEGER
+    if not isinstance(_column_type('generations', 'collection_id'), sa.Integer):
+        with op.batch_alter_table('generations', schema=None) as batch_op:
+            batch_op.alter_column('collection_id',
+                                  existing_type=sa.String(length=36),
+                                  type_=sa.Integer(),
+                                  existing_nullable=False,
+                                  postgresql_using='collection_id::integer')
+
+    if not isinstance(_column_type('selected_covers', 'collection_id'), sa.Integer):
+        with op.batch_alter_table('selected_covers', schema=None) as batch_op:
+            batch_op.alter_column('collection_id',
+                                  existing_type=sa.String(length=36),
+                                  type_=sa.Integer(),
+                                  existing_nullable=False,
+                                  postgresql_using='collection_id::integer')
+
+
+def downgrade():
+    with op.batch_alter_table('selected_covers', schema=None) as batch_op:
+        batch_op.alter_column('collection_id',
+                              existing_type=sa.Integer(),
+                              type_=sa.String(length=36),
+                              existing_nullable=False)
+
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.alter_column('collection_id',
+                              existing_type=sa.Integer(),
+                              type_=sa.String(length=36),
+                              existing_nullable=False)
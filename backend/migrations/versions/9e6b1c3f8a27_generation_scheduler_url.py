@@ -0,0 +1,34 @@
+"""Add generations.scheduler_url (scheduler instance the task was sent to)
+
+Revision ID: 9e6b1c3f8a27
+Revises: 7a4c9e2d5b61
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e6b1c3f8a27'
+down_revision = '7a4c9e2d5b61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'generations' not in inspector.get_table_names():
+        return # Таблица будет создана db.create_all() сразу с колонкой
+    columns = {c['name'] for c in inspector.get_columns('generations')}
+    if 'scheduler_url' in columns:
+        return
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('scheduler_url', sa.String(length=255), nullable=True))
+        batch_op.create_index('ix_generations_scheduler_url_status', ['scheduler_url', 'status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.drop_index('ix_generations_scheduler_url_status')
+        batch_op.drop_column('scheduler_url')
@@ -0,0 +1,34 @@
+"""Add jobs.runner_id and jobs.heartbeat_at (detect jobs interrupted by a restart)
+
+Revision ID: a6c1e8f3b7d2
+Revises: d3a7c9e1f4b6
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c1e8f3b7d2'
+down_revision = 'd3a7c9e1f4b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'jobs' not in inspector.get_table_names():
+        return
+    columns = {c['name'] for c in inspector.get_columns('jobs')}
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        if 'runner_id' not in columns:
+            batch_op.add_column(sa.Column('runner_id', sa.String(length=64), nullable=True))
+        if 'heartbeat_at' not in columns:
+            batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.drop_column('heartbeat_at')
+        batch_op.drop_column('runner_id')
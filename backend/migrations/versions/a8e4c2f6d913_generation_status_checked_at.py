@@ -0,0 +1,32 @@
+"""Add generations.status_checked_at (reconciliation of stale queued generations)
+
+Revision ID: a8e4c2f6d913
+Revises: f1c7a3d9e5b2
+Create Date: 2026-10-17 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8e4c2f6d913'
+down_revision = 'f1c7a3d9e5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'generations' not in inspector.get_table_names():
+        return # Таблица будет создана db.create_all() сразу с колонкой
+    columns = {c['name'] for c in inspector.get_columns('generations')}
+    if 'status_checked_at' in columns:
+        return
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status_checked_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.drop_column('status_checked_at')
@@ -0,0 +1,34 @@
+"""Add generations.params_hash (dedup of identical in-flight generations)
+
+Revision ID: b3d8f0a4c612
+Revises: 9e6b1c3f8a27
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d8f0a4c612'
+down_revision = '9e6b1c3f8a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'generations' not in inspector.get_table_names():
+        return # Таблица будет создана db.create_all() сразу с колонкой
+    columns = {c['name'] for c in inspector.get_columns('generations')}
+    if 'params_hash' in columns:
+        return
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('params_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_generations_params_hash_status', ['params_hash', 'status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.drop_index('ix_generations_params_hash_status')
+        batch_op.drop_column('params_hash')
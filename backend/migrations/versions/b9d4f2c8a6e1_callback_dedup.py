@@ -0,0 +1,44 @@
+"""Add generations.callback_digest and generated_files.content_hash (idempotent scheduler callbacks)
+
+Revision ID: b9d4f2c8a6e1
+Revises: e7b3d1a9c5f2
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9d4f2c8a6e1'
+down_revision = 'e7b3d1a9c5f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+    if 'generations' in tables:
+        columns = {c['name'] for c in inspector.get_columns('generations')}
+        if 'callback_digest' not in columns:
+            with op.batch_alter_table('generations', schema=None) as batch_op:
+                batch_op.add_column(sa.Column('callback_digest', sa.String(length=64), nullable=True))
+    if 'generated_files' in tables:
+        columns = {c['name'] for c in inspector.get_columns('generated_files')}
+        if 'content_hash' not in columns:
+            with op.batch_alter_table('generated_files', schema=None) as batch_op:
+                batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        indexes = {i['name'] for i in inspector.get_indexes('generated_files')}
+        if 'ux_generated_files_generation_hash' not in indexes:
+            # Существующие файлы без хэша (NULL) ограничению уникальности не мешают
+            op.create_index('ux_generated_files_generation_hash', 'generated_files',
+                            ['generation_id', 'content_hash'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ux_generated_files_generation_hash', table_name='generated_files')
+    with op.batch_alter_table('generated_files', schema=None) as batch_op:
+        batch_op.drop_column('content_hash')
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.drop_column('callback_digest')
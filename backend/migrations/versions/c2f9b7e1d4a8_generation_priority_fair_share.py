@@ -0,0 +1,41 @@
+"""Add generations.priority / requested_by and projects.queue_weight (priority and fair-share dispatch)
+
+Revision ID: c2f9b7e1d4a8
+Revises: a8e4c2f6d913
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2f9b7e1d4a8'
+down_revision = 'a8e4c2f6d913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+    if 'generations' in tables: # Иначе таблица будет создана db.create_all() сразу с колонками
+        columns = {c['name'] for c in inspector.get_columns('generations')}
+        with op.batch_alter_table('generations', schema=None) as batch_op:
+            if 'priority' not in columns:
+                batch_op.add_column(sa.Column('priority', sa.Integer(), nullable=False, server_default='0'))
+            if 'requested_by' not in columns:
+                batch_op.add_column(sa.Column('requested_by', sa.String(length=64), nullable=True))
+    if 'projects' in tables:
+        columns = {c['name'] for c in inspector.get_columns('projects')}
+        if 'queue_weight' not in columns:
+            with op.batch_alter_table('projects', schema=None) as batch_op:
+                batch_op.add_column(sa.Column('queue_weight', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('projects', schema=None) as batch_op:
+        batch_op.drop_column('queue_weight')
+    with op.batch_alter_table('generations', schema=None) as batch_op:
+        batch_op.drop_column('requested_by')
+        batch_op.drop_column('priority')
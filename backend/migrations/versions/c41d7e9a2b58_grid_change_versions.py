@@ -0,0 +1,62 @@
+"""Add grid change sequence, change_version columns and collection tombstones
+
+Revision ID: c41d7e9a2b58
+Revises: 8b2e4d6f1a3c
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e9a2b58'
+down_revision = '8b2e4d6f1a3c'
+branch_labels = None
+depends_on = None
+
+
+def _add_change_version(inspector, table_name, index_name):
+    if table_name not in inspector.get_table_names():
+        return # Таблица будет создана db.create_all() сразу с колонкой
+    if 'change_version' in {c['name'] for c in inspector.get_columns(table_name)}:
+        return
+    with op.batch_alter_table(table_name, schema=None) as batch_op:
+        batch_op.add_column(sa.Column('change_version', sa.BigInteger(), nullable=False, server_default='0'))
+        batch_op.create_index(index_name, ['change_version'], unique=False)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+
+    if 'change_sequence' not in tables:
+        op.create_table('change_sequence',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('version', sa.BigInteger(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'deleted_collections' not in tables:
+        op.create_table('deleted_collections',
+            sa.Column('collection_id', sa.Integer(), nullable=False),
+            sa.Column('change_version', sa.BigInteger(), nullable=False),
+            sa.Column('deleted_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('collection_id')
+        )
+        op.create_index('ix_deleted_collections_change_version', 'deleted_collections', ['change_version'], unique=False)
+
+    _add_change_version(inspector, 'collections', 'ix_collections_change_version')
+    _add_change_version(inspector, 'grid_cells', 'ix_grid_cells_change_version')
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table_name, index_name in (('grid_cells', 'ix_grid_cells_change_version'),
+                                   ('collections', 'ix_collections_change_version')):
+        if table_name in inspector.get_table_names():
+            with op.batch_alter_table(table_name, schema=None) as batch_op:
+                batch_op.drop_index(index_name)
+                batch_op.drop_column('change_version')
+    op.drop_index('ix_deleted_collections_change_version', table_name='deleted_collections')
+    op.drop_table('deleted_collections')
+    op.drop_table('change_sequence')
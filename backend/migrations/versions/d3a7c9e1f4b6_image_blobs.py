@@ -0,0 +1,34 @@
+"""Add image_blobs table (content-addressed image store)
+
+Revision ID: d3a7c9e1f4b6
+Revises: b9d4f2c8a6e1
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a7c9e1f4b6'
+down_revision = 'b9d4f2c8a6e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'image_blobs' in inspector.get_table_names():
+        return
+    op.create_table('image_blobs',
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('size_bytes', sa.Integer(), nullable=True),
+        sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('content_hash')
+    )
+
+
+def downgrade():
+    op.drop_table('image_blobs')
@@ -0,0 +1,44 @@
+"""Add generation_jobs table (background bulk generation jobs)
+
+Revision ID: d5a2e7b9c3f4
+Revises: b3d8f0a4c612
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a2e7b9c3f4'
+down_revision = 'b3d8f0a4c612'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'generation_jobs' in inspector.get_table_names():
+        return
+    op.create_table('generation_jobs',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('kind', sa.String(length=32), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('params', sa.JSON(), nullable=True),
+        sa.Column('total', sa.Integer(), nullable=True),
+        sa.Column('processed', sa.Integer(), nullable=False),
+        sa.Column('tasks_started', sa.Integer(), nullable=False),
+        sa.Column('coalesced', sa.Integer(), nullable=False),
+        sa.Column('errors', sa.Integer(), nullable=False),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_generation_jobs_status', 'generation_jobs', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_generation_jobs_status', table_name='generation_jobs')
+    op.drop_table('generation_jobs')
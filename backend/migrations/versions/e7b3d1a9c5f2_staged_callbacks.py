@@ -0,0 +1,43 @@
+"""Add staged_callbacks table (fast-ack scheduler callback ingest)
+
+Revision ID: e7b3d1a9c5f2
+Revises: c2f9b7e1d4a8
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3d1a9c5f2'
+down_revision = 'c2f9b7e1d4a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'staged_callbacks' in inspector.get_table_names():
+        return
+    op.create_table('staged_callbacks',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('generation_id', sa.String(length=36), nullable=False),
+        sa.Column('status', sa.String(length=32), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('files', sa.JSON(), nullable=True),
+        sa.Column('received_at', sa.DateTime(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('claim_token', sa.String(length=36), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_staged_callbacks_generation_id', 'staged_callbacks', ['generation_id'], unique=False)
+    op.create_index('ix_staged_callbacks_next_attempt_at', 'staged_callbacks', ['next_attempt_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_staged_callbacks_next_attempt_at', table_name='staged_callbacks')
+    op.drop_index('ix_staged_callbacks_generation_id', table_name='staged_callbacks')
+    op.drop_table('staged_callbacks')
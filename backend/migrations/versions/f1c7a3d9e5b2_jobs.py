@@ -0,0 +1,68 @@
+"""Replace generation_jobs with generic jobs table (background jobs of any kind)
+
+Revision ID: f1c7a3d9e5b2
+Revises: d5a2e7b9c3f4
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c7a3d9e5b2'
+down_revision = 'd5a2e7b9c3f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+    if 'jobs' not in tables:
+        op.create_table('jobs',
+            sa.Column('id', sa.String(length=36), nullable=False),
+            sa.Column('kind', sa.String(length=32), nullable=False),
+            sa.Column('status', sa.String(length=16), nullable=False),
+            sa.Column('params', sa.JSON(), nullable=True),
+            sa.Column('total', sa.Integer(), nullable=True),
+            sa.Column('processed', sa.Integer(), nullable=False),
+            sa.Column('errors', sa.Integer(), nullable=False),
+            sa.Column('result', sa.JSON(), nullable=True),
+            sa.Column('error_message', sa.Text(), nullable=True),
+            sa.Column('cancel_requested', sa.Boolean(), nullable=False, server_default=sa.false()),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_jobs_kind', 'jobs', ['kind'], unique=False)
+        op.create_index('ix_jobs_status', 'jobs', ['status'], unique=False)
+    # Задания массовой генерации теперь хранятся в jobs; история прежней таблицы не переносится
+    if 'generation_jobs' in tables:
+        op.drop_index('ix_generation_jobs_status', table_name='generation_jobs')
+        op.drop_table('generation_jobs')
+
+
+def downgrade():
+    op.drop_index('ix_jobs_status', table_name='jobs')
+    op.drop_index('ix_jobs_kind', table_name='jobs')
+    op.drop_table('jobs')
+    op.create_table('generation_jobs',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('kind', sa.String(length=32), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('params', sa.JSON(), nullable=True),
+        sa.Column('total', sa.Integer(), nullable=True),
+        sa.Column('processed', sa.Integer(), nullable=False),
+        sa.Column('tasks_started', sa.Integer(), nullable=False),
+        sa.Column('coalesced', sa.Integer(), nullable=False),
+        sa.Column('errors', sa.Integer(), nullable=False),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_generation_jobs_status', 'generation_jobs', ['status'], unique=False)
@@ -1,11 +1,52 @@
 import enum
+import os
 import uuid
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from flask import url_for
+from flask import current_app, has_request_context, request, url_for
+from backend.constants import CellStatus, JobStatus, GENERATION_PRIORITY_NAMES
 
 db = SQLAlchemy() # Создаем экземпляр SQLAlchemy здесь
 
+GENERATED_FILE_ENDPOINT = 'file_serving.serve_generated_file'
+
+
+def generated_file_url_prefix() -> str:
+    """
+    Префикс URL сгенерированных файлов ('http://host/generated_files/'), к которому
+    дописывается ID файла. Строится одним вызовом url_for: один раз на приложение,
+    если задан PUBLIC_BASE_URL, иначе один раз на запрос (хост берется из запроса;
+    вне запроса - из FLASK_CALLBACK_BASE_URL).
+    """
+    public_base_url = current_app.config.get('PUBLIC_BASE_URL')
+    if public_base_url:
+        prefix = current_app.extensions.get('generated_file_url_prefix')
+        if prefix is None:
+            path = current_app.url_map.bind('localhost').build(GENERATED_FILE_ENDPOINT, {'file_id': 0})
+            prefix = public_base_url.rstrip('/') + path[:-1]
+            current_app.extensions['generated_file_url_prefix'] = prefix
+        return prefix
+    if has_request_context():
+        # Кэш в environ запроса, а не в g: контекст приложения может охватывать несколько запросов
+        prefix = request.environ.get('backend.generated_file_url_prefix')
+        if prefix is None:
+            prefix = url_for(GENERATED_FILE_ENDPOINT, file_id=0, _external=True, _scheme='http')[:-1]
+            request.environ['backend.generated_file_url_prefix'] = prefix
+        return prefix
+    # Вне запроса (сверка с планировщиком, фоновые задания) хоста запроса нет:
+    # берем адрес, по которому приложение доступно планировщику
+    callback_base_url = os.environ.get('FLASK_CALLBACK_BASE_URL')
+    if callback_base_url:
+        path = current_app.url_map.bind('localhost').build(GENERATED_FILE_ENDPOINT, {'file_id': 0})
+        return callback_base_url.rstrip('/') + path[:-1]
+    return url_for(GENERATED_FILE_ENDPOINT, file_id=0, _external=True, _scheme='http')[:-1]
+
+
+def serialize_generated_files(files) -> list[dict]:
+    """ Сериализует список файлов с одним построением префикса URL на весь список. """
+    url_prefix = generated_file_url_prefix() if files else None
+    return [f.to_dict(url_prefix=url_prefix) for f in files]
+
 # Определяем Enum для статусов генерации
 class GenerationStatus(enum.Enum):
     PENDING = "pending"
@@ -38,6 +79,7 @@ class Project(db.Model):
     base_negative_prompt = db.Column(db.Text, nullable=True, default='')
     default_width = db.Column(db.Integer, nullable=False, default=512)
     default_height = db.Column(db.Integer, nullable=False, default=512)
+    queue_weight = db.Column(db.Integer, nullable=False, default=1, server_default='1') # Доля проекта в отправке генераций (fair_share.py)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     generations = db.relationship('Generation', back_populates='project', lazy='dynamic')
@@ -56,6 +98,7 @@ class Project(db.Model):
             'base_negative_prompt': self.base_negative_prompt,
             'default_width': self.default_width,
             'default_height': self.default_height,
+            'queue_weight': self.queue_weight,
             'created_at': self.created_at.isoformat() + 'Z',
             'updated_at': self.updated_at.isoformat() + 'Z'
         }
@@ -69,6 +112,10 @@ class Collection(db.Model):
     collection_positive_prompt = db.Column(db.Text, nullable=True, default='')
     collection_negative_prompt = db.Column(db.Text, nullable=True, default='')
     comment = db.Column(db.Text, nullable=True)
+    # Денормализованное max(Generation.updated_at); поддерживается refresh_grid_cell (grid_cells.py)
+    last_generation_at = db.Column(db.DateTime, nullable=True)
+    # Версия последнего изменения (глобальная последовательность, см. grid_selection/changes.py)
+    change_version = db.Column(db.BigInteger, nullable=False, default=0, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     generations = db.relationship('Generation', back_populates='collection', lazy='dynamic')
@@ -84,6 +131,7 @@ class Collection(db.Model):
             'collection_positive_prompt': self.collection_positive_prompt,
             'collection_negative_prompt': self.collection_negative_prompt,
             'comment': self.comment,
+            'last_generation_at': self.last_generation_at.isoformat() + 'Z' if self.last_generation_at else None,
             'created_at': self.created_at.isoformat() + 'Z',
             'updated_at': self.updated_at.isoformat() + 'Z'
         }
@@ -92,7 +140,7 @@ class Generation(db.Model):
     __tablename__ = 'generations'
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     project_id = db.Column(db.String(36), db.ForeignKey('projects.id'), nullable=False, index=True)
-    collection_id = db.Column(db.String(36), db.ForeignKey('collections.id'), nullable=False, index=True)
+    collection_id = db.Column(db.Integer, db.ForeignKey('collections.id'), nullable=False, index=True)
     scheduler_task_id = db.Column(db.String, nullable=True, index=True)
     status = db.Column(db.Enum(GenerationStatus), default=GenerationStatus.PENDING, nullable=False, index=True)
     moderation_status = db.Column(db.Enum(ModerationStatus), default=ModerationStatus.PENDING_MODERATION, nullable=False, index=True)
@@ -100,6 +148,17 @@ class Generation(db.Model):
     final_negative_prompt = db.Column(db.Text, nullable=True)
     generation_params = db.Column(db.JSON, nullable=True)
     error_message = db.Column(db.Text, nullable=True)
+    # Outbox отправки в планировщик (используется, пока status == PENDING)
+    submit_attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_submit_at = db.Column(db.DateTime, nullable=True) # Когда можно (пере)отправить; также срок аренды диспетчера
+    dispatch_token = db.Column(db.String(36), nullable=True) # Метка пачки, захваченной диспетчером
+    queued_at = db.Column(db.DateTime, nullable=True) # Когда планировщик принял задачу (для задержки callback'а)
+    scheduler_url = db.Column(db.String(255), nullable=True) # Экземпляр планировщика, на который отправлена задача
+    params_hash = db.Column(db.String(64), nullable=True) # sha256 пары и итоговых параметров (поиск повторных постановок)
+    status_checked_at = db.Column(db.DateTime, nullable=True) # Последняя сверка QUEUED-генерации с планировщиком (reconciler.py)
+    priority = db.Column(db.Integer, nullable=False, default=0, server_default='0') # GENERATION_PRIORITY_VALUES: выше - раньше отправка
+    requested_by = db.Column(db.String(64), nullable=True) # Клиент/сессия (X-Client-Id): справедливое разделение внутри проекта
+    callback_digest = db.Column(db.String(64), nullable=True) # Отпечаток принятого callback'а: повтор той же доставки игнорируется
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     project = db.relationship('Project', back_populates='generations')
@@ -122,11 +181,12 @@ class Generation(db.Model):
             'final_negative_prompt': self.final_negative_prompt,
             'generation_params': self.generation_params,
             'error_message': self.error_message,
+            'priority': GENERATION_PRIORITY_NAMES.get(self.priority, self.priority),
             'created_at': self.created_at.isoformat() + 'Z',
             'updated_at': self.updated_at.isoformat() + 'Z'
         }
         if include_files:
-             data['generated_files'] = [f.to_dict() for f in self.generated_files]
+             data['generated_files'] = serialize_generated_files(self.generated_files)
         return data
 
 class GeneratedFile(db.Model):
@@ -138,20 +198,21 @@ class GeneratedFile(db.Model):
     mime_type = db.Column(db.String, nullable=True)
     size_bytes = db.Column(db.Integer, nullable=True)
     infotext = db.Column(db.Text, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True) # SHA-256 содержимого (файлы из callback'ов)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     generation = db.relationship('Generation', back_populates='generated_files')
+    # Один и тот же файл не записывается в генерацию дважды (повторные callback'и)
+    __table_args__ = (db.Index('ux_generated_files_generation_hash', 'generation_id', 'content_hash', unique=True),)
     # selected_cover = db.relationship('SelectedCover', backref='generated_file', uselist=False, cascade="all, delete-orphan") # Может вызвать проблемы
 
     def __repr__(self):
         return f'<GeneratedFile {self.file_path} (Gen: {self.generation_id})>'
     
-    def get_url(self):
-        """ Возвращает полный URL для доступа к файлу. """
-        # Используем имя нового Blueprint: 'file_serving'
-        # И новый параметр file_id вместо filepath
-        return url_for('file_serving.serve_generated_file', file_id=self.id, _external=True, _scheme='http')
+    def get_url(self, url_prefix: str | None = None):
+        """ Возвращает полный URL для доступа к файлу (префикс можно передать заранее вычисленным). """
+        return (url_prefix or generated_file_url_prefix()) + str(self.id)
 
-    def to_dict(self): # Метод для сериализации
+    def to_dict(self, url_prefix: str | None = None): # Метод для сериализации
         return {
             'id': self.id,
             'generation_id': self.generation_id,
@@ -161,13 +222,13 @@ class GeneratedFile(db.Model):
             'size_bytes': self.size_bytes,
             'infotext': self.infotext,
             'created_at': self.created_at.isoformat() + 'Z',
-            'url': self.get_url() # Добавляем URL
+            'url': self.get_url(url_prefix) # Добавляем URL
         }
 
 
 class SelectedCover(db.Model):
     __tablename__ = 'selected_covers'
-    collection_id = db.Column(db.String(36), db.ForeignKey('collections.id'), primary_key=True)
+    collection_id = db.Column(db.Integer, db.ForeignKey('collections.id'), primary_key=True)
     project_id = db.Column(db.String(36), db.ForeignKey('projects.id'), primary_key=True)
     generation_id = db.Column(db.String(36), db.ForeignKey('generations.id'), nullable=False, index=True)
     generated_file_id = db.Column(db.Integer, db.ForeignKey('generated_files.id'), nullable=True)
@@ -182,11 +243,152 @@ class SelectedCover(db.Model):
     def __repr__(self):
         return f'<SelectedCover C:{self.collection_id} P:{self.project_id} G:{self.generation_id}>'
 
+class GridCell(db.Model):
+    """
+    Денормализованное состояние ячейки грида (коллекция × проект).
+    Поддерживается сервисами генерации/выбора обложек в той же транзакции,
+    что и изменения исходных таблиц (см. features/grid_selection/grid_cells.py).
+    Строка существует только для пар, у которых есть генерация или выбранная обложка.
+    """
+    __tablename__ = 'grid_cells'
+    collection_id = db.Column(db.Integer, db.ForeignKey('collections.id'), primary_key=True)
+    project_id = db.Column(db.String(36), db.ForeignKey('projects.id'), primary_key=True)
+    status = db.Column(db.String(32), nullable=False, default=CellStatus.NOT_GENERATED)
+    is_selected = db.Column(db.Boolean, nullable=False, default=False)
+    generation_id = db.Column(db.String(36), db.ForeignKey('generations.id'), nullable=True)
+    generated_file_id = db.Column(db.Integer, db.ForeignKey('generated_files.id'), nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+    change_version = db.Column(db.BigInteger, nullable=False, default=0, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    generated_file = db.relationship('GeneratedFile')
+
+    def __repr__(self):
+        return f'<GridCell C:{self.collection_id} P:{self.project_id} [{self.status}]>'
+
+    def to_dict(self, url_prefix: str | None = None): # Формат ячейки, который ожидает фронтенд
+        return {
+            'status': self.status,
+            'generation_id': self.generation_id,
+            'file_url': self.generated_file.get_url(url_prefix) if self.generated_file else None,
+            'file_path': self.generated_file.file_path if self.generated_file else None,
+            'is_selected': self.is_selected,
+            'error_message': self.error_message
+        }
+
+class ChangeSequence(db.Model):
+    """
+    Глобальная монотонная последовательность изменений грида (одна строка, id=1).
+    Увеличивается при записи Collection/Generation/SelectedCover в той же транзакции.
+    """
+    __tablename__ = 'change_sequence'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ChangeSequence {self.version}>'
+
+
+class DeletedCollection(db.Model):
+    """ Надгробие удаленной коллекции, чтобы клиенты узнали об удалении через /grid-data/changes. """
+    __tablename__ = 'deleted_collections'
+    collection_id = db.Column(db.Integer, primary_key=True)
+    change_version = db.Column(db.BigInteger, nullable=False, index=True)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<DeletedCollection {self.collection_id} (v{self.change_version})>'
+
+class ImageBlob(db.Model):
+    """
+    Содержимое изображения в контентно-адресуемом хранилище (IMAGE_STORE=blobs):
+    путь к blob'у и число GeneratedFile с этим content_hash (см. features/file_serving/blob_store.py).
+    """
+    __tablename__ = 'image_blobs'
+    content_hash = db.Column(db.String(64), primary_key=True) # SHA-256
+    path = db.Column(db.String, nullable=False) # Относительно GENERATED_FILES_FOLDER
+    size_bytes = db.Column(db.Integer, nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<ImageBlob {self.content_hash[:12]} refs={self.ref_count}>'
+
+
+class StagedCallback(db.Model):
+    """
+    Принятый, но еще не обработанный callback планировщика: статус, ошибка и файлы,
+    уже лежащие в staging (см. features/image_generation/callback_ingest.py).
+    """
+    __tablename__ = 'staged_callbacks'
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    generation_id = db.Column(db.String(36), nullable=False, index=True) # Без FK: callback может прийти для удаленной генерации
+    status = db.Column(db.String(32), nullable=True) # Статус из формы callback'а ('done', 'failed', ...)
+    error_message = db.Column(db.Text, nullable=True)
+    files = db.Column(db.JSON, nullable=True) # [{staged_name, original_filename, mime_type, size_bytes}]
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True) # Готовность к обработке / срок захвата
+    claim_token = db.Column(db.String(36), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return f'<StagedCallback {self.id} for {self.generation_id} [{self.status}]>'
+
+
+class Job(db.Model):
+    """
+    Фоновое задание (массовая генерация, переиндексация проекта, импорт CSV):
+    параметры, состояние, прогресс и итог (см. features/jobs/runner.py).
+    """
+    __tablename__ = 'jobs'
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    kind = db.Column(db.String(32), nullable=False, index=True)
+    status = db.Column(db.String(16), nullable=False, default=JobStatus.PENDING, index=True)
+    params = db.Column(db.JSON, nullable=True)
+    total = db.Column(db.Integer, nullable=True) # Объем работы, если известен заранее
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Integer, nullable=False, default=0)
+    result = db.Column(db.JSON, nullable=True) # Итог (или промежуточные счетчики) в формате синхронного ответа
+    error_message = db.Column(db.Text, nullable=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    # Процесс, выполняющий задание, и его последняя отметка: задание без живого исполнителя - прервано
+    runner_id = db.Column(db.String(64), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<Job {self.id} [{self.kind}/{self.status}] {self.processed}/{self.total}>'
+
+    def to_dict(self, include_result: bool = True):
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'params': self.params,
+            'total': self.total,
+            'processed': self.processed,
+            'errors': self.errors,
+            'progress': round(min(self.processed / self.total, 1.0), 4) if self.total else (1.0 if self.total == 0 else None),
+            'error_message': self.error_message,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at.isoformat() + 'Z',
+            'updated_at': self.updated_at.isoformat() + 'Z',
+            'started_at': self.started_at.isoformat() + 'Z' if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() + 'Z' if self.finished_at else None
+        }
+        if include_result:
+            data['result'] = self.result
+        return data
+
 # --- Индексы ---
 # Индексы для Collection
 db.Index('ix_collections_name', Collection.name)
 db.Index('ix_collections_created_at', Collection.created_at)
 db.Index('ix_collections_updated_at', Collection.updated_at) # Если будет сортировка по updated_at
+db.Index('ix_collections_last_generation_at_id', Collection.last_generation_at, Collection.id) # Сортировка + keyset по last_generation_at
 
 # Индекс для Generation для быстрого поиска последней генерации для пары collection/project
 db.Index('ix_generation_collection_project_updated', 
@@ -194,8 +396,17 @@ db.Index('ix_generation_collection_project_updated',
          Generation.project_id, 
          Generation.updated_at.desc()) # .desc() важно для ORDER BY updated_at DESC LIMIT 1
 
+# Индекс для выборки очереди отправки (PENDING, готовые к отправке)
+db.Index('ix_generations_outbox', Generation.status, Generation.next_submit_at)
+db.Index('ix_generations_status_queued_at', Generation.status, Generation.queued_at) # Генерации в очереди планировщика
+db.Index('ix_generations_scheduler_url_status', Generation.scheduler_url, Generation.status) # Незавершенные задачи экземпляра
+db.Index('ix_generations_params_hash_status', Generation.params_hash, Generation.status) # Незавершенные генерации с теми же параметрами
+
 # Индекс для SelectedCover для связи с GeneratedFile
 db.Index('ix_selected_covers_generated_file_id', SelectedCover.generated_file_id)
 
+# Индекс для фильтров грида по проекту (not_selected / not_generated)
+db.Index('ix_grid_cells_project_selected', GridCell.project_id, GridCell.is_selected)
+
 # Можно добавить простой индекс на Generation.created_at, если он будет часто использоваться для сортировки/фильтрации
 # db.Index('ix_generations_created_at', Generation.created_at)
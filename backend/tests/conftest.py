@@ -0,0 +1,192 @@
+"""
+Общие фикстуры тестов: приложение на временной SQLite-базе и локальные
+фейковые экземпляры agent-scheduler (ThreadingHTTPServer в фоновом потоке).
+
+Запуск из корня репозитория:
+    python -m pytest
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend.constants import SCHEDULER_QUEUE_TXT2IMG_PATH, SchedulerTaskStatus
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    Приложение без фоновых потоков диспетчера и приема callback'ов (тесты вызывают их сами);
+    поток отметок фоновых заданий останавливается после теста.
+    """
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv('GENERATED_FILES_FOLDER', str(tmp_path / 'generated'))
+    monkeypatch.setenv('FLASK_DEBUG', '0')
+    monkeypatch.setenv('FLASK_CALLBACK_BASE_URL', 'http://127.0.0.1:5001')
+    monkeypatch.setenv('GENERATION_DISPATCHER', 'off')
+    monkeypatch.setenv('GENERATION_RECONCILE_INTERVAL', '0')
+    monkeypatch.setenv('SCHEDULER_BACKPRESSURE', 'off')
+    monkeypatch.setenv('SCHEDULER_SUBMIT_RATE', '0')
+    monkeypatch.setenv('CALLBACK_INGEST', 'inline')
+    monkeypatch.setenv('IMAGE_STORE', 'paths')
+    monkeypatch.setenv('THUMBNAIL_WORKERS', '0')
+    monkeypatch.setenv('PUBLIC_BASE_URL', '')
+    monkeypatch.delenv('A1111_SCHEDULER_URLS', raising=False)
+    from backend.app import create_app
+    from backend.models import db
+
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        yield app
+        job_heartbeat = app.extensions.get('job_heartbeat')
+        if job_heartbeat is not None:
+            job_heartbeat.stop()
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class FakeScheduler(ThreadingHTTPServer):
+    """
+    Фейковый agent-scheduler: принимает задачи POST /agent-scheduler/v1/queue/txt2img,
+    отдает их статус GET /agent-scheduler/v1/task/<id> и изображения
+    GET /agent-scheduler/v1/task/<id>/results. Поведение задается атрибутами:
+    fail_with - HTTP-статус ответа на отправку (None - задача принимается),
+    delay - задержка ответа в секундах.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _FakeSchedulerHandler)
+        self.lock = threading.Lock()
+        self.fail_with = None
+        self.delay = 0.0
+        self.submitted = [] # [(time.monotonic(), payload)] принятых запросов на отправку
+        self.tasks = {} # task_id -> SchedulerTaskStatus
+        self.results = {} # task_id -> [{'image': 'data:image/png;base64,...', 'infotext': ...}]
+        self.requests = [] # [(method, path)] всех полученных запросов
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def submit_count(self) -> int:
+        with self.lock:
+            return len(self.submitted)
+
+
+class _FakeSchedulerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        with server.lock:
+            server.requests.append(('POST', self.path))
+        if self.path != SCHEDULER_QUEUE_TXT2IMG_PATH:
+            return self.send_json(404, {'detail': 'Not found'})
+        with server.lock:
+            server.submitted.append((time.monotonic(), json.loads(body or b'{}')))
+            position = len(server.submitted)
+            fail_with, delay = server.fail_with, server.delay
+        if delay:
+            time.sleep(delay)
+        if fail_with is not None:
+            return self.send_json(fail_with, {'detail': 'fake scheduler error'})
+        task_id = str(uuid.uuid4())
+        with server.lock:
+            server.tasks[task_id] = SchedulerTaskStatus.PENDING
+        self.send_json(200, {'task_id': task_id, 'queue_position': position})
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/') # agent-scheduler/v1/task/<id>[/results]
+        is_task_path = len(parts) in (4, 5) and parts[:3] == ['agent-scheduler', 'v1', 'task']
+        task_id = parts[3] if is_task_path else None
+        with self.server.lock:
+            self.server.requests.append(('GET', self.path))
+            task_status = self.server.tasks.get(task_id)
+            results = self.server.results.get(task_id, [])
+        if task_status is None:
+            return self.send_json(404, {'detail': 'Task not found'})
+        if len(parts) == 5:
+            if parts[4] != 'results':
+                return self.send_json(404, {'detail': 'Not found'})
+            return self.send_json(200, {'success': True, 'data': results})
+        self.send_json(200, {'success': True, 'data': {'id': task_id, 'status': task_status}})
+
+    def send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def start_schedulers(monkeypatch):
+    """
+    Фабрика фейковых планировщиков: start_schedulers(count) запускает экземпляры и
+    прописывает их адреса в A1111_SCHEDULER_URLS (до первого обращения к пулу).
+    """
+    servers = []
+
+    def start(count: int = 1) -> list[FakeScheduler]:
+        started = [FakeScheduler() for _ in range(count)]
+        for server in started:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.extend(started)
+        monkeypatch.setenv('A1111_SCHEDULER_URLS', ','.join(server.url for server in servers))
+        return started
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def make_pairs(app):
+    """ Создает проекты и коллекции; возвращает пары в формате /generate-batch (по проектам внутри коллекции). """
+
+    def make(projects: int = 1, collections: int = 1) -> list[dict]:
+        from backend.models import db, Project, Collection
+        project_ids = [str(uuid.uuid4()) for _ in range(projects)]
+        db.session.add_all(Project(id=pid, name=f'project {i}', path=f'project_{i}') for i, pid in enumerate(project_ids))
+        start = (db.session.query(db.func.max(Collection.id)).scalar() or 0) + 1
+        collection_ids = list(range(start, start + collections))
+        db.session.add_all(Collection(id=cid, name=f'collection {cid}', collection_positive_prompt='portrait')
+                           for cid in collection_ids)
+        db.session.commit()
+        return [{'project_id': pid, 'collection_id': str(cid)} for cid in collection_ids for pid in project_ids]
+
+    return make
+
+
+@pytest.fixture
+def enqueue(make_pairs):
+    """
+    Ставит count генераций в очередь отправки (PENDING) так же, как /generate-batch;
+    планировщики должны быть уже запущены (start_schedulers).
+    """
+
+    def enqueue(count: int) -> list[str]:
+        from backend.features.image_generation.services import process_generation_request
+        results = process_generation_request(make_pairs(projects=1, collections=count))
+        assert not results['pair_errors'] and results['overall_error'] is None
+        return results['tasks_started']
+
+    return enqueue
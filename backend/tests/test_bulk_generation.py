@@ -0,0 +1,66 @@
+"""
+Массовая генерация по фильтру грида (bulk_generation.py) фоновым заданием.
+"""
+import time
+
+import pytest
+
+from backend.constants import JOB_FINISHED_STATUSES, JobStatus, GenerationStatusFilters
+from backend.models import db, Generation, GridCell
+from backend.features.image_generation import bulk_generation
+
+
+@pytest.fixture(autouse=True)
+def scheduler(start_schedulers):
+    return start_schedulers(1)[0]
+
+
+def run_job(client, path: str, body: dict, timeout: float = 30.0) -> dict:
+    response = client.post(path, json=body)
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['status'] in JOB_FINISHED_STATUSES:
+            return job
+        time.sleep(0.05)
+    pytest.fail(f"Job {job_id} did not finish in {timeout}s")
+
+
+@pytest.mark.parametrize('status_filter', [GenerationStatusFilters.NOT_GENERATED, GenerationStatusFilters.NOT_SELECTED, None])
+def test_generate_by_filter_covers_collections_split_across_chunks(client, make_pairs, monkeypatch, status_filter):
+    # Порция меньше числа видимых проектов: пары каждой коллекции попадают в разные порции
+    monkeypatch.setattr(bulk_generation, 'BULK_GENERATION_CHUNK_SIZE', 2)
+    pairs = make_pairs(projects=3, collections=4)
+    project_ids = sorted({pair['project_id'] for pair in pairs})
+
+    job = run_job(client, '/api/generate-by-filter', {
+        'visible_project_ids': project_ids, 'generation_status_filter': status_filter, 'dedup': 'off'
+    })
+
+    assert job['status'] == JobStatus.COMPLETED, job['error_message']
+    assert job['total'] == job['processed'] == len(pairs) == 12
+    assert len(job['result']['tasks_started']) == 12
+    db.session.expire_all()
+    assert {(cell.collection_id, cell.project_id) for cell in GridCell.query} == {
+        (int(pair['collection_id']), pair['project_id']) for pair in pairs
+    }
+    assert Generation.query.count() == 12
+
+
+def test_generate_by_filter_skips_generated_cells(client, make_pairs, monkeypatch):
+    monkeypatch.setattr(bulk_generation, 'BULK_GENERATION_CHUNK_SIZE', 2)
+    pairs = make_pairs(projects=3, collections=3)
+    project_ids = sorted({pair['project_id'] for pair in pairs})
+    body = {'visible_project_ids': project_ids, 'generation_status_filter': GenerationStatusFilters.NOT_GENERATED,
+            'dedup': 'off'}
+    first = run_job(client, '/api/generate-by-filter', body)
+    assert first['processed'] == 9
+
+    # Все ячейки уже с генерациями: повторный запуск ничего не ставит
+    second = run_job(client, '/api/generate-by-filter', body)
+
+    assert second['status'] == JobStatus.COMPLETED
+    assert second['total'] == second['processed'] == 0
+    assert Generation.query.count() == 9
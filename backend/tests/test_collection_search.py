@@ -0,0 +1,61 @@
+"""
+Поиск коллекций (collection_management/search.py): keyset-пагинация по релевантности.
+"""
+import pytest
+
+from backend.models import db, Collection
+from backend.utils.pagination import decode_cursor
+from backend.features.collection_management.search import SEARCH_RANK_DECIMALS
+
+
+@pytest.fixture
+def collections(app):
+    if not app.config.get('COLLECTION_SEARCH_FTS'):
+        pytest.skip("SQLite without FTS5 trigram tokenizer")
+    names = (['sunset portrait'] * 12 # Одинаковый текст - равный ранг, порядок по id
+             + [f'sunset portrait {word}' for word in ('beach', 'city', 'forest', 'lake', 'mountain')]
+             + ['portrait at sunset', 'old sunset photo', 'sunrise'])
+    db.session.add_all(Collection(id=index + 1, name=name, collection_positive_prompt=f'style {index % 3}')
+                       for index, name in enumerate(names))
+    db.session.commit()
+    return names
+
+
+def fetch_pages(client, search: str, limit: int) -> tuple[list[int], list[str]]:
+    ids, cursors, cursor = [], [], ''
+    while True:
+        response = client.get('/api/collections', query_string={'search': search, 'limit': limit, 'cursor': cursor})
+        assert response.status_code == 200, response.get_json()
+        page = response.get_json()
+        ids.extend(item['id'] for item in page['items'])
+        if not page['has_next']:
+            return ids, cursors
+        cursor = page['next_cursor']
+        cursors.append(cursor)
+
+
+@pytest.mark.parametrize('limit', [1, 3, 4, 7])
+def test_relevance_pages_cover_every_match_once(client, collections, limit):
+    full = [item['id'] for item in client.get('/api/collections', query_string={'search': 'sunset'}).get_json()]
+
+    ids, _ = fetch_pages(client, 'sunset', limit)
+
+    assert len(full) == len(collections) - 1 # 'sunrise' не подходит
+    assert ids == full
+    assert len(set(ids)) == len(ids)
+
+
+def test_relevance_ties_are_ordered_by_id(client, collections):
+    ids, _ = fetch_pages(client, 'sunset', 5)
+
+    tied = [collection_id for collection_id in ids if collections[collection_id - 1] == 'sunset portrait']
+    assert tied == sorted(tied) == list(range(1, 13))
+
+
+def test_relevance_cursor_stores_rounded_rank(client, collections):
+    _, cursors = fetch_pages(client, 'sunset', 4)
+
+    assert cursors
+    for cursor in cursors:
+        rank, _ = decode_cursor(cursor, 'relevance', 'asc')
+        assert rank == round(rank, SEARCH_RANK_DECIMALS)
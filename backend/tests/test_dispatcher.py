@@ -0,0 +1,222 @@
+"""
+Очередь отправки генераций (dispatcher.py) против локального фейкового планировщика.
+"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.constants import DISPATCH_BACKOFF_BASE_SECONDS, DISPATCH_LEASE_SECONDS
+from backend.models import db, Generation, GenerationStatus
+from backend.features.image_generation import dispatcher, scheduler_client
+from backend.features.image_generation.scheduler_client import RateLimiter
+
+
+@pytest.fixture
+def scheduler(start_schedulers):
+    return start_schedulers(1)[0]
+
+
+@pytest.fixture
+def enqueue(enqueue, scheduler):
+    return enqueue
+
+
+def generations(ids: list[str]) -> list[Generation]:
+    db.session.expire_all()
+    return Generation.query.filter(Generation.id.in_(ids)).all()
+
+
+def test_enqueue_inserts_pending_without_contacting_scheduler(enqueue, scheduler):
+    ids = enqueue(3)
+
+    assert {g.status for g in generations(ids)} == {GenerationStatus.PENDING}
+    assert scheduler.submit_count == 0
+
+
+def test_claim_leases_pending_generations(enqueue):
+    ids = enqueue(3)
+
+    token, claimed = dispatcher.claim_due_generations()
+
+    assert sorted(g.id for g in claimed) == sorted(ids)
+    lease_until = datetime.utcnow() + timedelta(seconds=DISPATCH_LEASE_SECONDS)
+    for generation in generations(ids):
+        assert generation.status == GenerationStatus.PENDING
+        assert generation.dispatch_token == token
+        assert abs((generation.next_submit_at - lease_until).total_seconds()) < 5
+    # Пока аренда не истекла, другой проход эти генерации не захватывает
+    assert dispatcher.claim_due_generations()[1] == []
+
+
+def test_expired_lease_is_claimed_again(enqueue):
+    ids = enqueue(2)
+    first_token, _ = dispatcher.claim_due_generations()
+    # Процесс, захвативший пачку, "упал": аренда истекла
+    Generation.query.filter(Generation.id.in_(ids)).update(
+        {Generation.next_submit_at: datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False
+    )
+    db.session.commit()
+
+    second_token, claimed = dispatcher.claim_due_generations()
+
+    assert second_token != first_token
+    assert sorted(g.id for g in claimed) == sorted(ids)
+
+
+def test_dispatch_moves_pending_to_queued(enqueue, scheduler):
+    ids = enqueue(3)
+
+    outcomes = dispatcher.dispatch_due_generations()
+
+    assert outcomes == {gid: (dispatcher.OUTCOME_QUEUED, None) for gid in ids}
+    for generation in generations(ids):
+        assert generation.status == GenerationStatus.QUEUED
+        assert generation.scheduler_task_id in scheduler.tasks
+        assert generation.scheduler_url == scheduler.url
+        assert generation.dispatch_token is None and generation.next_submit_at is None
+        assert generation.queued_at is not None
+    callback_urls = {payload['callback_url'] for _, payload in scheduler.submitted}
+    assert callback_urls == {f'http://127.0.0.1:5001/api/scheduler_callback/{gid}' for gid in ids}
+
+
+@pytest.mark.parametrize('status', [500, 503, 429])
+def test_retryable_error_backs_off(enqueue, scheduler, status):
+    scheduler.fail_with = status
+    [generation_id] = enqueue(1)
+
+    started = datetime.utcnow()
+    outcomes = dispatcher.dispatch_due_generations()
+
+    assert outcomes[generation_id][0] == dispatcher.OUTCOME_RETRY
+    [generation] = generations([generation_id])
+    assert generation.status == GenerationStatus.PENDING
+    assert generation.submit_attempts == 1
+    assert str(status) in generation.error_message
+    assert generation.dispatch_token is None
+    # Первая повторная попытка - через [base/2, base] секунд (экспонента с джиттером)
+    delay = (generation.next_submit_at - started).total_seconds()
+    assert DISPATCH_BACKOFF_BASE_SECONDS / 2 - 1 <= delay <= DISPATCH_BACKOFF_BASE_SECONDS + 1
+    # До истечения задержки генерация повторно не отправляется
+    assert dispatcher.dispatch_due_generations() == {}
+    assert scheduler.submit_count == 1
+
+
+def test_backoff_grows_with_attempts(monkeypatch):
+    monkeypatch.setattr(dispatcher.random, 'uniform', lambda low, high: high)
+
+    delays = [dispatcher.backoff_delay(attempt) for attempt in range(1, 6)]
+
+    assert delays == [DISPATCH_BACKOFF_BASE_SECONDS * 2 ** i for i in range(5)]
+
+
+def test_timeout_is_retried(enqueue, scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler_client, 'SCHEDULER_REQUEST_TIMEOUT', 0.2)
+    scheduler.delay = 1.0
+    [generation_id] = enqueue(1)
+
+    outcomes = dispatcher.dispatch_due_generations()
+
+    assert outcomes[generation_id][0] == dispatcher.OUTCOME_RETRY
+    [generation] = generations([generation_id])
+    assert generation.status == GenerationStatus.PENDING
+    assert generation.submit_attempts == 1
+    assert generation.next_submit_at > datetime.utcnow()
+
+
+def test_retry_after_backoff_succeeds(enqueue, scheduler):
+    scheduler.fail_with = 503
+    [generation_id] = enqueue(1)
+    dispatcher.dispatch_due_generations()
+    scheduler.fail_with = None
+    Generation.query.filter_by(id=generation_id).update(
+        {Generation.next_submit_at: datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False
+    )
+    db.session.commit()
+
+    outcomes = dispatcher.dispatch_due_generations()
+
+    assert outcomes[generation_id] == (dispatcher.OUTCOME_QUEUED, None)
+    [generation] = generations([generation_id])
+    assert generation.status == GenerationStatus.QUEUED and generation.error_message is None
+
+
+def test_permanent_error_fails_generation(enqueue, scheduler):
+    scheduler.fail_with = 400
+    [generation_id] = enqueue(1)
+
+    outcomes = dispatcher.dispatch_due_generations()
+
+    assert outcomes[generation_id][0] == dispatcher.OUTCOME_FAILED
+    [generation] = generations([generation_id])
+    assert generation.status == GenerationStatus.FAILED
+    assert generation.dispatch_token is None
+
+
+def test_rate_limiter_spaces_requests():
+    limiter = RateLimiter(20, burst=1)
+
+    started = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+
+    # Первый токен есть сразу, остальные пять - по одному на 1/20 с
+    assert time.monotonic() - started >= 5 / 20 * 0.9
+
+
+def test_dispatch_respects_rate_limit(enqueue, scheduler):
+    ids = enqueue(5)
+
+    dispatcher.dispatch_due_generations(concurrency=5, rate_limiter=RateLimiter(10, burst=1))
+
+    times = sorted(submitted_at for submitted_at, _ in scheduler.submitted)
+    assert len(times) == len(ids)
+    assert times[-1] - times[0] >= 4 / 10 * 0.9
+
+
+def test_stale_dispatch_token_cannot_overwrite_newer_claim(enqueue):
+    ids = enqueue(2)
+    stale_token, claimed = dispatcher.claim_due_generations()
+    by_id = {g.id: dispatcher.ClaimedGeneration(g.project_id, g.collection_id, g.submit_attempts) for g in claimed}
+    # Аренда первой пачки истекла, ее захватил другой проход
+    Generation.query.filter(Generation.id.in_(ids)).update(
+        {Generation.next_submit_at: datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False
+    )
+    db.session.commit()
+    new_token, _ = dispatcher.claim_due_generations()
+    pool = dispatcher.scheduler_pool()
+    routes = {gid: pool.instances[0] for gid in ids}
+
+    # Опоздавший ответ для старой пачки ничего не меняет
+    stale_results = [(gid, {'task_id': f'stale-{gid}'}, None) for gid in ids]
+    dispatcher._record_submission_results(stale_results, by_id, stale_token, routes, pool)
+
+    for generation in generations(ids):
+        assert generation.status == GenerationStatus.PENDING
+        assert generation.dispatch_token == new_token
+        assert generation.scheduler_task_id is None
+
+    # Ответ для текущей пачки записывается
+    fresh_results = [(gid, {'task_id': f'fresh-{gid}'}, None) for gid in ids]
+    dispatcher._record_submission_results(fresh_results, by_id, new_token, routes, pool)
+
+    for generation in generations(ids):
+        assert generation.status == GenerationStatus.QUEUED
+        assert generation.scheduler_task_id == f'fresh-{generation.id}'
+
+
+def test_submission_result_does_not_overwrite_completed_callback(enqueue):
+    [generation_id] = enqueue(1)
+    token, claimed = dispatcher.claim_due_generations()
+    by_id = {g.id: dispatcher.ClaimedGeneration(g.project_id, g.collection_id, g.submit_attempts) for g in claimed}
+    # Callback пришел раньше ответа планировщика на отправку
+    Generation.query.filter_by(id=generation_id).update({Generation.status: GenerationStatus.COMPLETED},
+                                                        synchronize_session=False)
+    db.session.commit()
+    pool = dispatcher.scheduler_pool()
+
+    dispatcher._record_submission_results([(generation_id, {'task_id': 'late'}, None)], by_id, token,
+                                          {generation_id: pool.instances[0]}, pool)
+
+    [generation] = generations([generation_id])
+    assert generation.status == GenerationStatus.COMPLETED
@@ -0,0 +1,71 @@
+"""
+Условные GET и кэш сжатых ответов: ссылки на файлы в ответе зависят от хоста запроса.
+"""
+import gzip
+import io
+
+import pytest
+
+from backend.models import db, Generation
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'p' * 2048
+LOCAL_HOST, LAN_HOST = 'localhost:5001', '192.168.1.5:5001'
+
+
+@pytest.fixture
+def grid_query(client, start_schedulers, make_pairs):
+    """ Грид с файлом в каждой ячейке; возвращает строку запроса /api/grid-data. """
+    from backend.features.image_generation.services import process_generation_request
+    start_schedulers(1)
+    pairs = make_pairs(projects=1, collections=20)
+    for generation_id in process_generation_request(pairs)['tasks_started']:
+        data = {'status': 'done', 'files': [(io.BytesIO(PNG + generation_id.encode()), 'image.png')]}
+        client.post(f'/api/scheduler_callback/{generation_id}', data=data, content_type='multipart/form-data')
+        # Ссылка на файл в гриде есть у выбранной обложки
+        generation = db.session.get(Generation, generation_id)
+        client.post('/api/select-cover', json={'collection_id': generation.collection_id,
+                                               'project_id': generation.project_id, 'generation_id': generation_id})
+    db.session.remove()
+    return f"/api/grid-data?visible_project_ids={pairs[0]['project_id']}"
+
+
+def get(client, path: str, host: str, **headers):
+    return client.get(path, base_url=f'http://{host}', headers=headers)
+
+
+def body_text(response) -> str:
+    data = response.get_data()
+    return (gzip.decompress(data) if response.headers.get('Content-Encoding') == 'gzip' else data).decode()
+
+
+def test_grid_etag_depends_on_request_host(client, grid_query):
+    local = get(client, grid_query, LOCAL_HOST)
+    assert f'http://{LOCAL_HOST}/generated_files/' in body_text(local)
+
+    # ETag ответа для localhost не подходит клиенту, пришедшему по адресу в сети
+    lan = get(client, grid_query, LAN_HOST, **{'If-None-Match': local.headers['ETag']})
+
+    assert lan.status_code == 200
+    assert lan.headers['ETag'] != local.headers['ETag']
+    assert f'http://{LAN_HOST}/generated_files/' in body_text(lan)
+    assert get(client, grid_query, LAN_HOST, **{'If-None-Match': lan.headers['ETag']}).status_code == 304
+
+
+def test_compressed_body_cache_is_per_host(client, grid_query):
+    local = get(client, grid_query, LOCAL_HOST, **{'Accept-Encoding': 'gzip'})
+    lan = get(client, grid_query, LAN_HOST, **{'Accept-Encoding': 'gzip'})
+
+    assert local.headers['Content-Encoding'] == lan.headers['Content-Encoding'] == 'gzip'
+    assert LAN_HOST not in body_text(local)
+    assert f'http://{LAN_HOST}/generated_files/' in body_text(lan)
+    assert LOCAL_HOST not in body_text(lan)
+
+
+def test_public_base_url_makes_etag_host_independent(client, app, grid_query):
+    app.config['PUBLIC_BASE_URL'] = 'https://images.example.com'
+
+    local = get(client, grid_query, LOCAL_HOST)
+    lan = get(client, grid_query, LAN_HOST)
+
+    assert local.headers['ETag'] == lan.headers['ETag']
+    assert 'https://images.example.com/generated_files/' in body_text(lan)
@@ -0,0 +1,115 @@
+"""
+Фоновые задания (features/jobs/runner.py): отметки исполнителя и задания, прерванные перезапуском.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.constants import JOB_HEARTBEAT_TIMEOUT_SECONDS, JobStatus
+from backend.models import db, Job
+from backend.features.jobs import runner
+
+BLOCKING_KIND = 'test_blocking'
+
+
+def add_job(status: str = JobStatus.RUNNING, runner_id: str | None = 'host:1:previous', heartbeat_age: float | None = 0.0,
+            updated_age: float = 0.0) -> str:
+    now = datetime.utcnow()
+    job = Job(kind=BLOCKING_KIND, status=status, params={}, runner_id=runner_id,
+              heartbeat_at=now - timedelta(seconds=heartbeat_age) if heartbeat_age is not None else None)
+    db.session.add(job)
+    db.session.commit()
+    # updated_at ставится ORM при каждой записи; "возраст" задается отдельным UPDATE без onupdate
+    Job.query.filter_by(id=job.id).update({Job.updated_at: now - timedelta(seconds=updated_age)},
+                                          synchronize_session=False)
+    db.session.commit()
+    return job.id
+
+
+def job_status(job_id: str) -> str:
+    db.session.expire_all()
+    return db.session.get(Job, job_id).status
+
+
+@pytest.fixture
+def blocking_handler():
+    """ Обработчик, который выполняется, пока тест не отпустит release. """
+    started, release = threading.Event(), threading.Event()
+
+    def handler(ctx, params, payload):
+        started.set()
+        release.wait(10)
+        return {'done': True}
+
+    runner.register_job_handler(BLOCKING_KIND, handler)
+    yield started, release
+    release.set()
+    runner._handlers.pop(BLOCKING_KIND, None)
+
+
+@pytest.mark.parametrize('status', [JobStatus.PENDING, JobStatus.RUNNING])
+def test_job_of_dead_runner_fails_regardless_of_age(app, status):
+    # Задание создано только что, но его процесс перестал ставить отметки
+    job_id = add_job(status, heartbeat_age=JOB_HEARTBEAT_TIMEOUT_SECONDS + 1)
+
+    assert runner.fail_stale_jobs() == 1
+
+    assert job_status(job_id) == JobStatus.FAILED
+    assert 'restarted' in db.session.get(Job, job_id).error_message
+
+
+def test_job_of_live_runner_is_kept_until_heartbeats_stop(app):
+    job_id = add_job(heartbeat_age=1)
+
+    assert runner.fail_stale_jobs() == 0
+    assert job_status(job_id) == JobStatus.RUNNING
+
+    # Быстрый перезапуск: прежний процесс завершился, отметки больше не обновляются
+    Job.query.filter_by(id=job_id).update({Job.heartbeat_at: datetime.utcnow() - timedelta(
+        seconds=JOB_HEARTBEAT_TIMEOUT_SECONDS + 1)}, synchronize_session=False)
+    db.session.commit()
+    runner.JobHeartbeat(app).run_once()
+
+    assert job_status(job_id) == JobStatus.FAILED
+
+
+def test_job_without_runner_falls_back_to_updated_at(app):
+    fresh_id = add_job(runner_id=None, heartbeat_age=None)
+    stale_id = add_job(runner_id=None, heartbeat_age=None, updated_age=JOB_HEARTBEAT_TIMEOUT_SECONDS + 1)
+
+    runner.fail_stale_jobs()
+
+    assert job_status(fresh_id) == JobStatus.RUNNING
+    assert job_status(stale_id) == JobStatus.FAILED
+
+
+def test_finished_jobs_are_not_touched(app):
+    job_id = add_job(JobStatus.COMPLETED, heartbeat_age=JOB_HEARTBEAT_TIMEOUT_SECONDS * 10)
+
+    assert runner.fail_stale_jobs() == 0
+    assert job_status(job_id) == JobStatus.COMPLETED
+
+
+def test_running_job_of_this_process_gets_heartbeats(app, blocking_handler):
+    started, release = blocking_handler
+    job_id = runner.submit_job(BLOCKING_KIND).id
+    assert started.wait(10)
+    assert db.session.get(Job, job_id).runner_id == runner.runner_id()
+    old_heartbeat = datetime.utcnow() - timedelta(seconds=JOB_HEARTBEAT_TIMEOUT_SECONDS + 1)
+    Job.query.filter_by(id=job_id).update({Job.heartbeat_at: old_heartbeat}, synchronize_session=False)
+    db.session.commit()
+
+    # Свое задание живо, пока процесс работает: проход не помечает его, а обновляет отметку
+    assert runner.fail_stale_jobs() == 0
+    assert runner.beat_running_jobs() == 1
+    db.session.expire_all()
+    assert db.session.get(Job, job_id).heartbeat_at > old_heartbeat
+
+    release.set()
+    deadline = time.monotonic() + 10
+    while job_status(job_id) != JobStatus.COMPLETED and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert job_status(job_id) == JobStatus.COMPLETED
+    assert runner.beat_running_jobs() == 0
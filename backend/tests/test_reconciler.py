@@ -0,0 +1,215 @@
+"""
+Сверка зависших QUEUED-генераций (reconciler.py) с локальным фейковым планировщиком.
+"""
+import base64
+import io
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.constants import DISPATCH_MAX_ATTEMPTS, SchedulerTaskStatus
+from backend.models import db, GeneratedFile, Generation, GenerationStatus
+from backend.features.image_generation import dispatcher, reconciler, scheduler_client
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'r' * 256
+
+
+@pytest.fixture
+def scheduler(start_schedulers, monkeypatch):
+    # Любая QUEUED-генерация считается зависшей
+    monkeypatch.setenv('GENERATION_STALE_AFTER', '0')
+    return start_schedulers(1)[0]
+
+
+@pytest.fixture
+def queue(enqueue, scheduler):
+    """ Ставит count генераций в очередь планировщика (QUEUED) и возвращает {generation_id: task_id}. """
+
+    def queue(count: int) -> dict[str, str]:
+        ids = enqueue(count)
+        dispatcher.dispatch_due_generations()
+        task_ids = {g.id: g.scheduler_task_id for g in generations(ids)}
+        assert all(task_ids.values())
+        return task_ids
+
+    return queue
+
+
+def generations(ids) -> list[Generation]:
+    db.session.expire_all()
+    return Generation.query.filter(Generation.id.in_(list(ids))).all()
+
+
+def generation(generation_id: str) -> Generation:
+    db.session.expire_all()
+    return db.session.get(Generation, generation_id)
+
+
+def set_task_status(scheduler, task_id: str, status: str | None):
+    """ None - планировщик забыл задачу (404). """
+    with scheduler.lock:
+        if status is None:
+            scheduler.tasks.pop(task_id, None)
+        else:
+            scheduler.tasks[task_id] = status
+
+
+def status_requests(scheduler) -> list[str]:
+    with scheduler.lock:
+        return [path for method, path in scheduler.requests if method == 'GET']
+
+
+@pytest.mark.parametrize('task_status', [SchedulerTaskStatus.PENDING, SchedulerTaskStatus.RUNNING])
+def test_alive_task_stays_queued(queue, scheduler, task_status):
+    (generation_id, task_id), = queue(1).items()
+    set_task_status(scheduler, task_id, task_status)
+
+    summary = reconciler.reconcile_stale_generations()
+
+    assert summary['checked'] == summary['alive'] == 1
+    g = generation(generation_id)
+    assert g.status == GenerationStatus.QUEUED
+    assert g.scheduler_task_id == task_id
+    assert g.status_checked_at is not None
+
+
+def test_done_task_is_recovered_with_files(queue, scheduler):
+    (generation_id, task_id), = queue(1).items()
+    set_task_status(scheduler, task_id, SchedulerTaskStatus.DONE)
+    image = 'data:image/png;base64,' + base64.b64encode(PNG).decode()
+    scheduler.results[task_id] = [{'image': image, 'infotext': 'portrait, Steps: 20'}]
+
+    summary = reconciler.reconcile_stale_generations()
+
+    assert summary['recovered'] == 1
+    assert generation(generation_id).status == GenerationStatus.COMPLETED
+    files = GeneratedFile.query.filter_by(generation_id=generation_id).all()
+    assert len(files) == 1
+    assert files[0].mime_type == 'image/png'
+    with open(os.path.join(os.environ['GENERATED_FILES_FOLDER'], files[0].file_path), 'rb') as f:
+        assert f.read() == PNG
+    assert f'/agent-scheduler/v1/task/{task_id}/results?zip=false' in status_requests(scheduler)
+
+
+@pytest.mark.parametrize('task_status', [SchedulerTaskStatus.FAILED, SchedulerTaskStatus.INTERRUPTED])
+def test_failed_task_fails_generation(queue, scheduler, task_status):
+    (generation_id, task_id), = queue(1).items()
+    set_task_status(scheduler, task_id, task_status)
+
+    summary = reconciler.reconcile_stale_generations()
+
+    assert summary['failed'] == 1
+    g = generation(generation_id)
+    assert g.status == GenerationStatus.FAILED
+    assert task_status in g.error_message
+
+
+def test_lost_task_is_requeued_and_dispatched_again(queue, scheduler):
+    (generation_id, task_id), = queue(1).items()
+    set_task_status(scheduler, task_id, None)
+
+    summary = reconciler.reconcile_stale_generations()
+
+    assert summary['requeued'] == 1
+    g = generation(generation_id)
+    assert g.status == GenerationStatus.PENDING
+    assert g.submit_attempts == 1
+    assert g.scheduler_task_id is None and g.next_submit_at is not None
+    # Генерация снова в очереди отправки
+    dispatcher.dispatch_due_generations()
+    g = generation(generation_id)
+    assert g.status == GenerationStatus.QUEUED
+    assert g.scheduler_task_id not in (None, task_id)
+
+
+def test_lost_task_fails_after_max_attempts(queue, scheduler):
+    (generation_id, task_id), = queue(1).items()
+    set_task_status(scheduler, task_id, None)
+    Generation.query.filter_by(id=generation_id).update({Generation.submit_attempts: DISPATCH_MAX_ATTEMPTS - 1},
+                                                        synchronize_session=False)
+    db.session.commit()
+
+    summary = reconciler.reconcile_stale_generations()
+
+    assert summary['failed'] == 1 and summary['requeued'] == 0
+    g = generation(generation_id)
+    assert g.status == GenerationStatus.FAILED
+    assert 'no attempts are left' in g.error_message
+
+
+def test_unreachable_instance_leaves_generation_untouched(queue, scheduler):
+    (generation_id, task_id), = queue(1).items()
+    before = generation(generation_id)
+    before_state = (before.status, before.scheduler_task_id, before.submit_attempts, before.error_message)
+    scheduler.shutdown()
+    scheduler.server_close()
+    scheduler_client.get_scheduler_session().close() # Иначе запрос уйдет по живому keep-alive соединению
+
+    summary = reconciler.reconcile_stale_generations()
+
+    assert summary['unreachable'] == 1
+    g = generation(generation_id)
+    assert (g.status, g.scheduler_task_id, g.submit_attempts, g.error_message) == before_state
+
+
+def test_callback_during_reconciliation_is_not_overwritten(client, queue, scheduler, monkeypatch):
+    (generation_id, task_id), = queue(1).items()
+    set_task_status(scheduler, task_id, SchedulerTaskStatus.FAILED)
+    fetch_task_statuses = reconciler.fetch_task_statuses
+
+    def fetch_with_late_callback(*args, **kwargs):
+        # Callback приходит после захвата, но до записи исходов
+        data = {'status': 'done', 'files': [(io.BytesIO(PNG), 'image.png')]}
+        response = client.post(f'/api/scheduler_callback/{generation_id}', data=data,
+                               content_type='multipart/form-data')
+        assert response.status_code == 200
+        yield from fetch_task_statuses(*args, **kwargs)
+
+    monkeypatch.setattr(reconciler, 'fetch_task_statuses', fetch_with_late_callback)
+
+    summary = reconciler.reconcile_stale_generations()
+
+    assert summary['failed'] == 0
+    g = generation(generation_id)
+    assert g.status == GenerationStatus.COMPLETED
+    assert g.error_message is None
+    assert GeneratedFile.query.filter_by(generation_id=generation_id).count() == 1
+
+
+def test_generation_claimed_by_another_pass_is_not_written(queue, scheduler, monkeypatch):
+    ids = queue(2)
+    for task_id in ids.values():
+        set_task_status(scheduler, task_id, None)
+    fetch_task_statuses = reconciler.fetch_task_statuses
+
+    def fetch_after_reclaim(*args, **kwargs):
+        # Другой процесс перезахватил строки своей отметкой: этот проход их не пишет
+        Generation.query.filter(Generation.id.in_(list(ids))).update(
+            {Generation.status_checked_at: datetime.utcnow() + timedelta(seconds=1)}, synchronize_session=False)
+        db.session.commit()
+        yield from fetch_task_statuses(*args, **kwargs)
+
+    monkeypatch.setattr(reconciler, 'fetch_task_statuses', fetch_after_reclaim)
+
+    summary = reconciler.reconcile_stale_generations()
+
+    assert summary['checked'] == 2 and summary['requeued'] == summary['failed'] == 0
+    for g in generations(ids):
+        assert g.status == GenerationStatus.QUEUED
+        assert g.scheduler_task_id == ids[g.id]
+
+
+def test_second_pass_sends_no_requests(queue, scheduler):
+    task_ids = queue(3)
+    for task_id in task_ids.values():
+        set_task_status(scheduler, task_id, SchedulerTaskStatus.PENDING)
+
+    first = reconciler.reconcile_stale_generations()
+    requests_after_first = len(status_requests(scheduler))
+    second = reconciler.reconcile_stale_generations()
+
+    assert first['checked'] == first['alive'] == 3
+    assert requests_after_first == 3
+    assert second['checked'] == 0
+    assert len(status_requests(scheduler)) == requests_after_first
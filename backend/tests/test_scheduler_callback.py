@@ -0,0 +1,149 @@
+"""
+Callback'и планировщика: защита от повторной доставки и запись файлов генерации.
+"""
+import hashlib
+import io
+import os
+import sqlite3
+
+import pytest
+
+from backend.constants import CALLBACK_STAGING_FOLDER
+from backend.models import db, Generation, GenerationStatus, GeneratedFile, StagedCallback
+from backend.features.image_generation import callback_ingest, services
+from backend.features.image_generation.callback_ingest import ingest_staged_callbacks
+
+PNG_A = b'\x89PNG\r\n\x1a\n' + b'a' * 2048
+PNG_B = b'\x89PNG\r\n\x1a\n' + b'b' * 2048
+
+
+@pytest.fixture
+def generation_id(start_schedulers, enqueue):
+    start_schedulers(1)
+    return enqueue(1)[0]
+
+
+def post_callback(client, generation_id: str, *contents: bytes, status: str = 'done'):
+    data = {'status': status, 'files': [(io.BytesIO(content), f'image{i}.png') for i, content in enumerate(contents)]}
+    return client.post(f'/api/scheduler_callback/{generation_id}', data=data, content_type='multipart/form-data')
+
+
+def stored_files(generation_id: str) -> list[GeneratedFile]:
+    db.session.expire_all()
+    return GeneratedFile.query.filter_by(generation_id=generation_id).order_by(GeneratedFile.id).all()
+
+
+def files_on_disk(app) -> list[str]:
+    root = app.config['GENERATED_FILES_FOLDER']
+    return [os.path.join(path, name) for path, _, names in os.walk(root) for name in names]
+
+
+def test_callback_stores_files_and_completes(client, generation_id):
+    response = post_callback(client, generation_id, PNG_A, PNG_B)
+
+    assert response.status_code == 200
+    files = stored_files(generation_id)
+    assert {f.content_hash for f in files} == {hashlib.sha256(PNG_A).hexdigest(), hashlib.sha256(PNG_B).hexdigest()}
+    generation = db.session.get(Generation, generation_id)
+    assert generation.status == GenerationStatus.COMPLETED
+    assert generation.callback_digest is not None
+
+
+def test_same_image_twice_in_one_callback(client, app, generation_id):
+    response = post_callback(client, generation_id, PNG_A, PNG_A)
+
+    assert response.status_code == 200
+    assert [f.content_hash for f in stored_files(generation_id)] == [hashlib.sha256(PNG_A).hexdigest()]
+    assert db.session.get(Generation, generation_id).status == GenerationStatus.COMPLETED
+    assert len(files_on_disk(app)) == 1
+
+
+def test_redelivered_callback_is_ignored(client, generation_id):
+    post_callback(client, generation_id, PNG_A)
+
+    response = post_callback(client, generation_id, PNG_A)
+
+    assert response.get_json()['message'] == 'Duplicate callback ignored.'
+    assert len(stored_files(generation_id)) == 1
+
+
+def test_failed_file_insert_keeps_delivery_claim_and_other_files(client, app, generation_id, monkeypatch):
+    # Файл с тем же хэшем записан параллельно (сверкой с планировщиком) после проверки известных хэшей
+    hash_a = hashlib.sha256(PNG_A).hexdigest()
+    db.session.add(GeneratedFile(generation_id=generation_id, file_path='reconciled.png', original_filename='a.png',
+                                 mime_type='image/png', size_bytes=len(PNG_A), content_hash=hash_a))
+    db.session.commit()
+    monkeypatch.setattr(services, 'known_content_hashes', lambda generation_ids: set())
+
+    response = post_callback(client, generation_id, PNG_A, PNG_B)
+
+    assert response.status_code == 200
+    files = stored_files(generation_id)
+    assert [f.content_hash for f in files] == [hash_a, hashlib.sha256(PNG_B).hexdigest()]
+    generation = db.session.get(Generation, generation_id)
+    assert generation.status == GenerationStatus.COMPLETED
+    assert generation.callback_digest is not None
+    # Копия отклоненного файла удалена с диска
+    assert len(files_on_disk(app)) == 1
+    # Отметка доставки сохранилась: повтор того же callback'а ничего не пишет
+    assert post_callback(client, generation_id, PNG_A, PNG_B).get_json()['message'] == 'Duplicate callback ignored.'
+
+
+@pytest.fixture
+def async_ingest(monkeypatch):
+    monkeypatch.setenv('CALLBACK_INGEST', 'async')
+
+
+def staged_names(app) -> list[str]:
+    root = os.path.join(app.config['GENERATED_FILES_FOLDER'], CALLBACK_STAGING_FOLDER)
+    return os.listdir(root) if os.path.isdir(root) else []
+
+
+def test_async_callback_is_spooled_then_ingested(client, app, generation_id, async_ingest):
+    response = post_callback(client, generation_id, PNG_A, PNG_B)
+
+    assert response.get_json()['message'] == 'Callback accepted.'
+    assert StagedCallback.query.count() == 1 and len(staged_names(app)) == 2
+    assert post_callback(client, generation_id, PNG_A, PNG_B).get_json()['message'] == 'Duplicate callback ignored.'
+    assert len(staged_names(app)) == 2
+
+    assert ingest_staged_callbacks() == 1
+
+    assert len(stored_files(generation_id)) == 2
+    assert staged_names(app) == [] and StagedCallback.query.count() == 0
+
+
+def test_spool_does_not_hold_write_lock_during_disk_io(client, app, generation_id, async_ingest, monkeypatch):
+    database = db.engine.url.database
+    write_checks = []
+
+    def spool_and_write_elsewhere(file_storage, path):
+        # Пока файл пишется на диск, другое соединение может сразу начать запись
+        other = sqlite3.connect(database, timeout=0)
+        try:
+            other.execute('BEGIN IMMEDIATE')
+            other.rollback()
+            write_checks.append(True)
+        finally:
+            other.close()
+        return spool_upload(file_storage, path)
+
+    spool_upload = callback_ingest._spool_upload
+    monkeypatch.setattr(callback_ingest, '_spool_upload', spool_and_write_elsewhere)
+
+    assert post_callback(client, generation_id, PNG_A).status_code == 200
+    assert write_checks == [True]
+    assert StagedCallback.query.count() == 1
+
+
+def test_spool_losing_claim_race_removes_its_files(client, app, generation_id, async_ingest, monkeypatch):
+    post_callback(client, generation_id, PNG_A)
+    first_staged = staged_names(app)
+    # Параллельный повтор прошел проверку чтением до того, как первый поставил отметку
+    monkeypatch.setattr(callback_ingest, 'callback_already_delivered', lambda generation_id, digest: False)
+
+    response = post_callback(client, generation_id, PNG_A)
+
+    assert response.get_json()['message'] == 'Duplicate callback ignored.'
+    assert staged_names(app) == first_staged
+    assert StagedCallback.query.count() == 1
@@ -0,0 +1,141 @@
+"""
+Пул экземпляров планировщика (scheduler_pool.py): маршрутизация по числу незавершенных
+задач, вывод из ротации после сбоев и возврат после остывания - на нескольких фейковых
+планировщиках.
+"""
+import time
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+from backend.constants import SCHEDULER_UNHEALTHY_AFTER_FAILURES
+from backend.models import db, Generation, GenerationStatus
+from backend.features.image_generation import dispatcher
+from backend.features.image_generation.scheduler_pool import SchedulerPool, scheduler_urls
+
+COOLDOWN = 0.3
+
+
+def routed_counts(ids: list[str]) -> Counter:
+    db.session.expire_all()
+    return Counter(url for url, in Generation.query.filter(
+        Generation.id.in_(ids), Generation.status == GenerationStatus.QUEUED
+    ).with_entities(Generation.scheduler_url))
+
+
+def mark_queued_on(ids: list[str], url: str):
+    """ Генерации уже стоят в очереди экземпляра url (незавершенные задачи). """
+    Generation.query.filter(Generation.id.in_(ids)).update({
+        Generation.status: GenerationStatus.QUEUED, Generation.scheduler_url: url,
+        Generation.queued_at: datetime.utcnow(), Generation.next_submit_at: None
+    }, synchronize_session=False)
+    db.session.commit()
+
+
+def test_scheduler_urls_from_env(monkeypatch):
+    monkeypatch.setenv('A1111_SCHEDULER_URLS', ' http://a:7860/, http://b:7860 http://a:7860')
+    assert scheduler_urls() == ['http://a:7860', 'http://b:7860']
+
+
+def test_route_prefers_least_outstanding():
+    pool = SchedulerPool(['http://a', 'http://b', 'http://c'], backpressure_factory=lambda url: None)
+    outstanding = {'http://a': 4, 'http://c': 2}
+
+    routes = pool.route(6, outstanding, pool.capacities(outstanding, apply_backpressure=False))
+
+    # Выравнивание до 4 задач на каждом: b получает 4, c - 2, a - ничего
+    assert Counter(instance.url for instance in routes) == {'http://b': 4, 'http://c': 2}
+
+
+def test_route_respects_capacities():
+    pool = SchedulerPool(['http://a', 'http://b'], backpressure_factory=lambda url: None)
+
+    routes = pool.route(5, {}, {'http://a': 1, 'http://b': 2})
+
+    assert Counter(instance.url for instance in routes) == {'http://a': 1, 'http://b': 2}
+
+
+def test_cooldown_doubles_on_repeated_failures():
+    pool = SchedulerPool(['http://a'], backpressure_factory=lambda url: None)
+    [instance] = pool.instances
+    instance.cooldown = COOLDOWN
+
+    for _ in range(SCHEDULER_UNHEALTHY_AFTER_FAILURES):
+        pool.record_failure(instance, RuntimeError('down'))
+    assert not instance.is_healthy()
+    time.sleep(COOLDOWN + 0.05)
+    assert instance.is_healthy()
+
+    # Первая же ошибка после остывания снова выводит экземпляр, остывание вдвое дольше
+    pool.record_failure(instance, RuntimeError('still down'))
+    assert not instance.is_healthy()
+    assert instance.cooldown == pytest.approx(COOLDOWN * 2)
+
+    pool.record_success(instance)
+    assert instance.is_healthy() and instance.consecutive_failures == 0
+
+
+def test_dispatch_routes_by_outstanding(start_schedulers, enqueue):
+    a, b, c = start_schedulers(3)
+    mark_queued_on(enqueue(4), a.url)
+    mark_queued_on(enqueue(2), c.url)
+
+    ids = enqueue(6)
+    outcomes = dispatcher.dispatch_due_generations()
+
+    assert {outcome for outcome, _ in outcomes.values()} == {dispatcher.OUTCOME_QUEUED}
+    assert routed_counts(ids) == {b.url: 4, c.url: 2}
+    assert (a.submit_count, b.submit_count, c.submit_count) == (0, 4, 2)
+
+
+def test_failing_instance_is_excluded_during_cooldown_and_recovers(start_schedulers, enqueue):
+    a, b = start_schedulers(2)
+    a.fail_with = 503
+    ids = enqueue(6)
+    pool = dispatcher.scheduler_pool()
+    instance_a = pool.get(a.url)
+    instance_a.cooldown = COOLDOWN
+
+    # Первый проход: задачи поровну; три ошибки подряд выводят a из ротации,
+    # его генерации повторяются без задержки (есть здоровый экземпляр)
+    first = dispatcher.dispatch_due_generations()
+    assert a.submit_count == SCHEDULER_UNHEALTHY_AFTER_FAILURES
+    assert Counter(outcome for outcome, _ in first.values()) == {
+        dispatcher.OUTCOME_QUEUED: 3, dispatcher.OUTCOME_RETRY: 3
+    }
+    assert not instance_a.is_healthy()
+    assert [instance.url for instance in pool.healthy_instances()] == [b.url]
+
+    # Во время остывания все повторы уходят на b
+    second = dispatcher.dispatch_due_generations()
+    assert set(second) == {gid for gid, (outcome, _) in first.items() if outcome == dispatcher.OUTCOME_RETRY}
+    assert a.submit_count == SCHEDULER_UNHEALTHY_AFTER_FAILURES
+    assert routed_counts(ids) == {b.url: 6}
+
+    # После остывания a снова получает задачи; как наименее загруженный - все новые
+    a.fail_with = None
+    time.sleep(COOLDOWN + 0.05)
+    assert instance_a.is_healthy()
+    recovered_ids = enqueue(4)
+    dispatcher.dispatch_due_generations()
+
+    assert routed_counts(recovered_ids) == {a.url: 4}
+    assert instance_a.consecutive_failures == 0 and instance_a.unhealthy_until == 0.0
+
+
+def test_all_instances_down_holds_generations(start_schedulers, enqueue):
+    [a] = start_schedulers(1)
+    a.fail_with = 502
+    ids = enqueue(SCHEDULER_UNHEALTHY_AFTER_FAILURES)
+    dispatcher.dispatch_due_generations()
+    db.session.query(Generation).filter(Generation.id.in_(ids)).update(
+        {Generation.next_submit_at: datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+
+    # Единственный экземпляр остывает: проход ничего не захватывает и не отправляет
+    assert dispatcher.dispatch_due_generations() == {}
+    assert a.submit_count == SCHEDULER_UNHEALTHY_AFTER_FAILURES
+    db.session.expire_all()
+    assert {g.dispatch_token for g in Generation.query.filter(Generation.id.in_(ids))} == {None}
@@ -0,0 +1,49 @@
+"""
+Миниатюры (file_serving/thumbnails.py): предупреждение при старте, если они выключены.
+"""
+import logging
+
+from backend.features.file_serving import thumbnails
+
+
+def warnings_logged(caplog) -> list[str]:
+    return [r.getMessage() for r in caplog.records if r.name == thumbnails.logger.name and r.levelno == logging.WARNING]
+
+
+def test_startup_warns_when_thumbnail_workers_disabled(caplog, monkeypatch):
+    monkeypatch.setenv('THUMBNAIL_WORKERS', '0')
+    with caplog.at_level(logging.WARNING, logger=thumbnails.logger.name):
+        thumbnails.warn_if_thumbnails_disabled()
+
+    assert warnings_logged(caplog) == ["THUMBNAIL_WORKERS=0: thumbnails are disabled, ?size= serves original images"]
+
+
+def test_startup_warns_without_pillow(caplog, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'Image', None)
+    monkeypatch.setenv('THUMBNAIL_WORKERS', '2')
+    with caplog.at_level(logging.WARNING, logger=thumbnails.logger.name):
+        thumbnails.warn_if_thumbnails_disabled()
+
+    [message] = warnings_logged(caplog)
+    assert message.startswith("Pillow is not installed")
+
+
+def test_no_warning_when_thumbnails_enabled(caplog, monkeypatch):
+    if thumbnails.Image is None:
+        monkeypatch.setattr(thumbnails, 'Image', object())
+    monkeypatch.setenv('THUMBNAIL_WORKERS', '2')
+    with caplog.at_level(logging.WARNING, logger=thumbnails.logger.name):
+        thumbnails.warn_if_thumbnails_disabled()
+
+    assert warnings_logged(caplog) == []
+
+
+def test_create_app_logs_the_warning_once(caplog, app):
+    # Фикстура app создает приложение с THUMBNAIL_WORKERS=0
+    from backend.app import create_app
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger=thumbnails.logger.name):
+        second_app = create_app()
+    second_app.extensions['job_heartbeat'].stop()
+
+    assert len(warnings_logged(caplog)) == 1
@@ -0,0 +1,155 @@
+"""
+Сжатие ответов /api/* (gzip / brotli / zstd по Accept-Encoding).
+
+gzip доступен всегда (стандартная библиотека), brotli и zstandard - если
+установлены соответствующие пакеты. Ответы меньше порога, файлы
+(direct_passthrough) и уже закодированные ответы не сжимаются.
+
+Ответы с ETag сжимаются один раз: тело хранится в небольшом LRU-кэше по
+(ETag, кодировка, префикс URL файлов - ссылки в теле зависят от хоста
+запроса), и повторный опрос неизменившихся данных клиентами без
+If-None-Match не тратит CPU на повторное сжатие. ETag сжатого ответа
+становится слабым (как делает nginx): байты представления уже не совпадают
+с несжатым, а If-None-Match сравнивается слабым сравнением.
+"""
+import gzip
+import logging
+import threading
+from collections import OrderedDict
+from flask import request
+
+from backend.models import generated_file_url_prefix
+from backend.constants import (
+    COMPRESSION_MIN_SIZE_BYTES, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY, COMPRESSION_ZSTD_LEVEL,
+    COMPRESSION_CACHE_MAX_ENTRIES, COMPRESSION_CACHE_MAX_BYTES
+)
+
+try:
+    import brotli
+except ImportError: # pragma: no cover - зависит от окружения
+    brotli = None
+
+try:
+    import zstandard
+except ImportError: # pragma: no cover - зависит от окружения
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = '/api/'
+
+
+def _compress_gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def _compress_brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY)
+
+
+def _compress_zstd(data: bytes) -> bytes:
+    # ZstdCompressor не потокобезопасен, поэтому создается на каждый вызов (это дешево)
+    return zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compress(data)
+
+
+def available_encodings() -> dict:
+    """ Доступные кодировки в порядке предпочтения сервера. """
+    encoders = {}
+    if brotli is not None:
+        encoders['br'] = _compress_brotli
+    if zstandard is not None:
+        encoders['zstd'] = _compress_zstd
+    encoders['gzip'] = _compress_gzip
+    return encoders
+
+
+class CompressedBodyCache:
+    """ Потокобезопасный LRU-кэш сжатых тел, ограниченный числом записей и суммарным размером. """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._items.get(key)
+            if body is not None:
+                self._items.move_to_end(key)
+            return body
+
+    def put(self, key, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = body
+            self._size += len(body)
+            while len(self._items) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+
+def _choose_encoding(encoders: dict) -> str | None:
+    """ Кодировка с наибольшим q из Accept-Encoding; при равенстве - в порядке предпочтения сервера. """
+    best, best_quality = None, 0
+    for encoding in encoders:
+        quality = request.accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _should_compress(response) -> bool:
+    return (
+        request.path.startswith(API_PREFIX)
+        and response.status_code == 200
+        and not response.direct_passthrough
+        and not response.is_streamed
+        and 'Content-Encoding' not in response.headers
+        and response.content_length is not None
+        and response.content_length >= COMPRESSION_MIN_SIZE_BYTES
+    )
+
+
+def init_compression(app):
+    """ Регистрирует сжатие ответов /api/* для приложения. """
+    encoders = available_encodings()
+    cache = CompressedBodyCache(COMPRESSION_CACHE_MAX_ENTRIES, COMPRESSION_CACHE_MAX_BYTES)
+    app.extensions['compression_cache'] = cache
+    logger.info(f"Response compression enabled: {', '.join(encoders)}")
+
+    @app.after_request
+    def compress_response(response):
+        if request.path.startswith(API_PREFIX):
+            response.vary.add('Accept-Encoding')
+        if not _should_compress(response):
+            return response
+        encoding = _choose_encoding(encoders)
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        cache_key = (etag, encoding, generated_file_url_prefix()) if etag else None
+        body = cache.get(cache_key) if cache_key else None
+        if body is None:
+            body = encoders[encoding](response.get_data())
+            if cache_key:
+                cache.put(cache_key, body)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    return cache
@@ -0,0 +1,56 @@
+"""
+Условные GET-запросы (ETag / If-None-Match -> 304).
+
+ETag вычисляется из дешевых валидаторов (версия изменений, счетчики,
+max(updated_at)) ДО выполнения тяжелого запроса, поэтому повторный опрос
+неизменившихся данных стоит пару однострочных запросов к БД.
+"""
+import hashlib
+from flask import request, current_app, has_request_context
+from typing import Any
+
+from backend.models import generated_file_url_prefix
+
+
+def compute_etag(*parts: Any) -> str:
+    """
+    Строит ETag из валидаторов и параметров запроса. В запросе к ним добавляется
+    префикс URL файлов: без PUBLIC_BASE_URL он зависит от хоста запроса, и ответ
+    для другого хоста (localhost / IP в сети) содержит другие ссылки.
+
+    Args:
+        *parts: Значения, от которых зависит ответ
+
+    Returns:
+        str: Значение ETag (без кавычек)
+    """
+    if has_request_context():
+        parts += (generated_file_url_prefix(),)
+    raw = '|'.join(repr(part) for part in parts).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()
+
+
+def request_args_signature() -> tuple:
+    """ Нормализованные параметры запроса (порядок не важен). """
+    return tuple(sorted(request.args.items(multi=True)))
+
+
+def is_not_modified(etag: str) -> bool:
+    """
+    True, если клиент прислал совпадающий If-None-Match. Сравнение слабое
+    (RFC 9110): сжатые ответы отдаются со слабым W/"..." ETag.
+    """
+    return request.if_none_match.contains_weak(etag)
+
+
+def not_modified_response(etag: str):
+    """ Пустой ответ 304 с тем же ETag. """
+    response = current_app.response_class(status=304)
+    return with_etag(response, etag)
+
+
+def with_etag(response, etag: str):
+    """ Добавляет ETag и требует ревалидации при каждом использовании из кэша. """
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
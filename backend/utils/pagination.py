@@ -0,0 +1,153 @@
+"""
+Keyset (cursor) пагинация.
+
+Курсор - непрозрачная строка (base64 от JSON), в которой хранится значение
+активного поля сортировки и id последней строки страницы. Следующая страница
+выбирается условием "после (значение, id)" вместо OFFSET, поэтому глубокие
+страницы стоят столько же, сколько первая.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+from sqlalchemy import and_, or_
+
+from backend.utils.validators import ValidationError
+
+
+def encode_cursor(sort_key: str, order: str, value: Any, last_id: Any) -> str:
+    """
+    Кодирует позицию последней строки страницы в курсор.
+
+    Args:
+        sort_key: Имя поля сортировки (например, 'name')
+        order: Направление сортировки ('asc' или 'desc')
+        value: Значение поля сортировки у последней строки
+        last_id: id последней строки
+
+    Returns:
+        str: Непрозрачный курсор
+    """
+    payload = {'s': sort_key, 'o': order, 'id': last_id}
+    if isinstance(value, datetime):
+        payload['v'] = value.isoformat()
+        payload['t'] = 'dt'
+    else:
+        payload['v'] = value
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort_key: str, order: str) -> Tuple[Any, Any]:
+    """
+    Декодирует курсор и проверяет, что он выдан для той же сортировки.
+
+    Args:
+        cursor: Курсор из запроса
+        sort_key: Текущее поле сортировки
+        order: Текущее направление сортировки
+
+    Returns:
+        Tuple[Any, Any]: (значение поля сортировки, id)
+
+    Raises:
+        ValidationError: Если курсор поврежден или выдан для другой сортировки
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        value = payload['v']
+        if payload.get('t') == 'dt' and value is not None:
+            value = datetime.fromisoformat(value)
+        cursor_sort, cursor_order, last_id = payload['s'], payload['o'], payload['id']
+    except (ValueError, KeyError, TypeError):
+        raise ValidationError("Invalid cursor")
+
+    if cursor_sort != sort_key or cursor_order != order:
+        raise ValidationError("Cursor does not match current sort parameters")
+    return value, last_id
+
+
+def order_by_keyset(query, sort_column, id_column, order: str):
+    """
+    Применяет сортировку, совместимую с keyset-фильтром: поле (NULLS LAST) + id.
+
+    Args:
+        query: SQLAlchemy запрос
+        sort_column: Колонка/выражение сортировки
+        id_column: Уникальная колонка-разделитель (обычно id)
+        order: 'asc' или 'desc'
+
+    Returns:
+        Запрос с ORDER BY
+    """
+    if sort_column is id_column:
+        return query.order_by(id_column.asc() if order == 'asc' else id_column.desc())
+    if order == 'asc':
+        return query.order_by(sort_column.asc().nullslast(), id_column.asc())
+    return query.order_by(sort_column.desc().nullslast(), id_column.desc())
+
+
+def filter_after_keyset(query, sort_column, id_column, order: str, value: Any, last_id: Any):
+    """
+    Оставляет только строки, идущие после (value, last_id) в порядке order_by_keyset.
+
+    Args:
+        query: SQLAlchemy запрос
+        sort_column: Колонка/выражение сортировки
+        id_column: Уникальная колонка-разделитель
+        order: 'asc' или 'desc'
+        value: Значение поля сортировки последней строки предыдущей страницы
+        last_id: id последней строки предыдущей страницы
+
+    Returns:
+        Отфильтрованный запрос
+    """
+    id_after = id_column > last_id if order == 'asc' else id_column < last_id
+    if sort_column is id_column:
+        return query.filter(id_after)
+
+    # NULL-значения идут в конце при любом направлении
+    if value is None:
+        return query.filter(and_(sort_column.is_(None), id_after))
+    value_after = sort_column > value if order == 'asc' else sort_column < value
+    return query.filter(or_(
+        value_after,
+        and_(sort_column == value, id_after),
+        sort_column.is_(None)
+    ))
+
+
+def paginate_keyset(query, sort_column, id_column, sort_key: str, order: str,
+                    cursor: Optional[str], limit: int, value_getter) -> Tuple[list, Optional[str]]:
+    """
+    Выбирает одну страницу по курсору.
+
+    Args:
+        query: Отфильтрованный (но не отсортированный) запрос
+        sort_column: Колонка/выражение сортировки
+        id_column: Уникальная колонка-разделитель
+        sort_key: Имя поля сортировки (записывается в курсор)
+        order: 'asc' или 'desc'
+        cursor: Курсор из запроса или None/'' для первой страницы
+        limit: Размер страницы
+        value_getter: Функция item -> (значение поля сортировки, id)
+
+    Returns:
+        Tuple[list, Optional[str]]: (элементы страницы, курсор следующей страницы или None)
+
+    Raises:
+        ValidationError: Если курсор некорректен
+    """
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort_key, order)
+        query = filter_after_keyset(query, sort_column, id_column, order, value, last_id)
+    query = order_by_keyset(query, sort_column, id_column, order)
+
+    rows = query.limit(limit + 1).all() # +1 строка, чтобы узнать, есть ли следующая страница
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        value, last_id = value_getter(items[-1])
+        next_cursor = encode_cursor(sort_key, order, value, last_id)
+    return items, next_cursor
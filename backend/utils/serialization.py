@@ -0,0 +1,65 @@
+"""
+Кодирование JSON-ответов API.
+
+Если установлен orjson, ответы кодируются им (в несколько раз быстрее
+стандартного json на больших списках), иначе используется json из стандартной
+библиотеки. Клиент может запросить MessagePack заголовком
+Accept: application/msgpack - если установлен msgpack, ответ кодируется им.
+Обе библиотеки опциональны.
+"""
+import json
+from datetime import date, datetime
+from flask import request, current_app
+
+try:
+    import orjson
+except ImportError: # pragma: no cover - зависит от окружения
+    orjson = None
+
+try:
+    import msgpack
+except ImportError: # pragma: no cover - зависит от окружения
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+def _default(value):
+    """ Сериализация типов, которые не поддерживаются кодировщиками напрямую. """
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def dumps_json(data) -> bytes:
+    """ Кодирует данные в JSON (orjson, если доступен). Ключи-числа приводятся к строкам. """
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_msgpack(data) -> bytes:
+    """ Кодирует данные в MessagePack. Требует установленный msgpack. """
+    return msgpack.packb(data, default=_default)
+
+
+def negotiated_mimetype() -> str:
+    """ Формат ответа по заголовку Accept: msgpack только если он запрошен явно и доступен. """
+    if msgpack is not None:
+        best = request.accept_mimetypes.best_match([JSON_MIMETYPE, MSGPACK_MIMETYPE], default=JSON_MIMETYPE)
+        if best == MSGPACK_MIMETYPE and request.accept_mimetypes[MSGPACK_MIMETYPE] > request.accept_mimetypes[JSON_MIMETYPE]:
+            return MSGPACK_MIMETYPE
+    return JSON_MIMETYPE
+
+
+def encoded_response(data, status: int = 200):
+    """
+    Ответ с данными в формате, выбранном по Accept (JSON через orjson/json или MessagePack).
+    Добавляет Vary: Accept, т.к. тело зависит от заголовка запроса.
+    """
+    mimetype = negotiated_mimetype()
+    body = dumps_msgpack(data) if mimetype == MSGPACK_MIMETYPE else dumps_json(data)
+    response = current_app.response_class(body, status=status, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
@@ -1,6 +1,7 @@
 import React from "react";
 import { Image, Spinner } from "react-bootstrap";
 import { CheckCircleFill, XCircleFill } from "react-bootstrap-icons";
+import { thumbnailUrl } from "../../../services/api";
 
 const GridCell = ({ cellData, onClick }) => {
   let content = null;
@@ -54,7 +55,7 @@ const GridCell = ({ cellData, onClick }) => {
         if (cellData.file_url) {
           content = (
             <Image
-              src={cellData.file_url}
+              src={thumbnailUrl(cellData.file_url)}
               style={{ maxWidth: "100%", maxHeight: "100%", objectFit: "contain" }}
               alt={`Gen ${cellData.generation_id}`}
               fluid
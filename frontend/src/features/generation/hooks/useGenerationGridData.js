@@ -116,7 +116,7 @@ export const useGenerationGridData = (
       sortConfig?.direction,
       generationStatusFilter
     ],
-    queryFn: ({ pageParam = 1 }) => fetchGridData({
+    queryFn: ({ pageParam = "" }) => fetchGridData({
       visibleProjectIds: Array.from(visibleColumnProjectIds),
       search: searchTerm,
       type: typeFilter,
@@ -124,16 +124,16 @@ export const useGenerationGridData = (
       sort: sortConfig?.key,
       order: sortConfig?.direction,
       generationStatusFilter,
-      page: pageParam,
+      cursor: pageParam,
       per_page: PER_PAGE,
     }),
     getNextPageParam: (lastPage) => {
       if (lastPage.collections.has_next) {
-        return lastPage.collections.page + 1;
+        return lastPage.collections.next_cursor;
       }
       return undefined;
     },
-    initialPageParam: 1,
+    initialPageParam: "",
     keepPreviousData: true,
     enabled: isInitialized,
   });
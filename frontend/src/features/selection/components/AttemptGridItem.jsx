@@ -2,6 +2,7 @@ import React, { memo } from "react";
 import { Col, Image } from "react-bootstrap";
 import { CheckCircleFill } from "react-bootstrap-icons";
 import { useSelectionContext } from "../context/SelectionContext";
+import { thumbnailUrl } from "../../../services/api";
 
 const AttemptGridItem = ({ attempt }) => {
   const {
@@ -25,7 +26,7 @@ const AttemptGridItem = ({ attempt }) => {
         onClick={() => handleAttemptClick(attempt)}
       >
         <Image
-          src={attempt.file_url}
+          src={thumbnailUrl(attempt.file_url)}
           alt={`Attempt ${attempt.generation_id} (Project ${attempt.origin_project_id})`}
         />
         {isPersisted && (
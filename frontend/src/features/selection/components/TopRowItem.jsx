@@ -1,5 +1,6 @@
 import React, { memo } from "react";
 import { useSelectionContext } from "../context/SelectionContext";
+import { thumbnailUrl } from "../../../services/api";
 
 const PlaceholderIcon = () => (
   <svg width="32" height="32" viewBox="0 0 32 32" fill="none" xmlns="http://www.w3.org/2000/svg">
@@ -27,7 +28,7 @@ const TopRowItem = ({ item }) => {
     >
       {displayUrl ? (
         <img
-          src={displayUrl}
+          src={thumbnailUrl(displayUrl)}
           className="thumbnail small"
           alt={`Обложка для ${item.project_name}`}
         />
@@ -57,6 +57,7 @@ export const fetchGridData = async ({
   generationStatusFilter = '',
   page = 1,
   per_page = 100,
+  cursor = null,
 } = {}) => {
   const params = {};
   if (visibleProjectIds && visibleProjectIds.length > 0) {
@@ -68,7 +69,12 @@ export const fetchGridData = async ({
   if (sort) params.sort = sort;
   if (order) params.order = order;
   if (generationStatusFilter && generationStatusFilter !== 'all') params.generation_status_filter = generationStatusFilter;
-  params.page = page;
+  // Keyset-пагинация: пустой cursor - первая страница, далее next_cursor из ответа
+  if (cursor !== null) {
+    params.cursor = cursor;
+  } else {
+    params.page = page;
+  }
   params.per_page = per_page;
 
   const { data } = await apiClient.get("/grid-data", { params });
@@ -137,4 +143,9 @@ export const reindexProject = async (projectId) => {
   return data; // Ожидаем JSON с сообщением, path_checked, entry_count или ошибкой
 };
 
+// --- Generated files ---
+// WebP-миниатюра сгенерированного файла (размеры: 256, 512, 1024 по длинной стороне)
+export const thumbnailUrl = (fileUrl, size = 256) =>
+  fileUrl ? `${fileUrl}${fileUrl.includes("?") ? "&" : "?"}size=${size}` : fileUrl;
+
 // Можно добавить другие функции API по мере необходимости